@@ -0,0 +1,171 @@
+"""
+Avisos masivos: envio de un aviso del admin a su equipo o a toda la plataforma.
+
+create_broadcast (db.py) deja el aviso y sus destinatarios en la BD con un solo
+INSERT ... SELECT. Este modulo los entrega sin pasar por el dispatcher del bot:
+
+- BroadcastSender es un hilo que toma lotes (claim_broadcast_recipients) y envia a un
+  ritmo fijo de BROADCAST_RATE_PER_SECOND mensajes. El limite de Telegram (~30 msg/s)
+  es de todo el bot y las ofertas no reintentan un 429: por defecto el aviso usa la
+  mitad y deja el resto al despacho.
+- Cada lote se confirma en la BD (SENT / FAILED / de vuelta a PENDING), eso es el
+  progreso que ve el admin. Lo que quedo CLAIMED (proceso caido, o un lote que no se
+  pudo confirmar) vuelve a PENDING al arrancar y cada BROADCAST_REQUEUE_SECONDS: el
+  envio sigue donde iba (a lo sumo se repite un lote).
+- Un 429 de Telegram (RetryAfter) pausa el emisor el tiempo indicado y devuelve el lote
+  sin gastar intentos. Los errores de red se reintentan hasta BROADCAST_MAX_ATTEMPTS; el
+  resto (bloqueo del bot, chat inexistente) marca FAILED al destinatario.
+- Al terminar un aviso se avisa al admin que lo creo.
+
+Solo un proceso debe correr el emisor (el de los jobs singleton del bot).
+"""
+import itertools
+import logging
+import os
+import threading
+import time
+import uuid
+
+from db import claim_broadcast_recipients, complete_broadcast_recipients, requeue_broadcast_recipients
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_RATE_PER_SECOND = float(os.getenv("BROADCAST_RATE_PER_SECOND", "15"))
+BROADCAST_BATCH = 50
+BROADCAST_POLL_SECONDS = 2.0
+BROADCAST_REQUEUE_SECONDS = 60.0
+BROADCAST_MAX_TEXT = 3500
+
+# Errores de python-telegram-bot que vale la pena reintentar (BadRequest/Unauthorized no).
+_TRANSIENT_ERRORS = ("TimedOut", "NetworkError")
+
+
+def broadcast_summary_text(broadcast: dict) -> str:
+    """Texto del resultado de un aviso terminado (para el admin que lo creo)."""
+    return (
+        "Aviso #{} terminado.\n\n"
+        "Entregados: {} de {}\n"
+        "Fallidos: {}"
+    ).format(broadcast["id"], broadcast["sent"], broadcast["total"], broadcast["failed"])
+
+
+class BroadcastSender:
+    """Hilo que envia los avisos pendientes a ritmo constante y confirma por lotes."""
+
+    def __init__(self, bot, rate_per_second: float = BROADCAST_RATE_PER_SECOND,
+                 batch_size: int = BROADCAST_BATCH, poll_seconds: float = BROADCAST_POLL_SECONDS,
+                 worker_id: str = None):
+        self._bot = bot
+        self.interval = 1.0 / max(rate_per_second, 0.1)
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self.worker_id = worker_id or "{}-{}".format(os.getpid(), uuid.uuid4().hex[:8])
+        self._claims = itertools.count(1)
+        self._next_send = 0.0
+        self._next_requeue = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _wait_turn(self):
+        """Espera el turno del siguiente mensaje (ritmo fijo). False si se esta apagando."""
+        now = time.monotonic()
+        if self._next_send > now and self._stop.wait(self._next_send - now):
+            return False
+        self._next_send = max(now, self._next_send) + self.interval
+        return not self._stop.is_set()
+
+    def send_once(self) -> int:
+        """Envia un lote. Retorna cuantos destinatarios tomo (0 = no hay nada pendiente)."""
+        token = "{}:{}".format(self.worker_id, next(self._claims))
+        batch = claim_broadcast_recipients(token, limit=self.batch_size)
+        if not batch:
+            return 0
+        sent, failed, retry, release = [], {}, [], []
+        pause = 0.0
+        for item in batch:
+            if pause or not self._wait_turn():
+                release.append(item["id"])
+                continue
+            try:
+                self._bot.send_message(chat_id=item["telegram_id"], text=item["text"])
+                sent.append(item["id"])
+            except Exception as e:
+                retry_after = getattr(e, "retry_after", None)
+                if retry_after is not None:
+                    pause = float(retry_after) + 1
+                    release.append(item["id"])
+                elif type(e).__name__ in _TRANSIENT_ERRORS:
+                    retry.append(item["id"])
+                else:
+                    failed[item["id"]] = "{}: {}".format(type(e).__name__, e)
+        finished = complete_broadcast_recipients(sent, failed, retry, release)
+        for broadcast in finished:
+            self._notify_creator(broadcast)
+        if pause:
+            logger.warning("broadcasts: limite de Telegram, pausa de %.0fs", pause)
+            self._stop.wait(pause)
+        return len(batch)
+
+    def _notify_creator(self, broadcast: dict):
+        chat_id = broadcast.get("created_by_telegram_id")
+        logger.info("broadcasts: aviso %s terminado (%s/%s enviados, %s fallidos)",
+                    broadcast["id"], broadcast["sent"], broadcast["total"], broadcast["failed"])
+        if not chat_id or not self._wait_turn():
+            return
+        try:
+            self._bot.send_message(chat_id=chat_id, text=broadcast_summary_text(broadcast))
+        except Exception as e:
+            logger.warning("broadcasts: no se pudo avisar al admin %s: %s", chat_id, e)
+
+    def _requeue(self):
+        self._next_requeue = time.monotonic() + BROADCAST_REQUEUE_SECONDS
+        try:
+            requeued = requeue_broadcast_recipients()
+        except Exception as e:
+            logger.warning("broadcasts: no se pudo devolver lo CLAIMED a la cola: %s", e)
+            return
+        if requeued:
+            logger.info("broadcasts: %s destinatarios a medias devueltos a la cola", requeued)
+
+    def step(self) -> int:
+        """Una vuelta del hilo: un lote y, si toca o si el lote fallo, devolver a la cola lo
+        que quedo CLAIMED. Es seguro porque el emisor es unico y aqui no hay lote en vuelo."""
+        try:
+            taken = self.send_once()
+        except Exception as e:
+            logger.warning("broadcasts: error enviando avisos: %s", e)
+            taken = 0
+            self._next_requeue = 0.0
+        if time.monotonic() >= self._next_requeue:
+            self._requeue()
+        return taken
+
+    def _run(self):
+        while not self._stop.is_set():
+            if not self.step():
+                self._stop.wait(self.poll_seconds)
+
+    def start(self):
+        """Recupera lo que quedo a medias y arranca el hilo emisor."""
+        self._requeue()
+        self._thread = threading.Thread(target=self._run, name="broadcast-sender", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+_sender_lock = threading.Lock()
+_sender = None
+
+
+def start_broadcast_sender(bot) -> BroadcastSender:
+    """Arranca (una vez) el emisor de avisos. Lo llama el proceso de jobs singleton del bot."""
+    global _sender
+    with _sender_lock:
+        if _sender is None:
+            _sender = BroadcastSender(bot)
+            _sender.start()
+        return _sender
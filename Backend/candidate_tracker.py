@@ -0,0 +1,155 @@
+"""
+Conjuntos de candidatos por pedido/ruta activos con refresco incremental.
+
+Cuando la cola de ofertas de un pedido se agota, el ciclo se relanza con los
+couriers elegibles actuales. La consulta de elegibilidad (get_eligible_couriers_for_order)
+sigue siendo la fuente de las reglas duras (online, carga, vetos, base, radio), pero la
+verificacion por courier del vinculo aprobado y del saldo ya no se repite para todos:
+
+- cada pedido/ruta guarda el ultimo conjunto evaluado (courier -> admin_id, saldo)
+  con el cursor del feed de cambios del momento de la evaluacion;
+- al relanzar solo se re-evaluan los couriers nuevos en el conjunto (entraron al
+  radio, se conectaron, se liberaron) y los que cambiaron de saldo o estado de
+  vinculo desde la pasada anterior (admin_couriers.updated_at, comparado contra lo
+  ya evaluado). Ubicacion y disponibilidad no disparan re-evaluacion: las aplica la
+  consulta de elegibilidad, y cada ping de ubicacion las tocaria a todas;
+- esa re-evaluacion es una sola consulta por lotes (get_courier_dispatch_links).
+
+Como red de seguridad, un conjunto con mas de CANDIDATE_FULL_REFRESH_SECONDS desde su
+evaluacion completa se descarta y se evalua de nuevo entero.
+"""
+import os
+import threading
+import time
+
+from db import get_courier_dispatch_changes_since, get_courier_dispatch_links
+
+CANDIDATE_FULL_REFRESH_SECONDS = 300
+
+
+def _db_key() -> str:
+    return os.getenv("DATABASE_URL") or os.getenv("DB_PATH", "domiquerendona.db")
+
+
+def _changed_links(known: dict, link_rows) -> set:
+    """
+    Couriers cuyo vinculo en el feed no coincide con el (admin_id, saldo) evaluado.
+    Un vinculo APPROVED de otro admin tambien cuenta: puede ser el mas reciente.
+    """
+    changed = set()
+    for courier_id, admin_id, status, balance in link_rows:
+        if courier_id not in known:
+            continue
+        current = known[courier_id]
+        approved = status == "APPROVED"
+        if current is None or current[0] != admin_id:
+            if approved:
+                changed.add(courier_id)
+        elif not approved or current[1] != balance:
+            changed.add(courier_id)
+    return changed
+
+
+def _funded(link, required_balance, admin_id) -> bool:
+    return link is not None and link[1] >= required_balance and (admin_id is None or link[0] == admin_id)
+
+
+class _CandidateSet:
+    __slots__ = ("links", "since", "full_at", "required_balance", "admin_id")
+
+    def __init__(self, since, full_at):
+        self.links = {}  # courier_id -> (admin_id, balance) o None si no tiene vinculo aprobado
+        self.since = since
+        self.full_at = full_at
+        self.required_balance = 0
+        self.admin_id = None
+
+
+class CandidateTracker:
+    """Ultimo conjunto de candidatos evaluado por owner (pedido o ruta)."""
+
+    def __init__(self, full_refresh_seconds: float = CANDIDATE_FULL_REFRESH_SECONDS):
+        self.full_refresh_seconds = full_refresh_seconds
+        self._lock = threading.Lock()
+        self._sets = {}
+        self._db_key = None
+
+    def _check_db(self):
+        key = _db_key()
+        if key != self._db_key:
+            self._sets.clear()
+            self._db_key = key
+
+    def refresh(self, owner_id, eligible_ids, required_balance: int, admin_id: int = None):
+        """
+        Filtra eligible_ids (ya ordenados por la consulta de elegibilidad) a los couriers
+        con vinculo aprobado y saldo >= required_balance, re-evaluando solo lo que cambio.
+        Con admin_id (pedidos team_only) solo quedan los couriers vinculados a ese admin.
+        Retorna (courier_ids, evaluados).
+        """
+        owner_id = int(owner_id)
+        eligible_ids = [int(cid) for cid in eligible_ids]
+        now = time.monotonic()
+        with self._lock:
+            self._check_db()
+            # Los conjuntos vencidos se reconstruyen enteros: se descartan aqui.
+            for stale in [k for k, s in self._sets.items() if now - s.full_at >= self.full_refresh_seconds]:
+                del self._sets[stale]
+            cset = self._sets.get(owner_id)
+
+        if cset is None:
+            changes = get_courier_dispatch_changes_since()
+            cset = _CandidateSet(changes["now"], now)
+            to_evaluate = eligible_ids
+        else:
+            changes = get_courier_dispatch_changes_since(cset.since)
+            changed = _changed_links(cset.links, changes["links"])
+            to_evaluate = [cid for cid in eligible_ids if cid not in cset.links or cid in changed]
+
+        fresh_links = get_courier_dispatch_links(to_evaluate) if to_evaluate else {}
+        links = {cid: cset.links.get(cid) for cid in eligible_ids}
+        for cid in to_evaluate:
+            links[cid] = fresh_links.get(cid)
+
+        with self._lock:
+            cset.links = links
+            cset.since = changes["now"]
+            cset.required_balance = required_balance
+            cset.admin_id = admin_id
+            self._sets[owner_id] = cset
+
+        courier_ids = [cid for cid in eligible_ids if _funded(links[cid], required_balance, admin_id)]
+        return courier_ids, len(to_evaluate)
+
+    def unfunded(self, owner_id) -> list:
+        """
+        Couriers del ultimo refresh del owner que quedaron fuera por vinculo o saldo, en el
+        orden de elegibilidad (a quienes se les pide recargar). Con admin_id solo los de su
+        equipo: un courier de otro admin no queda fuera por saldo.
+        """
+        with self._lock:
+            cset = self._sets.get(int(owner_id))
+            if cset is None:
+                return []
+            links, required_balance, admin_id = dict(cset.links), cset.required_balance, cset.admin_id
+        return [
+            cid for cid, link in links.items()
+            if not _funded(link, required_balance, admin_id)
+            and (admin_id is None or (link is not None and link[0] == admin_id))
+        ]
+
+    def forget(self, owner_id=None):
+        """Descarta el conjunto de un owner (o todos)."""
+        with self._lock:
+            if owner_id is None:
+                self._sets.clear()
+            else:
+                self._sets.pop(int(owner_id), None)
+
+    def tracked(self) -> int:
+        with self._lock:
+            return len(self._sets)
+
+
+order_candidates = CandidateTracker()
+route_candidates = CandidateTracker()
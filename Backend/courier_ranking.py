@@ -0,0 +1,170 @@
+"""
+Kernel de ranking de couriers: distancias, radio, prioridad y desvios por lotes.
+
+get_eligible_couriers_for_order ordenaba con un _sort_key por courier y volvia a
+calcular haversine para filtrar el radio; el texto de oferta calculaba el desvio de
+cada courier por separado. Aqui los candidatos se pasan a columnas (radianes, coseno
+de la latitud, prioridad, base) y todo se resuelve en una pasada:
+
+- las constantes del punto de recogida (radianes, coseno) se calculan una sola vez;
+- un descarte por caja (diferencia de latitud) evita la trigonometria de los que estan
+  claramente fuera del radio;
+- cada distancia se calcula una vez y sirve para el radio y para el orden;
+- los desvios de todos los couriers con servicios activos se calculan juntos
+  (detour_ratios), con el mismo redondeo por tramo que haversine_km.
+
+Es Python puro (el backend no depende de NumPy); el benchmark esta en
+tests/bench_courier_ranking.py.
+"""
+import math
+
+EARTH_RADIUS_KM = 6371.0
+MAX_OFFER_RADIUS_KM = 7.0
+_KM_PER_DEG_LAT = math.pi * EARTH_RADIUS_KM / 180.0
+
+
+def _haversine_rad(lat1, cos1, lng1, lat2, cos2, lng2):
+    """Haversine con latitudes/longitudes en radianes y cosenos ya calculados."""
+    s_lat = math.sin((lat2 - lat1) / 2)
+    s_lng = math.sin((lng2 - lng1) / 2)
+    a = s_lat * s_lat + cos1 * cos2 * s_lng * s_lng
+    return EARTH_RADIUS_KM * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+def courier_point(courier):
+    """Mejor ubicacion conocida del courier: live > residence. (None, None) si no hay."""
+    lat = courier.get("live_lat") or courier.get("residence_lat")
+    lng = courier.get("live_lng") or courier.get("residence_lng")
+    if lat is None or lng is None:
+        return None, None
+    return float(lat), float(lng)
+
+
+def _priority(courier) -> int:
+    status = courier.get("availability_status", "INACTIVE")
+    if status == "APPROVED":
+        return 0 if int(courier.get("live_location_active") or 0) == 1 else 1
+    return 2
+
+
+def distances_km(origin_lat, origin_lng, points, max_km=None):
+    """
+    Distancias desde un origen a una lista de (lat, lng) en una pasada.
+    Puntos sin coordenadas dan None; con max_km, los que estan claramente fuera
+    (por diferencia de latitud) tambien dan None sin calcular trigonometria.
+    """
+    lat0 = math.radians(float(origin_lat))
+    lng0 = math.radians(float(origin_lng))
+    cos0 = math.cos(lat0)
+    deg_limit = (max_km / _KM_PER_DEG_LAT) if max_km is not None else None
+    origin_deg = float(origin_lat)
+    radians = math.radians
+    cos = math.cos
+    out = []
+    for lat, lng in points:
+        if lat is None or lng is None:
+            out.append(None)
+            continue
+        if deg_limit is not None and abs(lat - origin_deg) > deg_limit:
+            out.append(None)
+            continue
+        lat_r = radians(lat)
+        out.append(_haversine_rad(lat0, cos0, lng0, lat_r, cos(lat_r), radians(lng)))
+    return out
+
+
+def rank_candidates(couriers, pickup_lat, pickup_lng, max_radius_km=MAX_OFFER_RADIUS_KM):
+    """
+    Filtra por radio y ordena couriers (dicts de get_eligible_couriers_for_order) por
+    (prioridad, distancia al pickup, base DESC). Los couriers sin ubicacion conocida
+    quedan fuera del radio. El orden es estable respecto a la lista de entrada.
+    """
+    points = [courier_point(c) for c in couriers]
+    dists = distances_km(pickup_lat, pickup_lng, points, max_km=max_radius_km)
+    keyed = [
+        (_priority(c), dist, -int(c.get("available_cash") or 0), idx)
+        for idx, (c, dist) in enumerate(zip(couriers, dists))
+        if dist is not None and dist <= max_radius_km
+    ]
+    keyed.sort()
+    return [couriers[key[3]] for key in keyed]
+
+
+def detour_ratios(pickup_lat, pickup_lng, origins, destinations):
+    """
+    Desvio de pasar por el pickup antes del destino actual, para varios couriers:
+    (origen->pickup + pickup->destino) / (origen->destino), con cada tramo redondeado a
+    2 decimales como haversine_km. 1.0 si el destino esta casi encima del courier.
+    origins/destinations: listas paralelas de (lat, lng); pares sin coordenadas dan None.
+    """
+    p_lat = math.radians(float(pickup_lat))
+    p_lng = math.radians(float(pickup_lng))
+    p_cos = math.cos(p_lat)
+    radians, cos, sin, sqrt, atan2 = math.radians, math.cos, math.sin, math.sqrt, math.atan2
+    diameter = 2 * EARTH_RADIUS_KM
+    out = []
+    for (o_lat, o_lng), (d_lat, d_lng) in zip(origins, destinations):
+        if o_lat is None or o_lng is None or d_lat is None or d_lng is None:
+            out.append(None)
+            continue
+        o_lat_r, d_lat_r = radians(o_lat), radians(d_lat)
+        o_lng_r, d_lng_r = radians(o_lng), radians(d_lng)
+        o_cos, d_cos = cos(o_lat_r), cos(d_lat_r)
+        s1, s2 = sin((d_lat_r - o_lat_r) / 2), sin((d_lng_r - o_lng_r) / 2)
+        a = s1 * s1 + o_cos * d_cos * s2 * s2
+        direct = round(diameter * atan2(sqrt(a), sqrt(1 - a)), 2)
+        if direct < 0.05:
+            out.append(1.0)
+            continue
+        s1, s2 = sin((p_lat - o_lat_r) / 2), sin((p_lng - o_lng_r) / 2)
+        a = s1 * s1 + o_cos * p_cos * s2 * s2
+        leg1 = round(diameter * atan2(sqrt(a), sqrt(1 - a)), 2)
+        s1, s2 = sin((d_lat_r - p_lat) / 2), sin((d_lng_r - p_lng) / 2)
+        a = s1 * s1 + p_cos * d_cos * s2 * s2
+        leg2 = round(diameter * atan2(sqrt(a), sqrt(1 - a)), 2)
+        out.append((leg1 + leg2) / direct)
+    return out
+
+
+def detour_ratio(c_lat, c_lng, pickup_lat, pickup_lng, dest_lat, dest_lng):
+    """Version escalar de detour_ratios."""
+    return detour_ratios(
+        pickup_lat, pickup_lng,
+        [(float(c_lat), float(c_lng))], [(float(dest_lat), float(dest_lng))],
+    )[0]
+
+
+def nearest_neighbor_order(items):
+    """
+    Ordena dicts con "lat"/"lng" por vecino mas cercano empezando por el primero.
+    Retorna (ordenados, km_totales del recorrido).
+    """
+    if not items:
+        return [], 0.0
+    coords = [(math.radians(i["lat"]), math.radians(i["lng"])) for i in items]
+    cosines = [math.cos(lat) for lat, _lng in coords]
+    remaining = list(range(1, len(items)))
+    order = [0]
+    total = 0.0
+    cur = 0
+    while remaining:
+        lat1, lng1 = coords[cur]
+        best, best_km = None, None
+        for idx in remaining:
+            km = _haversine_rad(lat1, cosines[cur], lng1, coords[idx][0], cosines[idx], coords[idx][1])
+            if best_km is None or km < best_km:
+                best, best_km = idx, km
+        order.append(best)
+        remaining.remove(best)
+        total += best_km
+        cur = best
+    return [items[idx] for idx in order], total
+
+
+def path_length_km(items):
+    """Largo del recorrido que visita los dicts "lat"/"lng" en el orden dado."""
+    coords = [(math.radians(i["lat"]), math.radians(i["lng"])) for i in items]
+    return sum(
+        _haversine_rad(a[0], math.cos(a[0]), a[1], b[0], math.cos(b[0]), b[1])
+        for a, b in zip(coords, coords[1:])
+    )
@@ -12,6 +12,8 @@ import unicodedata
 from typing import Tuple
 from datetime import datetime, timedelta, timezone
 
+from courier_ranking import MAX_OFFER_RADIUS_KM, rank_candidates
+
 logger = logging.getLogger(__name__)
 
 # Detectar motor de base de datos
@@ -1575,6 +1577,16 @@ def init_db():
     if 'use_count' not in admc_cols:
         cur.execute("ALTER TABLE admin_customers ADD COLUMN use_count INTEGER DEFAULT 0")
 
+    # Migración: columnas normalizadas de búsqueda (name_search sin tildes, phone_search solo dígitos)
+    # + índice FTS5 trigram para búsqueda por subcadena sin escanear la agenda completa
+    for _table in _CUSTOMER_SEARCH_TABLES:
+        if not _column_exists(cur, _table, "name_search"):
+            cur.execute(f"ALTER TABLE {_table} ADD COLUMN name_search TEXT")
+        if not _column_exists(cur, _table, "phone_search"):
+            cur.execute(f"ALTER TABLE {_table} ADD COLUMN phone_search TEXT")
+        _backfilled = _backfill_customer_search_columns(cur, _table)
+        _ensure_sqlite_customer_fts(cur, _table, rebuild=_backfilled > 0)
+
     # Migración: agregar use_count a ally_customer_addresses (orden por uso)
     cur.execute("PRAGMA table_info(ally_customer_addresses)")
     aca_cols = [col[1] for col in cur.fetchall()]
@@ -1910,6 +1922,14 @@ def init_db():
     """)
     cur.execute("CREATE INDEX IF NOT EXISTS idx_routes_ally_id ON routes(ally_id)")
     cur.execute("CREATE INDEX IF NOT EXISTS idx_routes_status ON routes(status)")
+    # Historial paginado por dueno y fecha (cubren los totales por dia sin leer la fila)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_orders_ally_created ON orders(ally_id, created_at, status, total_fee)")
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_orders_admin_created "
+        "ON orders(creator_admin_id, created_at, status, total_fee, special_commission)"
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_orders_courier_created ON orders(courier_id, created_at)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_routes_ally_created ON routes(ally_id, created_at, status, total_fee)")
     cur.execute("CREATE INDEX IF NOT EXISTS idx_route_destinations_route_id ON route_destinations(route_id, sequence)")
     cur.execute("CREATE INDEX IF NOT EXISTS idx_route_offer_queue_route_id ON route_offer_queue(route_id, status)")
 
@@ -1951,9 +1971,187 @@ def init_db():
             job_data TEXT DEFAULT '{}',
             status TEXT DEFAULT 'PENDING',
             created_at TEXT DEFAULT (datetime('now')),
-            updated_at TEXT DEFAULT (datetime('now'))
+            updated_at TEXT DEFAULT (datetime('now')),
+            entity_id INTEGER
+        );
+    """)
+    # entity_id: pedido/ruta duenio del job (shard del despacho repartido)
+    try:
+        cur.execute("ALTER TABLE scheduled_jobs ADD COLUMN entity_id INTEGER;")
+    except Exception:
+        pass
+
+    # Tabla: ops_feed_events (feed incremental del mapa en vivo del panel web)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS ops_feed_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            entity_type TEXT NOT NULL,
+            entity_id INTEGER NOT NULL,
+            admin_id INTEGER,
+            payload TEXT DEFAULT '{}',
+            created_at TEXT DEFAULT (datetime('now'))
+        );
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_ops_feed_events_created_at ON ops_feed_events(created_at)")
+    # Feed de cambios de saldo/estado de couriers para el refresco incremental de candidatos
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_admin_couriers_updated_at ON admin_couriers(updated_at)")
+
+    # Tabla: dispatch_events (analitica de despacho, solo insercion; escrita por lotes por el bot)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS dispatch_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            entity_type TEXT NOT NULL,
+            entity_id INTEGER NOT NULL,
+            event TEXT NOT NULL,
+            courier_id INTEGER,
+            position INTEGER,
+            distance_m INTEGER,
+            response_s INTEGER,
+            wait_s INTEGER,
+            supply INTEGER,
+            admin_id INTEGER,
+            cell TEXT,
+            created_at TEXT NOT NULL
+        );
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_dispatch_events_created_at ON dispatch_events(created_at)")
+
+    # Tabla: dispatch_rollups_hourly (agregados por hora, celda geohash y equipo)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS dispatch_rollups_hourly (
+            hour TEXT NOT NULL,
+            cell TEXT NOT NULL,
+            admin_id INTEGER NOT NULL DEFAULT 0,
+            entity_type TEXT NOT NULL,
+            published INTEGER NOT NULL DEFAULT 0,
+            offered INTEGER NOT NULL DEFAULT 0,
+            expired INTEGER NOT NULL DEFAULT 0,
+            rejected INTEGER NOT NULL DEFAULT 0,
+            busy INTEGER NOT NULL DEFAULT 0,
+            accepted INTEGER NOT NULL DEFAULT 0,
+            supply_sum INTEGER NOT NULL DEFAULT 0,
+            supply_samples INTEGER NOT NULL DEFAULT 0,
+            seen_sum INTEGER NOT NULL DEFAULT 0,
+            wait_sum_s INTEGER NOT NULL DEFAULT 0,
+            response_sum_s INTEGER NOT NULL DEFAULT 0,
+            responses INTEGER NOT NULL DEFAULT 0,
+            wait_lt_1m INTEGER NOT NULL DEFAULT 0,
+            wait_lt_3m INTEGER NOT NULL DEFAULT 0,
+            wait_lt_5m INTEGER NOT NULL DEFAULT 0,
+            wait_lt_10m INTEGER NOT NULL DEFAULT 0,
+            wait_ge_10m INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (hour, cell, admin_id, entity_type)
+        );
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_dispatch_rollups_admin_hour ON dispatch_rollups_hourly(admin_id, hour)")
+
+    # Tabla: demand_model_cells (curvas de aceptacion por incentivo, entrenadas desde el historico)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS demand_model_cells (
+            level INTEGER NOT NULL,
+            bucket TEXT NOT NULL,
+            incentive INTEGER NOT NULL,
+            samples INTEGER NOT NULL DEFAULT 0,
+            accepted INTEGER NOT NULL DEFAULT 0,
+            accepted_target INTEGER NOT NULL DEFAULT 0,
+            median_wait_s INTEGER,
+            trained_at TEXT NOT NULL,
+            PRIMARY KEY (level, bucket, incentive)
+        );
+    """)
+
+    # Tabla: telegram_update_queue (updates recibidos por webhook, consumidos por particion de chat)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS telegram_update_queue (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            update_id INTEGER NOT NULL UNIQUE,
+            partition_no INTEGER NOT NULL,
+            chat_id INTEGER,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'PENDING',
+            claimed_by TEXT,
+            received_at TEXT NOT NULL,
+            processed_at TEXT
+        );
+    """)
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_telegram_update_queue_partition "
+        "ON telegram_update_queue(status, partition_no, id)"
+    )
+
+    # Tablas: broadcasts + broadcast_recipients (avisos masivos, enviados por broadcasts.py)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_by_admin_id INTEGER NOT NULL,
+            created_by_telegram_id INTEGER,
+            scope_admin_id INTEGER,
+            role TEXT NOT NULL,
+            city TEXT,
+            barrio TEXT,
+            text TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'SENDING',
+            total INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL,
+            finished_at TEXT
+        );
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS broadcast_recipients (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            broadcast_id INTEGER NOT NULL,
+            telegram_id INTEGER NOT NULL,
+            role TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'PENDING',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            claimed_by TEXT,
+            error TEXT,
+            sent_at TEXT,
+            UNIQUE (broadcast_id, telegram_id)
+        );
+    """)
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_broadcast_recipients_status "
+        "ON broadcast_recipients(status, broadcast_id, id)"
+    )
+
+    # Tablas del despacho repartido entre procesos: leases de shard con token de
+    # fencing, estado compartido de ciclos de oferta y comandos para el duenio del shard
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS shard_leases (
+            resource TEXT NOT NULL,
+            shard_no INTEGER NOT NULL,
+            owner TEXT,
+            fencing_token INTEGER NOT NULL DEFAULT 0,
+            expires_at REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (resource, shard_no)
+        );
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS dispatch_state (
+            scope TEXT NOT NULL,
+            entity_id INTEGER NOT NULL,
+            payload TEXT NOT NULL,
+            fencing_token INTEGER NOT NULL DEFAULT 0,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY (scope, entity_id)
+        );
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS dispatch_commands (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            shard_no INTEGER NOT NULL,
+            command TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            created_at TEXT NOT NULL
         );
     """)
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_dispatch_commands_shard "
+        "ON dispatch_commands(shard_no, id)"
+    )
 
     # Tabla: pending_fee_collections (cobros de fees fallidos pendientes de reintento)
     cur.execute("""
@@ -1991,6 +2189,15 @@ def init_db():
         );
     """)
 
+    # Tablas frias de pedidos/rutas terminados y vistas caliente + fria
+    _ensure_archive_tables(cur)
+
+    # Versiones de cambio de los listados del panel (ETag)
+    _ensure_change_version_triggers(cur)
+
+    # Contadores de pendientes de los menus del admin
+    _ensure_admin_inbox_counters(cur)
+
     conn.commit()
     conn.close()
 
@@ -2226,6 +2433,21 @@ def _init_db_postgres():
     _pg_add_col("ally_customers", "use_count", "INTEGER DEFAULT 0")
     _pg_add_col("admin_customers", "use_count", "INTEGER DEFAULT 0")
 
+    # ally_customers / admin_customers: columnas normalizadas + índices trigram para búsqueda
+    cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for _table in _CUSTOMER_SEARCH_TABLES:
+        _pg_add_col(_table, "name_search", "TEXT")
+        _pg_add_col(_table, "phone_search", "TEXT")
+        _backfill_customer_search_columns(cur, _table)
+        cur.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_{_table}_name_trgm "
+            f"ON {_table} USING gin (name_search gin_trgm_ops)"
+        )
+        cur.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_{_table}_phone_trgm "
+            f"ON {_table} USING gin (phone_search gin_trgm_ops)"
+        )
+
     # ally_customer_addresses / admin_customer_addresses: use_count para orden por uso
     _pg_add_col("ally_customer_addresses", "use_count", "INTEGER DEFAULT 0")
     _pg_add_col("admin_customer_addresses", "use_count", "INTEGER DEFAULT 0")
@@ -2257,6 +2479,9 @@ def _init_db_postgres():
     # routes: additional_incentive para incentivos agregados por el aliado
     _pg_add_col("routes", "additional_incentive", "INTEGER DEFAULT 0")
 
+    # scheduled_jobs: pedido/ruta duenio del job (shard del despacho repartido)
+    _pg_add_col("scheduled_jobs", "entity_id", "BIGINT")
+
     # web_users: tabla de usuarios del panel web (multiusuario real)
     cur.execute("""
         CREATE TABLE IF NOT EXISTS web_users (
@@ -2430,6 +2655,25 @@ def _init_db_postgres():
             ('ALLY', 'ALLY_V1', 'https://domiquerendona.com/terms/ally', sha256_hash, 1),
         )
 
+    # Historial paginado por dueno y fecha (INCLUDE: totales por dia sin leer la fila).
+    # Despues de las migraciones: special_commission puede haberse agregado arriba.
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_orders_ally_created ON orders(ally_id, created_at) INCLUDE (status, total_fee)")
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_orders_admin_created "
+        "ON orders(creator_admin_id, created_at) INCLUDE (status, total_fee, special_commission)"
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_orders_courier_created ON orders(courier_id, created_at)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_routes_ally_created ON routes(ally_id, created_at) INCLUDE (status, total_fee)")
+
+    # Tablas frias de pedidos/rutas terminados y vistas caliente + fria
+    _ensure_archive_tables(cur)
+
+    # Versiones de cambio de los listados del panel (ETag)
+    _ensure_change_version_triggers(cur)
+
+    # Contadores de pendientes de los menus del admin
+    _ensure_admin_inbox_counters(cur)
+
     conn.commit()
     conn.close()
 
@@ -3024,126 +3268,7 @@ def get_blocked_courier_ids_for_ally(ally_id: int) -> set:
     return {row["courier_id"] for row in rows}
 
 
-def create_offer_queue(order_id: int, courier_ids: list):
-    """Crea la cola de ofertas para un pedido. courier_ids ya viene ordenado por prioridad."""
-    conn = get_connection()
-    cur = conn.cursor()
-    for position, courier_id in enumerate(courier_ids):
-        cur.execute(f"""
-            INSERT INTO order_offer_queue (order_id, courier_id, position, status)
-            VALUES ({P}, {P}, {P}, 'PENDING');
-        """, (order_id, courier_id, position))
-    conn.commit()
-    conn.close()
-
-
-def get_next_pending_offer(order_id: int):
-    """Devuelve el siguiente courier en cola con status PENDING."""
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(f"""
-        SELECT oq.id, oq.courier_id, oq.position, c.full_name, u.telegram_id
-        FROM order_offer_queue oq
-        JOIN couriers c ON c.id = oq.courier_id
-        JOIN users u ON u.id = c.user_id
-        WHERE oq.order_id = {P} AND oq.status = 'PENDING'
-        ORDER BY oq.position ASC
-        LIMIT 1;
-    """, (order_id,))
-    row = cur.fetchone()
-    conn.close()
-    if not row:
-        return None
-    return {
-        "queue_id": row["id"],
-        "courier_id": row["courier_id"],
-        "position": row["position"],
-        "full_name": row["full_name"],
-        "telegram_id": row["telegram_id"],
-    }
-
-
-def mark_offer_as_offered(queue_id: int):
-    conn = get_connection()
-    cur = conn.cursor()
-    now_sql = "NOW()" if DB_ENGINE == "postgres" else "datetime('now')"
-    cur.execute(f"""
-        UPDATE order_offer_queue
-        SET status = 'OFFERED', offered_at = {now_sql}
-        WHERE id = {P};
-    """, (queue_id,))
-    conn.commit()
-    conn.close()
-
-
-def mark_offer_response(queue_id: int, response: str):
-    """response: 'ACCEPTED', 'REJECTED', o 'EXPIRED'"""
-    conn = get_connection()
-    cur = conn.cursor()
-    now_sql = "NOW()" if DB_ENGINE == "postgres" else "datetime('now')"
-    cur.execute(f"""
-        UPDATE order_offer_queue
-        SET status = {P}, response = {P}, responded_at = {now_sql}
-        WHERE id = {P};
-    """, (response, response, queue_id))
-    conn.commit()
-    conn.close()
-
-
-def get_current_offer_for_order(order_id: int):
-    """Devuelve la oferta actualmente en status OFFERED para un pedido."""
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(f"""
-        SELECT oq.id, oq.courier_id, oq.position, oq.offered_at, u.telegram_id
-        FROM order_offer_queue oq
-        JOIN couriers c ON c.id = oq.courier_id
-        JOIN users u ON u.id = c.user_id
-        WHERE oq.order_id = {P} AND oq.status = 'OFFERED'
-        LIMIT 1;
-    """, (order_id,))
-    row = cur.fetchone()
-    conn.close()
-    if not row:
-        return None
-    return {
-        "queue_id": row["id"],
-        "courier_id": row["courier_id"],
-        "position": row["position"],
-        "offered_at": row["offered_at"],
-        "telegram_id": row["telegram_id"],
-    }
-
-
-def reset_offer_queue(order_id: int):
-    """Resetea toda la cola a PENDING para reiniciar el ciclo."""
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(f"""
-        UPDATE order_offer_queue
-        SET status = 'PENDING', offered_at = NULL, responded_at = NULL, response = NULL
-        WHERE order_id = {P} AND status IN ('REJECTED', 'EXPIRED');
-    """, (order_id,))
-    conn.commit()
-    conn.close()
-
-
-def clear_offer_queue(order_id: int):
-    """Elimina todos los registros de la cola de ofertas de un pedido para permitir re-oferta completa."""
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(f"DELETE FROM order_offer_queue WHERE order_id = {P};", (order_id,))
-    conn.commit()
-    conn.close()
-
-
-def delete_offer_queue(order_id: int):
-    """Elimina la cola de ofertas de un pedido (al cancelar o completar)."""
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(f"DELETE FROM order_offer_queue WHERE order_id = {P};", (order_id,))
-    conn.commit()
-    conn.close()
+# Colas de ofertas (order_offer_queue / route_offer_queue): ver offer_queue.py
 
 
 def upsert_order_pickup_confirmation(order_id: int, courier_id: int, ally_id: int, status: str = "PENDING"):
@@ -3218,6 +3343,7 @@ def deactivate_courier(courier_id: int):
         "UPDATE couriers SET is_active = 0, available_cash = 0, "
         f"availability_status = 'INACTIVE', live_location_active = 0 WHERE id = {P};",
         (courier_id,))
+    _record_ops_feed_event_in_tx(cur, OPS_FEED_COURIER, courier_id, {"state": "offline"})
     conn.commit()
     conn.close()
 
@@ -3261,6 +3387,9 @@ def update_courier_live_location(courier_id: int, lat: float, lng: float, live_p
                 f"UPDATE couriers SET {', '.join(set_clauses)} WHERE id = {P};",
                 tuple(params),
             )
+            _record_ops_feed_event_in_tx(
+                cur, OPS_FEED_COURIER, courier_id, {"state": "moved", "lat": lat, "lng": lng}
+            )
             conn.commit()
             return True
         except sqlite3.OperationalError as exc:
@@ -3287,6 +3416,7 @@ def set_courier_availability(courier_id: int, status: str):
             "UPDATE couriers SET availability_status = 'INACTIVE', "
             f"live_location_active = 0 WHERE id = {P};",
             (courier_id,))
+        _record_ops_feed_event_in_tx(cur, OPS_FEED_COURIER, courier_id, {"state": "offline"})
     else:
         cur.execute(
             f"UPDATE couriers SET availability_status = {P} WHERE id = {P};",
@@ -3354,6 +3484,8 @@ def expire_stale_live_locations(stale_timeout_seconds: int = 900):
                       AND live_location_active = 1
                       AND {condition_sql}
                 """, condition_params)
+                for courier_id in expired:
+                    _record_ops_feed_event_in_tx(cur, OPS_FEED_COURIER, courier_id, {"state": "offline"})
                 conn.commit()
 
             return expired
@@ -3371,100 +3503,1387 @@ def expire_stale_live_locations(stale_timeout_seconds: int = 900):
     return []
 
 
-def get_active_courier_cash(courier_id: int) -> int:
+def get_active_courier_cash(courier_id: int) -> int:
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute(f"SELECT available_cash FROM couriers WHERE id = {P};", (courier_id,))
+    row = cur.fetchone()
+    conn.close()
+    return row["available_cash"] if row else 0
+
+
+def get_all_online_couriers(courier_ids: list = None):
+    """
+    Retorna todos los repartidores ONLINE (live_location_active=1) de cualquier equipo.
+    Incluye datos de ubicación en vivo, residencia y equipo para calcular distancias.
+    Incluye active_order_count: cantidad de pedidos activos (ACCEPTED/PICKED_UP) del courier.
+    Si courier_ids se indica, limita el resultado a esos repartidores.
+    """
+    ids_sql = ""
+    params = ()
+    if courier_ids is not None:
+        if not courier_ids:
+            return []
+        ids_sql = f" AND c.id IN ({', '.join([P] * len(courier_ids))})"
+        params = tuple(courier_ids)
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT
+            c.id AS courier_id,
+            c.full_name,
+            u.telegram_id,
+            c.phone,
+            c.live_lat,
+            c.live_lng,
+            c.live_location_updated_at,
+            c.residence_lat,
+            c.residence_lng,
+            c.available_cash,
+            c.availability_status,
+            a.city AS admin_city,
+            ac.admin_id,
+            (SELECT COUNT(*) FROM orders o
+             WHERE o.courier_id = c.id
+               AND o.status IN ('ACCEPTED', 'PICKED_UP')) AS active_order_count
+        FROM couriers c
+        JOIN users u ON u.id = c.user_id
+        JOIN admin_couriers ac ON ac.courier_id = c.id AND ac.status = 'APPROVED'
+        JOIN admins a ON a.id = ac.admin_id
+        WHERE c.live_location_active = 1
+          AND c.availability_status = 'APPROVED'
+          AND c.is_deleted = 0{ids_sql}
+        ORDER BY c.live_location_updated_at DESC
+    """, params)
+    rows = cur.fetchall()
+    conn.close()
+    return rows
+
+
+def get_active_orders_without_courier(limit: int = 20, order_ids: list = None):
+    """
+    Retorna pedidos activos sin courier asignado, con coordenadas de pickup.
+    Usado por el admin de plataforma para buscar repartidores cercanos.
+    admin_id es el equipo dueño del pedido (snapshot del aliado o admin creador).
+    Si order_ids se indica, limita el resultado a esos pedidos.
+    """
+    ids_sql = ""
+    params = []
+    if order_ids is not None:
+        if not order_ids:
+            return []
+        ids_sql = f" AND o.id IN ({', '.join([P] * len(order_ids))})"
+        params.extend(order_ids)
+    params.append(limit)
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT
+            o.id,
+            o.status,
+            aloc.address AS pickup_address,
+            o.pickup_lat,
+            o.pickup_lng,
+            o.customer_name,
+            o.created_at,
+            COALESCE(al.business_name, 'Admin') AS ally_name,
+            COALESCE(o.ally_admin_id_snapshot, o.creator_admin_id) AS admin_id
+        FROM orders o
+        LEFT JOIN allies al ON al.id = o.ally_id
+        LEFT JOIN ally_locations aloc ON aloc.id = o.pickup_location_id
+        WHERE o.status NOT IN ('DELIVERED', 'CANCELLED')
+          AND (o.courier_id IS NULL OR o.courier_id = 0)
+          AND o.pickup_lat IS NOT NULL
+          AND o.pickup_lng IS NOT NULL{ids_sql}
+        ORDER BY o.created_at ASC
+        LIMIT {P}
+    """, tuple(params))
+    rows = cur.fetchall()
+    conn.close()
+    return rows
+
+
+def get_active_orders_by_ally(ally_id: int):
+    """Devuelve pedidos activos de un aliado (no entregados ni cancelados)."""
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT * FROM orders
+        WHERE ally_id = {P}
+          AND status NOT IN ('DELIVERED', 'CANCELLED')
+        ORDER BY created_at DESC;
+    """, (ally_id,))
+    rows = cur.fetchall()
+    conn.close()
+    return rows
+
+
+# ---------- FEED DE OPERACIONES EN VIVO (mapa del panel web) ----------
+# El bot y la API web corren en procesos distintos: las funciones de escritura
+# registran aqui cada cambio relevante para el mapa (dentro de su misma
+# transaccion) y la API web lee el feed de forma incremental por id.
+
+OPS_FEED_COURIER = "COURIER"
+OPS_FEED_ORDER = "ORDER"
+
+
+def _record_ops_feed_event_in_tx(cur, entity_type: str, entity_id: int, payload: dict = None):
+    """Inserta un evento del feed en vivo resolviendo el equipo (admin_id) en la misma sentencia."""
+    if entity_type == OPS_FEED_COURIER:
+        admin_sql = (
+            f"(SELECT admin_id FROM admin_couriers WHERE courier_id = {P} AND status = 'APPROVED' "
+            "ORDER BY updated_at DESC LIMIT 1)"
+        )
+    else:
+        admin_sql = f"(SELECT COALESCE(ally_admin_id_snapshot, creator_admin_id) FROM orders WHERE id = {P})"
+    cur.execute(
+        f"INSERT INTO ops_feed_events (entity_type, entity_id, admin_id, payload) "
+        f"SELECT {P}, {P}, {admin_sql}, {P}",
+        (entity_type, entity_id, entity_id, json.dumps(payload or {})),
+    )
+
+
+def get_ops_feed_last_event_id() -> int:
+    """Retorna el id del ultimo evento del feed (0 si esta vacio)."""
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT COALESCE(MAX(id), 0) AS last_id FROM ops_feed_events")
+        return int(_row_value(cur.fetchone(), "last_id", 0) or 0)
+    finally:
+        conn.close()
+
+
+def list_ops_feed_events_since(last_id: int, limit: int = 500) -> list:
+    """Retorna eventos del feed con id > last_id en orden ascendente, con payload decodificado."""
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            f"""
+            SELECT id, entity_type, entity_id, admin_id, payload, created_at
+            FROM ops_feed_events
+            WHERE id > {P}
+            ORDER BY id ASC
+            LIMIT {P}
+            """,
+            (last_id, limit),
+        )
+        rows = cur.fetchall()
+    finally:
+        conn.close()
+    events = []
+    for row in rows:
+        event = dict(row)
+        try:
+            event["payload"] = json.loads(event.get("payload") or "{}")
+        except (TypeError, ValueError):
+            event["payload"] = {}
+        events.append(event)
+    return events
+
+
+def prune_ops_feed_events(max_age_seconds: int = 3600) -> int:
+    """Elimina eventos del feed mas antiguos que max_age_seconds. Retorna filas borradas."""
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        if DB_ENGINE == "postgres":
+            cur.execute(
+                f"DELETE FROM ops_feed_events WHERE created_at < NOW() - ({P} * INTERVAL '1 second')",
+                (max_age_seconds,),
+            )
+        else:
+            cur.execute(
+                f"DELETE FROM ops_feed_events WHERE created_at < datetime('now', {P})",
+                (f"-{int(max_age_seconds)} seconds",),
+            )
+        deleted = cur.rowcount
+        conn.commit()
+        return deleted
+    finally:
+        conn.close()
+
+
+# ---------- VERSIONES DE CAMBIO (ETag de los listados del panel web) ----------
+# Cada escritura sobre estas tablas sube su version, venga del bot o de la API:
+# triggers que actualizan la fila de la tabla en change_versions dentro de la misma
+# transaccion (en Postgres diferidos al COMMIT). La API compara versiones antes de
+# reconstruir un listado.
+
+CHANGE_VERSION_TABLES = (
+    "admins", "users", "couriers", "allies",
+    "admin_couriers", "admin_allies", "orders", "ledger",
+)
+
+# Columnas de estado en vivo que no aparecen en los listados: la ubicacion y la
+# disponibilidad de un courier cambian cada pocos segundos y no deben invalidarlos.
+_CHANGE_VERSION_IGNORED_COLUMNS = {
+    "couriers": {
+        "live_lat", "live_lng", "live_location_active", "live_location_updated_at",
+        "live_location_expires_at", "availability_status", "is_active", "available_cash",
+    },
+}
+
+
+def _table_columns(cur, table: str) -> list:
+    """Columnas de la tabla en orden: [(nombre, tipo)]. Lista vacia si no existe."""
+    if DB_ENGINE == "postgres":
+        cur.execute(
+            "SELECT column_name, data_type FROM information_schema.columns "
+            "WHERE table_name = %s ORDER BY ordinal_position",
+            (table,),
+        )
+        return [(_row_value(r, "column_name", 0), _row_value(r, "data_type", 1)) for r in cur.fetchall()]
+    cur.execute(f"PRAGMA table_info({table})")
+    return [(r[1], r[2]) for r in cur.fetchall()]
+
+
+def _change_version_update_columns(cur, table: str):
+    """Columnas que disparan el trigger de UPDATE (None = todas)."""
+    ignored = _CHANGE_VERSION_IGNORED_COLUMNS.get(table)
+    if not ignored:
+        return None
+    return [name for name, _type in _table_columns(cur, table) if name not in ignored]
+
+
+def _ensure_change_version_triggers(cur):
+    """
+    Crea (o recrea, por si la tabla gano columnas) los triggers que suben la version
+    de cada tabla de CHANGE_VERSION_TABLES.
+    """
+    version_type = "BIGINT" if DB_ENGINE == "postgres" else "INTEGER"
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS change_versions (
+            table_name TEXT PRIMARY KEY,
+            version {version_type} NOT NULL DEFAULT 0
+        );
+    """)
+    if DB_ENGINE == "postgres":
+        # La fila de version se actualiza dentro de la transaccion del escritor, asi
+        # la version nueva se hace visible junto con los datos en el COMMIT. Una vez
+        # por tabla y transaccion (marca local de la transaccion).
+        cur.execute("""
+            CREATE OR REPLACE FUNCTION bump_change_version() RETURNS trigger AS $$
+            DECLARE
+                marker TEXT := 'domi_change_version.' || TG_ARGV[0];
+            BEGIN
+                IF current_setting(marker, true) = txid_current()::text THEN
+                    RETURN NULL;
+                END IF;
+                PERFORM set_config(marker, txid_current()::text, true);
+                UPDATE change_versions SET version = version + 1 WHERE table_name = TG_ARGV[0];
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+        """)
+
+    for table in CHANGE_VERSION_TABLES:
+        columns = _change_version_update_columns(cur, table)
+        update_of = "UPDATE OF " + ", ".join(columns) if columns else "UPDATE"
+        trigger = f"trg_{table}_change_version"
+        if DB_ENGINE == "postgres":
+            cur.execute(
+                "INSERT INTO change_versions (table_name, version) VALUES (%s, 0) "
+                "ON CONFLICT (table_name) DO NOTHING",
+                (table,),
+            )
+            # Diferido: la fila de version se bloquea solo durante el COMMIT, no durante
+            # toda la transaccion del escritor.
+            cur.execute(f"DROP TRIGGER IF EXISTS {trigger} ON {table}")
+            cur.execute(
+                f"CREATE CONSTRAINT TRIGGER {trigger} AFTER INSERT OR {update_of} OR DELETE ON {table} "
+                f"DEFERRABLE INITIALLY DEFERRED FOR EACH ROW "
+                f"EXECUTE FUNCTION bump_change_version('{table}')"
+            )
+            continue
+        cur.execute("INSERT OR IGNORE INTO change_versions (table_name, version) VALUES (?, 0)", (table,))
+        for suffix, event in (("ins", "INSERT"), ("upd", update_of), ("del", "DELETE")):
+            cur.execute(f"DROP TRIGGER IF EXISTS {trigger}_{suffix}")
+            cur.execute(f"""
+                CREATE TRIGGER {trigger}_{suffix} AFTER {event} ON {table}
+                BEGIN
+                    UPDATE change_versions SET version = version + 1 WHERE table_name = '{table}';
+                END
+            """)
+
+
+def get_change_versions(tables) -> dict:
+    """Version actual de cada tabla pedida: {tabla: entero}. Una sola consulta."""
+    tables = [t for t in tables if t in CHANGE_VERSION_TABLES]
+    if not tables:
+        return {}
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        placeholders = ", ".join([P] * len(tables))
+        cur.execute(
+            f"SELECT table_name, version FROM change_versions WHERE table_name IN ({placeholders})",
+            tuple(tables),
+        )
+        return {_row_value(r, "table_name", 0): int(_row_value(r, "version", 1) or 0) for r in cur.fetchall()}
+    finally:
+        conn.close()
+
+
+# ---------- ARCHIVO DE PEDIDOS Y RUTAS (datos frios) ----------
+# Las consultas operativas (pedidos activos, elegibilidad, ofertas, reintentos) leen
+# orders/routes y sus tablas hijas, que antes guardaban toda la historia. Un job diario
+# mueve los pedidos y rutas terminados hace mas de ARCHIVE_AFTER_DAYS dias (con sus
+# colas de ofertas, solicitudes de ayuda y liquidaciones) a <tabla>_archive.
+# Historial, ganancias y reportes leen la vista <tabla>_all (caliente UNION ALL fria).
+
+ARCHIVE_AFTER_DAYS = 30
+ARCHIVE_BATCH_SIZE = 500
+ARCHIVE_TERMINAL_STATUSES = ("DELIVERED", "CANCELLED")
+
+ARCHIVE_TABLES = (
+    "orders", "order_offer_queue", "order_support_requests", "order_accounting_settlements",
+    "routes", "route_destinations", "route_offer_queue",
+)
+
+# Indices de las tablas frias (las consultas de historial filtran por estos campos)
+_ARCHIVE_INDEXES = {
+    "orders": (("id",), ("ally_id", "created_at"), ("creator_admin_id", "created_at"),
+               ("courier_id", "created_at"), ("created_at",)),
+    "order_offer_queue": (("order_id",),),
+    "order_support_requests": (("order_id",), ("route_id",)),
+    "order_accounting_settlements": (("order_id",), ("courier_id", "week_key"), ("week_key",)),
+    "routes": (("id",), ("ally_id", "created_at"), ("courier_id", "created_at")),
+    "route_destinations": (("route_id", "sequence"),),
+    "route_offer_queue": (("route_id",),),
+}
+
+
+def _ensure_archive_tables(cur):
+    """
+    Crea las tablas frias y sus vistas <tabla>_all. Si la tabla caliente gano columnas
+    (migraciones), la fria las recibe y la vista se recrea con la lista explicita; si no,
+    la vista existente se deja como esta.
+    """
+    for table in ARCHIVE_TABLES:
+        cold = f"{table}_archive"
+        if DB_ENGINE == "postgres":
+            cur.execute(f"CREATE TABLE IF NOT EXISTS {cold} (LIKE {table})")
+        else:
+            cur.execute(f"CREATE TABLE IF NOT EXISTS {cold} AS SELECT * FROM {table} WHERE 0")
+        hot_columns = _table_columns(cur, table)
+        cold_names = {name for name, _type in _table_columns(cur, cold)}
+        for name, col_type in hot_columns:
+            if name not in cold_names:
+                cur.execute(f'ALTER TABLE {cold} ADD COLUMN "{name}" {col_type or ""}')
+        for columns in _ARCHIVE_INDEXES.get(table, ()):
+            unique = "UNIQUE " if columns == ("id",) else ""
+            cur.execute(
+                f"CREATE {unique}INDEX IF NOT EXISTS idx_{cold}_{'_'.join(columns)} "
+                f"ON {cold}({', '.join(columns)})"
+            )
+        view_names = [name for name, _type in _table_columns(cur, f"{table}_all")]
+        if view_names == [name for name, _type in hot_columns]:
+            continue
+        names = ", ".join(f'"{name}"' for name, _type in hot_columns)
+        cur.execute(f"DROP VIEW IF EXISTS {table}_all")
+        cur.execute(
+            f"CREATE VIEW {table}_all AS "
+            f"SELECT {names} FROM {table} UNION ALL SELECT {names} FROM {cold}"
+        )
+
+
+def _move_to_archive_in_tx(cur, table: str, column: str, ids: list, columns_by_table: dict) -> int:
+    """Copia a la tabla fria las filas con column IN ids y las borra de la caliente."""
+    if table not in columns_by_table:
+        columns_by_table[table] = ", ".join(f'"{name}"' for name, _type in _table_columns(cur, table))
+    columns = columns_by_table[table]
+    where = f"{column} IN ({', '.join([P] * len(ids))})"
+    cur.execute(f"INSERT INTO {table}_archive ({columns}) SELECT {columns} FROM {table} WHERE {where}", tuple(ids))
+    cur.execute(f"DELETE FROM {table} WHERE {where}", tuple(ids))
+    return cur.rowcount
+
+
+def archive_finished_orders(max_age_days: int = ARCHIVE_AFTER_DAYS, batch_size: int = ARCHIVE_BATCH_SIZE,
+                            max_batches: int = 100) -> dict:
+    """
+    Mueve a las tablas frias los pedidos y rutas DELIVERED/CANCELLED cuyo cierre tiene
+    mas de max_age_days, junto con sus filas hijas. Cada lote es una transaccion.
+    No archiva los que tienen una solicitud de ayuda o un cobro de fee pendiente.
+    Retorna {"orders": n, "routes": n}.
+    """
+    if DB_ENGINE == "postgres":
+        cutoff_sql = f"NOW() - ({P} * INTERVAL '1 day')"
+        cutoff = int(max_age_days)
+    else:
+        cutoff_sql = f"datetime('now', {P})"
+        cutoff = f"-{int(max_age_days)} days"
+    statuses = ", ".join(f"'{s}'" for s in ARCHIVE_TERMINAL_STATUSES)
+
+    plans = (
+        ("orders", f"""
+            SELECT o.id FROM orders o
+            WHERE o.status IN ({statuses})
+              AND COALESCE(o.delivered_at, o.canceled_at, o.created_at) < {cutoff_sql}
+              AND NOT EXISTS (SELECT 1 FROM order_support_requests s
+                              WHERE s.order_id = o.id AND s.status = 'PENDING')
+              AND NOT EXISTS (SELECT 1 FROM pending_fee_collections f
+                              WHERE f.order_id = o.id AND f.status = 'PENDING')
+            ORDER BY o.id
+            LIMIT {P}
+        """, (("order_offer_queue", "order_id"), ("order_support_requests", "order_id"),
+              ("order_accounting_settlements", "order_id"), ("orders", "id"))),
+        ("routes", f"""
+            SELECT r.id FROM routes r
+            WHERE r.status IN ({statuses})
+              AND COALESCE(r.delivered_at, r.canceled_at, r.created_at) < {cutoff_sql}
+              AND NOT EXISTS (SELECT 1 FROM order_support_requests s
+                              WHERE s.route_id = r.id AND s.status = 'PENDING')
+            ORDER BY r.id
+            LIMIT {P}
+        """, (("route_offer_queue", "route_id"), ("route_destinations", "route_id"),
+              ("order_support_requests", "route_id"), ("routes", "id"))),
+    )
+
+    archived = {"orders": 0, "routes": 0}
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        columns_by_table = {}
+        for entity, select_sql, moves in plans:
+            for _ in range(max_batches):
+                cur.execute(select_sql, (cutoff, batch_size))
+                ids = [_row_value(r, "id", 0) for r in cur.fetchall()]
+                if not ids:
+                    break
+                for table, column in moves:
+                    _move_to_archive_in_tx(cur, table, column, ids, columns_by_table)
+                conn.commit()
+                archived[entity] += len(ids)
+                if len(ids) < batch_size:
+                    break
+        return archived
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+# ---------- Analitica de despacho ----------
+# El bot acumula eventos de oferta en memoria (dispatch_analytics.py) y los escribe por
+# lotes junto con los agregados horarios; el panel solo lee dispatch_rollups_hourly.
+
+DISPATCH_EVENT_COLUMNS = (
+    "entity_type", "entity_id", "event", "courier_id", "position", "distance_m",
+    "response_s", "wait_s", "supply", "admin_id", "cell", "created_at",
+)
+DISPATCH_ROLLUP_COUNTERS = (
+    "published", "offered", "expired", "rejected", "busy", "accepted",
+    "supply_sum", "supply_samples", "seen_sum", "wait_sum_s", "response_sum_s", "responses",
+    "wait_lt_1m", "wait_lt_3m", "wait_lt_5m", "wait_lt_10m", "wait_ge_10m",
+)
+
+
+def dispatch_events_table_exists() -> bool:
+    """True si la BD actual ya tiene dispatch_events. En SQLite no crea el archivo si no existe."""
+    if DB_ENGINE != "postgres" and not os.path.exists(os.getenv("DB_PATH", "domiquerendona.db")):
+        return False
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        if DB_ENGINE == "postgres":
+            cur.execute("SELECT to_regclass('dispatch_events') IS NOT NULL AS ok")
+        else:
+            cur.execute("SELECT COUNT(*) AS ok FROM sqlite_master WHERE type = 'table' AND name = 'dispatch_events'")
+        return bool(_row_value(cur.fetchone(), "ok", 0))
+    finally:
+        conn.close()
+
+
+def write_dispatch_batch(event_columns: dict, rollups: dict) -> int:
+    """
+    Escribe en una sola transaccion un lote de eventos y suma los agregados horarios.
+
+    event_columns: {columna: [valores]} con las columnas de DISPATCH_EVENT_COLUMNS (mismo largo).
+    rollups: {(hour, cell, admin_id, entity_type): [contadores en el orden de DISPATCH_ROLLUP_COUNTERS]}.
+    Retorna la cantidad de eventos escritos.
+    """
+    events = list(zip(*(event_columns[col] for col in DISPATCH_EVENT_COLUMNS)))
+    if not events and not rollups:
+        return 0
+    key_cols = "hour, cell, admin_id, entity_type"
+    counters = ", ".join(DISPATCH_ROLLUP_COUNTERS)
+    placeholders = ", ".join([P] * (4 + len(DISPATCH_ROLLUP_COUNTERS)))
+    updates = ", ".join(f"{c} = dispatch_rollups_hourly.{c} + excluded.{c}" for c in DISPATCH_ROLLUP_COUNTERS)
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        if events:
+            cur.executemany(
+                f"INSERT INTO dispatch_events ({', '.join(DISPATCH_EVENT_COLUMNS)}) "
+                f"VALUES ({', '.join([P] * len(DISPATCH_EVENT_COLUMNS))})",
+                events,
+            )
+        if rollups:
+            cur.executemany(
+                f"INSERT INTO dispatch_rollups_hourly ({key_cols}, {counters}) VALUES ({placeholders}) "
+                f"ON CONFLICT ({key_cols}) DO UPDATE SET {updates}",
+                [tuple(key) + tuple(values) for key, values in rollups.items()],
+            )
+        conn.commit()
+        return len(events)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def get_dispatch_rollup_totals(since_hour: str, admin_id: int = None, entity_type: str = None,
+                               by_cell: bool = False) -> list:
+    """
+    Suma los agregados horarios desde since_hour ('YYYY-MM-DD HH:00:00', UTC).
+    admin_id filtra por equipo; by_cell agrupa por celda geohash (heatmap).
+    Retorna filas dict con los contadores de DISPATCH_ROLLUP_COUNTERS (y 'cell' si by_cell).
+    """
+    where = [f"hour >= {P}"]
+    params = [since_hour]
+    if admin_id is not None:
+        where.append(f"admin_id = {P}")
+        params.append(int(admin_id))
+    if entity_type:
+        where.append(f"entity_type = {P}")
+        params.append(entity_type)
+    sums = ", ".join(f"COALESCE(SUM({c}), 0) AS {c}" for c in DISPATCH_ROLLUP_COUNTERS)
+    select_cell = "cell, " if by_cell else ""
+    group_by = " GROUP BY cell ORDER BY cell" if by_cell else ""
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            f"SELECT {select_cell}{sums} FROM dispatch_rollups_hourly "
+            f"WHERE {' AND '.join(where)}{group_by}",
+            tuple(params),
+        )
+        rows = cur.fetchall()
+    finally:
+        conn.close()
+    columns = (("cell",) if by_cell else ()) + DISPATCH_ROLLUP_COUNTERS
+    return [
+        {col: (_row_value(row, col, idx) if col == "cell" else int(_row_value(row, col, idx, 0) or 0))
+         for idx, col in enumerate(columns)}
+        for row in rows
+    ]
+
+
+def prune_dispatch_events(max_age_days: int = 30) -> int:
+    """Elimina eventos de despacho mas antiguos que max_age_days (los agregados se conservan)."""
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        if DB_ENGINE == "postgres":
+            cur.execute(
+                f"DELETE FROM dispatch_events WHERE created_at < NOW() - ({P} * INTERVAL '1 day')",
+                (int(max_age_days),),
+            )
+        else:
+            cur.execute(
+                f"DELETE FROM dispatch_events WHERE created_at < datetime('now', {P})",
+                (f"-{int(max_age_days)} days",),
+            )
+        deleted = cur.rowcount
+        conn.commit()
+        return deleted
+    finally:
+        conn.close()
+
+
+DEMAND_MODEL_COLUMNS = (
+    "level", "bucket", "incentive", "samples", "accepted", "accepted_target", "median_wait_s", "trained_at",
+)
+
+
+def get_demand_training_rows(days: int = 60) -> list:
+    """
+    Historico de pedidos y rutas publicados en los ultimos `days` dias y ya resueltos
+    (aceptados o cancelados), para entrenar el modelo de demanda (demand_model.py).
+
+    Retorna filas dict: entity_type, pickup_lat, pickup_lng, distance_km, incentive,
+    hour (UTC de publicacion), wait_s (segundos hasta aceptar, None si no se acepto),
+    end_s (segundos hasta aceptar o cancelar) y supply (couriers elegibles al publicar,
+    desde dispatch_events; None si ya no hay evento).
+    """
+    days = max(1, int(days))
+    if DB_ENGINE == "postgres":
+        since_sql = f"NOW() - ({P} * INTERVAL '1 day')"
+        since_param = days
+        hour_sql = "CAST(EXTRACT(HOUR FROM t.published_at) AS INTEGER)"
+
+        def seconds_sql(col):
+            return f"CAST(EXTRACT(EPOCH FROM (t.{col} - t.published_at)) AS INTEGER)"
+    else:
+        since_sql = f"datetime('now', {P})"
+        since_param = f"-{days} days"
+        hour_sql = "CAST(strftime('%H', t.published_at) AS INTEGER)"
+
+        def seconds_sql(col):
+            return f"CAST(ROUND((julianday(t.{col}) - julianday(t.published_at)) * 86400) AS INTEGER)"
+
+    sources = (
+        ("ORDER", "orders", "distance_km"),
+        ("ROUTE", "routes", "total_distance_km"),
+    )
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        rows = []
+        for entity_type, table, distance_col in sources:
+            cur.execute(f"""
+                SELECT t.id, t.pickup_lat, t.pickup_lng, t.{distance_col} AS distance_km,
+                       COALESCE(t.additional_incentive, 0) AS incentive, {hour_sql} AS hour,
+                       {seconds_sql("accepted_at")} AS wait_s, {seconds_sql("canceled_at")} AS cancel_s
+                FROM {table} t
+                WHERE t.published_at IS NOT NULL
+                  AND t.published_at >= {since_sql}
+                  AND (t.accepted_at IS NOT NULL OR t.canceled_at IS NOT NULL)
+            """, (since_param,))
+            for row in cur.fetchall():
+                rows.append((entity_type, row))
+
+        # Oferta al publicar: primer evento PUBLISHED de cada servicio (una sola lectura).
+        cur.execute(f"""
+            SELECT entity_type, entity_id, supply FROM dispatch_events
+            WHERE event = 'PUBLISHED' AND created_at >= {since_sql}
+            ORDER BY id
+        """, (since_param,))
+        supply = {}
+        for row in cur.fetchall():
+            key = (_row_value(row, "entity_type", 0), int(_row_value(row, "entity_id", 1)))
+            if key not in supply:
+                supply[key] = _row_value(row, "supply", 2)
+    finally:
+        conn.close()
+
+    result = []
+    for entity_type, row in rows:
+        hour = _row_value(row, "hour", 5)
+        wait_s = _row_value(row, "wait_s", 6)
+        end_s = wait_s if wait_s is not None else _row_value(row, "cancel_s", 7)
+        result.append({
+            "entity_type": entity_type,
+            "pickup_lat": _row_value(row, "pickup_lat", 1),
+            "pickup_lng": _row_value(row, "pickup_lng", 2),
+            "distance_km": float(_row_value(row, "distance_km", 3) or 0),
+            "incentive": int(_row_value(row, "incentive", 4) or 0),
+            "hour": int(hour) if hour is not None else None,
+            "wait_s": max(0, int(wait_s)) if wait_s is not None else None,
+            "end_s": max(0, int(end_s)) if end_s is not None else None,
+            "supply": supply.get((entity_type, int(_row_value(row, "id", 0)))),
+        })
+    return result
+
+
+def replace_demand_model_cells(cells: list) -> int:
+    """Reemplaza en una transaccion las celdas del modelo de demanda (tuplas en DEMAND_MODEL_COLUMNS)."""
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM demand_model_cells")
+        if cells:
+            cur.executemany(
+                f"INSERT INTO demand_model_cells ({', '.join(DEMAND_MODEL_COLUMNS)}) "
+                f"VALUES ({', '.join([P] * len(DEMAND_MODEL_COLUMNS))})",
+                [tuple(cell) for cell in cells],
+            )
+        conn.commit()
+        return len(cells)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def get_demand_model_cells() -> list:
+    """Todas las celdas del modelo de demanda, como tuplas en el orden de DEMAND_MODEL_COLUMNS."""
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(f"SELECT {', '.join(DEMAND_MODEL_COLUMNS)} FROM demand_model_cells")
+        return [tuple(_row_value(row, col, idx) for idx, col in enumerate(DEMAND_MODEL_COLUMNS))
+                for row in cur.fetchall()]
+    finally:
+        conn.close()
+
+
+def get_demand_model_trained_at():
+    """Marca de entrenamiento del modelo vigente (None si nunca se entreno)."""
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT MAX(trained_at) FROM demand_model_cells")
+        row = cur.fetchone()
+        return _row_value(row, "max", 0) if row else None
+    finally:
+        conn.close()
+
+
+# ---------- COLA DE UPDATES DE TELEGRAM (modo webhook) ----------
+
+def _queue_now() -> str:
+    return datetime.now(timezone.utc).replace(tzinfo=None).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def enqueue_telegram_update(update_id: int, partition_no: int, chat_id, payload_json: str) -> bool:
+    """
+    Guarda un update recibido por webhook. Telegram reintenta si no recibe 200:
+    un update_id repetido se ignora. Retorna True si se inserto.
+    """
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            f"""
+            INSERT INTO telegram_update_queue (update_id, partition_no, chat_id, payload, status, received_at)
+            VALUES ({P}, {P}, {P}, {P}, 'PENDING', {P})
+            ON CONFLICT (update_id) DO NOTHING
+            """,
+            (int(update_id), int(partition_no), chat_id, payload_json, _queue_now()),
+        )
+        inserted = cur.rowcount > 0
+        conn.commit()
+        return inserted
+    finally:
+        conn.close()
+
+
+def claim_telegram_updates(partitions, claim_token: str, limit: int = 100) -> list:
+    """
+    Toma (PENDING -> PROCESSING) los updates mas antiguos de las particiones dadas.
+    claim_token debe ser unico por llamada: solo se retornan las filas que esta llamada
+    alcanzo a marcar, aunque otro proceso compita por la misma particion.
+    Retorna [(id, payload)] en orden de llegada.
+    """
+    partitions = [int(p) for p in partitions]
+    if not partitions:
+        return []
+    part_ph = ", ".join([P] * len(partitions))
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            f"SELECT id FROM telegram_update_queue WHERE status = 'PENDING' AND partition_no IN ({part_ph}) "
+            f"ORDER BY id LIMIT {P}",
+            tuple(partitions) + (int(limit),),
+        )
+        ids = [int(_row_value(row, "id", 0)) for row in cur.fetchall()]
+        if not ids:
+            return []
+        id_ph = ", ".join([P] * len(ids))
+        cur.execute(
+            f"UPDATE telegram_update_queue SET status = 'PROCESSING', claimed_by = {P} "
+            f"WHERE status = 'PENDING' AND id IN ({id_ph})",
+            (claim_token,) + tuple(ids),
+        )
+        conn.commit()
+        cur.execute(
+            f"SELECT id, payload FROM telegram_update_queue "
+            f"WHERE status = 'PROCESSING' AND claimed_by = {P} AND id IN ({id_ph}) ORDER BY id",
+            (claim_token,) + tuple(ids),
+        )
+        return [(int(_row_value(row, "id", 0)), _row_value(row, "payload", 1)) for row in cur.fetchall()]
+    finally:
+        conn.close()
+
+
+def complete_telegram_updates(ids) -> int:
+    """Marca DONE los updates ya procesados (una sola sentencia por lote)."""
+    ids = [int(i) for i in ids]
+    if not ids:
+        return 0
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            f"UPDATE telegram_update_queue SET status = 'DONE', processed_at = {P} "
+            f"WHERE id IN ({', '.join([P] * len(ids))})",
+            (_queue_now(),) + tuple(ids),
+        )
+        conn.commit()
+        return cur.rowcount
+    finally:
+        conn.close()
+
+
+def requeue_telegram_updates(partitions) -> int:
+    """
+    Devuelve a PENDING los updates PROCESSING de las particiones dadas: los que un
+    worker anterior de esas particiones no alcanzo a terminar antes de caerse.
+    """
+    partitions = [int(p) for p in partitions]
+    if not partitions:
+        return 0
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            f"UPDATE telegram_update_queue SET status = 'PENDING', claimed_by = NULL "
+            f"WHERE status = 'PROCESSING' AND partition_no IN ({', '.join([P] * len(partitions))})",
+            tuple(partitions),
+        )
+        conn.commit()
+        return cur.rowcount
+    finally:
+        conn.close()
+
+
+def prune_telegram_updates(max_age_hours: int = 24) -> int:
+    """Elimina updates DONE procesados hace mas de max_age_hours."""
+    cutoff = (datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(hours=int(max_age_hours)))
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            f"DELETE FROM telegram_update_queue WHERE status = 'DONE' AND processed_at < {P}",
+            (cutoff.strftime("%Y-%m-%d %H:%M:%S"),),
+        )
+        deleted = cur.rowcount
+        conn.commit()
+        return deleted
+    finally:
+        conn.close()
+
+# ============================================================
+# Avisos masivos (broadcasts)
+# ============================================================
+# Un aviso resuelve sus destinatarios una sola vez con INSERT ... SELECT
+# (broadcast_recipients, un telegram_id por aviso) y broadcasts.py los envia por
+# lotes: PENDING -> CLAIMED -> SENT / FAILED. Lo que quedo CLAIMED por un reinicio
+# vuelve a PENDING al arrancar el emisor, asi el envio continua donde iba.
+
+BROADCAST_ROLE_COURIER = "COURIER"
+BROADCAST_ROLE_ALLY = "ALLY"
+BROADCAST_ROLE_ALL = "ALL"
+BROADCAST_ROLES = (BROADCAST_ROLE_COURIER, BROADCAST_ROLE_ALLY, BROADCAST_ROLE_ALL)
+BROADCAST_MAX_ATTEMPTS = 3
+
+
+def _broadcast_audience_sql(role: str, scope_admin_id=None, city: str = None, barrio: str = None):
+    """
+    SELECT telegram_id, role de los destinatarios (puede repetir telegram_id).
+    scope_admin_id: equipo del admin (vinculos APPROVED, mismo criterio que
+    list_courier_links_by_admin / list_ally_links_by_admin); None = toda la plataforma
+    (perfiles APPROVED). city/barrio filtran por la ciudad/barrio del perfil.
+    """
+    if role not in BROADCAST_ROLES:
+        raise ValueError("role invalido: {}".format(role))
+    parts, params = [], []
+    sources = (
+        (BROADCAST_ROLE_COURIER, "couriers", "admin_couriers", "courier_id"),
+        (BROADCAST_ROLE_ALLY, "allies", "admin_allies", "ally_id"),
+    )
+    for part_role, table, link_table, link_col in sources:
+        if role not in (part_role, BROADCAST_ROLE_ALL):
+            continue
+        if scope_admin_id is None:
+            sql = (
+                f"SELECT u.telegram_id AS telegram_id, '{part_role}' AS role "
+                f"FROM {table} p JOIN users u ON u.id = p.user_id "
+                "WHERE p.status = 'APPROVED'"
+            )
+            part_params = []
+        else:
+            sql = (
+                f"SELECT u.telegram_id AS telegram_id, '{part_role}' AS role "
+                f"FROM {link_table} l JOIN {table} p ON p.id = l.{link_col} JOIN users u ON u.id = p.user_id "
+                f"WHERE l.admin_id = {P} AND l.status = 'APPROVED'"
+            )
+            part_params = [int(scope_admin_id)]
+        sql += " AND (p.is_deleted IS NULL OR p.is_deleted = 0) AND u.telegram_id IS NOT NULL"
+        if city:
+            sql += f" AND LOWER(TRIM(p.city)) = LOWER(TRIM({P}))"
+            part_params.append(city)
+        if barrio:
+            sql += f" AND LOWER(TRIM(p.barrio)) = LOWER(TRIM({P}))"
+            part_params.append(barrio)
+        parts.append(sql)
+        params.extend(part_params)
+    return " UNION ALL ".join(parts), tuple(params)
+
+
+def count_broadcast_audience(role: str, scope_admin_id=None, city: str = None, barrio: str = None) -> int:
+    """Cuantos usuarios distintos recibirian el aviso (vista previa antes de confirmar)."""
+    sql, params = _broadcast_audience_sql(role, scope_admin_id, city, barrio)
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(f"SELECT COUNT(DISTINCT telegram_id) AS total FROM ({sql}) aud", params)
+        return int(_row_value(cur.fetchone(), "total", 0) or 0)
+    finally:
+        conn.close()
+
+
+def create_broadcast(created_by_admin_id: int, text: str, role: str, scope_admin_id=None,
+                     city: str = None, barrio: str = None, created_by_telegram_id: int = None):
+    """
+    Crea un aviso y su lista de destinatarios en una transaccion (un INSERT ... SELECT,
+    un destinatario por telegram_id). Retorna (broadcast_id, total). Sin destinatarios
+    el aviso queda DONE de una vez.
+    """
+    audience_sql, audience_params = _broadcast_audience_sql(role, scope_admin_id, city, barrio)
+    now = _queue_now()
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        broadcast_id = _insert_returning_id(cur, f"""
+            INSERT INTO broadcasts
+                (created_by_admin_id, created_by_telegram_id, scope_admin_id, role, city, barrio,
+                 text, status, created_at)
+            VALUES ({P}, {P}, {P}, {P}, {P}, {P}, {P}, 'SENDING', {P})
+        """, (created_by_admin_id, created_by_telegram_id, scope_admin_id, role, city or None,
+              barrio or None, text, now))
+        cur.execute(
+            f"INSERT INTO broadcast_recipients (broadcast_id, telegram_id, role) "
+            f"SELECT {P}, telegram_id, MIN(role) FROM ({audience_sql}) aud GROUP BY telegram_id",
+            (broadcast_id,) + audience_params,
+        )
+        cur.execute(
+            f"SELECT COUNT(*) AS total FROM broadcast_recipients WHERE broadcast_id = {P}",
+            (broadcast_id,),
+        )
+        total = int(_row_value(cur.fetchone(), "total", 0) or 0)
+        if total:
+            cur.execute(f"UPDATE broadcasts SET total = {P} WHERE id = {P}", (total, broadcast_id))
+        else:
+            cur.execute(
+                f"UPDATE broadcasts SET status = 'DONE', finished_at = {P} WHERE id = {P}",
+                (now, broadcast_id),
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return broadcast_id, total
+
+
+def get_broadcast(broadcast_id: int):
+    """Aviso con su progreso (total, sent, failed, pending) o None."""
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT b.id, b.created_by_admin_id, b.created_by_telegram_id, b.scope_admin_id, b.role,
+                   b.city, b.barrio, b.text, b.status, b.total, b.sent, b.failed, b.created_at,
+                   b.finished_at,
+                   (SELECT COUNT(*) FROM broadcast_recipients r
+                    WHERE r.broadcast_id = b.id AND r.status IN ('PENDING', 'CLAIMED')) AS pending
+            FROM broadcasts b
+            WHERE b.id = {P}
+        """, (broadcast_id,))
+        row = cur.fetchone()
+    finally:
+        conn.close()
+    if not row:
+        return None
+    keys = ("id", "created_by_admin_id", "created_by_telegram_id", "scope_admin_id", "role", "city",
+            "barrio", "text", "status", "total", "sent", "failed", "created_at", "finished_at", "pending")
+    return {key: _row_value(row, key, idx) for idx, key in enumerate(keys)}
+
+
+def claim_broadcast_recipients(claim_token: str, limit: int = 50) -> list:
+    """
+    Toma (PENDING -> CLAIMED) los siguientes destinatarios de avisos SENDING, el aviso
+    mas antiguo primero. claim_token debe ser unico por llamada (como
+    claim_telegram_updates). Retorna [{id, broadcast_id, telegram_id, text}].
+    """
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT r.id
+            FROM broadcast_recipients r
+            JOIN broadcasts b ON b.id = r.broadcast_id
+            WHERE r.status = 'PENDING' AND b.status = 'SENDING'
+            ORDER BY r.broadcast_id, r.id
+            LIMIT {P}
+        """, (int(limit),))
+        ids = [int(_row_value(row, "id", 0)) for row in cur.fetchall()]
+        if not ids:
+            return []
+        id_ph = ", ".join([P] * len(ids))
+        cur.execute(
+            f"UPDATE broadcast_recipients SET status = 'CLAIMED', claimed_by = {P} "
+            f"WHERE status = 'PENDING' AND id IN ({id_ph})",
+            (claim_token,) + tuple(ids),
+        )
+        conn.commit()
+        cur.execute(
+            f"SELECT r.id, r.broadcast_id, r.telegram_id, b.text "
+            f"FROM broadcast_recipients r JOIN broadcasts b ON b.id = r.broadcast_id "
+            f"WHERE r.status = 'CLAIMED' AND r.claimed_by = {P} AND r.id IN ({id_ph}) "
+            f"ORDER BY r.broadcast_id, r.id",
+            (claim_token,) + tuple(ids),
+        )
+        return [
+            {
+                "id": int(_row_value(row, "id", 0)),
+                "broadcast_id": int(_row_value(row, "broadcast_id", 1)),
+                "telegram_id": int(_row_value(row, "telegram_id", 2)),
+                "text": _row_value(row, "text", 3),
+            }
+            for row in cur.fetchall()
+        ]
+    finally:
+        conn.close()
+
+
+def complete_broadcast_recipients(sent_ids=(), failed=None, retry_ids=(), release_ids=()) -> list:
+    """
+    Cierra un lote del emisor en una transaccion:
+    - sent_ids -> SENT; failed {id: error} -> FAILED (error permanente);
+    - retry_ids -> PENDING con un intento mas (FAILED al llegar a BROADCAST_MAX_ATTEMPTS);
+    - release_ids -> PENDING sin gastar intento (no se alcanzaron a enviar).
+    Recalcula sent/failed de los avisos tocados y marca DONE los que ya no tienen
+    pendientes. Retorna esos avisos terminados [{id, total, sent, failed, created_by_telegram_id}].
+    """
+    failed = failed or {}
+    now = _queue_now()
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        touched = set()
+        for ids, sql, extra in (
+            (list(sent_ids), "status = 'SENT', sent_at = {}, attempts = attempts + 1".format(P), (now,)),
+            (list(retry_ids),
+             "status = CASE WHEN attempts + 1 >= {} THEN 'FAILED' ELSE 'PENDING' END, "
+             "attempts = attempts + 1".format(int(BROADCAST_MAX_ATTEMPTS)), ()),
+            (list(release_ids), "status = 'PENDING'", ()),
+        ):
+            if not ids:
+                continue
+            cur.execute(
+                f"UPDATE broadcast_recipients SET {sql}, claimed_by = NULL "
+                f"WHERE status = 'CLAIMED' AND id IN ({', '.join([P] * len(ids))})",
+                extra + tuple(int(i) for i in ids),
+            )
+            touched.update(int(i) for i in ids)
+        for recipient_id, error in failed.items():
+            cur.execute(
+                f"UPDATE broadcast_recipients SET status = 'FAILED', error = {P}, "
+                f"attempts = attempts + 1, claimed_by = NULL WHERE status = 'CLAIMED' AND id = {P}",
+                (str(error or "")[:200], int(recipient_id)),
+            )
+            touched.add(int(recipient_id))
+        if not touched:
+            conn.commit()
+            return []
+        id_ph = ", ".join([P] * len(touched))
+        cur.execute(
+            f"SELECT DISTINCT broadcast_id FROM broadcast_recipients WHERE id IN ({id_ph})",
+            tuple(sorted(touched)),
+        )
+        broadcast_ids = sorted(int(_row_value(row, "broadcast_id", 0)) for row in cur.fetchall())
+        b_ph = ", ".join([P] * len(broadcast_ids))
+        cur.execute(f"""
+            UPDATE broadcasts SET
+                sent = (SELECT COUNT(*) FROM broadcast_recipients r
+                        WHERE r.broadcast_id = broadcasts.id AND r.status = 'SENT'),
+                failed = (SELECT COUNT(*) FROM broadcast_recipients r
+                          WHERE r.broadcast_id = broadcasts.id AND r.status = 'FAILED')
+            WHERE id IN ({b_ph})
+        """, tuple(broadcast_ids))
+        cur.execute(f"""
+            SELECT id, total, sent, failed, created_by_telegram_id
+            FROM broadcasts b
+            WHERE b.id IN ({b_ph}) AND b.status = 'SENDING'
+              AND NOT EXISTS (
+                  SELECT 1 FROM broadcast_recipients r
+                  WHERE r.broadcast_id = b.id AND r.status IN ('PENDING', 'CLAIMED'))
+            ORDER BY id
+        """, tuple(broadcast_ids))
+        finished = [
+            {
+                "id": int(_row_value(row, "id", 0)),
+                "total": int(_row_value(row, "total", 1) or 0),
+                "sent": int(_row_value(row, "sent", 2) or 0),
+                "failed": int(_row_value(row, "failed", 3) or 0),
+                "created_by_telegram_id": _row_value(row, "created_by_telegram_id", 4),
+            }
+            for row in cur.fetchall()
+        ]
+        if finished:
+            done_ids = [item["id"] for item in finished]
+            cur.execute(
+                f"UPDATE broadcasts SET status = 'DONE', finished_at = {P} "
+                f"WHERE status = 'SENDING' AND id IN ({', '.join([P] * len(done_ids))})",
+                (now,) + tuple(done_ids),
+            )
+        conn.commit()
+        return finished
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def requeue_broadcast_recipients() -> int:
+    """Devuelve a PENDING lo que quedo CLAIMED (emisor caido a mitad de lote)."""
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("UPDATE broadcast_recipients SET status = 'PENDING', claimed_by = NULL WHERE status = 'CLAIMED'")
+        requeued = cur.rowcount
+        conn.commit()
+        return requeued
+    finally:
+        conn.close()
+
+
+def cancel_broadcast(broadcast_id: int) -> bool:
+    """Detiene un aviso en curso: lo pendiente queda SKIPPED. Retorna True si se cancelo."""
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            f"UPDATE broadcasts SET status = 'CANCELLED', finished_at = {P} WHERE id = {P} AND status = 'SENDING'",
+            (_queue_now(), broadcast_id),
+        )
+        cancelled = cur.rowcount > 0
+        if cancelled:
+            cur.execute(
+                f"UPDATE broadcast_recipients SET status = 'SKIPPED', claimed_by = NULL "
+                f"WHERE broadcast_id = {P} AND status = 'PENDING'",
+                (broadcast_id,),
+            )
+        conn.commit()
+        return cancelled
+    finally:
+        conn.close()
+
+
+def acquire_shard_leases(resource: str, shard_nos, owner: str, ttl_seconds: float, now: float) -> dict:
+    """
+    Toma o renueva leases de shard de un recurso (p.ej. "dispatch"). Un shard se puede
+    tomar si esta libre, vencido o ya es de owner. Al cambiar de duenio el token de
+    fencing sube en 1; al renovar se conserva. now/expires_at son epoch en segundos.
+    Retorna {shard_no: fencing_token} de los shards pedidos que owner tiene ahora.
+    """
+    shard_nos = sorted({int(s) for s in shard_nos})
+    if not shard_nos:
+        return {}
+    shard_ph = ", ".join([P] * len(shard_nos))
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.executemany(
+            f"INSERT INTO shard_leases (resource, shard_no) VALUES ({P}, {P}) "
+            f"ON CONFLICT (resource, shard_no) DO NOTHING",
+            [(resource, shard_no) for shard_no in shard_nos],
+        )
+        cur.execute(
+            f"""
+            UPDATE shard_leases
+            SET fencing_token = CASE WHEN owner = {P} THEN fencing_token ELSE fencing_token + 1 END,
+                owner = {P},
+                expires_at = {P}
+            WHERE resource = {P} AND shard_no IN ({shard_ph})
+              AND (owner IS NULL OR owner = {P} OR expires_at < {P})
+            """,
+            (owner, owner, float(now) + float(ttl_seconds), resource) + tuple(shard_nos) + (owner, float(now)),
+        )
+        cur.execute(
+            f"SELECT shard_no, fencing_token FROM shard_leases "
+            f"WHERE resource = {P} AND owner = {P} AND expires_at > {P} AND shard_no IN ({shard_ph})",
+            (resource, owner, float(now)) + tuple(shard_nos),
+        )
+        held = {int(_row_value(row, "shard_no", 0)): int(_row_value(row, "fencing_token", 1)) for row in cur.fetchall()}
+        conn.commit()
+        return held
+    finally:
+        conn.close()
+
+
+def release_shard_leases(resource: str, shard_nos, owner: str) -> int:
+    """Libera ya los leases de owner en esos shards (apagado ordenado o reparto)."""
+    shard_nos = [int(s) for s in shard_nos]
+    if not shard_nos:
+        return 0
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            f"UPDATE shard_leases SET owner = NULL, expires_at = 0 "
+            f"WHERE resource = {P} AND owner = {P} AND shard_no IN ({', '.join([P] * len(shard_nos))})",
+            (resource, owner) + tuple(shard_nos),
+        )
+        conn.commit()
+        return cur.rowcount
+    finally:
+        conn.close()
+
+
+def get_shard_leases(resource: str) -> list:
+    """Estado de los leases del recurso: [{shard_no, owner, fencing_token, expires_at}]."""
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            f"SELECT shard_no, owner, fencing_token, expires_at FROM shard_leases "
+            f"WHERE resource = {P} ORDER BY shard_no",
+            (resource,),
+        )
+        return [
+            {
+                "shard_no": int(_row_value(row, "shard_no", 0)),
+                "owner": _row_value(row, "owner", 1),
+                "fencing_token": int(_row_value(row, "fencing_token", 2) or 0),
+                "expires_at": float(_row_value(row, "expires_at", 3) or 0),
+            }
+            for row in cur.fetchall()
+        ]
+    finally:
+        conn.close()
+
+
+def check_shard_fence(resource: str, shard_no: int, owner: str, fencing_token: int, now: float) -> bool:
+    """True si owner sigue teniendo el lease vigente del shard con ese token."""
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            f"SELECT 1 FROM shard_leases WHERE resource = {P} AND shard_no = {P} "
+            f"AND owner = {P} AND fencing_token = {P} AND expires_at > {P}",
+            (resource, int(shard_no), owner, int(fencing_token), float(now)),
+        )
+        return cur.fetchone() is not None
+    finally:
+        conn.close()
+
+
+def put_dispatch_state(scope: str, entity_id: int, payload_json: str, fencing_token: int = None) -> bool:
+    """
+    Guarda el estado compartido (scope, entity_id). Con fencing_token, la escritura se
+    rechaza si la fila ya fue escrita con un token mayor (un duenio anterior del shard
+    que perdio el lease). Sin token se escribe conservando el token de la fila.
+    Retorna True si se escribio.
+    """
+    if fencing_token is None:
+        on_conflict = "DO UPDATE SET payload = excluded.payload, updated_at = excluded.updated_at"
+        token = 0
+    else:
+        on_conflict = (
+            "DO UPDATE SET payload = excluded.payload, fencing_token = excluded.fencing_token, "
+            "updated_at = excluded.updated_at WHERE dispatch_state.fencing_token <= excluded.fencing_token"
+        )
+        token = int(fencing_token)
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            f"INSERT INTO dispatch_state (scope, entity_id, payload, fencing_token, updated_at) "
+            f"VALUES ({P}, {P}, {P}, {P}, {P}) ON CONFLICT (scope, entity_id) {on_conflict}",
+            (scope, int(entity_id), payload_json, token, _queue_now()),
+        )
+        written = cur.rowcount > 0
+        conn.commit()
+        return written
+    finally:
+        conn.close()
+
+
+def get_dispatch_state(scope: str, entity_id: int):
+    """Payload JSON del estado compartido, o None."""
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            f"SELECT payload FROM dispatch_state WHERE scope = {P} AND entity_id = {P}",
+            (scope, int(entity_id)),
+        )
+        row = cur.fetchone()
+        return _row_value(row, "payload", 0) if row else None
+    finally:
+        conn.close()
+
+
+def delete_dispatch_state(scope: str, entity_id: int) -> bool:
     conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(f"SELECT available_cash FROM couriers WHERE id = {P};", (courier_id,))
-    row = cur.fetchone()
-    conn.close()
-    return row["available_cash"] if row else 0
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            f"DELETE FROM dispatch_state WHERE scope = {P} AND entity_id = {P}",
+            (scope, int(entity_id)),
+        )
+        deleted = cur.rowcount > 0
+        conn.commit()
+        return deleted
+    finally:
+        conn.close()
 
 
-def get_all_online_couriers():
-    """
-    Retorna todos los repartidores ONLINE (live_location_active=1) de cualquier equipo.
-    Incluye datos de ubicación en vivo, residencia y equipo para calcular distancias.
-    Incluye active_order_count: cantidad de pedidos activos (ACCEPTED/PICKED_UP) del courier.
-    """
+def list_dispatch_state_ids(scope: str) -> list:
     conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(f"""
-        SELECT
-            c.id AS courier_id,
-            c.full_name,
-            u.telegram_id,
-            c.phone,
-            c.live_lat,
-            c.live_lng,
-            c.live_location_updated_at,
-            c.residence_lat,
-            c.residence_lng,
-            c.available_cash,
-            c.availability_status,
-            a.city AS admin_city,
-            ac.admin_id,
-            (SELECT COUNT(*) FROM orders o
-             WHERE o.courier_id = c.id
-               AND o.status IN ('ACCEPTED', 'PICKED_UP')) AS active_order_count
-        FROM couriers c
-        JOIN users u ON u.id = c.user_id
-        JOIN admin_couriers ac ON ac.courier_id = c.id AND ac.status = 'APPROVED'
-        JOIN admins a ON a.id = ac.admin_id
-        WHERE c.live_location_active = 1
-          AND c.availability_status = 'APPROVED'
-          AND c.is_deleted = 0
-        ORDER BY c.live_location_updated_at DESC
-    """)
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+    try:
+        cur = conn.cursor()
+        cur.execute(f"SELECT entity_id FROM dispatch_state WHERE scope = {P} ORDER BY entity_id", (scope,))
+        return [int(_row_value(row, "entity_id", 0)) for row in cur.fetchall()]
+    finally:
+        conn.close()
 
 
-def get_active_orders_without_courier(limit: int = 20):
-    """
-    Retorna pedidos activos sin courier asignado, con coordenadas de pickup.
-    Usado por el admin de plataforma para buscar repartidores cercanos.
-    """
+def enqueue_dispatch_command(shard_no: int, command: str, payload_json: str) -> int:
+    """Encola un comando para el proceso duenio del shard. Retorna el id."""
     conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(f"""
-        SELECT
-            o.id,
-            o.status,
-            aloc.address AS pickup_address,
-            o.pickup_lat,
-            o.pickup_lng,
-            o.customer_name,
-            o.created_at,
-            COALESCE(al.business_name, 'Admin') AS ally_name
-        FROM orders o
-        LEFT JOIN allies al ON al.id = o.ally_id
-        LEFT JOIN ally_locations aloc ON aloc.id = o.pickup_location_id
-        WHERE o.status NOT IN ('DELIVERED', 'CANCELLED')
-          AND (o.courier_id IS NULL OR o.courier_id = 0)
-          AND o.pickup_lat IS NOT NULL
-          AND o.pickup_lng IS NOT NULL
-        ORDER BY o.created_at ASC
-        LIMIT {P}
-    """, (limit,))
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+    try:
+        cur = conn.cursor()
+        command_id = _insert_returning_id(
+            cur,
+            f"INSERT INTO dispatch_commands (shard_no, command, payload, created_at) "
+            f"VALUES ({P}, {P}, {P}, {P})",
+            (int(shard_no), command, payload_json, _queue_now()),
+        )
+        conn.commit()
+        return command_id
+    finally:
+        conn.close()
 
 
-def get_active_orders_by_ally(ally_id: int):
-    """Devuelve pedidos activos de un aliado (no entregados ni cancelados)."""
+def fetch_dispatch_commands(shard_nos, limit: int = 100) -> list:
+    """Comandos pendientes de esos shards en orden de llegada: [(id, command, payload)]."""
+    shard_nos = [int(s) for s in shard_nos]
+    if not shard_nos:
+        return []
     conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(f"""
-        SELECT * FROM orders
-        WHERE ally_id = {P}
-          AND status NOT IN ('DELIVERED', 'CANCELLED')
-        ORDER BY created_at DESC;
-    """, (ally_id,))
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            f"SELECT id, command, payload FROM dispatch_commands "
+            f"WHERE shard_no IN ({', '.join([P] * len(shard_nos))}) ORDER BY id LIMIT {P}",
+            tuple(shard_nos) + (int(limit),),
+        )
+        return [
+            (int(_row_value(row, "id", 0)), _row_value(row, "command", 1), _row_value(row, "payload", 2))
+            for row in cur.fetchall()
+        ]
+    finally:
+        conn.close()
+
+
+def delete_dispatch_commands(ids) -> int:
+    ids = [int(i) for i in ids]
+    if not ids:
+        return 0
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            f"DELETE FROM dispatch_commands WHERE id IN ({', '.join([P] * len(ids))})",
+            tuple(ids),
+        )
+        conn.commit()
+        return cur.rowcount
+    finally:
+        conn.close()
 
 
 def republish_cancelled_order(order_id: int):
@@ -3490,6 +4909,8 @@ def republish_cancelled_order(order_id: int):
         WHERE id = {P} AND status = 'CANCELLED';
     """, (order_id,))
     updated = cur.rowcount > 0
+    if updated:
+        _record_ops_feed_event_in_tx(cur, OPS_FEED_ORDER, order_id, {"status": "PUBLISHED"})
     conn.commit()
     conn.close()
     return updated
@@ -3512,6 +4933,7 @@ def cancel_order(order_id: int, canceled_by: str, reason: str = None):
         SET status = 'CANCELLED', canceled_at = {now_sql}, canceled_by = {P}{reason_sql}
         WHERE id = {P};
     """, tuple(params))
+    _record_ops_feed_event_in_tx(cur, OPS_FEED_ORDER, order_id, {"status": "CANCELLED"})
     conn.commit()
     conn.close()
 
@@ -4059,6 +5481,7 @@ def cancel_order_by_actor(order_id: int, actor_type: str, actor_admin_id: int =
             result.update(code="RACE", message="El pedido cambio de estado antes de cancelar.")
             return result
 
+        _record_ops_feed_event_in_tx(cur, OPS_FEED_ORDER, int(order_id), {"status": "CANCELLED"})
         conn.commit()
         result.update(ok=True, code="OK", status_after="CANCELLED", message="Pedido cancelado.")
         logger.info(
@@ -4207,6 +5630,7 @@ def penalize_courier_for_delay_and_release(order_id: int, actor_admin_id: int =
             result.update(code="RACE", message="El pedido cambio de estado antes de liberarse.")
             return result
 
+        _record_ops_feed_event_in_tx(cur, OPS_FEED_ORDER, int(order_id), {"status": "PUBLISHED"})
         conn.commit()
         result.update(ok=True, code="OK", status_after="PUBLISHED", message="Pedido liberado y listo para reoferta.")
         logger.info(
@@ -4542,6 +5966,7 @@ def release_order_from_courier(order_id: int):
             arrival_wait_override_at = NULL
         WHERE id = {P};
     """, (order_id,))
+    _record_ops_feed_event_in_tx(cur, OPS_FEED_ORDER, order_id, {"status": "PUBLISHED"})
     conn.commit()
     conn.close()
 
@@ -4725,6 +6150,69 @@ def get_active_route_for_courier(courier_id: int):
     return row
 
 
+def get_offer_courier_contexts(courier_ids) -> dict:
+    """
+    Carga por lotes lo que necesita la oferta de un pedido para cada courier de la cola.
+
+    Retorna {courier_id: {"courier": fila con ubicacion, "active_services": [...]}} donde
+    active_services equivale a get_active_orders_for_courier + get_active_route_for_courier.
+    Una sola conexion para toda la cola en lugar de tres consultas por oferta.
+    """
+    ids = sorted({int(cid) for cid in (courier_ids or []) if cid})
+    if not ids:
+        return {}
+    placeholders = ", ".join([P] * len(ids))
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT id, live_lat, live_lng, live_location_active, residence_lat, residence_lng
+            FROM couriers
+            WHERE id IN ({placeholders});
+        """, tuple(ids))
+        courier_rows = cur.fetchall()
+        cur.execute(f"""
+            SELECT
+                o.*,
+                COALESCE(aloc.address, adloc.address) AS pickup_address
+            FROM orders o
+            LEFT JOIN ally_locations aloc
+                ON aloc.id = o.pickup_location_id AND o.ally_id IS NOT NULL
+            LEFT JOIN admin_locations adloc
+                ON adloc.id = o.pickup_location_id AND o.creator_admin_id IS NOT NULL
+            WHERE o.courier_id IN ({placeholders})
+              AND o.status IN ('ACCEPTED', 'PICKED_UP')
+            ORDER BY o.courier_id, o.accepted_at DESC;
+        """, tuple(ids))
+        order_rows = cur.fetchall()
+        cur.execute(f"""
+            SELECT *
+            FROM routes
+            WHERE courier_id IN ({placeholders})
+              AND status = 'ACCEPTED'
+            ORDER BY courier_id, accepted_at DESC;
+        """, tuple(ids))
+        route_rows = cur.fetchall()
+    finally:
+        conn.close()
+
+    contexts = {}
+    for row in courier_rows:
+        contexts[int(row["id"])] = {"courier": row, "active_services": []}
+    for row in order_rows:
+        ctx = contexts.get(int(row["courier_id"]))
+        if ctx is not None:
+            ctx["active_services"].append(row)
+    with_route = set()
+    for row in route_rows:
+        courier_id = int(row["courier_id"])
+        ctx = contexts.get(courier_id)
+        if ctx is not None and courier_id not in with_route:
+            ctx["active_services"].append(row)
+            with_route.add(courier_id)
+    return contexts
+
+
 def get_eligible_couriers_for_order(admin_id: int = None, ally_id: int = None,
                                       requires_cash: bool = False,
                                       cash_required_amount: int = 0,
@@ -4829,54 +6317,84 @@ def get_eligible_couriers_for_order(admin_id: int = None, ally_id: int = None,
     if order_distance_km is not None and order_distance_km > 3.0:
         result = [c for c in result if (c.get("vehicle_type") or "MOTO") != "BICICLETA"]
 
-    # Ordenamiento inteligente si tenemos coordenadas de pickup
+    # Ordenamiento inteligente si tenemos coordenadas de pickup: prioridad,
+    # distancia y base en una pasada, con radio maximo de 7 km desde la recogida.
+    # Repartidores sin coordenadas conocidas quedan excluidos del radio.
     if pickup_lat is not None and pickup_lng is not None:
-        import math
-
-        def _haversine(lat1, lng1, lat2, lng2):
-            r = 6371.0
-            p1, p2 = math.radians(lat1), math.radians(lat2)
-            dlat = math.radians(lat2 - lat1)
-            dlng = math.radians(lng2 - lng1)
-            a = math.sin(dlat / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dlng / 2) ** 2
-            return r * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-
-        def _sort_key(c):
-            status = c.get("availability_status", "INACTIVE")
-            is_live = int(c.get("live_location_active") or 0) == 1
-            if status == "APPROVED" and is_live:
-                priority = 0
-            elif status == "APPROVED":
-                priority = 1
-            else:
-                priority = 2
+        result = rank_candidates(result, pickup_lat, pickup_lng, MAX_OFFER_RADIUS_KM)
 
-            # Mejor ubicacion disponible: live > residence
-            clat = c.get("live_lat") or c.get("residence_lat")
-            clng = c.get("live_lng") or c.get("residence_lng")
+    return result
 
-            if clat is not None and clng is not None:
-                dist = _haversine(pickup_lat, pickup_lng, clat, clng)
-            else:
-                dist = 9999  # Sin ubicacion, al final
 
-            return (priority, dist, -int(c.get("available_cash") or 0))
+def get_courier_dispatch_links(courier_ids) -> dict:
+    """
+    Version por lotes de get_approved_admin_id_for_courier + get_courier_link_balance.
+    Retorna {courier_id: (admin_id, balance)} del vinculo APPROVED mas reciente de cada
+    courier; los couriers sin vinculo aprobado no aparecen.
+    """
+    ids = sorted({int(cid) for cid in (courier_ids or []) if cid})
+    if not ids:
+        return {}
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        placeholders = ", ".join([P] * len(ids))
+        cur.execute(f"""
+            SELECT courier_id, admin_id, balance FROM admin_couriers
+            WHERE status = 'APPROVED' AND courier_id IN ({placeholders})
+            ORDER BY courier_id, updated_at DESC;
+        """, tuple(ids))
+        rows = cur.fetchall()
+    finally:
+        conn.close()
+    links = {}
+    for row in rows:
+        courier_id = int(_row_value(row, "courier_id", 0))
+        if courier_id not in links:
+            links[courier_id] = (
+                int(_row_value(row, "admin_id", 1)),
+                int(_row_value(row, "balance", 2, 0) or 0),
+            )
+    return links
 
-        result.sort(key=_sort_key)
 
-        # Filtrar por radio maximo de 7 km desde el punto de recogida.
-        # Repartidores sin coordenadas conocidas quedan excluidos del radio.
-        MAX_OFFER_RADIUS_KM = 7.0
-        within = []
-        for c in result:
-            clat = c.get("live_lat") or c.get("residence_lat")
-            clng = c.get("live_lng") or c.get("residence_lng")
-            if clat is not None and clng is not None:
-                if _haversine(pickup_lat, pickup_lng, clat, clng) <= MAX_OFFER_RADIUS_KM:
-                    within.append(c)
-        result = within
+def get_courier_dispatch_changes_since(since=None) -> dict:
+    """
+    Feed de cambios de vinculo/saldo para refrescar candidatos de despacho.
 
-    return result
+    Retorna {"links", "now"}:
+    - links: (courier_id, admin_id, status, balance) de los vinculos admin_couriers
+      tocados desde `since` (updated_at >= since). Vacio si since es None (solo se toma
+      el cursor). updated_at tiene resolucion de segundos, por eso el corte es
+      inclusivo y el llamador compara contra lo que ya conoce para descartar repetidos.
+    - now: cursor para la siguiente consulta. Se lee antes que los cambios, asi lo que
+      ocurra durante la consulta se vuelve a ver la proxima vez.
+    Ubicacion y disponibilidad no entran aqui: las filtra la consulta de elegibilidad.
+    """
+    now_sql = "NOW()" if DB_ENGINE == "postgres" else "datetime('now')"
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(f"SELECT {now_sql} AS now_ts")
+        now_ts = _row_value(cur.fetchone(), "now_ts", 0)
+        links = []
+        if since is not None:
+            cur.execute(
+                f"SELECT courier_id, admin_id, status, balance FROM admin_couriers WHERE updated_at >= {P}",
+                (since,),
+            )
+            links = [
+                (
+                    int(_row_value(r, "courier_id", 0)),
+                    int(_row_value(r, "admin_id", 1)),
+                    _row_value(r, "status", 2),
+                    int(_row_value(r, "balance", 3, 0) or 0),
+                )
+                for r in cur.fetchall()
+            ]
+    finally:
+        conn.close()
+    return {"links": links, "now": now_ts}
 
 
 def get_approved_admin_id_for_courier(courier_id: int):
@@ -4944,6 +6462,7 @@ def upsert_admin_ally_link(admin_id: int, ally_id: int, status: str = "PENDING")
             status = excluded.status,
             updated_at = {now_sql}
     """, (admin_id, ally_id, status))
+    _refresh_ally_inbox(cur, ally_id)
 
     conn.commit()
     conn.close()
@@ -4963,6 +6482,7 @@ def deactivate_other_approved_admin_courier_links(courier_id: int, keep_admin_id
           AND status='APPROVED'
           AND admin_id<>{P};
     """, (courier_id, keep_admin_id))
+    _refresh_courier_inbox(cur, courier_id)
     conn.commit()
     conn.close()
 
@@ -4981,6 +6501,7 @@ def deactivate_other_approved_admin_ally_links(ally_id: int, keep_admin_id: int)
           AND status='APPROVED'
           AND admin_id<>{P};
     """, (ally_id, keep_admin_id))
+    _refresh_ally_inbox(cur, ally_id)
     conn.commit()
     conn.close()
 
@@ -5015,6 +6536,7 @@ def upsert_admin_courier_link(admin_id: int, courier_id: int, status: str = "PEN
                 status=excluded.status,
                 updated_at={now_sql}
         """, (admin_id, courier_id, status))
+    _refresh_courier_inbox(cur, courier_id)
     conn.commit()
     conn.close()
 
@@ -5083,6 +6605,7 @@ def sync_all_courier_link_statuses():
         cstatus = _row_value(c, "status", default="")
         _sync_courier_link_status(cur, cid, cstatus if cstatus == "APPROVED" else "INACTIVE", now_sql)
         fixed += 1
+    _reconcile_admin_inbox(cur)
     conn.commit()
     conn.close()
     logger.info("sync_all_courier_link_statuses: %s couriers procesados", fixed)
@@ -5231,13 +6754,13 @@ def get_courier_web_dashboard(courier_id: int) -> dict:
         entregas_hoy = _row_value(cur.fetchone(), 0) or 0
 
         cur.execute(
-            f"SELECT COUNT(*) FROM orders WHERE courier_id = {P} AND status = 'DELIVERED' AND {month_filter}",
+            f"SELECT COUNT(*) FROM orders_all WHERE courier_id = {P} AND status = 'DELIVERED' AND {month_filter}",
             (courier_id,)
         )
         entregas_mes = _row_value(cur.fetchone(), 0) or 0
 
         cur.execute(
-            f"SELECT COALESCE(SUM(total_fee), 0) FROM orders WHERE courier_id = {P} AND status = 'DELIVERED' AND {month_filter}",
+            f"SELECT COALESCE(SUM(total_fee), 0) FROM orders_all WHERE courier_id = {P} AND status = 'DELIVERED' AND {month_filter}",
             (courier_id,)
         )
         tarifa_mes = _row_value(cur.fetchone(), 0) or 0
@@ -5250,7 +6773,7 @@ def get_courier_web_dashboard(courier_id: int) -> dict:
         saldo = _row_value(row, 0) if row else 0
 
         cur.execute(
-            f"SELECT COUNT(*) FROM orders WHERE courier_id = {P} AND status = 'DELIVERED'",
+            f"SELECT COUNT(*) FROM orders_all WHERE courier_id = {P} AND status = 'DELIVERED'",
             (courier_id,)
         )
         total_entregas = _row_value(cur.fetchone(), 0) or 0
@@ -5274,7 +6797,7 @@ def get_courier_web_earnings(courier_id: int, start_s: str, end_s: str) -> list:
         cur.execute(
             f"""SELECT o.id, o.total_fee, o.additional_incentive, o.delivered_at,
                        a.business_name as ally_name, o.customer_city
-                FROM orders o
+                FROM orders_all o
                 LEFT JOIN allies a ON o.ally_id = a.id
                 WHERE o.courier_id = {P} AND o.status = 'DELIVERED'
                 AND o.delivered_at >= {P} AND o.delivered_at <= {P}
@@ -5507,7 +7030,7 @@ def get_courier_recent_activity(courier_id: int) -> list:
     try:
         cur.execute(
             f"""SELECT o.id, o.total_fee, o.incentivo, o.updated_at, a.name as ally_name, o.dropoff_city
-                FROM orders o
+                FROM orders_all o
                 LEFT JOIN allies a ON o.ally_id = a.id
                 WHERE o.courier_id = {P} AND o.status = 'DELIVERED'
                 ORDER BY o.updated_at DESC LIMIT 5""",
@@ -5598,6 +7121,7 @@ def upsert_reference_alias_candidate(raw_text: str, normalized_text: str, sugges
                 ELSE reference_alias_candidates.status
             END
     """, (raw_text.strip(), normalized, suggested_lat, suggested_lng, source))
+    _refresh_admin_inbox(cur, (INBOX_REFERENCES,))
     conn.commit()
     conn.close()
 
@@ -5723,6 +7247,7 @@ def review_reference_alias_candidate(candidate_id: int, new_status: str, reviewe
         SET status = {P}, reviewed_by_admin_id = {P}, reviewed_at = {now_sql}, review_note = {P}
         WHERE id = {P}
     """, (status, reviewed_by_admin_id, (note or "").strip() or None, candidate_id))
+    _refresh_admin_inbox(cur, (INBOX_REFERENCES,))
     conn.commit()
     conn.close()
     return True, "Referencia actualizada a {}.".format(status)
@@ -5820,6 +7345,7 @@ def create_ally(
             normalize_phone(phone),
             normalize_document(document_number),
         ))
+        _refresh_admin_inbox(cur, (INBOX_ALLIES,))
         conn.commit()
 
     except _IntegrityError as e:
@@ -6052,6 +7578,7 @@ def update_courier_status_by_id(courier_id: int, new_status: str, rejection_type
             changed_by=changed_by,
         )
     _sync_courier_link_status(cur, courier_id, new_status, now_sql)
+    _refresh_courier_inbox(cur, courier_id)
     conn.commit()
     conn.close()
 
@@ -6096,6 +7623,7 @@ def update_ally_status_by_id(ally_id: int, new_status: str, rejection_type: str
             changed_by=changed_by,
         )
     _sync_ally_link_status(cur, ally_id, new_status, now_sql)
+    _refresh_ally_inbox(cur, ally_id)
     conn.commit()
     conn.close()
 
@@ -6829,6 +8357,7 @@ def create_admin_courier_link(admin_id: int, courier_id: int):
     c_row = cur.fetchone()
     if _row_value(c_row, "status", default="") == "APPROVED":
         _sync_courier_link_status(cur, courier_id, "APPROVED", now_sql)
+    _refresh_courier_inbox(cur, courier_id)
 
     conn.commit()
     conn.close()
@@ -6862,6 +8391,7 @@ def update_ally_status(ally_id: int, status: str, changed_by: str = None):
             changed_by=changed_by,
         )
     _sync_ally_link_status(cur, ally_id, status, now_sql)
+    _refresh_ally_inbox(cur, ally_id)
     conn.commit()
     conn.close()
 
@@ -7410,6 +8940,7 @@ def set_order_status(order_id: int, status: str, timestamp_field: str = None):
         cur.execute(query, (status, order_id))
     else:
         cur.execute(f"UPDATE orders SET status = {P} WHERE id = {P};", (status, order_id))
+    _record_ops_feed_event_in_tx(cur, OPS_FEED_ORDER, order_id, {"status": status})
 
     conn.commit()
     conn.close()
@@ -7494,16 +9025,24 @@ def assign_order_to_courier(order_id: int, courier_id: int, courier_admin_id_sna
             arrival_wait_override_at = NULL
         WHERE id = {P};
     """, (courier_id, courier_admin_id_snapshot, order_id))
+    _record_ops_feed_event_in_tx(
+        cur, OPS_FEED_ORDER, order_id, {"status": "ACCEPTED", "courier_id": courier_id}
+    )
     conn.commit()
     conn.close()
 
 
-def get_order_by_id(order_id: int):
+def get_order_by_id(order_id: int, include_archived: bool = False):
+    """
+    Pedido por id en la tabla caliente: los flujos que despues hacen UPDATE orders no ven
+    pedidos archivados (None). include_archived=True lee tambien la fria (solo lectura).
+    """
+    table = "orders_all" if include_archived else "orders"
     conn = get_connection()
     cur = conn.cursor()
     cur.execute(f"""
         SELECT *
-        FROM orders
+        FROM {table}
         WHERE id = {P};
     """, (order_id,))
     row = cur.fetchone()
@@ -7517,7 +9056,7 @@ def get_orders_by_ally(ally_id: int, limit: int = 50):
     cur = conn.cursor()
     cur.execute(f"""
         SELECT *
-        FROM orders
+        FROM orders_all
         WHERE ally_id = {P}
         ORDER BY id DESC
         LIMIT {P};
@@ -7527,58 +9066,291 @@ def get_orders_by_ally(ally_id: int, limit: int = 50):
     return rows
 
 
-def get_ally_orders_between(ally_id: int, start_s: str, end_s: str):
-    """Pedidos de un aliado (DELIVERED o CANCELLED) creados entre start_s y end_s."""
+# ---------- HISTORIAL PAGINADO (aliado, pedidos especiales del admin, repartidor) ----------
+# Los totales por dia salen agregados de la BD y el detalle se lee por paginas con
+# cursor (keyset) sobre (created_at, tipo, id): ninguna vista de historial carga el
+# periodo completo. Indices: orders(ally_id, created_at), orders(creator_admin_id,
+# created_at), routes(ally_id, created_at) y sus equivalentes en las tablas frias.
+
+HISTORY_SCOPES = ("ally", "admin", "courier")
+HISTORY_PAGE_SIZE = 15
+
+# Tipo de fila del historial: pedido (0) o ruta (1); desempata filas del mismo instante.
+HISTORY_KIND_ORDER = 0
+HISTORY_KIND_ROUTE = 1
+
+
+def _history_sources(scope: str):
+    """[(tabla, columna del dueno, tipo)] que forman el historial de cada alcance."""
+    if scope == "ally":
+        return [("orders_all", "ally_id", HISTORY_KIND_ORDER), ("routes_all", "ally_id", HISTORY_KIND_ROUTE)]
+    if scope == "admin":
+        return [("orders_all", "creator_admin_id", HISTORY_KIND_ORDER)]
+    if scope == "courier":
+        return [("orders_all", "courier_id", HISTORY_KIND_ORDER)]
+    raise ValueError("Alcance de historial desconocido: {}".format(scope))
+
+
+def _history_branch(table: str, owner_col: str, kind: int, columns: str, owner_id: int,
+                    start_s: str = None, end_s: str = None, key_op: str = None, cursor=None):
+    """SELECT de una fuente del historial con sus filtros (todos dentro de la rama, para usar el indice)."""
+    where = [f"{owner_col} = {P}", "status IN ('DELIVERED', 'CANCELLED')"]
+    params = [owner_id]
+    if start_s:
+        where.append(f"created_at >= {P}")
+        params.append(start_s)
+    if end_s:
+        where.append(f"created_at < {P}")
+        params.append(end_s)
+    if cursor is not None:
+        created_at, cursor_kind, cursor_id = cursor
+        bound = "<=" if key_op == "<" else ">="
+        where.append(f"created_at {bound} {P}")
+        where.append(f"(created_at, {kind}, id) {key_op} ({P}, {P}, {P})")
+        params.extend([created_at, created_at, cursor_kind, cursor_id])
+    return f"SELECT {columns} FROM {table} WHERE {' AND '.join(where)}", params
+
+
+def get_history_day_totals(scope: str, owner_id: int, start_s: str, end_s: str) -> list:
+    """
+    Totales por dia del historial (pedidos DELIVERED/CANCELLED creados en [start_s, end_s)),
+    del dia mas reciente al mas antiguo:
+    [{day: 'YYYY-MM-DD', total, delivered, cancelled, pesos, commission}].
+    pesos y commission suman solo los entregados.
+    """
+    if DB_ENGINE == "postgres":
+        day_expr = "to_char(created_at, 'YYYY-MM-DD')"
+    else:
+        day_expr = "substr(created_at, 1, 10)"
+    branches, params = [], []
+    for table, owner_col, kind in _history_sources(scope):
+        commission = "special_commission" if kind == HISTORY_KIND_ORDER else "0"
+        sql, branch_params = _history_branch(
+            table, owner_col, kind,
+            f"{day_expr} AS day, status, total_fee, {commission} AS special_commission",
+            owner_id, start_s, end_s,
+        )
+        branches.append(sql)
+        params.extend(branch_params)
     conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(f"""
-        SELECT *
-        FROM orders
-        WHERE ally_id = {P}
-          AND status IN ('DELIVERED', 'CANCELLED')
-          AND created_at >= {P}
-          AND created_at < {P}
-        ORDER BY created_at DESC
-    """, (ally_id, start_s, end_s))
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+    try:
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT day,
+                   COUNT(*) AS total,
+                   SUM(CASE WHEN status = 'DELIVERED' THEN 1 ELSE 0 END) AS delivered,
+                   SUM(CASE WHEN status = 'CANCELLED' THEN 1 ELSE 0 END) AS cancelled,
+                   SUM(CASE WHEN status = 'DELIVERED' THEN COALESCE(total_fee, 0) ELSE 0 END) AS pesos,
+                   SUM(CASE WHEN status = 'DELIVERED' THEN COALESCE(special_commission, 0) ELSE 0 END) AS commission
+            FROM ({" UNION ALL ".join(branches)}) h
+            GROUP BY day
+            ORDER BY day DESC
+        """, tuple(params))
+        rows = cur.fetchall()
+    finally:
+        conn.close()
+    return [{
+        "day": str(_row_value(r, "day", 0)),
+        "total": int(_row_value(r, "total", 1) or 0),
+        "delivered": int(_row_value(r, "delivered", 2) or 0),
+        "cancelled": int(_row_value(r, "cancelled", 3) or 0),
+        "pesos": int(_row_value(r, "pesos", 4) or 0),
+        "commission": int(_row_value(r, "commission", 5) or 0),
+    } for r in rows]
+
+
+def encode_history_cursor(item: dict) -> str:
+    """Cursor compacto (cabe en callback_data): digitos de created_at + o/r + id."""
+    digits = "".join(ch for ch in str(item["created_at"]) if ch.isdigit())
+    return "{}{}{}".format(digits, "r" if item["kind"] == HISTORY_KIND_ROUTE else "o", item["id"])
+
+
+def decode_history_cursor(cursor: str):
+    """Inverso de encode_history_cursor: (created_at, tipo, id) o None si no es valido."""
+    for marker, kind in (("o", HISTORY_KIND_ORDER), ("r", HISTORY_KIND_ROUTE)):
+        digits, sep, row_id = (cursor or "").partition(marker)
+        if sep and digits.isdigit() and row_id.isdigit() and len(digits) >= 14:
+            created_at = "{}-{}-{} {}:{}:{}".format(
+                digits[:4], digits[4:6], digits[6:8], digits[8:10], digits[10:12], digits[12:14],
+            )
+            if len(digits) > 14:
+                created_at += "." + digits[14:]
+            return created_at, kind, int(row_id)
+    return None
+
 
+def get_history_page(scope: str, owner_id: int, start_s: str = None, end_s: str = None,
+                     cursor: str = None, direction: str = "older", limit: int = HISTORY_PAGE_SIZE) -> dict:
+    """
+    Una pagina del detalle del historial, del mas reciente al mas antiguo.
+
+    cursor: el de la primera ("newer") o ultima ("older") fila de la pagina actual;
+    None = primera pagina. Retorna {"items", "has_older", "has_newer"}; cada item trae
+    kind, id, created_at, status, total_fee, special_commission, customer_name,
+    customer_address, delivered_at, canceled_at y cursor.
+    """
+    key = decode_history_cursor(cursor) if cursor else None
+    newer = key is not None and direction == "newer"
+    key_op = ">" if newer else "<"
+    branches, params = [], []
+    for table, owner_col, kind in _history_sources(scope):
+        if kind == HISTORY_KIND_ORDER:
+            columns = (f"{kind} AS kind, id, created_at, status, total_fee, special_commission, "
+                       "customer_name, customer_address, delivered_at, canceled_at")
+        else:
+            columns = (f"{kind} AS kind, id, created_at, status, total_fee, 0 AS special_commission, "
+                       "NULL AS customer_name, NULL AS customer_address, delivered_at, canceled_at")
+        sql, branch_params = _history_branch(table, owner_col, kind, columns, owner_id,
+                                             start_s, end_s, key_op if key else None, key)
+        branches.append(sql)
+        params.extend(branch_params)
+    order = "ASC" if newer else "DESC"
+    params.append(limit + 1)
 
-def get_ally_routes_between(ally_id: int, start_s: str, end_s: str):
-    """Rutas de un aliado (DELIVERED o CANCELLED) creadas entre start_s y end_s."""
     conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(f"""
-        SELECT *
-        FROM routes
-        WHERE ally_id = {P}
-          AND status IN ('DELIVERED', 'CANCELLED')
-          AND created_at >= {P}
-          AND created_at < {P}
-        ORDER BY created_at DESC
-    """, (ally_id, start_s, end_s))
-    rows = cur.fetchall()
-    conn.close()
-    return [dict(r) for r in rows]
+    try:
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT * FROM ({" UNION ALL ".join(branches)}) h
+            ORDER BY created_at {order}, kind {order}, id {order}
+            LIMIT {P}
+        """, tuple(params))
+        rows = [dict(r) for r in cur.fetchall()]
+    finally:
+        conn.close()
+
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if newer:
+        rows.reverse()
+    for row in rows:
+        row["cursor"] = encode_history_cursor(row)
+    return {
+        "items": rows,
+        "has_older": more if not newer else True,
+        "has_newer": more if newer else key is not None,
+    }
+
+
+SPECIAL_ORDERS_METRICS_SUMMARY = (
+    "total_pedidos", "entregados", "cancelados", "total_tarifas",
+    "total_comisiones", "total_fees_admin", "ganancia_neta",
+)
+
+
+def get_special_orders_metrics(start_s: str, end_s: str, platform_share: int, tech_dev_pct: int,
+                               admin_id: int = None) -> dict:
+    """
+    Reporte de rentabilidad de pedidos especiales (DELIVERED o CANCELLED) entre start_s y
+    end_s en una sola consulta: filas por pedido con el nombre del courier, fees del admin
+    creador calculados en SQL y totales del periodo como agregados de ventana.
+
+    admin_id: solo los pedidos de ese admin. None = todos los admins aprobados mas el de
+    plataforma (vista global del panel).
 
+    Solo los DELIVERED pagan fee: platform_share fijo mas tech_dev_pct% de total_fee si el
+    pedido tiene comision especial. El redondeo es el de round() de Python (mitad al par),
+    el mismo que aplica el cobro real, sin usar % (psycopg2 lo toma como placeholder).
+
+    Retorna {"resumen": {...}, "pedidos": [...]}.
+    """
+    if admin_id is not None:
+        scope_sql = f"o.creator_admin_id = {P}"
+        scope_params = (admin_id,)
+    else:
+        scope_sql = """o.creator_admin_id IN (
+                SELECT id FROM admins
+                WHERE (status = 'APPROVED' AND (is_deleted IS NULL OR is_deleted = 0))
+                   OR (team_code = 'PLATFORM' AND is_deleted = 0)
+            )"""
+        scope_params = ()
 
-def get_admin_special_orders_between(admin_id: int, start_s: str, end_s: str):
-    """Pedidos especiales creados por un admin (DELIVERED o CANCELLED) entre start_s y end_s."""
     conn = get_connection()
     cur = conn.cursor()
     cur.execute(f"""
-        SELECT *
-        FROM orders
-        WHERE creator_admin_id = {P}
-          AND status IN ('DELIVERED', 'CANCELLED')
-          AND created_at >= {P}
-          AND created_at < {P}
-        ORDER BY created_at DESC
-    """, (admin_id, start_s, end_s))
+        WITH params AS (
+            SELECT {P} AS platform_share, {P} AS tech_dev_pct
+        ),
+        base AS (
+            SELECT
+                o.id, o.created_at, o.status, o.creator_admin_id,
+                o.customer_name, o.customer_barrio, o.customer_city,
+                c.full_name AS courier_name,
+                COALESCE(o.total_fee, 0) AS total_fee,
+                COALESCE(o.special_commission, 0) AS special_commission,
+                CASE WHEN o.status = 'DELIVERED' THEN 1 ELSE 0 END AS delivered,
+                COALESCE(o.total_fee, 0) * p.tech_dev_pct AS fee_x100,
+                p.platform_share
+            FROM orders_all o
+            CROSS JOIN params p
+            LEFT JOIN couriers c ON c.id = o.courier_id
+            WHERE {scope_sql}
+              AND o.status IN ('DELIVERED', 'CANCELLED')
+              AND o.created_at >= {P}
+              AND o.created_at < {P}
+        ),
+        fees AS (
+            SELECT
+                base.*,
+                CASE WHEN delivered = 1 THEN platform_share ELSE 0 END AS platform_fee,
+                CASE WHEN delivered = 1 AND special_commission > 0 THEN
+                    fee_x100 / 100
+                    + CASE
+                        WHEN fee_x100 - 100 * (fee_x100 / 100) > 50 THEN 1
+                        WHEN fee_x100 - 100 * (fee_x100 / 100) = 50
+                             AND (fee_x100 / 100) - 2 * (fee_x100 / 200) = 1 THEN 1
+                        ELSE 0
+                      END
+                ELSE 0 END AS tech_dev_fee
+            FROM base
+        ),
+        per_order AS (
+            SELECT
+                fees.*,
+                platform_fee + tech_dev_fee AS fee_admin_pagado,
+                CASE WHEN delivered = 1 THEN special_commission - platform_fee - tech_dev_fee ELSE 0 END
+                    AS ganancia_neta
+            FROM fees
+        )
+        SELECT
+            id, created_at, status, creator_admin_id,
+            customer_name, customer_barrio, customer_city, courier_name,
+            total_fee, special_commission, platform_fee, tech_dev_fee,
+            fee_admin_pagado, ganancia_neta,
+            COUNT(*) OVER () AS sum_total_pedidos,
+            SUM(delivered) OVER () AS sum_entregados,
+            SUM(1 - delivered) OVER () AS sum_cancelados,
+            SUM(delivered * total_fee) OVER () AS sum_total_tarifas,
+            SUM(delivered * special_commission) OVER () AS sum_total_comisiones,
+            SUM(fee_admin_pagado) OVER () AS sum_total_fees_admin,
+            SUM(ganancia_neta) OVER () AS sum_ganancia_neta
+        FROM per_order
+        ORDER BY created_at DESC, id DESC
+    """, (int(platform_share), int(tech_dev_pct)) + scope_params + (start_s, end_s))
     rows = cur.fetchall()
     conn.close()
-    return rows
+
+    resumen = {name: int(rows[0]["sum_" + name] or 0) if rows else 0 for name in SPECIAL_ORDERS_METRICS_SUMMARY}
+    pedidos = [
+        {
+            "id": row["id"],
+            "created_at": str(row["created_at"] or ""),
+            "status": row["status"] or "",
+            "total_fee": int(row["total_fee"]),
+            "special_commission": int(row["special_commission"]),
+            "platform_fee": int(row["platform_fee"]),
+            "tech_dev_fee": int(row["tech_dev_fee"]),
+            "fee_admin_pagado": int(row["fee_admin_pagado"]),
+            "ganancia_neta": int(row["ganancia_neta"]),
+            "courier_name": row["courier_name"],
+            "customer_name": row["customer_name"],
+            "customer_barrio": row["customer_barrio"],
+            "customer_city": row["customer_city"],
+            "creator_admin_id": row["creator_admin_id"],
+        }
+        for row in rows
+    ]
+    return {"resumen": resumen, "pedidos": pedidos}
 
 
 def get_admin_special_orders_recent(admin_id: int, limit: int = 15) -> list:
@@ -7588,7 +9360,7 @@ def get_admin_special_orders_recent(admin_id: int, limit: int = 15) -> list:
     cur.execute(f"""
         SELECT id, status, customer_name, customer_address, total_fee, special_commission,
                created_at, courier_id
-        FROM orders
+        FROM orders_all
         WHERE creator_admin_id = {P} AND ally_id IS NULL
         ORDER BY id DESC
         LIMIT {P}
@@ -7667,22 +9439,6 @@ def delete_order_template(template_id: int, admin_id: int):
     conn.close()
 
 
-def get_orders_by_courier(courier_id: int, limit: int = 50):
-    """Devuelve los últimos pedidos de un repartidor."""
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(f"""
-        SELECT *
-        FROM orders
-        WHERE courier_id = {P}
-        ORDER BY id DESC
-        LIMIT {P};
-    """, (courier_id, limit))
-    rows = cur.fetchall()
-    conn.close()
-    return rows
-
-
 def get_orders_by_admin_team(admin_id: int, status_filter: str = None, limit: int = 20):
     """
     Devuelve pedidos del admin: aliados vinculados y pedidos especiales creados por el mismo admin.
@@ -7693,7 +9449,7 @@ def get_orders_by_admin_team(admin_id: int, status_filter: str = None, limit: in
 
     query = f"""
         SELECT DISTINCT o.*
-        FROM orders o
+        FROM orders_all o
         LEFT JOIN admin_allies aa
           ON aa.ally_id = o.ally_id
          AND aa.status = 'APPROVED'
@@ -7725,11 +9481,14 @@ def get_all_orders(status_filter: str = None, limit: int = 20):
     """
     Devuelve todos los pedidos del sistema (para admin plataforma).
     status_filter: 'ACTIVE', 'DELIVERED', 'CANCELLED', o None (todos).
+    Los activos salen de la tabla caliente; el resto de orders_all, que incluye los
+    pedidos ya archivados.
     """
     conn = get_connection()
     cur = conn.cursor()
 
-    query = "SELECT * FROM orders"
+    table = "orders" if status_filter == "ACTIVE" else "orders_all"
+    query = f"SELECT * FROM {table}"
     params = []
 
     if status_filter == "ACTIVE":
@@ -8104,7 +9863,7 @@ def get_dashboard_stats_data(admin_id=None):
         pedidos_activos = _row_value(cur.fetchone(), "COUNT(*)", 0, 0) or 0
         cur.execute(f"SELECT COUNT(*) FROM orders WHERE status = 'DELIVERED' AND {hoy_filter}")
         pedidos_entregados_hoy = _row_value(cur.fetchone(), "COUNT(*)", 0, 0) or 0
-        cur.execute("SELECT COUNT(*) FROM orders WHERE status = 'DELIVERED'")
+        cur.execute("SELECT COUNT(*) FROM orders_all WHERE status = 'DELIVERED'")
         pedidos_total_entregados = _row_value(cur.fetchone(), "COUNT(*)", 0, 0) or 0
 
         cur.execute("""
@@ -8167,7 +9926,7 @@ def get_dashboard_stats_data(admin_id=None):
         )
         pedidos_entregados_hoy = _row_value(cur.fetchone(), "COUNT(*)", 0, 0) or 0
         cur.execute(
-            f"SELECT COUNT(*) FROM orders WHERE status = 'DELIVERED'"
+            f"SELECT COUNT(*) FROM orders_all WHERE status = 'DELIVERED'"
             f" AND (ally_admin_id_snapshot = {P} OR courier_admin_id_snapshot = {P} OR creator_admin_id = {P})",
             (admin_id, admin_id, admin_id),
         )
@@ -8252,7 +10011,7 @@ def get_courier_delivery_time_stats(admin_id=None, courier_id=None, days=30):
             {avg_llegada} AS avg_llegada_seg,
             {avg_entrega} AS avg_entrega_seg,
             {avg_total}   AS avg_total_seg
-        FROM orders o
+        FROM orders_all o
         JOIN couriers c ON c.id = o.courier_id
     """
     params = []
@@ -8359,6 +10118,7 @@ def create_courier(
             selfie_file_id,
             vehicle_type,
         ))
+        _refresh_admin_inbox(cur, (INBOX_COURIERS,))
         conn.commit()
 
     except _IntegrityError as e:
@@ -8435,6 +10195,7 @@ def update_courier_status(courier_id: int, new_status: str, changed_by: str = No
             changed_by=changed_by,
         )
     _sync_courier_link_status(cur, courier_id, new_status, now_sql)
+    _refresh_courier_inbox(cur, courier_id)
     conn.commit()
     conn.close()
 
@@ -8475,6 +10236,7 @@ def delete_courier(courier_id: int) -> None:
             updated_at = {now_sql}
         WHERE courier_id = {P}
     """, (courier_id,))
+    _refresh_courier_inbox(cur, courier_id)
 
     conn.commit()
     conn.close()
@@ -8503,6 +10265,7 @@ def delete_ally(ally_id: int) -> None:
             updated_at = {now_sql}
         WHERE ally_id = {P}
     """, (ally_id,))
+    _refresh_ally_inbox(cur, ally_id)
 
     conn.commit()
     conn.close()
@@ -8834,6 +10597,7 @@ def update_admin_courier_status(admin_id, courier_id, status, changed_by: str =
             source="update_admin_courier_status",
             changed_by=changed_by,
         )
+    _refresh_courier_inbox(cur, courier_id)
     conn.commit()
     conn.close()
 
@@ -9102,10 +10866,12 @@ def create_ally_customer(ally_id: int, name: str, phone: str, notes: str = None)
     conn = get_connection()
     cur = conn.cursor()
     now_sql = "NOW()" if DB_ENGINE == "postgres" else "datetime('now')"
+    name_search, phone_search = _customer_search_values(name, phone)
     customer_id = _insert_returning_id(cur, f"""
-        INSERT INTO ally_customers (ally_id, name, phone, notes, status, created_at, updated_at)
-        VALUES ({P}, {P}, {P}, {P}, 'ACTIVE', {now_sql}, {now_sql})
-    """, (ally_id, name.strip(), normalize_phone(phone), notes))
+        INSERT INTO ally_customers (ally_id, name, phone, notes, status, name_search, phone_search,
+                                    created_at, updated_at)
+        VALUES ({P}, {P}, {P}, {P}, 'ACTIVE', {P}, {P}, {now_sql}, {now_sql})
+    """, (ally_id, name.strip(), normalize_phone(phone), notes, name_search, phone_search))
     conn.commit()
     conn.close()
     return customer_id
@@ -9119,11 +10885,13 @@ def update_ally_customer(customer_id: int, ally_id: int, name: str, phone: str,
     conn = get_connection()
     cur = conn.cursor()
     now_sql = "NOW()" if DB_ENGINE == "postgres" else "datetime('now')"
+    name_search, phone_search = _customer_search_values(name, phone)
     cur.execute(f"""
         UPDATE ally_customers
-        SET name = {P}, phone = {P}, notes = {P}, updated_at = {now_sql}
+        SET name = {P}, phone = {P}, notes = {P}, name_search = {P}, phone_search = {P},
+            updated_at = {now_sql}
         WHERE id = {P} AND ally_id = {P} AND status = 'ACTIVE'
-    """, (name.strip(), normalize_phone(phone), notes, customer_id, ally_id))
+    """, (name.strip(), normalize_phone(phone), notes, name_search, phone_search, customer_id, ally_id))
     updated = cur.rowcount > 0
     conn.commit()
     conn.close()
@@ -9233,41 +11001,232 @@ def _normalize_phone_query(text: str) -> str:
     return _re.sub(r'[\s\-\(\)\.\+]', '', text)
 
 
+# ---------- BÚSQUEDA INDEXADA DE CLIENTES (agendas de aliado y admin) ----------
+# name_search/phone_search se mantienen en cada escritura. La búsqueda por subcadena
+# usa índices trigram (pg_trgm en Postgres, FTS5 trigram en SQLite) y, si no alcanza
+# el límite, completa con coincidencias aproximadas por similitud de trigramas.
+
+_CUSTOMER_SEARCH_TABLES = {
+    "ally_customers": "ally_id",
+    "admin_customers": "admin_id",
+}
+CUSTOMER_FUZZY_MIN_SIMILARITY = 0.5
+CUSTOMER_FUZZY_CANDIDATES = 200
+_sqlite_customer_fts_ready = {}
+
+
+def _customer_search_values(name: str, phone: str) -> tuple:
+    """Valores normalizados para name_search (sin tildes, minúsculas) y phone_search (solo dígitos)."""
+    name_search = " ".join(_normalize_search_term((name or "").strip()).split())
+    phone_search = re.sub(r"\D", "", normalize_phone(phone or ""))
+    return name_search, phone_search
+
+
+def _backfill_customer_search_columns(cur, table: str) -> int:
+    """Completa name_search/phone_search en filas antiguas. Retorna filas actualizadas."""
+    cur.execute(f"SELECT id, name, phone FROM {table} WHERE name_search IS NULL OR phone_search IS NULL")
+    rows = cur.fetchall()
+    for row in rows:
+        name_search, phone_search = _customer_search_values(
+            _row_value(row, "name", 1), _row_value(row, "phone", 2)
+        )
+        cur.execute(
+            f"UPDATE {table} SET name_search = {P}, phone_search = {P} WHERE id = {P}",
+            (name_search, phone_search, _row_value(row, "id", 0)),
+        )
+    return len(rows)
+
+
+def _ensure_sqlite_customer_fts(cur, table: str, rebuild: bool = False) -> bool:
+    """Crea el índice FTS5 trigram (external content) y sus triggers de sincronización.
+
+    Si la versión de SQLite no trae el tokenizer trigram, la búsqueda cae a LIKE sobre
+    name_search/phone_search (sigue siendo insensible a tildes).
+    """
+    fts = f"{table}_fts"
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts,))
+    existed = cur.fetchone() is not None
+    try:
+        cur.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+            f"name_search, phone_search, content='{table}', content_rowid='id', tokenize='trigram')"
+        )
+    except sqlite3.OperationalError as exc:
+        logger.warning("FTS5 trigram no disponible para %s: %s", table, exc)
+        return False
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN
+            INSERT INTO {fts}(rowid, name_search, phone_search)
+            VALUES (new.id, new.name_search, new.phone_search);
+        END
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN
+            INSERT INTO {fts}({fts}, rowid, name_search, phone_search)
+            VALUES ('delete', old.id, old.name_search, old.phone_search);
+        END
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF name_search, phone_search ON {table} BEGIN
+            INSERT INTO {fts}({fts}, rowid, name_search, phone_search)
+            VALUES ('delete', old.id, old.name_search, old.phone_search);
+            INSERT INTO {fts}(rowid, name_search, phone_search)
+            VALUES (new.id, new.name_search, new.phone_search);
+        END
+    """)
+    if rebuild or not existed:
+        cur.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+    return True
+
+
+def _sqlite_customer_fts_available(cur, table: str) -> bool:
+    """Cachea por archivo de BD si el índice FTS5 de la tabla existe."""
+    key = (os.getenv("DB_PATH", "domiquerendona.db"), table)
+    if key not in _sqlite_customer_fts_ready:
+        cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (f"{table}_fts",))
+        _sqlite_customer_fts_ready[key] = cur.fetchone() is not None
+    return _sqlite_customer_fts_ready[key]
+
+
+def _trigrams(text: str) -> set:
+    """Trigramas por palabra con relleno, al estilo pg_trgm ('  ana ' -> '  a', ' an', 'ana', 'na ')."""
+    grams = set()
+    for word in (text or "").split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def _trigram_word_similarity(term: str, text: str) -> float:
+    """Fracción de los trigramas del término presentes en el texto.
+
+    Aproxima word_similarity() de pg_trgm: "zulauga" se parece a "ana zuluaga rios"
+    aunque el nombre completo tenga muchas más palabras que la búsqueda.
+    """
+    tq = _trigrams(term)
+    if not tq:
+        return 0.0
+    return len(tq & _trigrams(text)) / len(tq)
+
+
+def _fts_phrase(text: str) -> str:
+    return '"' + text.replace('"', '""') + '"'
+
+
+def _search_customers(table: str, owner_id: int, query: str, limit: int):
+    """Búsqueda de agenda: subcadena indexada ordenada por uso + relleno aproximado por similitud."""
+    owner_col = _CUSTOMER_SEARCH_TABLES[table]
+    term = " ".join(_normalize_search_term(query.strip()).split())
+    digits = re.sub(r"\D", "", _normalize_phone_query(query.strip()))
+    select_cols = (
+        f"c.id, c.{owner_col}, c.name, c.phone, c.notes, c.status, c.created_at, c.updated_at"
+    )
+    base_where = f"c.{owner_col} = {P} AND c.status = 'ACTIVE'"
+    order_by = "c.use_count DESC, c.updated_at DESC"
+    if not term and not digits:
+        return []
+
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        use_fts = (
+            DB_ENGINE != "postgres"
+            and len(term) >= 3
+            and (not digits or len(digits) >= 3)
+            and _sqlite_customer_fts_available(cur, table)
+        )
+
+        # 1) Coincidencias exactas por subcadena (nombre o teléfono)
+        if use_fts:
+            match = f"name_search : {_fts_phrase(term)}"
+            if digits:
+                match += f" OR phone_search : {_fts_phrase(digits)}"
+            cur.execute(f"""
+                SELECT {select_cols}
+                FROM {table}_fts f
+                JOIN {table} c ON c.id = f.rowid
+                WHERE {table}_fts MATCH {P} AND {base_where}
+                ORDER BY {order_by}
+                LIMIT {P}
+            """, (match, owner_id, limit))
+        else:
+            phone_sql = f" OR c.phone_search LIKE {P}" if digits else ""
+            params = [owner_id, f"%{term}%"] + ([f"%{digits}%"] if digits else []) + [limit]
+            cur.execute(f"""
+                SELECT {select_cols}
+                FROM {table} c
+                WHERE {base_where} AND (c.name_search LIKE {P}{phone_sql})
+                ORDER BY {order_by}
+                LIMIT {P}
+            """, tuple(params))
+        rows = list(cur.fetchall())
+
+        # 2) Tolerancia a errores de tipeo: completa con nombres similares
+        if len(rows) >= limit or len(term) < 4 or (digits and digits == term.replace(" ", "")):
+            return rows
+        seen = {_row_value(r, "id", 0) for r in rows}
+        if DB_ENGINE == "postgres":
+            # El operador <% usa el índice GIN trigram con el umbral de la transacción.
+            cur.execute(
+                f"SELECT set_config('pg_trgm.word_similarity_threshold', {P}, true)",
+                (str(CUSTOMER_FUZZY_MIN_SIMILARITY),),
+            )
+            cur.execute(f"""
+                SELECT {select_cols}
+                FROM {table} c
+                WHERE {base_where} AND {P} <%% c.name_search
+                ORDER BY word_similarity({P}, c.name_search) DESC, {order_by}
+                LIMIT {P}
+            """, (owner_id, term, term, limit + len(rows)))
+            fuzzy = list(cur.fetchall())
+        else:
+            if use_fts:
+                grams = sorted(g for g in _trigrams(term) if " " not in g)
+                cur.execute(f"""
+                    SELECT {select_cols}, c.name_search, c.use_count
+                    FROM {table}_fts f
+                    JOIN {table} c ON c.id = f.rowid
+                    WHERE {table}_fts MATCH {P} AND {base_where}
+                    ORDER BY f.rank
+                    LIMIT {P}
+                """, (" OR ".join(f"name_search : {_fts_phrase(g)}" for g in grams),
+                      owner_id, CUSTOMER_FUZZY_CANDIDATES))
+            else:
+                cur.execute(f"""
+                    SELECT {select_cols}, c.name_search, c.use_count
+                    FROM {table} c
+                    WHERE {base_where}
+                    ORDER BY {order_by}
+                    LIMIT {P}
+                """, (owner_id, CUSTOMER_FUZZY_CANDIDATES * 10))
+            scored = []
+            for row in cur.fetchall():
+                score = _trigram_word_similarity(term, row["name_search"])
+                if score >= CUSTOMER_FUZZY_MIN_SIMILARITY:
+                    scored.append((score, int(row["use_count"] or 0), row))
+            scored.sort(key=lambda item: (-item[0], -item[1]))
+            fuzzy = [item[2] for item in scored]
+        for row in fuzzy:
+            if len(rows) >= limit:
+                break
+            if _row_value(row, "id", 0) not in seen:
+                seen.add(_row_value(row, "id", 0))
+                rows.append(row)
+        return rows
+    finally:
+        conn.close()
+
+
 def search_ally_customers(ally_id: int, query: str, limit: int = 10):
     """
     Busca clientes por nombre o teléfono (solo activos).
-    La búsqueda es insensible a mayúsculas y tildes.
+    La búsqueda es insensible a mayúsculas y tildes y tolera errores de tipeo.
     El campo phone usa la query sin separadores (310-555 1234 → 3105551234).
     Si query == '.', retorna todos los clientes ordenados por uso (atajo "ver todos").
     """
     if query.strip() == ".":
         return list_ally_customers(ally_id, limit=limit, include_inactive=False)
-    conn = get_connection()
-    cur = conn.cursor()
-    normalized = _normalize_search_term(query.strip())
-    search_term = f"%{normalized}%"
-    phone_term = f"%{_normalize_phone_query(query.strip())}%"
-    if DB_ENGINE == "postgres":
-        cur.execute(f"""
-            SELECT id, ally_id, name, phone, notes, status, created_at, updated_at
-            FROM ally_customers
-            WHERE ally_id = {P} AND status = 'ACTIVE'
-              AND (unaccent(name) ILIKE unaccent({P}) OR phone ILIKE {P})
-            ORDER BY use_count DESC, updated_at DESC
-            LIMIT {P}
-        """, (ally_id, search_term, phone_term, limit))
-    else:
-        cur.execute(f"""
-            SELECT id, ally_id, name, phone, notes, status, created_at, updated_at
-            FROM ally_customers
-            WHERE ally_id = {P} AND status = 'ACTIVE'
-              AND (name LIKE {P} OR phone LIKE {P})
-            ORDER BY use_count DESC, updated_at DESC
-            LIMIT {P}
-        """, (ally_id, search_term, phone_term, limit))
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+    return _search_customers("ally_customers", ally_id, query, limit)
 
 
 def get_ally_customer_by_phone(ally_id: int, phone: str):
@@ -9372,6 +11331,8 @@ def archive_customer_address(address_id: int, customer_id: int) -> bool:
         WHERE id = {P} AND customer_id = {P} AND status = 'ACTIVE'
     """, (address_id, customer_id))
     archived = cur.rowcount > 0
+    if archived:
+        _refresh_address_parking_inbox(cur, address_id)
     conn.commit()
     conn.close()
     return archived
@@ -9390,6 +11351,8 @@ def restore_customer_address(address_id: int, customer_id: int) -> bool:
         WHERE id = {P} AND customer_id = {P} AND status = 'INACTIVE'
     """, (address_id, customer_id))
     restored = cur.rowcount > 0
+    if restored:
+        _refresh_address_parking_inbox(cur, address_id)
     conn.commit()
     conn.close()
     return restored
@@ -9541,6 +11504,8 @@ def set_address_parking_status(address_id: int, status: str, reviewed_by: int =
             WHERE id = {P} AND status = 'ACTIVE'
         """, (status, address_id))
     updated = cur.rowcount > 0
+    if updated and table == "ally_customer_addresses":
+        _refresh_address_parking_inbox(cur, address_id)
     conn.commit()
     conn.close()
     return updated
@@ -9768,10 +11733,12 @@ def create_admin_customer(admin_id: int, name: str, phone: str, notes: str = Non
     conn = get_connection()
     cur = conn.cursor()
     now_sql = "NOW()" if DB_ENGINE == "postgres" else "datetime('now')"
+    name_search, phone_search = _customer_search_values(name, phone)
     customer_id = _insert_returning_id(cur, f"""
-        INSERT INTO admin_customers (admin_id, name, phone, notes, status, created_at, updated_at)
-        VALUES ({P}, {P}, {P}, {P}, 'ACTIVE', {now_sql}, {now_sql})
-    """, (admin_id, name.strip(), normalize_phone(phone), notes))
+        INSERT INTO admin_customers (admin_id, name, phone, notes, status, name_search, phone_search,
+                                     created_at, updated_at)
+        VALUES ({P}, {P}, {P}, {P}, 'ACTIVE', {P}, {P}, {now_sql}, {now_sql})
+    """, (admin_id, name.strip(), normalize_phone(phone), notes, name_search, phone_search))
     conn.commit()
     conn.close()
     return customer_id
@@ -9782,11 +11749,13 @@ def update_admin_customer(customer_id: int, admin_id: int, name: str, phone: str
     conn = get_connection()
     cur = conn.cursor()
     now_sql = "NOW()" if DB_ENGINE == "postgres" else "datetime('now')"
+    name_search, phone_search = _customer_search_values(name, phone)
     cur.execute(f"""
         UPDATE admin_customers
-        SET name = {P}, phone = {P}, notes = {P}, updated_at = {now_sql}
+        SET name = {P}, phone = {P}, notes = {P}, name_search = {P}, phone_search = {P},
+            updated_at = {now_sql}
         WHERE id = {P} AND admin_id = {P} AND status = 'ACTIVE'
-    """, (name.strip(), normalize_phone(phone), notes, customer_id, admin_id))
+    """, (name.strip(), normalize_phone(phone), notes, name_search, phone_search, customer_id, admin_id))
     updated = cur.rowcount > 0
     conn.commit()
     conn.close()
@@ -9873,37 +11842,12 @@ def list_admin_customers(admin_id: int, limit: int = 20, include_inactive: bool
 
 def search_admin_customers(admin_id: int, query: str, limit: int = 10):
     """Busca clientes del admin por nombre o teléfono (solo activos).
-    La búsqueda es insensible a mayúsculas y tildes.
+    La búsqueda es insensible a mayúsculas y tildes y tolera errores de tipeo.
     El campo phone usa la query sin separadores (310-555 1234 → 3105551234).
     Si query == '.', retorna todos los clientes ordenados por uso (atajo "ver todos")."""
     if query.strip() == ".":
         return list_admin_customers(admin_id, limit=limit, include_inactive=False)
-    conn = get_connection()
-    cur = conn.cursor()
-    normalized = _normalize_search_term(query.strip())
-    search_term = f"%{normalized}%"
-    phone_term = f"%{_normalize_phone_query(query.strip())}%"
-    if DB_ENGINE == "postgres":
-        cur.execute(f"""
-            SELECT id, admin_id, name, phone, notes, status, created_at, updated_at
-            FROM admin_customers
-            WHERE admin_id = {P} AND status = 'ACTIVE'
-              AND (unaccent(name) ILIKE unaccent({P}) OR phone ILIKE {P})
-            ORDER BY use_count DESC, updated_at DESC
-            LIMIT {P}
-        """, (admin_id, search_term, phone_term, limit))
-    else:
-        cur.execute(f"""
-            SELECT id, admin_id, name, phone, notes, status, created_at, updated_at
-            FROM admin_customers
-            WHERE admin_id = {P} AND status = 'ACTIVE'
-              AND (name LIKE {P} OR phone LIKE {P})
-            ORDER BY use_count DESC, updated_at DESC
-            LIMIT {P}
-        """, (admin_id, search_term, phone_term, limit))
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+    return _search_customers("admin_customers", admin_id, query, limit)
 
 
 def get_admin_customer_by_phone(admin_id: int, phone: str):
@@ -10135,7 +12079,7 @@ def get_last_order_by_ally(ally_id: int):
             customer_barrio,
             dropoff_lat,
             dropoff_lng
-        FROM orders
+        FROM orders_all
         WHERE ally_id = {P}
         ORDER BY id DESC
         LIMIT 1
@@ -10154,7 +12098,7 @@ def get_recent_delivery_addresses_for_ally(ally_id: int, limit: int = 5):
     cur = conn.cursor()
     cur.execute(f"""
         SELECT customer_address, customer_city, customer_barrio, dropoff_lat, dropoff_lng
-        FROM orders
+        FROM orders_all
         WHERE ally_id = {P}
           AND customer_address IS NOT NULL
           AND customer_address != ''
@@ -11035,6 +12979,7 @@ def create_recharge_request(target_type: str, target_id: int, admin_id: int,
             (target_type, target_id, admin_id, amount, status, requested_by_user_id, method, note, proof_file_id)
         VALUES ({P}, {P}, {P}, {P}, 'PENDING', {P}, {P}, {P}, {P})
     """, (target_type, target_id, admin_id, amount, requested_by_user_id, method, note, proof_file_id))
+    _refresh_admin_inbox(cur, (INBOX_RECHARGES,), [admin_id])
     conn.commit()
     conn.close()
     return request_id
@@ -11194,6 +13139,8 @@ def update_recharge_status(request_id: int, status: str, decided_by_admin_id: in
         SET status = {P}, decided_by_admin_id = {P}, decided_at = {now_sql}
         WHERE id = {P}
     """, (status, decided_by_admin_id, request_id))
+    cur.execute(f"SELECT admin_id FROM recharge_requests WHERE id = {P}", (request_id,))
+    _refresh_admin_inbox(cur, (INBOX_RECHARGES,), [_row_value(cur.fetchone(), "admin_id", 0)])
     conn.commit()
     conn.close()
 
@@ -11420,7 +13367,7 @@ def _get_courier_earnings_between(courier_id: int, start_s: str, end_s: str):
             customer_name,
             COALESCE(total_fee, 0) AS gross_amount,
             'order' AS kind
-        FROM orders
+        FROM orders_all
         WHERE courier_id = {P}
           AND status = 'DELIVERED'
           AND delivered_at IS NOT NULL
@@ -11437,7 +13384,7 @@ def _get_courier_earnings_between(courier_id: int, start_s: str, end_s: str):
             NULL AS customer_name,
             COALESCE(total_fee, 0) AS gross_amount,
             'route' AS kind
-        FROM routes
+        FROM routes_all
         WHERE courier_id = {P}
           AND status = 'DELIVERED'
           AND delivered_at IS NOT NULL
@@ -11917,7 +13864,7 @@ def get_weekly_courier_settlement_summary(week_key: str, courier_id: int = None)
             COALESCE(SUM(CASE WHEN settlement_status = 'SETTLED' THEN 1 ELSE 0 END), 0) AS settled_orders,
             COALESCE(SUM(CASE WHEN settlement_status = 'PARTIAL' THEN 1 ELSE 0 END), 0) AS partial_orders,
             COALESCE(SUM(CASE WHEN settlement_status = 'OPEN' THEN 1 ELSE 0 END), 0) AS open_orders
-        FROM order_accounting_settlements
+        FROM order_accounting_settlements_all
         WHERE week_key = {P}
     """
     params = [week_key]
@@ -12206,6 +14153,7 @@ def create_profile_change_request(
         team_admin_id,
         team_code,
     ))
+    _refresh_admin_inbox(cur, (INBOX_CHANGE_REQUESTS,), [team_admin_id])
     conn.commit()
     conn.close()
     return req_id
@@ -12261,6 +14209,11 @@ def get_profile_change_request_by_id(request_id):
     return row
 
 
+def _refresh_change_request_inbox(cur, request_id):
+    cur.execute(f"SELECT team_admin_id FROM profile_change_requests WHERE id = {P}", (request_id,))
+    _refresh_admin_inbox(cur, (INBOX_CHANGE_REQUESTS,), [_row_value(cur.fetchone(), "team_admin_id", 0)])
+
+
 def mark_profile_change_request_approved(request_id, reviewer_user_id, reviewer_admin_id):
     conn = get_connection()
     cur = conn.cursor()
@@ -12273,6 +14226,7 @@ def mark_profile_change_request_approved(request_id, reviewer_user_id, reviewer_
             reviewed_at = {now_sql}
         WHERE id = {P}
     """, (reviewer_user_id, reviewer_admin_id, request_id))
+    _refresh_change_request_inbox(cur, request_id)
     conn.commit()
     conn.close()
 
@@ -12290,6 +14244,7 @@ def mark_profile_change_request_rejected(request_id, reviewer_user_id, reviewer_
             rejection_reason = {P}
         WHERE id = {P}
     """, (reviewer_user_id, reviewer_admin_id, reason, request_id))
+    _refresh_change_request_inbox(cur, request_id)
     conn.commit()
     conn.close()
 
@@ -12438,11 +14393,12 @@ def create_route_destination(route_id, sequence, customer_name, customer_phone,
     return dest_id
 
 
-def get_route_by_id(route_id):
-    """Retorna la ruta o None."""
+def get_route_by_id(route_id, include_archived: bool = False):
+    """Retorna la ruta o None. Como get_order_by_id: archivadas solo con include_archived."""
+    table = "routes_all" if include_archived else "routes"
     conn = get_connection()
     cur = conn.cursor()
-    cur.execute(f"SELECT * FROM routes WHERE id = {P}", (route_id,))
+    cur.execute(f"SELECT * FROM {table} WHERE id = {P}", (route_id,))
     row = cur.fetchone()
     conn.close()
     return dict(row) if row else None
@@ -12474,12 +14430,13 @@ def get_routes_by_status(status: str, limit: int = 20):
     return [dict(r) for r in rows]
 
 
-def get_route_destinations(route_id):
+def get_route_destinations(route_id, include_archived: bool = False):
     """Lista todas las paradas de la ruta ordenadas por sequence."""
+    table = "route_destinations_all" if include_archived else "route_destinations"
     conn = get_connection()
     cur = conn.cursor()
     cur.execute(
-        f"SELECT * FROM route_destinations WHERE route_id = {P} ORDER BY sequence ASC",
+        f"SELECT * FROM {table} WHERE route_id = {P} ORDER BY sequence ASC",
         (route_id,)
     )
     rows = cur.fetchall()
@@ -12612,118 +14569,6 @@ def cancel_route(route_id: int, canceled_by: str, reason: str = None):
     conn.close()
 
 
-def create_route_offer_queue(route_id, courier_ids):
-    """Crea entradas en la cola de ofertas de la ruta."""
-    conn = get_connection()
-    cur = conn.cursor()
-    for pos, courier_id in enumerate(courier_ids, start=1):
-        cur.execute(
-            f"""
-            INSERT INTO route_offer_queue (route_id, courier_id, position, status)
-            VALUES ({P}, {P}, {P}, 'PENDING')
-            """,
-            (route_id, courier_id, pos)
-        )
-    conn.commit()
-    conn.close()
-
-
-def get_next_pending_route_offer(route_id):
-    """Retorna el proximo courier pendiente en la cola de la ruta."""
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        f"""
-        SELECT q.id AS queue_id, q.courier_id, q.position, u.telegram_id
-        FROM route_offer_queue q
-        JOIN couriers c ON c.id = q.courier_id
-        JOIN users u ON u.id = c.user_id
-        WHERE q.route_id = {P} AND q.status = 'PENDING'
-        ORDER BY q.position ASC
-        LIMIT 1
-        """,
-        (route_id,)
-    )
-    row = cur.fetchone()
-    conn.close()
-    return dict(row) if row else None
-
-
-def mark_route_offer_as_offered(queue_id):
-    """Marca una oferta de ruta como enviada."""
-    conn = get_connection()
-    cur = conn.cursor()
-    now_sql = "NOW()" if DB_ENGINE == "postgres" else "datetime('now')"
-    cur.execute(
-        f"UPDATE route_offer_queue SET status = 'OFFERED', offered_at = {now_sql} WHERE id = {P}",
-        (queue_id,)
-    )
-    conn.commit()
-    conn.close()
-
-
-def mark_route_offer_response(queue_id, response):
-    """Marca la respuesta de una oferta de ruta (ACCEPTED, REJECTED, EXPIRED, BUSY)."""
-    conn = get_connection()
-    cur = conn.cursor()
-    now_sql = "NOW()" if DB_ENGINE == "postgres" else "datetime('now')"
-    cur.execute(
-        f"""
-        UPDATE route_offer_queue
-        SET status = {P}, response = {P}, responded_at = {now_sql}
-        WHERE id = {P}
-        """,
-        (response, response, queue_id)
-    )
-    conn.commit()
-    conn.close()
-
-
-def get_current_route_offer(route_id):
-    """Retorna la oferta activa (OFFERED) de la ruta."""
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        f"""
-        SELECT q.id AS queue_id, q.courier_id, q.position, q.offered_at, u.telegram_id
-        FROM route_offer_queue q
-        JOIN couriers c ON c.id = q.courier_id
-        JOIN users u ON u.id = c.user_id
-        WHERE q.route_id = {P} AND q.status = 'OFFERED'
-        LIMIT 1
-        """,
-        (route_id,)
-    )
-    row = cur.fetchone()
-    conn.close()
-    return dict(row) if row else None
-
-
-def delete_route_offer_queue(route_id):
-    """Borra toda la cola de ofertas de una ruta."""
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(f"DELETE FROM route_offer_queue WHERE route_id = {P}", (route_id,))
-    conn.commit()
-    conn.close()
-
-
-def reset_route_offer_queue(route_id):
-    """Reinicia todos los estados de la cola a PENDING para un nuevo ciclo."""
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        f"""
-        UPDATE route_offer_queue
-        SET status = 'PENDING', offered_at = NULL, responded_at = NULL, response = NULL
-        WHERE route_id = {P}
-        """,
-        (route_id,)
-    )
-    conn.commit()
-    conn.close()
-
-
 # ---------------------------------------------------------------------------
 # order_support_requests — solicitudes de ayuda por pin mal ubicado
 # ---------------------------------------------------------------------------
@@ -12787,6 +14632,7 @@ def create_or_get_pending_support_request(courier_id: int, admin_id: int,
             """,
             (order_id, route_id, route_seq, courier_id, admin_id, support_type),
         )
+        _refresh_admin_inbox(cur, (INBOX_SUPPORT,), [admin_id])
         conn.commit()
         return support_id, True
     except Exception:
@@ -12842,6 +14688,9 @@ def resolve_support_request(support_id: int, resolution: str, resolved_by: int)
         (resolution, resolved_by, support_id)
     )
     ok = cur.rowcount > 0
+    if ok:
+        cur.execute(f"SELECT admin_id FROM order_support_requests WHERE id = {P}", (support_id,))
+        _refresh_admin_inbox(cur, (INBOX_SUPPORT,), [_row_value(cur.fetchone(), "admin_id", 0)])
     conn.commit()
     conn.close()
     return ok
@@ -12943,6 +14792,240 @@ def get_support_request_full(support_id: int):
     return dict(row) if row else None
 
 
+# ============================================================
+# Bandeja del admin: contadores de pendientes
+# ============================================================
+# Los menus del admin muestran cuantos pendientes tiene cada bandeja (registros,
+# recargas, soportes, cambios de perfil, referencias, parqueo). Los contadores viven en
+# admin_inbox_counters, una fila por admin y tipo (admin_id 0 = total de plataforma),
+# y los recalcula, dentro de su misma transaccion, cada funcion que crea o resuelve un
+# pendiente. reconcile_admin_inbox_counters (job periodico y arranque) corrige lo que
+# cambie por otros caminos. Pintar un menu cuesta una consulta.
+
+INBOX_PLATFORM_ADMIN_ID = 0
+
+INBOX_COURIERS = "couriers"
+INBOX_ALLIES = "allies"
+INBOX_RECHARGES = "recharges"
+INBOX_SUPPORT = "support"
+INBOX_CHANGE_REQUESTS = "change_requests"
+INBOX_REFERENCES = "references"
+INBOX_PARKING = "parking"
+INBOX_KINDS = (
+    INBOX_COURIERS, INBOX_ALLIES, INBOX_RECHARGES, INBOX_SUPPORT,
+    INBOX_CHANGE_REQUESTS, INBOX_REFERENCES, INBOX_PARKING,
+)
+
+# Tipo -> SELECT COUNT(*) del total de plataforma (lo que lista el Admin de Plataforma)
+_INBOX_PLATFORM_COUNTS = {
+    INBOX_COURIERS: """
+        SELECT COUNT(*) AS pending FROM couriers
+        WHERE status = 'PENDING' AND (is_deleted IS NULL OR is_deleted = 0)""",
+    INBOX_ALLIES: """
+        SELECT COUNT(*) AS pending FROM allies
+        WHERE status = 'PENDING' AND (is_deleted IS NULL OR is_deleted = 0)""",
+    INBOX_RECHARGES: "SELECT COUNT(*) AS pending FROM recharge_requests WHERE status = 'PENDING'",
+    INBOX_SUPPORT: "SELECT COUNT(*) AS pending FROM order_support_requests WHERE status = 'PENDING'",
+    INBOX_CHANGE_REQUESTS: "SELECT COUNT(*) AS pending FROM profile_change_requests WHERE status = 'PENDING'",
+    INBOX_REFERENCES: "SELECT COUNT(*) AS pending FROM reference_alias_candidates WHERE status = 'PENDING'",
+    INBOX_PARKING: """
+        SELECT COUNT(*) AS pending
+        FROM ally_customer_addresses aca
+        JOIN ally_customers ac ON aca.customer_id = ac.id
+        JOIN allies al ON ac.ally_id = al.id
+        WHERE aca.status = 'ACTIVE' AND aca.parking_status IN ('ALLY_YES', 'PENDING_REVIEW')""",
+}
+
+# Tipo -> (columna del admin, FROM ... WHERE ...) de lo que lista un admin de equipo.
+# Referencias locales no tiene conteo por equipo: solo las revisa la plataforma.
+_INBOX_TEAM_SOURCES = {
+    INBOX_COURIERS: ("ac.admin_id", """
+        FROM admin_couriers ac
+        JOIN couriers c ON c.id = ac.courier_id
+        WHERE ac.status = 'PENDING'
+          AND c.status != 'REJECTED'
+          AND (c.is_deleted IS NULL OR c.is_deleted = 0)"""),
+    INBOX_ALLIES: ("aa.admin_id", """
+        FROM admin_allies aa
+        JOIN allies a ON a.id = aa.ally_id
+        WHERE aa.status = 'PENDING'
+          AND a.status != 'REJECTED'
+          AND (a.is_deleted IS NULL OR a.is_deleted = 0)"""),
+    INBOX_RECHARGES: ("rr.admin_id", """
+        FROM recharge_requests rr
+        WHERE rr.status = 'PENDING'"""),
+    INBOX_SUPPORT: ("sr.admin_id", """
+        FROM order_support_requests sr
+        WHERE sr.status = 'PENDING'"""),
+    INBOX_CHANGE_REQUESTS: ("pcr.team_admin_id", """
+        FROM profile_change_requests pcr
+        WHERE pcr.status = 'PENDING'
+          AND (pcr.team_code IS NULL OR pcr.team_code != 'PLATFORM')"""),
+    INBOX_PARKING: ("aa.admin_id", """
+        FROM ally_customer_addresses aca
+        JOIN ally_customers ac ON aca.customer_id = ac.id
+        JOIN admin_allies aa ON aa.ally_id = ac.ally_id AND aa.status = 'APPROVED'
+        WHERE aca.status = 'ACTIVE'
+          AND aca.parking_status IN ('ALLY_YES', 'PENDING_REVIEW')"""),
+}
+
+
+def _inbox_count_sql(kind: str, admin_id: int):
+    """(sql, params) del conteo exacto de un contador."""
+    if admin_id == INBOX_PLATFORM_ADMIN_ID:
+        return _INBOX_PLATFORM_COUNTS[kind], ()
+    owner_col, from_where = _INBOX_TEAM_SOURCES[kind]
+    return f"SELECT COUNT(*) AS pending {from_where} AND {owner_col} = {P}", (admin_id,)
+
+
+def _inbox_store(cur, admin_id: int, kind: str):
+    """
+    Recalcula un contador en la transaccion del llamador. Primero bloquea su fila: en
+    Postgres el COUNT siguiente ya ve lo que confirmo otra transaccion que estaba
+    recalculando el mismo contador, asi dos escrituras simultaneas no dejan un conteo viejo.
+    """
+    now_sql = "NOW()" if DB_ENGINE == "postgres" else "datetime('now')"
+    cur.execute(f"""
+        INSERT INTO admin_inbox_counters (admin_id, kind, pending, updated_at)
+        VALUES ({P}, {P}, 0, {now_sql})
+        ON CONFLICT(admin_id, kind) DO UPDATE SET updated_at = excluded.updated_at
+    """, (admin_id, kind))
+    sql, params = _inbox_count_sql(kind, admin_id)
+    cur.execute(sql, params)
+    pending = int(_row_value(cur.fetchone(), "pending", 0) or 0)
+    cur.execute(
+        f"UPDATE admin_inbox_counters SET pending = {P} WHERE admin_id = {P} AND kind = {P}",
+        (pending, admin_id, kind),
+    )
+    return pending
+
+
+def _refresh_admin_inbox(cur, kinds, admin_ids=()):
+    """
+    Recalcula los contadores de esos tipos: el total de plataforma y el de cada admin de
+    admin_ids. Llamar antes del commit de la escritura que crea o resuelve el pendiente.
+    Recorre las filas en orden (tipo, admin) para que dos transacciones no se crucen.
+    """
+    team_ids = sorted({int(admin_id) for admin_id in admin_ids if admin_id})
+    for kind in sorted(set(kinds)):
+        _inbox_store(cur, INBOX_PLATFORM_ADMIN_ID, kind)
+        if kind in _INBOX_TEAM_SOURCES:
+            for admin_id in team_ids:
+                _inbox_store(cur, admin_id, kind)
+
+
+def _linked_admin_ids(cur, link_table: str, entity_col: str, entity_id: int) -> list:
+    cur.execute(f"SELECT admin_id FROM {link_table} WHERE {entity_col} = {P}", (entity_id,))
+    return [_row_value(r, "admin_id", 0) for r in cur.fetchall()]
+
+
+def _refresh_courier_inbox(cur, courier_id: int):
+    """Repartidores pendientes de todos los admins vinculados al repartidor."""
+    _refresh_admin_inbox(cur, (INBOX_COURIERS,), _linked_admin_ids(cur, "admin_couriers", "courier_id", courier_id))
+
+
+def _refresh_ally_inbox(cur, ally_id: int):
+    """Aliados pendientes y parqueo (depende del vinculo APPROVED) de los admins del aliado."""
+    _refresh_admin_inbox(cur, (INBOX_ALLIES, INBOX_PARKING),
+                         _linked_admin_ids(cur, "admin_allies", "ally_id", ally_id))
+
+
+def _refresh_address_parking_inbox(cur, address_id: int):
+    """Parqueo pendiente de los admins del aliado duenio de la direccion (revision o archivo)."""
+    cur.execute(f"""
+        SELECT ac.ally_id FROM ally_customer_addresses aca
+        JOIN ally_customers ac ON ac.id = aca.customer_id
+        WHERE aca.id = {P}
+    """, (address_id,))
+    row = cur.fetchone()
+    if row:
+        ally_id = _row_value(row, "ally_id", 0)
+        _refresh_admin_inbox(cur, (INBOX_PARKING,), _linked_admin_ids(cur, "admin_allies", "ally_id", ally_id))
+
+
+def _ensure_admin_inbox_counters(cur):
+    """Crea admin_inbox_counters y la llena desde las tablas de origen."""
+    updated_type = "TIMESTAMP DEFAULT NOW()" if DB_ENGINE == "postgres" else "TEXT DEFAULT (datetime('now'))"
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS admin_inbox_counters (
+            admin_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            pending INTEGER NOT NULL DEFAULT 0,
+            updated_at {updated_type},
+            PRIMARY KEY (admin_id, kind)
+        )
+    """)
+    _reconcile_admin_inbox(cur)
+
+
+def _reconcile_admin_inbox(cur) -> int:
+    """Compara todos los contadores con un conteo agrupado y recalcula los que difieren."""
+    actual = {}
+    for kind, sql in _INBOX_PLATFORM_COUNTS.items():
+        cur.execute(sql)
+        actual[(INBOX_PLATFORM_ADMIN_ID, kind)] = int(_row_value(cur.fetchone(), "pending", 0) or 0)
+    for kind, (owner_col, from_where) in _INBOX_TEAM_SOURCES.items():
+        cur.execute(f"SELECT {owner_col} AS admin_id, COUNT(*) AS pending {from_where} "
+                    f"AND {owner_col} IS NOT NULL GROUP BY {owner_col}")
+        for row in cur.fetchall():
+            actual[(int(_row_value(row, "admin_id", 0)), kind)] = int(_row_value(row, "pending", 1) or 0)
+
+    cur.execute("SELECT admin_id, kind, pending FROM admin_inbox_counters")
+    stored = {(int(_row_value(r, "admin_id", 0)), _row_value(r, "kind", 1)): int(_row_value(r, "pending", 2) or 0)
+              for r in cur.fetchall()}
+    drifted = sorted(
+        (kind, admin_id) for admin_id, kind in set(actual) | set(stored)
+        if actual.get((admin_id, kind), 0) != stored.get((admin_id, kind), 0)
+        and (admin_id == INBOX_PLATFORM_ADMIN_ID or kind in _INBOX_TEAM_SOURCES)
+    )
+    for kind, admin_id in drifted:
+        _inbox_store(cur, admin_id, kind)
+    return len(drifted)
+
+
+def reconcile_admin_inbox_counters() -> int:
+    """Recalcula los contadores de la bandeja que no coinciden con las tablas. Retorna cuantos corrigio."""
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        fixed = _reconcile_admin_inbox(cur)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return fixed
+
+
+def get_admin_inbox_counts(admin_ids) -> dict:
+    """
+    Contadores de la bandeja en una sola consulta: {admin_id: {tipo: pendientes}} con
+    todos los tipos de INBOX_KINDS (0 si no hay fila). INBOX_PLATFORM_ADMIN_ID = totales
+    de plataforma.
+    """
+    admin_ids = sorted({int(admin_id) for admin_id in admin_ids if admin_id is not None})
+    counts = {admin_id: dict.fromkeys(INBOX_KINDS, 0) for admin_id in admin_ids}
+    if not admin_ids:
+        return counts
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT admin_id, kind, pending FROM admin_inbox_counters WHERE admin_id IN ({})".format(
+                ", ".join([P] * len(admin_ids))),
+            tuple(admin_ids),
+        )
+        rows = cur.fetchall()
+    finally:
+        conn.close()
+    for row in rows:
+        kind = _row_value(row, "kind", 1)
+        if kind in INBOX_KINDS:
+            counts[int(_row_value(row, "admin_id", 0))][kind] = int(_row_value(row, "pending", 2) or 0)
+    return counts
+
+
 # ============================================================
 # Funciones: ally_form_requests (enlace público del aliado)
 # ============================================================
@@ -13638,33 +15721,38 @@ def get_ally_subscription_info(ally_id: int):
 # SCHEDULED JOBS — persistencia de timers del bot
 # ============================================================
 
-def upsert_scheduled_job(job_name: str, callback_name: str, fire_at: str, job_data_json: str):
-    """Inserta o reemplaza un job programado. fire_at es ISO timestamp string."""
+def upsert_scheduled_job(job_name: str, callback_name: str, fire_at: str, job_data_json: str,
+                         entity_id: int = None):
+    """Inserta o reemplaza un job programado. fire_at es ISO timestamp string.
+
+    entity_id es el pedido o la ruta duenio del job."""
     conn = get_connection()
     cur = conn.cursor()
     now = datetime.now(timezone.utc).replace(tzinfo=None).isoformat()
     if DB_ENGINE == "postgres":
         cur.execute(
             """
-            INSERT INTO scheduled_jobs (job_name, callback_name, fire_at, job_data, status, created_at, updated_at)
-            VALUES (%s, %s, %s, %s, 'PENDING', %s, %s)
+            INSERT INTO scheduled_jobs
+                (job_name, callback_name, fire_at, job_data, status, created_at, updated_at, entity_id)
+            VALUES (%s, %s, %s, %s, 'PENDING', %s, %s, %s)
             ON CONFLICT (job_name) DO UPDATE SET
                 callback_name = EXCLUDED.callback_name,
                 fire_at = EXCLUDED.fire_at,
                 job_data = EXCLUDED.job_data,
                 status = 'PENDING',
-                updated_at = EXCLUDED.updated_at
+                updated_at = EXCLUDED.updated_at,
+                entity_id = EXCLUDED.entity_id
             """,
-            (job_name, callback_name, fire_at, job_data_json, now, now),
+            (job_name, callback_name, fire_at, job_data_json, now, now, entity_id),
         )
     else:
         cur.execute(
             """
             INSERT OR REPLACE INTO scheduled_jobs
-                (job_name, callback_name, fire_at, job_data, status, created_at, updated_at)
-            VALUES (?, ?, ?, ?, 'PENDING', ?, ?)
+                (job_name, callback_name, fire_at, job_data, status, created_at, updated_at, entity_id)
+            VALUES (?, ?, ?, ?, 'PENDING', ?, ?, ?)
             """,
-            (job_name, callback_name, fire_at, job_data_json, now, now),
+            (job_name, callback_name, fire_at, job_data_json, now, now, entity_id),
         )
     conn.commit()
     conn.close()
@@ -0,0 +1,240 @@
+"""
+Modelo de demanda: incentivo sugerido y tiempo estimado hasta aceptacion.
+
+Reemplaza los umbrales fijos del "modo red pequena" de build_offer_demand_preview por
+curvas de aceptacion medidas sobre el historico propio de pedidos y rutas:
+
+- Entrenamiento (fuera del camino del aliado): train_demand_model() lee los servicios
+  resueltos de los ultimos DEMAND_TRAINING_DAYS dias y, para cada combinacion de zona
+  (geohash), couriers elegibles al publicar, distancia y franja horaria, cuenta por
+  nivel de incentivo cuantos servicios se aceptaron dentro de DEMAND_TARGET_SECONDS y
+  la mediana de espera. El resultado se guarda en demand_model_cells. Lo corre el bot
+  una vez al dia; tambien se puede lanzar a mano con `python demand_model.py`.
+- Servicio: la tabla se carga completa en memoria y cada consulta es un punado de
+  lecturas de dict (del bucket mas fino al mas grueso hasta encontrar muestras
+  suficientes). Se recarga cuando cambia la marca de entrenamiento.
+
+Sin muestras suficientes suggest_incentive retorna None y el preview mantiene las
+reglas fijas de siempre.
+"""
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+
+from db import get_demand_model_cells, get_demand_model_trained_at, get_demand_training_rows, replace_demand_model_cells
+from dispatch_analytics import geohash_encode
+
+logger = logging.getLogger(__name__)
+
+DEMAND_TRAINING_DAYS = 60
+DEMAND_TARGET_SECONDS = 5 * 60
+DEMAND_TARGET_PROBABILITY = 0.7
+DEMAND_MIN_BUCKET_SAMPLES = 8
+DEMAND_MIN_TIER_SAMPLES = 3
+DEMAND_MODEL_RELOAD_SECONDS = 600
+DEMAND_ZONE_PRECISION = 5  # ~4.9 km x 4.9 km
+DEMAND_LOCAL_UTC_OFFSET_HOURS = -5  # Colombia, sin horario de verano
+
+# Niveles de incentivo: los mismos montos que ofrecen los botones de sugerencia.
+DEMAND_INCENTIVE_TIERS = (0, 1000, 1500, 2000, 3000)
+
+_SUPPLY_BUCKETS = ((0, "0"), (2, "1-2"), (5, "3-5"))
+_DISTANCE_BUCKETS = ((3, "0-3"), (5, "3-5"), (10, "5-10"))
+_HOUR_BANDS = ((6, "MADRUGADA"), (11, "MANANA"), (14, "ALMUERZO"), (18, "TARDE"), (24, "NOCHE"))
+
+
+def _supply_bucket(count) -> str:
+    count = int(count or 0)
+    for limit, name in _SUPPLY_BUCKETS:
+        if count <= limit:
+            return name
+    return "6+"
+
+
+def _distance_bucket(distance_km) -> str:
+    distance_km = float(distance_km or 0)
+    for limit, name in _DISTANCE_BUCKETS:
+        if distance_km < limit:
+            return name
+    return "10+"
+
+
+def _hour_band(utc_hour) -> str:
+    local_hour = (int(utc_hour) + DEMAND_LOCAL_UTC_OFFSET_HOURS) % 24
+    for limit, name in _HOUR_BANDS:
+        if local_hour < limit:
+            return name
+    return "NOCHE"
+
+
+def _incentive_tier(amount) -> int:
+    amount = int(amount or 0)
+    tier = 0
+    for value in DEMAND_INCENTIVE_TIERS:
+        if amount >= value:
+            tier = value
+    return tier
+
+
+def _bucket_keys(pickup_lat, pickup_lng, distance_km, supply, utc_hour) -> list:
+    """
+    Buckets del mas fino al mas grueso: (nivel, clave).
+    Sin dato de oferta al publicar solo aplica el nivel por distancia.
+    """
+    dist = _distance_bucket(distance_km)
+    keys = []
+    if supply is not None:
+        sup = _supply_bucket(supply)
+        band = _hour_band(utc_hour) if utc_hour is not None else None
+        if band is not None and pickup_lat is not None and pickup_lng is not None:
+            zone = geohash_encode(float(pickup_lat), float(pickup_lng), DEMAND_ZONE_PRECISION)
+            keys.append((0, "|".join((zone, sup, dist, band))))
+        if band is not None:
+            keys.append((1, "|".join((sup, dist, band))))
+        keys.append((2, "|".join((sup, dist))))
+    keys.append((3, dist))
+    return keys
+
+
+def _median(values):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    mid = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[mid]
+    return (ordered[mid - 1] + ordered[mid]) // 2
+
+
+def build_demand_cells(rows, trained_at: str) -> list:
+    """Agrega filas de get_demand_training_rows en celdas (nivel, bucket, incentivo)."""
+    stats = {}
+    for row in rows:
+        end_s = row.get("end_s")
+        wait_s = row.get("wait_s")
+        # Cancelado antes del objetivo: no se sabe si se hubiera aceptado a tiempo.
+        if wait_s is None and (end_s is None or end_s < DEMAND_TARGET_SECONDS):
+            continue
+        tier = _incentive_tier(row.get("incentive"))
+        for level, bucket in _bucket_keys(row.get("pickup_lat"), row.get("pickup_lng"),
+                                          row.get("distance_km"), row.get("supply"), row.get("hour")):
+            entry = stats.setdefault((level, bucket, tier), [0, 0, 0, []])
+            entry[0] += 1
+            if wait_s is not None:
+                entry[1] += 1
+                entry[3].append(wait_s)
+                if wait_s <= DEMAND_TARGET_SECONDS:
+                    entry[2] += 1
+    return [
+        (level, bucket, tier, samples, accepted, accepted_target, _median(waits), trained_at)
+        for (level, bucket, tier), (samples, accepted, accepted_target, waits) in sorted(stats.items())
+    ]
+
+
+def train_demand_model(days: int = DEMAND_TRAINING_DAYS) -> int:
+    """Reentrena el modelo desde el historico y lo publica. Retorna las celdas escritas."""
+    trained_at = datetime.now(timezone.utc).replace(tzinfo=None).strftime("%Y-%m-%d %H:%M:%S")
+    cells = build_demand_cells(get_demand_training_rows(days), trained_at)
+    written = replace_demand_model_cells(cells)
+    demand_model.invalidate()
+    return written
+
+
+class DemandModel:
+    """Tabla de curvas en memoria: {(nivel, bucket): {incentivo: (muestras, p_objetivo, mediana_s)}}."""
+
+    def __init__(self, reload_seconds: float = DEMAND_MODEL_RELOAD_SECONDS):
+        self.reload_seconds = reload_seconds
+        self._lock = threading.Lock()
+        self._curves = {}
+        self._trained_at = None
+        self._checked_at = None
+
+    def invalidate(self):
+        with self._lock:
+            self._checked_at = None
+
+    def _ensure_loaded(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._checked_at is not None and now - self._checked_at < self.reload_seconds:
+                return
+            self._checked_at = now
+        trained_at = get_demand_model_trained_at()
+        if trained_at == self._trained_at:
+            return
+        curves = {}
+        for level, bucket, tier, samples, _accepted, accepted_target, median_wait_s, _t in get_demand_model_cells():
+            samples = int(samples or 0)
+            if samples <= 0:
+                continue
+            curves.setdefault((int(level), bucket), {})[int(tier)] = (
+                samples,
+                int(accepted_target or 0) / samples,
+                int(median_wait_s) if median_wait_s is not None else None,
+            )
+        with self._lock:
+            self._curves = curves
+            self._trained_at = trained_at
+
+    def lookup(self, pickup_lat, pickup_lng, distance_km, supply, utc_hour=None):
+        """
+        Curva del bucket mas fino con muestras suficientes, o None.
+        Retorna {"level", "samples", "curve": [(incentivo, p_objetivo, mediana_s)]} con
+        p_objetivo no decreciente en el incentivo (un incentivo mayor no empeora la curva).
+        """
+        self._ensure_loaded()
+        if utc_hour is None:
+            utc_hour = datetime.now(timezone.utc).hour
+        curves = self._curves
+        for key in _bucket_keys(pickup_lat, pickup_lng, distance_km, supply, utc_hour):
+            tiers = curves.get(key)
+            if not tiers:
+                continue
+            usable = [(tier, tiers[tier]) for tier in DEMAND_INCENTIVE_TIERS
+                      if tier in tiers and tiers[tier][0] >= DEMAND_MIN_TIER_SAMPLES]
+            samples = sum(entry[0] for _tier, entry in usable)
+            if samples < DEMAND_MIN_BUCKET_SAMPLES:
+                continue
+            curve = []
+            best = 0.0
+            for tier, (_n, p_target, median_s) in usable:
+                best = max(best, p_target)
+                curve.append((tier, best, median_s))
+            return {"level": key[0], "samples": samples, "curve": curve}
+        return None
+
+
+demand_model = DemandModel()
+
+
+def suggest_incentive(pickup_lat, pickup_lng, distance_km, eligible_count, utc_hour=None):
+    """
+    Incentivo minimo cuya probabilidad historica de aceptacion dentro de
+    DEMAND_TARGET_SECONDS alcanza DEMAND_TARGET_PROBABILITY (o el de mejor curva si
+    ninguno la alcanza), con la espera mediana observada a ese nivel.
+
+    Retorna {"suggested_incentive", "eta_accept_s", "p_accept_target", "p_accept_base",
+    "samples", "level"} o None si no hay historico suficiente.
+    """
+    found = demand_model.lookup(pickup_lat, pickup_lng, distance_km, eligible_count, utc_hour)
+    if not found:
+        return None
+    curve = found["curve"]
+    chosen = next((point for point in curve if point[1] >= DEMAND_TARGET_PROBABILITY), None)
+    if chosen is None:
+        chosen = max(curve, key=lambda point: (point[1], -point[0]))
+    return {
+        "suggested_incentive": chosen[0],
+        "eta_accept_s": chosen[2],
+        "p_accept_target": round(chosen[1], 3),
+        "p_accept_base": round(curve[0][1], 3),
+        "samples": found["samples"],
+        "level": found["level"],
+    }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    logger.info("demand_model: %s celdas entrenadas", train_demand_model())
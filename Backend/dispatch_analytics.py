@@ -0,0 +1,407 @@
+"""
+Analitica de despacho: eventos de oferta y agregados horarios por celda y equipo.
+
+El motor de ofertas registra aqui cada paso del mercado (publicacion, oferta, expiracion,
+rechazo, ocupado, aceptacion) y build_offer_demand_preview su muestra de oferta
+disponible. Nada de esto toca la BD en el camino del despacho:
+
+- los eventos se acumulan en columnas (una lista por campo) y se escriben por lotes con
+  executemany cada DISPATCH_ANALYTICS_FLUSH_SECONDS o al llegar a
+  DISPATCH_ANALYTICS_MAX_BUFFER eventos;
+- en el mismo lote se suman los agregados de dispatch_rollups_hourly (hora UTC, celda
+  geohash del pickup, admin del equipo), que es lo unico que leen los endpoints del panel;
+- dispatch_events es solo insercion y se poda por antiguedad; las colas de ofertas
+  (order_offer_queue / route_offer_queue) ya no son la fuente de estas preguntas.
+
+Tiempos: la espera de un servicio se mide desde su primera publicacion en este proceso y
+el tiempo de respuesta desde que se envio la oferta al courier.
+"""
+import atexit
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from db import (
+    DISPATCH_EVENT_COLUMNS,
+    DISPATCH_ROLLUP_COUNTERS,
+    dispatch_events_table_exists,
+    get_dispatch_rollup_totals,
+    write_dispatch_batch,
+)
+
+logger = logging.getLogger(__name__)
+
+DISPATCH_ANALYTICS_FLUSH_SECONDS = 5.0
+DISPATCH_ANALYTICS_MAX_BUFFER = 500
+DISPATCH_GEOHASH_PRECISION = 6  # ~1.2 km x 0.6 km: escala de barrio
+DISPATCH_ENTITY_TTL_SECONDS = 24 * 3600
+DISPATCH_EVENTS_RETENTION_DAYS = 30
+
+DISPATCH_EVENTS = ("PUBLISHED", "SIGNAL", "OFFERED", "EXPIRED", "REJECTED", "BUSY", "ACCEPTED")
+_EVENT_COUNTER = {
+    "PUBLISHED": "published",
+    "OFFERED": "offered",
+    "EXPIRED": "expired",
+    "REJECTED": "rejected",
+    "BUSY": "busy",
+    "ACCEPTED": "accepted",
+}
+_COUNTER_INDEX = {name: idx for idx, name in enumerate(DISPATCH_ROLLUP_COUNTERS)}
+_WAIT_BUCKETS = ((60, "wait_lt_1m"), (180, "wait_lt_3m"), (300, "wait_lt_5m"), (600, "wait_lt_10m"))
+_NO_CELL = "-"
+
+_GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash_encode(lat: float, lng: float, precision: int = DISPATCH_GEOHASH_PRECISION) -> str:
+    """Geohash estandar (base32) de una coordenada."""
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        rng, value = (lng_range, lng) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            rng[0] = mid
+        else:
+            bits <<= 1
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_GEOHASH_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return "".join(chars)
+
+
+def geohash_decode(cell: str):
+    """Centro (lat, lng) de una celda geohash, o (None, None) si no es valida."""
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    even = True
+    try:
+        for ch in cell:
+            value = _GEOHASH_BASE32.index(ch)
+            for shift in range(4, -1, -1):
+                rng = lng_range if even else lat_range
+                mid = (rng[0] + rng[1]) / 2
+                if (value >> shift) & 1:
+                    rng[0] = mid
+                else:
+                    rng[1] = mid
+                even = not even
+    except ValueError:
+        return None, None
+    if not cell:
+        return None, None
+    return (lat_range[0] + lat_range[1]) / 2, (lng_range[0] + lng_range[1]) / 2
+
+
+def _cell_for(lat, lng) -> str:
+    try:
+        if lat is None or lng is None:
+            return _NO_CELL
+        return geohash_encode(float(lat), float(lng))
+    except (TypeError, ValueError):
+        return _NO_CELL
+
+
+def _utc_now():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _hour_key(now) -> str:
+    return now.strftime("%Y-%m-%d %H:00:00")
+
+
+class DispatchAnalytics:
+    """Buffer en columnas de eventos + agregados horarios en memoria, escritos por lotes."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._columns = {col: [] for col in DISPATCH_EVENT_COLUMNS}
+        self._rollups = {}
+        self._entities = {}   # (entity_type, entity_id) -> [admin_id, cell, published_ts, offers]
+        self._offered_at = {}  # (entity_type, entity_id, courier_id) -> ts
+
+    # ---------------- registro ----------------
+
+    def _entity(self, entity_type, entity_id, admin_id=None, pickup_lat=None, pickup_lng=None):
+        key = (entity_type, int(entity_id))
+        state = self._entities.get(key)
+        if state is None:
+            state = [admin_id, _cell_for(pickup_lat, pickup_lng), None, 0]
+            self._entities[key] = state
+        else:
+            if admin_id is not None:
+                state[0] = admin_id
+            if state[1] == _NO_CELL and pickup_lat is not None:
+                state[1] = _cell_for(pickup_lat, pickup_lng)
+        return key, state
+
+    def _append(self, now, entity_type, entity_id, event, state, courier_id=None, position=None,
+                distance_km=None, response_s=None, wait_s=None, supply=None):
+        row = {
+            "entity_type": entity_type,
+            "entity_id": int(entity_id),
+            "event": event,
+            "courier_id": courier_id,
+            "position": position,
+            "distance_m": int(round(float(distance_km) * 1000)) if distance_km is not None else None,
+            "response_s": response_s,
+            "wait_s": wait_s,
+            "supply": supply,
+            "admin_id": state[0],
+            "cell": state[1],
+            "created_at": now.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        for col in DISPATCH_EVENT_COLUMNS:
+            self._columns[col].append(row[col])
+
+        counters = self._rollups.get((_hour_key(now), state[1], int(state[0] or 0), entity_type))
+        if counters is None:
+            counters = [0] * len(DISPATCH_ROLLUP_COUNTERS)
+            self._rollups[(_hour_key(now), state[1], int(state[0] or 0), entity_type)] = counters
+        counter = _EVENT_COUNTER.get(event)
+        if counter:
+            counters[_COUNTER_INDEX[counter]] += 1
+        if supply is not None:
+            counters[_COUNTER_INDEX["supply_sum"]] += int(supply)
+            counters[_COUNTER_INDEX["supply_samples"]] += 1
+        if response_s is not None:
+            counters[_COUNTER_INDEX["response_sum_s"]] += int(response_s)
+            counters[_COUNTER_INDEX["responses"]] += 1
+        if event == "ACCEPTED":
+            counters[_COUNTER_INDEX["seen_sum"]] += int(state[3])
+            if wait_s is not None:
+                counters[_COUNTER_INDEX["wait_sum_s"]] += int(wait_s)
+                bucket = "wait_ge_10m"
+                for limit, name in _WAIT_BUCKETS:
+                    if wait_s < limit:
+                        bucket = name
+                        break
+                counters[_COUNTER_INDEX[bucket]] += 1
+
+    def record_published(self, entity_type, entity_id, admin_id=None, pickup_lat=None, pickup_lng=None,
+                         supply=None, first=True):
+        """Publicacion en el mercado. first=False para reintentos: no suma demanda nueva."""
+        ts = time.time()
+        now = _utc_now()
+        with self._lock:
+            _key, state = self._entity(entity_type, entity_id, admin_id, pickup_lat, pickup_lng)
+            if state[2] is None:
+                state[2] = ts
+            event = "PUBLISHED" if first else "SIGNAL"
+            self._append(now, entity_type, entity_id, event, state, supply=supply)
+        self._maybe_flush()
+
+    def record_signal(self, entity_type, admin_id, pickup_lat, pickup_lng, supply, nearest_km=None):
+        """Muestra de oferta disponible antes de publicar (build_offer_demand_preview)."""
+        now = _utc_now()
+        state = [admin_id, _cell_for(pickup_lat, pickup_lng), None, 0]
+        with self._lock:
+            self._append(now, entity_type, 0, "SIGNAL", state, distance_km=nearest_km, supply=supply)
+        self._maybe_flush()
+
+    def record(self, entity_type, entity_id, event, courier_id=None, position=None, distance_km=None,
+               admin_id=None, pickup_lat=None, pickup_lng=None):
+        """Evento de oferta: OFFERED, EXPIRED, REJECTED, BUSY o ACCEPTED."""
+        ts = time.time()
+        now = _utc_now()
+        with self._lock:
+            key, state = self._entity(entity_type, entity_id, admin_id, pickup_lat, pickup_lng)
+            response_s = None
+            wait_s = None
+            offer_key = key + (courier_id,)
+            if event == "OFFERED":
+                state[3] += 1
+                self._offered_at[offer_key] = ts
+            else:
+                offered_at = self._offered_at.pop(offer_key, None)
+                if offered_at is not None:
+                    response_s = int(round(ts - offered_at))
+            if event == "ACCEPTED":
+                if state[2] is not None:
+                    wait_s = int(round(ts - state[2]))
+            self._append(now, entity_type, entity_id, event, state, courier_id=courier_id,
+                         position=position, distance_km=distance_km, response_s=response_s, wait_s=wait_s)
+            if event == "ACCEPTED":
+                self._entities.pop(key, None)
+                for stale in [k for k in self._offered_at if k[:2] == key]:
+                    del self._offered_at[stale]
+        self._maybe_flush()
+
+    # ---------------- escritura ----------------
+
+    def buffered(self) -> int:
+        with self._lock:
+            return len(self._columns["event"])
+
+    def _maybe_flush(self):
+        if self.buffered() >= DISPATCH_ANALYTICS_MAX_BUFFER:
+            self.flush()
+
+    def flush(self) -> int:
+        """Escribe eventos y agregados pendientes. Si falla, se conservan para el siguiente intento."""
+        with self._lock:
+            columns, rollups = self._columns, self._rollups
+            if not rollups:
+                return 0
+            self._columns = {col: [] for col in DISPATCH_EVENT_COLUMNS}
+            self._rollups = {}
+            horizon = time.time() - DISPATCH_ENTITY_TTL_SECONDS
+            for key in [k for k, s in self._entities.items() if s[2] is not None and s[2] < horizon]:
+                del self._entities[key]
+            for key in [k for k, ts in self._offered_at.items() if ts < horizon]:
+                del self._offered_at[key]
+        try:
+            return write_dispatch_batch(columns, rollups)
+        except Exception as e:
+            logger.warning("dispatch_analytics.flush: %s", e)
+            with self._lock:
+                for col in DISPATCH_EVENT_COLUMNS:
+                    self._columns[col][:0] = columns[col]
+                for key, values in rollups.items():
+                    current = self._rollups.setdefault(key, [0] * len(DISPATCH_ROLLUP_COUNTERS))
+                    for idx, value in enumerate(values):
+                        current[idx] += value
+            return 0
+
+    def has_pending(self) -> bool:
+        with self._lock:
+            return bool(self._rollups)
+
+    def forget(self):
+        with self._lock:
+            self._columns = {col: [] for col in DISPATCH_EVENT_COLUMNS}
+            self._rollups = {}
+            self._entities.clear()
+            self._offered_at.clear()
+
+
+dispatch_analytics = DispatchAnalytics()
+
+record_dispatch_published = dispatch_analytics.record_published
+record_dispatch_signal = dispatch_analytics.record_signal
+record_dispatch_event = dispatch_analytics.record
+
+
+def flush_dispatch_analytics() -> int:
+    return dispatch_analytics.flush()
+
+
+_flusher_lock = threading.Lock()
+_flusher_started = False
+
+
+def _flusher_loop():
+    while True:
+        time.sleep(DISPATCH_ANALYTICS_FLUSH_SECONDS)
+        flush_dispatch_analytics()
+
+
+def start_dispatch_analytics_flusher():
+    """Arranca (una vez) el hilo que escribe el buffer periodicamente. Lo llama el bot."""
+    global _flusher_started
+    with _flusher_lock:
+        if _flusher_started:
+            return
+        threading.Thread(target=_flusher_loop, name="dispatch-analytics-flush", daemon=True).start()
+        _flusher_started = True
+
+
+def _flush_at_exit():
+    """Al salir escribe lo pendiente, solo si hay algo y la BD tiene dispatch_events
+    (una BD temporal ya borrada o sin init_db no se toca)."""
+    if not dispatch_analytics.has_pending():
+        return
+    try:
+        if not dispatch_events_table_exists():
+            return
+    except Exception as e:
+        logger.debug("dispatch_analytics: sin BD al salir: %s", e)
+        return
+    flush_dispatch_analytics()
+
+
+atexit.register(_flush_at_exit)
+
+
+# ---------------- lectura (panel) ----------------
+
+def _since_hour(hours: int) -> str:
+    hours = max(1, min(int(hours or 24), 24 * 90))
+    return _hour_key(_utc_now() - timedelta(hours=hours - 1))
+
+
+def _approx_median_wait(totals: dict):
+    """Mediana aproximada de espera hasta aceptar a partir del histograma (limite superior del tramo)."""
+    accepted = sum(totals[name] for _limit, name in _WAIT_BUCKETS) + totals["wait_ge_10m"]
+    if not accepted:
+        return None
+    half = accepted / 2.0
+    running = 0
+    for limit, name in _WAIT_BUCKETS:
+        running += totals[name]
+        if running >= half:
+            return limit
+    return None  # mas de 10 minutos: sin cota superior
+
+
+def _ratio(num, den, digits=3):
+    return round(num / den, digits) if den else None
+
+
+def build_dispatch_funnel(hours: int = 24, admin_id: int = None, entity_type: str = None) -> dict:
+    """Embudo publicado -> ofrecido -> aceptado con tiempos, desde los agregados horarios."""
+    rows = get_dispatch_rollup_totals(_since_hour(hours), admin_id=admin_id, entity_type=entity_type)
+    totals = rows[0] if rows else {c: 0 for c in DISPATCH_ROLLUP_COUNTERS}
+    accepted = totals["accepted"]
+    return {
+        "hours": max(1, int(hours or 24)),
+        "published": totals["published"],
+        "offered": totals["offered"],
+        "expired": totals["expired"],
+        "rejected": totals["rejected"],
+        "busy": totals["busy"],
+        "accepted": accepted,
+        "acceptance_rate": _ratio(accepted, totals["published"]),
+        "offer_acceptance_rate": _ratio(accepted, totals["offered"]),
+        "avg_couriers_seen_before_accept": _ratio(totals["seen_sum"], accepted, 2),
+        "avg_wait_to_accept_s": _ratio(totals["wait_sum_s"], accepted, 1),
+        "median_wait_to_accept_s_upper": _approx_median_wait(totals),
+        "avg_response_s": _ratio(totals["response_sum_s"], totals["responses"], 1),
+        "avg_supply_at_publish": _ratio(totals["supply_sum"], totals["supply_samples"], 2),
+        "wait_histogram": {name: totals[name] for name in
+                           ("wait_lt_1m", "wait_lt_3m", "wait_lt_5m", "wait_lt_10m", "wait_ge_10m")},
+    }
+
+
+def build_dispatch_heatmap(hours: int = 24, admin_id: int = None, entity_type: str = None) -> list:
+    """Demanda (publicados) vs oferta (couriers elegibles promedio) por celda geohash."""
+    cells = []
+    for row in get_dispatch_rollup_totals(_since_hour(hours), admin_id=admin_id,
+                                          entity_type=entity_type, by_cell=True):
+        if row["cell"] == _NO_CELL:
+            continue
+        lat, lng = geohash_decode(row["cell"])
+        avg_supply = _ratio(row["supply_sum"], row["supply_samples"], 2)
+        cells.append({
+            "cell": row["cell"],
+            "lat": lat,
+            "lng": lng,
+            "demand": row["published"],
+            "avg_supply": avg_supply,
+            "offered": row["offered"],
+            "accepted": row["accepted"],
+            "expired": row["expired"],
+            "acceptance_rate": _ratio(row["accepted"], row["published"]),
+            "starving": bool(row["published"]) and (avg_supply or 0) < 1 and row["accepted"] < row["published"],
+        })
+    return cells
@@ -0,0 +1,290 @@
+"""
+Despacho repartido entre varios procesos del bot (modo webhook con BOT_WORKER_COUNT > 1).
+
+Con un solo proceso todo el estado del despacho (offer_cycles, offer_messages, colas de
+oferta en memoria, timers) vive en su bot_data y en su JobQueue. Para repartir el
+trabajo entre procesos:
+
+- Cada pedido/ruta cae en un shard (id mod DISPATCH_SHARDS). Cada shard tiene un lease
+  en shard_leases con duenio, vencimiento y token de fencing. Los workers renuevan sus
+  leases cada DISPATCH_LEASE_RENEW_SECONDS y se reparten los shards en partes iguales
+  entre los workers vivos (cada worker publica su presencia en el mismo mecanismo).
+- Solo el duenio del shard despacha: envia ofertas, vence timeouts, reinicia ciclos y
+  mantiene los timers del servicio. Si otro proceso recibe algo que mueve el despacho
+  (un rechazo del courier, la publicacion del aliado, un timer), lo deja como comando
+  en dispatch_commands y el duenio lo ejecuta en orden.
+- Antes de enviar cada oferta el duenio verifica en BD que su lease y su token siguen
+  vigentes; las escrituras de estado compartido llevan el token y la BD rechaza las de
+  un duenio anterior. Asi dos workers nunca despachan el mismo pedido.
+- Si un worker muere, sus leases vencen (DISPATCH_LEASE_SECONDS) y los demas toman
+  sus shards: recuperan los jobs persistidos y las ofertas activas de esos shards.
+
+El estado de bot_data que leen varios procesos (ciclos, mensajes de oferta, posicion al
+aceptar una ruta, aviso de llegada manual) pasa a SharedDispatchState, un mapa sobre la
+tabla dispatch_state.
+"""
+import json
+import logging
+import math
+import threading
+import time
+import uuid
+from collections.abc import MutableMapping
+
+from db import (
+    acquire_shard_leases,
+    check_shard_fence,
+    delete_dispatch_commands,
+    delete_dispatch_state,
+    enqueue_dispatch_command,
+    fetch_dispatch_commands,
+    get_dispatch_state,
+    get_shard_leases,
+    list_dispatch_state_ids,
+    put_dispatch_state,
+    release_shard_leases,
+)
+
+logger = logging.getLogger(__name__)
+
+DISPATCH_SHARDS = 64
+DISPATCH_LEASE_RESOURCE = "dispatch"
+DISPATCH_LEASE_SECONDS = 20
+DISPATCH_LEASE_RENEW_SECONDS = 5
+DISPATCH_COMMAND_POLL_SECONDS = 1.0
+DISPATCH_COMMAND_BATCH = 100
+
+
+def dispatch_shard(entity_id) -> int:
+    return int(entity_id or 0) % DISPATCH_SHARDS
+
+
+class ShardLeases:
+    """
+    Leases de los shards de un recurso para este worker.
+
+    refresh() renueva lo propio y reparte: el objetivo es ceil(shards / workers vivos).
+    Con menos, toma shards libres o vencidos (los de un worker caido); con mas, cede el
+    excedente para que lo tome un worker nuevo. owns() responde sin BD y deja de ser
+    True apenas vence el lease local, aunque no se haya podido renovar.
+    """
+
+    def __init__(self, resource: str, shard_count: int, worker_id: str = None,
+                 ttl_seconds: float = DISPATCH_LEASE_SECONDS,
+                 renew_seconds: float = DISPATCH_LEASE_RENEW_SECONDS, clock=time.time):
+        self.resource = resource
+        self.shard_count = int(shard_count)
+        self.worker_id = worker_id or "{}-{}".format(uuid.uuid4().hex[:8], int(clock()))
+        self.ttl_seconds = float(ttl_seconds)
+        self.renew_seconds = float(renew_seconds)
+        self._clock = clock
+        self._members_resource = "{}:workers".format(resource)
+        self._member_no = uuid.uuid4().int % (2 ** 31)
+        self._lock = threading.Lock()
+        self._held = {}
+        self._valid_until = 0.0
+        self._refreshed_at = None
+
+    def refresh(self):
+        """Renueva y reparte los leases. Retorna (shards adquiridos, shards perdidos)."""
+        now = self._clock()
+        acquire_shard_leases(self._members_resource, [self._member_no], self.worker_id, self.ttl_seconds, now)
+        live = {
+            row["owner"] for row in get_shard_leases(self._members_resource)
+            if row["owner"] and row["expires_at"] > now
+        }
+        live.add(self.worker_id)
+        target = math.ceil(self.shard_count / len(live))
+
+        rows = {row["shard_no"]: row for row in get_shard_leases(self.resource)}
+        mine = [s for s in range(self.shard_count) if (rows.get(s) or {}).get("owner") == self.worker_id]
+        surplus = mine[target:]
+        wanted = mine[:target]
+        for shard_no in range(self.shard_count):
+            if len(wanted) >= target:
+                break
+            row = rows.get(shard_no)
+            if row is None or row["owner"] is None or (row["owner"] != self.worker_id and row["expires_at"] <= now):
+                wanted.append(shard_no)
+
+        held = acquire_shard_leases(self.resource, wanted, self.worker_id, self.ttl_seconds, now)
+        if surplus:
+            release_shard_leases(self.resource, surplus, self.worker_id)
+        with self._lock:
+            previous = set(self._held)
+            self._held = held
+            # Margen de un segundo: se deja de despachar antes de que el lease venza en BD.
+            self._valid_until = now + self.ttl_seconds - 1.0
+            self._refreshed_at = now
+        acquired = sorted(set(held) - previous)
+        lost = sorted(previous - set(held))
+        if acquired or lost:
+            logger.info(
+                "shard_leases %s: worker %s tiene %s shards (+%s, -%s, workers vivos=%s)",
+                self.resource, self.worker_id, len(held), len(acquired), len(lost), len(live),
+            )
+        return acquired, lost
+
+    def maybe_refresh(self):
+        """refresh() si ya toca renovar; si no, ([], [])."""
+        if self._refreshed_at is not None and self._clock() - self._refreshed_at < self.renew_seconds:
+            return [], []
+        return self.refresh()
+
+    def owns(self, shard_no) -> bool:
+        with self._lock:
+            return shard_no in self._held and self._clock() < self._valid_until
+
+    def fence(self, shard_no):
+        """Token de fencing del shard si este worker lo tiene vigente; si no, None."""
+        with self._lock:
+            if shard_no in self._held and self._clock() < self._valid_until:
+                return self._held[shard_no]
+            return None
+
+    def owned(self) -> list:
+        with self._lock:
+            if self._clock() >= self._valid_until:
+                return []
+            return sorted(self._held)
+
+    def fence_holds(self, shard_no) -> bool:
+        """Verifica en BD que el lease del shard sigue siendo de este worker con el mismo token."""
+        token = self.fence(shard_no)
+        if token is None:
+            return False
+        return check_shard_fence(self.resource, shard_no, self.worker_id, token, self._clock())
+
+    def release_all(self):
+        """Cede todos los leases (apagado ordenado): otro worker los toma sin esperar el vencimiento."""
+        with self._lock:
+            held, self._held = list(self._held), {}
+            self._valid_until = 0.0
+        try:
+            release_shard_leases(self.resource, held, self.worker_id)
+            release_shard_leases(self._members_resource, [self._member_no], self.worker_id)
+        except Exception as e:
+            logger.warning("shard_leases %s: no se pudieron ceder los leases: %s", self.resource, e)
+
+
+# ---------------- leases del despacho instalados en este proceso ----------------
+
+_dispatch_leases = None
+
+
+def install_dispatch_leases(leases):
+    """Activa el despacho repartido con esos leases (None lo desactiva)."""
+    global _dispatch_leases
+    _dispatch_leases = leases
+    return leases
+
+
+def dispatch_leases():
+    return _dispatch_leases
+
+
+def owns_dispatch(entity_id) -> bool:
+    """True si este proceso despacha el servicio. Sin despacho repartido, siempre."""
+    leases = _dispatch_leases
+    return leases is None or leases.owns(dispatch_shard(entity_id))
+
+
+def dispatch_fence_holds(entity_id) -> bool:
+    """Chequeo de fencing en BD antes de despachar. Sin despacho repartido, siempre True."""
+    leases = _dispatch_leases
+    return leases is None or leases.fence_holds(dispatch_shard(entity_id))
+
+
+# ---------------- comandos para el duenio del shard ----------------
+
+def _json_default(value):
+    if isinstance(value, (set, frozenset)):
+        return {"__set__": sorted(value)}
+    raise TypeError("no serializable: {!r}".format(type(value)))
+
+
+def _json_object_hook(obj):
+    if len(obj) == 1 and "__set__" in obj:
+        return set(obj["__set__"])
+    return obj
+
+
+def dumps_state(value) -> str:
+    return json.dumps(value, default=_json_default, separators=(",", ":"))
+
+
+def loads_state(payload):
+    return json.loads(payload, object_hook=_json_object_hook)
+
+
+def forward_dispatch_command(entity_id, command: str, payload: dict) -> int:
+    """Deja un comando para el proceso duenio del shard del servicio."""
+    return enqueue_dispatch_command(dispatch_shard(entity_id), command, dumps_state(payload))
+
+
+def take_dispatch_commands(limit: int = DISPATCH_COMMAND_BATCH) -> list:
+    """Comandos pendientes de los shards propios: [(id, command, payload)] en orden."""
+    leases = _dispatch_leases
+    shards = leases.owned() if leases is not None else []
+    if not shards:
+        return []
+    commands = []
+    for command_id, command, payload in fetch_dispatch_commands(shards, limit=limit):
+        try:
+            commands.append((command_id, command, loads_state(payload)))
+        except Exception as e:
+            logger.warning("dispatch_commands: comando %s ilegible, se descarta: %s", command_id, e)
+            delete_dispatch_commands([command_id])
+    return commands
+
+
+def ack_dispatch_commands(ids) -> int:
+    return delete_dispatch_commands(ids)
+
+
+# ---------------- estado compartido de bot_data ----------------
+
+class SharedDispatchState(MutableMapping):
+    """
+    Reemplazo de un dict de bot_data (entity_id -> valor) guardado en dispatch_state.
+
+    No hay cache: cada proceso ve lo que escribio el ultimo. Los valores son copias, asi
+    que una mutacion en sitio hay que volver a asignarla. Con fenced=True, las
+    escrituras del duenio del shard llevan su token de fencing y la BD rechaza las de
+    un duenio anterior; las de otros procesos (p.ej. la liberacion de una ruta desde el
+    chat del courier) se escriben sin token.
+    """
+
+    def __init__(self, scope: str, fenced: bool = False):
+        self.scope = scope
+        self.fenced = fenced
+
+    def __getitem__(self, entity_id):
+        payload = get_dispatch_state(self.scope, entity_id)
+        if payload is None:
+            raise KeyError(entity_id)
+        return loads_state(payload)
+
+    def __setitem__(self, entity_id, value):
+        token = None
+        if self.fenced and _dispatch_leases is not None:
+            token = _dispatch_leases.fence(dispatch_shard(entity_id))
+        if not put_dispatch_state(self.scope, entity_id, dumps_state(value), fencing_token=token):
+            logger.warning(
+                "dispatch_state %s[%s]: escritura rechazada por fencing (token=%s)",
+                self.scope, entity_id, token,
+            )
+
+    def __delitem__(self, entity_id):
+        if not delete_dispatch_state(self.scope, entity_id):
+            raise KeyError(entity_id)
+
+    def __iter__(self):
+        return iter(list_dispatch_state_ids(self.scope))
+
+    def __len__(self):
+        return len(list_dispatch_state_ids(self.scope))
+
+    def __reduce__(self):
+        # PicklePersistence guarda bot_data: el estado ya esta en la BD.
+        return (dict, ())
@@ -18,6 +18,7 @@ from telegram.ext import (
 )
 
 from handlers.common import (
+    _inbox_button_label,
     _resolve_important_alert,
     _row_value,
     _schedule_important_alerts,
@@ -40,6 +41,13 @@ from services import (
     get_admin_reference_validator_permission,
     get_admin_reset_state_by_id,
     get_all_admins,
+    get_admin_inbox_counts,
+    INBOX_ALLIES,
+    INBOX_COURIERS,
+    INBOX_PLATFORM_ADMIN_ID,
+    INBOX_RECHARGES,
+    INBOX_REFERENCES,
+    INBOX_SUPPORT,
     PARKING_FEE_AMOUNT,
     set_address_parking_status,
     get_addresses_pending_parking_review,
@@ -100,12 +108,28 @@ from services import (
     user_has_platform_admin,
     _get_reference_reviewer,
     get_setting,
+    resolve_owned_admin_actor,
+    count_broadcast_audience,
+    create_broadcast,
+    get_broadcast,
+    cancel_broadcast,
+    BROADCAST_ROLE_COURIER,
+    BROADCAST_ROLE_ALLY,
+    BROADCAST_ROLE_ALL,
 )
 from order_delivery import admin_orders_panel
 from profile_changes import admin_change_requests_list
 from handlers.config import tarifas_start
 from handlers.registration import _create_or_reset_courier_from_context
-from handlers.states import RECHAZAR_MOTIVO, RECHAZAR_CONFIRMAR
+from handlers.states import (
+    RECHAZAR_MOTIVO,
+    RECHAZAR_CONFIRMAR,
+    AVISO_DESTINO,
+    AVISO_ZONA,
+    AVISO_TEXTO,
+    AVISO_CONFIRMAR,
+)
+from broadcasts import BROADCAST_MAX_TEXT, BROADCAST_RATE_PER_SECOND
 
 ADMIN_USER_ID = int(os.getenv("ADMIN_USER_ID", "0"))
 SUPPORT_PAGE_SIZE = 6
@@ -892,19 +916,30 @@ def repartidores_pendientes(update, context):
                     logger.warning("No se pudieron enviar fotos del repartidor %s: %s", courier_id, e)
 
         
+def _platform_inbox():
+    """Conteos de pendientes de toda la plataforma (una consulta a admin_inbox_counters)."""
+    return get_admin_inbox_counts([INBOX_PLATFORM_ADMIN_ID])[INBOX_PLATFORM_ADMIN_ID]
+
+
 def _build_platform_admin_keyboard():
     """Construye el teclado del Panel Admin de Plataforma. Fuente unica de verdad."""
+    inbox = _platform_inbox()
     return [
-        [InlineKeyboardButton("👥 Gestión de usuarios", callback_data="admin_gestion_usuarios")],
+        [InlineKeyboardButton(
+            _inbox_button_label("👥 Gestión de usuarios", inbox[INBOX_COURIERS] + inbox[INBOX_ALLIES]),
+            callback_data="admin_gestion_usuarios",
+        )],
         [InlineKeyboardButton("📦 Pedidos", callback_data="admin_pedidos")],
         [InlineKeyboardButton("⚙️ Configuraciones", callback_data="admin_config")],
         [InlineKeyboardButton("💰 Saldos de todos", callback_data="admin_saldos")],
         [
-            InlineKeyboardButton("Soportes pendientes", callback_data="admin_support_open"),
-            InlineKeyboardButton("Referencias locales", callback_data="admin_ref_candidates"),
+            InlineKeyboardButton(_inbox_button_label("Soportes pendientes", inbox[INBOX_SUPPORT]),
+                                 callback_data="admin_support_open"),
+            InlineKeyboardButton(_inbox_button_label("Referencias locales", inbox[INBOX_REFERENCES]),
+                                 callback_data="admin_ref_candidates"),
         ],
         [InlineKeyboardButton("📊 Finanzas", callback_data="admin_finanzas")],
-        [InlineKeyboardButton("💳 Recargas", callback_data="plat_rec_menu")],
+        [InlineKeyboardButton(_inbox_button_label("💳 Recargas", inbox[INBOX_RECHARGES]), callback_data="plat_rec_menu")],
         [InlineKeyboardButton("📍 Repartidores online", callback_data="config_couriers_online")],
         [InlineKeyboardButton("📌 Corregir coords de aliados", callback_data="plat_corr_inicio")],
     ]
@@ -979,9 +1014,12 @@ def admin_menu_callback(update, context):
             query.answer("Solo el Administrador de Plataforma puede usar este menú.", show_alert=True)
             return
         query.answer()
+        inbox = _platform_inbox()
         keyboard = [
-            [InlineKeyboardButton("👤 Aliados pendientes", callback_data="admin_aliados_pendientes")],
-            [InlineKeyboardButton("🚚 Repartidores pendientes", callback_data="admin_repartidores_pendientes")],
+            [InlineKeyboardButton(_inbox_button_label("👤 Aliados pendientes", inbox[INBOX_ALLIES]),
+                                  callback_data="admin_aliados_pendientes")],
+            [InlineKeyboardButton(_inbox_button_label("🚚 Repartidores pendientes", inbox[INBOX_COURIERS]),
+                                  callback_data="admin_repartidores_pendientes")],
             [InlineKeyboardButton("🧑‍💼 Gestionar administradores", callback_data="admin_administradores")],
             [InlineKeyboardButton("Ver totales de registros", callback_data="config_totales")],
             [InlineKeyboardButton("Gestionar aliados", callback_data="config_gestion_aliados")],
@@ -3490,6 +3528,318 @@ rechazar_conv = ConversationHandler(
 )
 
 
+# =============================================================================
+# aviso_conv — Aviso masivo del admin a su equipo (Admin Plataforma: tambien a
+# toda la plataforma). El envio lo hace broadcasts.BroadcastSender en segundo plano.
+# =============================================================================
+
+_AVISO_ROLE_LABELS = {
+    BROADCAST_ROLE_COURIER: "Repartidores",
+    BROADCAST_ROLE_ALLY: "Aliados",
+    BROADCAST_ROLE_ALL: "Repartidores y aliados",
+}
+_AVISO_STATUS_LABELS = {
+    "SENDING": "Enviando",
+    "DONE": "Terminado",
+    "CANCELLED": "Detenido",
+}
+_AVISO_KEYS = ("aviso_admin_id", "aviso_platform", "aviso_scope_all", "aviso_role",
+               "aviso_city", "aviso_barrio", "aviso_text")
+
+
+def _aviso_clear(context):
+    for key in _AVISO_KEYS:
+        context.user_data.pop(key, None)
+
+
+def _aviso_cancel_kb():
+    return [[InlineKeyboardButton("Cancelar", callback_data="aviso_cancelar")]]
+
+
+def _aviso_audience(context):
+    """(scope_admin_id, role, city, barrio) del aviso en curso."""
+    ud = context.user_data
+    scope_admin_id = None if ud.get("aviso_scope_all") else ud.get("aviso_admin_id")
+    return scope_admin_id, ud.get("aviso_role"), ud.get("aviso_city"), ud.get("aviso_barrio")
+
+
+def _aviso_audience_label(context):
+    ud = context.user_data
+    scope = "Toda la plataforma" if ud.get("aviso_scope_all") else "Mi equipo"
+    zona = ", ".join(part for part in (ud.get("aviso_city"), ud.get("aviso_barrio")) if part) or "Todas las zonas"
+    return "{} - {} - {}".format(scope, _AVISO_ROLE_LABELS.get(ud.get("aviso_role"), "-"), zona)
+
+
+def _aviso_role_kb():
+    return [
+        [InlineKeyboardButton("🚚 Repartidores", callback_data="aviso_rol_COURIER")],
+        [InlineKeyboardButton("🏪 Aliados", callback_data="aviso_rol_ALLY")],
+        [InlineKeyboardButton("👥 Repartidores y aliados", callback_data="aviso_rol_ALL")],
+        [InlineKeyboardButton("Cancelar", callback_data="aviso_cancelar")],
+    ]
+
+
+def _aviso_eta(total):
+    minutes = int(total / BROADCAST_RATE_PER_SECOND // 60) + 1
+    return "menos de 1 minuto" if total <= BROADCAST_RATE_PER_SECOND * 60 else "unos {} minutos".format(minutes)
+
+
+def aviso_inicio(update, context):
+    """Entry point: boton Enviar aviso de /mi_admin (aviso_inicio_{admin_id})."""
+    query = update.callback_query
+    query.answer()
+    admin_id = int(query.data.replace("aviso_inicio_", ""))
+    admin = resolve_owned_admin_actor(query.from_user.id, selected_admin_id=admin_id)
+    if not admin:
+        query.edit_message_text(
+            "No se pudo validar tu perfil de administrador.\n\n"
+            "Vuelve a abrir Mi admin y entra de nuevo desde el boton actualizado."
+        )
+        return ConversationHandler.END
+
+    _aviso_clear(context)
+    context.user_data["aviso_admin_id"] = admin_id
+    context.user_data["aviso_platform"] = _row_value(admin, "team_code") == "PLATFORM"
+
+    if context.user_data["aviso_platform"]:
+        kb = [
+            [InlineKeyboardButton("👥 Mi equipo", callback_data="aviso_alcance_equipo")],
+            [InlineKeyboardButton("🌐 Toda la plataforma", callback_data="aviso_alcance_plataforma")],
+            [InlineKeyboardButton("Cancelar", callback_data="aviso_cancelar")],
+        ]
+        query.edit_message_text("Enviar aviso\n\nA quien va dirigido?", reply_markup=InlineKeyboardMarkup(kb))
+        return AVISO_DESTINO
+
+    query.edit_message_text(
+        "Enviar aviso a tu equipo\n\nQue usuarios deben recibirlo?",
+        reply_markup=InlineKeyboardMarkup(_aviso_role_kb()),
+    )
+    return AVISO_DESTINO
+
+
+def aviso_alcance(update, context):
+    """Admin Plataforma elige equipo propio o toda la plataforma."""
+    query = update.callback_query
+    query.answer()
+    if not context.user_data.get("aviso_platform"):
+        query.edit_message_text("Accion no disponible.")
+        _aviso_clear(context)
+        return ConversationHandler.END
+    context.user_data["aviso_scope_all"] = query.data == "aviso_alcance_plataforma"
+    query.edit_message_text(
+        "Enviar aviso\n\nQue usuarios deben recibirlo?",
+        reply_markup=InlineKeyboardMarkup(_aviso_role_kb()),
+    )
+    return AVISO_DESTINO
+
+
+def aviso_rol(update, context):
+    """Elige el rol destinatario y pide la zona."""
+    query = update.callback_query
+    query.answer()
+    context.user_data["aviso_role"] = query.data.replace("aviso_rol_", "")
+    kb = [
+        [InlineKeyboardButton("Sin filtro (todas las zonas)", callback_data="aviso_zona_todas")],
+        [InlineKeyboardButton("Cancelar", callback_data="aviso_cancelar")],
+    ]
+    query.edit_message_text(
+        "Filtrar por zona\n\n"
+        "Escribe la ciudad, o ciudad y barrio separados por coma.\n"
+        "Ejemplo: Pereira, Cuba\n\n"
+        "O pulsa Sin filtro.",
+        reply_markup=InlineKeyboardMarkup(kb),
+    )
+    return AVISO_ZONA
+
+
+def _aviso_ask_text(context):
+    """Cuenta destinatarios con el filtro actual. Retorna (texto, siguiente_estado)."""
+    scope_admin_id, role, city, barrio = _aviso_audience(context)
+    total = count_broadcast_audience(role, scope_admin_id=scope_admin_id, city=city, barrio=barrio)
+    if not total:
+        return (
+            "No hay usuarios con ese filtro ({}).\n\n"
+            "Escribe otra ciudad o pulsa Cancelar.".format(_aviso_audience_label(context)),
+            AVISO_ZONA,
+        )
+    return (
+        "Destinatarios: {} ({})\n\n"
+        "Escribe el texto del aviso (maximo {} caracteres).".format(
+            total, _aviso_audience_label(context), BROADCAST_MAX_TEXT),
+        AVISO_TEXTO,
+    )
+
+
+def aviso_zona_todas(update, context):
+    query = update.callback_query
+    query.answer()
+    context.user_data.pop("aviso_city", None)
+    context.user_data.pop("aviso_barrio", None)
+    text, state = _aviso_ask_text(context)
+    query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(_aviso_cancel_kb()))
+    return state
+
+
+def aviso_zona_texto(update, context):
+    parts = [part.strip() for part in update.message.text.split(",")]
+    if not parts[0]:
+        update.message.reply_text("Escribe la ciudad (y opcionalmente el barrio) o pulsa Cancelar.")
+        return AVISO_ZONA
+    context.user_data["aviso_city"] = parts[0]
+    context.user_data["aviso_barrio"] = parts[1] if len(parts) > 1 and parts[1] else None
+    text, state = _aviso_ask_text(context)
+    update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(_aviso_cancel_kb()))
+    return state
+
+
+def aviso_texto(update, context):
+    """Recibe el texto y muestra la vista previa con el numero de destinatarios."""
+    text = update.message.text.strip()
+    if not text:
+        update.message.reply_text("El aviso no puede estar vacio. Escribelo o pulsa Cancelar.")
+        return AVISO_TEXTO
+    if len(text) > BROADCAST_MAX_TEXT:
+        update.message.reply_text(
+            "El aviso tiene {} caracteres; el maximo es {}. Acortalo y envialo de nuevo.".format(
+                len(text), BROADCAST_MAX_TEXT))
+        return AVISO_TEXTO
+    context.user_data["aviso_text"] = text
+    scope_admin_id, role, city, barrio = _aviso_audience(context)
+    total = count_broadcast_audience(role, scope_admin_id=scope_admin_id, city=city, barrio=barrio)
+    kb = [
+        [
+            InlineKeyboardButton("📣 Enviar", callback_data="aviso_enviar"),
+            InlineKeyboardButton("Cancelar", callback_data="aviso_cancelar"),
+        ]
+    ]
+    update.message.reply_text(
+        "Vista previa del aviso\n\n"
+        "{}\n\n"
+        "Destinatarios: {} ({})\n"
+        "Tiempo estimado de envio: {}.".format(text, total, _aviso_audience_label(context), _aviso_eta(total)),
+        reply_markup=InlineKeyboardMarkup(kb),
+    )
+    return AVISO_CONFIRMAR
+
+
+def _aviso_progress_view(broadcast):
+    text = (
+        "Aviso #{}\n\n"
+        "Estado: {}\n"
+        "Entregados: {} de {}\n"
+        "Fallidos: {}\n"
+        "Pendientes: {}"
+    ).format(
+        broadcast["id"],
+        _AVISO_STATUS_LABELS.get(broadcast["status"], broadcast["status"]),
+        broadcast["sent"], broadcast["total"], broadcast["failed"], broadcast["pending"],
+    )
+    kb = []
+    if broadcast["status"] == "SENDING":
+        kb = [[
+            InlineKeyboardButton("🔄 Ver progreso", callback_data="aviso_estado_{}".format(broadcast["id"])),
+            InlineKeyboardButton("⛔ Detener", callback_data="aviso_detener_{}".format(broadcast["id"])),
+        ]]
+    return text, (InlineKeyboardMarkup(kb) if kb else None)
+
+
+def aviso_enviar(update, context):
+    """Crea el aviso (destinatarios resueltos en la BD) y lo deja en cola para el emisor."""
+    query = update.callback_query
+    query.answer()
+    admin_id = context.user_data.get("aviso_admin_id")
+    text = context.user_data.get("aviso_text")
+    scope_admin_id, role, city, barrio = _aviso_audience(context)
+    if not admin_id or not text or not role:
+        _aviso_clear(context)
+        query.edit_message_text("Error: datos del aviso perdidos. Inicia el proceso de nuevo.")
+        return ConversationHandler.END
+    try:
+        broadcast_id, total = create_broadcast(
+            admin_id, text, role, scope_admin_id=scope_admin_id, city=city, barrio=barrio,
+            created_by_telegram_id=query.from_user.id,
+        )
+    except Exception as e:
+        logger.error("aviso_enviar admin=%s: %s", admin_id, e)
+        query.edit_message_text("No se pudo crear el aviso. Intenta de nuevo.")
+        return ConversationHandler.END
+    finally:
+        _aviso_clear(context)
+
+    if not total:
+        query.edit_message_text("El aviso no tiene destinatarios; no se envio.")
+        return ConversationHandler.END
+    body, markup = _aviso_progress_view(get_broadcast(broadcast_id))
+    query.edit_message_text(
+        "Aviso en cola para {} usuarios. Se envia en segundo plano ({}) "
+        "y te aviso al terminar.\n\n".format(total, _aviso_eta(total)) + body,
+        reply_markup=markup,
+    )
+    return ConversationHandler.END
+
+
+def aviso_cancelar(update, context):
+    query = update.callback_query
+    query.answer()
+    _aviso_clear(context)
+    query.edit_message_text("Aviso cancelado.")
+    return ConversationHandler.END
+
+
+def aviso_estado_callback(update, context):
+    """Progreso de un aviso (aviso_estado_{id}) o detenerlo (aviso_detener_{id}). Solo su creador."""
+    query = update.callback_query
+    data = query.data
+    broadcast_id = int(data.rsplit("_", 1)[1])
+    broadcast = get_broadcast(broadcast_id)
+    if not broadcast or not resolve_owned_admin_actor(
+            query.from_user.id, selected_admin_id=broadcast["created_by_admin_id"]):
+        query.answer("Aviso no disponible.", show_alert=True)
+        return
+    if data.startswith("aviso_detener_"):
+        if cancel_broadcast(broadcast_id):
+            query.answer("Aviso detenido.")
+        else:
+            query.answer("El aviso ya habia terminado.")
+        broadcast = get_broadcast(broadcast_id)
+    else:
+        query.answer()
+    body, markup = _aviso_progress_view(broadcast)
+    try:
+        query.edit_message_text(body, reply_markup=markup)
+    except Exception as e:
+        # "Message is not modified" si el progreso no cambio desde la ultima vista
+        logger.debug("aviso_estado_callback: %s", e)
+
+
+aviso_conv = ConversationHandler(
+    entry_points=[
+        CallbackQueryHandler(aviso_inicio, pattern=r"^aviso_inicio_\d+$"),
+    ],
+    states={
+        AVISO_DESTINO: [
+            CallbackQueryHandler(aviso_alcance, pattern=r"^aviso_alcance_(equipo|plataforma)$"),
+            CallbackQueryHandler(aviso_rol, pattern=r"^aviso_rol_(COURIER|ALLY|ALL)$"),
+        ],
+        AVISO_ZONA: [
+            CallbackQueryHandler(aviso_zona_todas, pattern=r"^aviso_zona_todas$"),
+            MessageHandler(Filters.text & ~Filters.command, aviso_zona_texto),
+        ],
+        AVISO_TEXTO: [
+            MessageHandler(Filters.text & ~Filters.command, aviso_texto),
+        ],
+        AVISO_CONFIRMAR: [
+            CallbackQueryHandler(aviso_enviar, pattern=r"^aviso_enviar$"),
+        ],
+    },
+    fallbacks=[
+        CallbackQueryHandler(aviso_cancelar, pattern=r"^aviso_cancelar$"),
+    ],
+    name="aviso_conv",
+    persistent=True,
+)
+
+
 def config_ally_subsidy_start(update, context):
     """Entry point del ConversationHandler para editar el subsidio de domicilio de un aliado."""
     query = update.callback_query
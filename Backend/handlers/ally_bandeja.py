@@ -315,9 +315,9 @@ _ORDER_STATUS_LABELS_ALLY = {
 def _ally_bandeja_mostrar_pedido(query, ally_id, order_id):
     """
     Muestra el detalle de un pedido desde la bandeja del aliado.
-    Valida que el pedido pertenezca al aliado. Solo lectura.
+    Valida que el pedido pertenezca al aliado. Solo lectura (incluye pedidos archivados).
     """
-    order = get_order_by_id(order_id)
+    order = get_order_by_id(order_id, include_archived=True)
     if not order:
         query.edit_message_text(
             "El pedido #{} no fue encontrado.".format(order_id),
@@ -300,6 +300,11 @@ def _courier_main_button_label(courier):
     return "Mi repartidor · OFFLINE"
 
 
+def _inbox_button_label(label, pending):
+    """Agrega el conteo de pendientes de la bandeja al texto del boton: 'Recargas (3)'."""
+    return "{} ({})".format(label, pending) if pending else label
+
+
 def get_main_menu_keyboard(missing_cmds, courier=None, ally=None, admin_local=None, is_platform_admin: bool = False):
     """Retorna el teclado principal para usuarios fuera de flujos."""
     keyboard = []
@@ -741,6 +746,9 @@ def build_offer_demand_badge_text(preview: dict) -> str:
     ]
     if nearest_km is not None:
         lines[-1] += " (mas cercano ~{:.1f} km)".format(float(nearest_km))
+    eta_accept_s = preview.get("eta_accept_s")
+    if eta_accept_s is not None:
+        lines.append("Tiempo estimado hasta que lo acepten: ~{} min".format(max(1, int(round(eta_accept_s / 60.0)))))
     if reason:
         lines.append(reason)
 
@@ -470,6 +470,7 @@ def _ruta_mostrar_confirmacion(update_or_query, context):
         requires_cash=requires_cash,
         cash_required_amount=cash_required_amount,
         current_incentive=incentivo,
+        entity_type="ROUTE",
     )
     demand_block = build_offer_demand_badge_text(demand_preview)
     if demand_block:
@@ -411,3 +411,12 @@ PLAT_CORR_BUSCAR       = 1020  # Admin escribe texto para buscar aliado (o . par
 PLAT_CORR_SEL_CLIENTE  = 1021  # Selecciona cliente del aliado via callbacks
 PLAT_CORR_SEL_DIR      = 1022  # Selecciona direccion del cliente via callbacks
 PLAT_CORR_COORDS       = 1023  # Ingresa nuevas coordenadas (GPS pin, link Maps o texto geocodificable)
+
+# =========================
+# aviso_conv — Aviso masivo del admin a su equipo (o a toda la plataforma)
+# Entry: callback aviso_inicio_{admin_id}  |  Prefijo callbacks: aviso_  |  Prefijo user_data: aviso_
+# =========================
+AVISO_DESTINO   = 1024  # Alcance (equipo/plataforma) y rol via callbacks
+AVISO_ZONA      = 1025  # Texto con ciudad[, barrio] o boton "Sin filtro"
+AVISO_TEXTO     = 1026  # Texto del aviso
+AVISO_CONFIRMAR = 1027  # Vista previa + confirmacion via callbacks
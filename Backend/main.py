@@ -1,6 +1,8 @@
 import logging
 import os
 import hashlib
+import signal
+import threading
 import time
 import traceback
 from datetime import datetime, timezone
@@ -10,7 +12,7 @@ except ImportError:
     def load_dotenv(*args, **kwargs):
         return False
 
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove, Update
 from telegram.error import BadRequest
 from telegram.ext import (
     Updater,
@@ -153,6 +155,19 @@ from services import (
     update_courier_live_location,
     set_courier_availability,
     expire_stale_live_locations,
+    prune_ops_feed_events,
+    prune_dispatch_events,
+    archive_finished_orders,
+    reconcile_admin_inbox_counters,
+    get_admin_inbox_counts,
+    INBOX_PLATFORM_ADMIN_ID,
+    INBOX_COURIERS,
+    INBOX_ALLIES,
+    INBOX_RECHARGES,
+    INBOX_SUPPORT,
+    INBOX_CHANGE_REQUESTS,
+    INBOX_PARKING,
+    train_demand_model,
     get_pending_couriers,
     get_pending_couriers_by_admin,
     get_pending_allies_by_admin,
@@ -174,7 +189,7 @@ from services import (
     assign_order_to_courier,
     get_order_by_id,
     get_orders_by_ally,
-    get_orders_by_courier,
+    get_history_page,
     get_courier_active_order_stage_line,
     get_active_order_for_courier,
     get_active_orders_for_courier,
@@ -283,13 +298,21 @@ from services import (
     try_acquire_bot_polling_lock,
     release_bot_polling_lock,
 )
-from order_delivery import publish_order_to_couriers, order_courier_callback, ally_active_orders, ally_orders_history_callback, admin_orders_panel, admin_orders_callback, publish_route_to_couriers, handle_route_callback, handle_rating_callback, check_courier_arrival_at_pickup, repost_order_to_couriers, recover_scheduled_jobs, recover_active_offer_dispatches, admin_special_orders_history_callback, _get_order_visible_pickup_line, _get_order_visible_dropoff_line, _get_route_visible_pickup_line, _get_route_stop_visible_line, build_courier_order_earnings_text, build_courier_route_earnings_text
+from order_delivery import publish_order_to_couriers, order_courier_callback, ally_active_orders, ally_orders_history_callback, admin_orders_panel, admin_orders_callback, publish_route_to_couriers, handle_route_callback, handle_rating_callback, check_courier_arrival_at_pickup, repost_order_to_couriers, recover_scheduled_jobs, recover_active_offer_dispatches, install_dispatch_sharding, admin_special_orders_history_callback, _get_order_visible_pickup_line, _get_order_visible_dropoff_line, _get_route_visible_pickup_line, _get_route_stop_visible_line, build_courier_order_earnings_text, build_courier_route_earnings_text
 from db import (
     init_db,
     force_platform_admin,
     ensure_pricing_defaults,
     ensure_platform_sociedad,
+    prune_telegram_updates,
 )
+from update_workers import BOT_UPDATE_WORKERS, install_chat_ordered_processing
+from offer_queue import flush_offer_queues
+from dispatch_analytics import DISPATCH_EVENTS_RETENTION_DAYS, flush_dispatch_analytics, start_dispatch_analytics_flusher
+from broadcasts import start_broadcast_sender
+from timer_wheel import install_timer_wheel
+from update_queue import UPDATE_LEASE_RESOURCE, UPDATE_QUEUE_PARTITIONS, UPDATE_QUEUE_RETENTION_HOURS, UpdateQueueConsumer, owned_partitions, register_webhook
+from dispatch_shards import ShardLeases
 from profile_changes import (
     profile_change_conv,
     admin_change_requests_callback,
@@ -298,6 +321,7 @@ from profile_changes import (
 )
 from handlers.states import *
 from handlers.common import (
+    _inbox_button_label,
     _set_flow_step,
     _debug_admin_registration_state,
     _OPTIONS_HINT,
@@ -495,6 +519,8 @@ from handlers.admin_panel import (
     admin_parking_review,
     admin_parking_review_callback,
     rechazar_conv,
+    aviso_conv,
+    aviso_estado_callback,
 )
 from handlers.courier_panel import (
     courier_earnings_start,
@@ -535,9 +561,26 @@ else:
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_USER_ID = int(os.getenv("ADMIN_USER_ID", "0"))
 
+# Recepcion de updates: "polling" (una instancia, lock en PostgreSQL) o "webhook"
+# (la API guarda los updates en telegram_update_queue y cada worker consume sus
+# particiones de chat: BOT_WORKER_INDEX de BOT_WORKER_COUNT). En webhook con varios
+# workers, particiones y despacho se reparten por leases (dispatch_shards) y los jobs
+# globales (avisos diarios, podas, cobros pendientes) corren solo en el worker 0.
+BOT_UPDATE_MODE = os.getenv("BOT_UPDATE_MODE", "polling").strip().lower()
+TELEGRAM_WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL", "").strip()
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET", "")
+BOT_WORKER_INDEX = int(os.getenv("BOT_WORKER_INDEX", "0"))
+BOT_WORKER_COUNT = int(os.getenv("BOT_WORKER_COUNT", "1"))
+
 COURIER_CHAT_ID = int(os.getenv("COURIER_CHAT_ID", "0"))
 RESTAURANT_CHAT_ID = int(os.getenv("RESTAURANT_CHAT_ID", "0"))
 
+# Pedidos y rutas terminados hace mas de estos dias pasan a las tablas frias (*_archive)
+ORDERS_ARCHIVE_AFTER_DAYS = int(os.getenv("ORDERS_ARCHIVE_AFTER_DAYS", "30"))
+
+# Cada cuantos segundos se recuentan los contadores de la bandeja del admin (admin_inbox_counters)
+ADMIN_INBOX_RECONCILE_SECONDS = int(os.getenv("ADMIN_INBOX_RECONCILE_SECONDS", "600"))
+
 # URL base del formulario público de pedidos del aliado.
 # Configurar en Railway como variable de entorno FORM_BASE_URL.
 # Ejemplo: https://form.domiquerendona.com
@@ -1148,35 +1191,64 @@ def mi_repartidor(update, context):
         )
 
 
+COURIER_HISTORY_PAGE_SIZE = 10
+
+_COURIER_ORDER_STATUS_LABELS = {
+    "PENDING": "Pendiente",
+    "PUBLISHED": "Buscando repartidor",
+    "ACCEPTED": "Asignado",
+    "PICKED_UP": "En camino",
+    "DELIVERED": "Entregado",
+    "CANCELLED": "Cancelado",
+}
+
+
+def _courier_history_page(courier_id, cursor=None, direction="older"):
+    """Texto y botones de una pagina del historial del repartidor (entregados/cancelados)."""
+    page = get_history_page("courier", courier_id, cursor=cursor, direction=direction,
+                            limit=COURIER_HISTORY_PAGE_SIZE)
+    if not page["items"]:
+        return "No tienes pedidos en tu historial.", None
+
+    lines = ["Tu historial:"]
+    for item in page["items"]:
+        event_at = item["delivered_at"] if item["status"] == "DELIVERED" else item["canceled_at"]
+        lines.append(
+            "\nPedido #{}\n"
+            "Estado: {}\n"
+            "Fecha: {}\n"
+            "Cliente: {}\n"
+            "Dirección: {}".format(
+                item["id"],
+                _COURIER_ORDER_STATUS_LABELS.get(item["status"], item["status"]),
+                event_at or "-",
+                item["customer_name"] or "N/A",
+                item["customer_address"] or "N/A",
+            )
+        )
+    nav = []
+    if page["has_newer"]:
+        nav.append(InlineKeyboardButton(
+            "« Mas recientes", callback_data="courierhist_n_{}".format(page["items"][0]["cursor"])))
+    if page["has_older"]:
+        nav.append(InlineKeyboardButton(
+            "Anteriores »", callback_data="courierhist_o_{}".format(page["items"][-1]["cursor"])))
+    return "\n".join(lines), (InlineKeyboardMarkup([nav]) if nav else None)
+
+
 def courier_orders_history(update, context):
-    """Muestra pedidos del repartidor (activos e historial reciente)."""
+    """Muestra pedidos del repartidor: activos y la primera pagina del historial."""
     user_db_id = get_user_db_id_from_update(update)
     courier = get_courier_by_user_id(user_db_id)
     if not courier:
         update.message.reply_text("No tienes perfil de repartidor.")
         return
 
-    orders = get_orders_by_courier(courier["id"], limit=20)
-    if not orders:
-        update.message.reply_text("No tienes pedidos registrados.")
-        return
-
-    status_labels = {
-        "PENDING": "Pendiente",
-        "PUBLISHED": "Buscando repartidor",
-        "ACCEPTED": "Asignado",
-        "PICKED_UP": "En camino",
-        "DELIVERED": "Entregado",
-        "CANCELLED": "Cancelado",
-    }
-
-    active_orders = [o for o in orders if _row_value(o, "status") not in ("DELIVERED", "CANCELLED")]
-    history_orders = [o for o in orders if _row_value(o, "status") in ("DELIVERED", "CANCELLED")]
-
+    active_orders = get_active_orders_for_courier(courier["id"])
     if active_orders:
         update.message.reply_text("Tus pedidos activos:")
         for order in active_orders:
-            status = status_labels.get(_row_value(order, "status"), _row_value(order, "status", "-"))
+            status = _COURIER_ORDER_STATUS_LABELS.get(_row_value(order, "status"), _row_value(order, "status", "-"))
             msg = (
                 "Pedido #{}\n"
                 "Estado: {}\n"
@@ -1192,30 +1264,24 @@ def courier_orders_history(update, context):
     else:
         update.message.reply_text("No tienes pedidos activos.")
 
-    if history_orders:
-        update.message.reply_text("Tu historial reciente:")
-        for order in history_orders[:10]:
-            status = status_labels.get(_row_value(order, "status"), _row_value(order, "status", "-"))
-            event_at = "-"
-            if _row_value(order, "status") == "DELIVERED":
-                event_at = _row_value(order, "delivered_at", "-") or "-"
-            elif _row_value(order, "status") == "CANCELLED":
-                event_at = _row_value(order, "canceled_at", "-") or "-"
+    text, markup = _courier_history_page(courier["id"])
+    update.message.reply_text(text, reply_markup=markup)
+
 
-            msg = (
-                "Pedido #{}\n"
-                "Estado: {}\n"
-                "Fecha: {}\n"
-                "Cliente: {}\n"
-                "Dirección: {}"
-            ).format(
-                _row_value(order, "id", "-"),
-                status,
-                event_at,
-                _row_value(order, "customer_name", "N/A") or "N/A",
-                _row_value(order, "customer_address", "N/A") or "N/A",
-            )
-            update.message.reply_text(msg)
+def courier_history_page_callback(update, context):
+    """Pagina anterior/siguiente del historial del repartidor: courierhist_{n|o}_{cursor}."""
+    query = update.callback_query
+    query.answer()
+    parts = (query.data or "").split("_", 2)
+    if len(parts) != 3 or parts[1] not in ("n", "o"):
+        return
+    courier = get_courier_by_user_id(get_user_db_id_from_update(update))
+    if not courier:
+        query.edit_message_text("No tienes perfil de repartidor.")
+        return
+    direction = "newer" if parts[1] == "n" else "older"
+    text, markup = _courier_history_page(courier["id"], cursor=parts[2], direction=direction)
+    query.edit_message_text(text, reply_markup=markup)
 
 
 def courier_pedidos_en_curso(update, context):
@@ -1549,11 +1615,24 @@ def mi_admin(update, context):
         "Tu código de equipo sigue disponible como respaldo.\n\n"
     )
 
+    # Conteos de pendientes: una sola consulta a los contadores de la bandeja.
+    # Soportes, solicitudes de cambio y parqueo: el admin de plataforma ve el total de
+    # plataforma; un admin de equipo ve solo los de su equipo (su propio contador).
+    inbox = get_admin_inbox_counts([admin_id, INBOX_PLATFORM_ADMIN_ID])
+    own_inbox = inbox[admin_id]
+    shared_inbox = inbox[INBOX_PLATFORM_ADMIN_ID] if team_code == "PLATFORM" else own_inbox
+    couriers_label = _inbox_button_label("⏳ Repartidores pendientes", own_inbox[INBOX_COURIERS])
+    allies_label = _inbox_button_label("⏳ Aliados pendientes", own_inbox[INBOX_ALLIES])
+    recharges_label = _inbox_button_label("💳 Recargas pendientes", own_inbox[INBOX_RECHARGES])
+    support_label = _inbox_button_label("Soportes pendientes", shared_inbox[INBOX_SUPPORT])
+    changes_label = _inbox_button_label("📝 Solicitudes de cambio", shared_inbox[INBOX_CHANGE_REQUESTS])
+    parking_label = _inbox_button_label("🅿️ Puntos difícil parqueo", shared_inbox[INBOX_PARKING])
+
     # Administrador de Plataforma: siempre operativo
     if team_code == "PLATFORM":
         keyboard = [
-            [InlineKeyboardButton("⏳ Repartidores pendientes", callback_data=f"local_couriers_pending_{admin_id}")],
-            [InlineKeyboardButton("⏳ Aliados pendientes", callback_data=f"local_allies_pending_{admin_id}")],
+            [InlineKeyboardButton(couriers_label, callback_data=f"local_couriers_pending_{admin_id}")],
+            [InlineKeyboardButton(allies_label, callback_data=f"local_allies_pending_{admin_id}")],
             [InlineKeyboardButton("👥 Mi equipo", callback_data=f"local_my_team_{admin_id}")],
             [InlineKeyboardButton("📦 Pedidos", callback_data="admin_pedidos_local_{}".format(admin_id))],
             [InlineKeyboardButton("📋 Nuevo pedido especial", callback_data="admin_nuevo_pedido_{}".format(admin_id))],
@@ -1561,12 +1640,13 @@ def mi_admin(update, context):
             [InlineKeyboardButton("👤 Mis clientes", callback_data="admin_mis_clientes_{}".format(admin_id))],
             [InlineKeyboardButton("📍 Mis direcciones", callback_data="admin_mis_dirs_{}".format(admin_id))],
             [InlineKeyboardButton("🗂 Mis plantillas", callback_data="admin_mis_plantillas_{}".format(admin_id))],
-            [InlineKeyboardButton("💳 Recargas pendientes", callback_data=f"local_recargas_pending_{admin_id}")],
+            [InlineKeyboardButton(recharges_label, callback_data=f"local_recargas_pending_{admin_id}")],
             [InlineKeyboardButton("💰 Mi saldo", callback_data="admin_mi_saldo_{}".format(admin_id)), InlineKeyboardButton("📊 Mis movimientos", callback_data="admin_movimientos_{}".format(admin_id))],
             [InlineKeyboardButton("📋 Ver mi estado", callback_data=f"local_status_{admin_id}")],
-            [InlineKeyboardButton("Soportes pendientes", callback_data="admin_support_open")],
-            [InlineKeyboardButton("📝 Solicitudes de cambio", callback_data="admin_change_requests")],
-            [InlineKeyboardButton("🅿️ Puntos difícil parqueo", callback_data="parking_review_list")],
+            [InlineKeyboardButton("📣 Enviar aviso", callback_data=f"aviso_inicio_{admin_id}")],
+            [InlineKeyboardButton(support_label, callback_data="admin_support_open")],
+            [InlineKeyboardButton(changes_label, callback_data="admin_change_requests")],
+            [InlineKeyboardButton(parking_label, callback_data="parking_review_list")],
         ]
         saldo_alerta = ""
         saldo_sociedad = get_sociedad_balance()
@@ -1618,8 +1698,8 @@ def mi_admin(update, context):
     )
     # En FASE 1: panel siempre habilitado
     keyboard = [
-        [InlineKeyboardButton("⏳ Repartidores pendientes", callback_data=f"local_couriers_pending_{admin_id}")],
-        [InlineKeyboardButton("⏳ Aliados pendientes", callback_data=f"local_allies_pending_{admin_id}")],
+        [InlineKeyboardButton(couriers_label, callback_data=f"local_couriers_pending_{admin_id}")],
+        [InlineKeyboardButton(allies_label, callback_data=f"local_allies_pending_{admin_id}")],
         [InlineKeyboardButton("👥 Mi equipo", callback_data=f"local_my_team_{admin_id}")],
         [InlineKeyboardButton("📦 Pedidos de mi equipo", callback_data="admin_pedidos_local_{}".format(admin_id))],
         [InlineKeyboardButton("📋 Nuevo pedido especial", callback_data="admin_nuevo_pedido_{}".format(admin_id))],
@@ -1627,14 +1707,15 @@ def mi_admin(update, context):
         [InlineKeyboardButton("👤 Mis clientes", callback_data="admin_mis_clientes_{}".format(admin_id))],
         [InlineKeyboardButton("📍 Mis direcciones", callback_data="admin_mis_dirs_{}".format(admin_id))],
         [InlineKeyboardButton("🗂 Mis plantillas", callback_data="admin_mis_plantillas_{}".format(admin_id))],
-        [InlineKeyboardButton("💳 Recargas pendientes", callback_data=f"local_recargas_pending_{admin_id}")],
+        [InlineKeyboardButton(recharges_label, callback_data=f"local_recargas_pending_{admin_id}")],
         [InlineKeyboardButton("💰 Mi saldo", callback_data="admin_mi_saldo_{}".format(admin_id)), InlineKeyboardButton("📊 Mis movimientos", callback_data="admin_movimientos_{}".format(admin_id))],
         [InlineKeyboardButton("📋 Ver mi estado", callback_data=f"local_status_{admin_id}")],
         [InlineKeyboardButton("🔍 Verificar requisitos", callback_data=f"local_check_{admin_id}")],
-        [InlineKeyboardButton("Soportes pendientes", callback_data="admin_support_open")],
-        [InlineKeyboardButton("📝 Solicitudes de cambio", callback_data="admin_change_requests")],
+        [InlineKeyboardButton("📣 Enviar aviso", callback_data=f"aviso_inicio_{admin_id}")],
+        [InlineKeyboardButton(support_label, callback_data="admin_support_open")],
+        [InlineKeyboardButton(changes_label, callback_data="admin_change_requests")],
         [InlineKeyboardButton("⚙️ Configuraciones", callback_data="admin_config")],
-        [InlineKeyboardButton("🅿️ Puntos difícil parqueo", callback_data="parking_review_list")],
+        [InlineKeyboardButton(parking_label, callback_data="parking_review_list")],
     ]
     if WEB_PANEL_URL and WEB_PANEL_URL_IS_HTTPS:
         keyboard.append([InlineKeyboardButton("🌐 Abrir panel web", url=WEB_PANEL_URL)])
@@ -2301,6 +2382,10 @@ def courier_live_location_expired_check(context):
     ya expiro y los desactiva completamente (requieren re-activacion con base).
     """
     expired_ids = expire_stale_live_locations(stale_timeout_seconds=900)
+    try:
+        prune_ops_feed_events(max_age_seconds=3600)
+    except Exception as e:
+        logger.warning("prune_ops_feed_events: %s", e)
     for cid in expired_ids:
         try:
             courier = get_courier_by_id(cid)
@@ -2642,8 +2727,9 @@ def _recover_pending_fee_collections(bot):
                 creator_admin_id = rec.get("creator_admin_id") or (rec[2] if len(rec) > 2 else None)
                 if not order_id or not creator_admin_id:
                     continue
-                # Verificar que el pedido sigue en DELIVERED antes de reenviar
-                order = get_order_by_id(int(order_id))
+                # Verificar que el pedido sigue en DELIVERED antes de reenviar (puede estar
+                # archivado)
+                order = get_order_by_id(int(order_id), include_archived=True)
                 if not order:
                     continue
                 order_status = order["status"] if isinstance(order, dict) else order[3]
@@ -2680,6 +2766,53 @@ def _recover_pending_fee_collections(bot):
         logger.warning("_recover_pending_fee_collections: %s", e)
 
 
+def _prune_dispatch_events_job(context):
+    """Job diario: poda eventos de despacho antiguos (los agregados horarios se conservan)."""
+    try:
+        deleted = prune_dispatch_events(max_age_days=DISPATCH_EVENTS_RETENTION_DAYS)
+        logger.info("prune_dispatch_events: %s eventos eliminados", deleted)
+    except Exception as e:
+        logger.warning("prune_dispatch_events: %s", e)
+
+
+def _archive_finished_orders_job(context):
+    """Job diario: mueve pedidos y rutas terminados antiguos a las tablas frias."""
+    try:
+        archived = archive_finished_orders(max_age_days=ORDERS_ARCHIVE_AFTER_DAYS)
+        logger.info("archive_finished_orders: %s pedidos, %s rutas archivados",
+                    archived["orders"], archived["routes"])
+    except Exception as e:
+        logger.warning("archive_finished_orders: %s", e)
+
+
+def _reconcile_admin_inbox_job(context):
+    """Job periodico: recuenta la bandeja de pendientes de los admins y corrige desvios."""
+    try:
+        fixed = reconcile_admin_inbox_counters()
+        if fixed:
+            logger.info("reconcile_admin_inbox_counters: %s contadores corregidos", fixed)
+    except Exception as e:
+        logger.warning("reconcile_admin_inbox_counters: %s", e)
+
+
+def _prune_telegram_updates_job(context):
+    """Job horario: poda updates del webhook ya procesados."""
+    try:
+        deleted = prune_telegram_updates(max_age_hours=UPDATE_QUEUE_RETENTION_HOURS)
+        logger.info("prune_telegram_updates: %s updates eliminados", deleted)
+    except Exception as e:
+        logger.warning("prune_telegram_updates: %s", e)
+
+
+def _train_demand_model_job(context):
+    """Job diario: reentrena las curvas de aceptacion del preview de demanda."""
+    try:
+        cells = train_demand_model()
+        logger.info("train_demand_model: %s celdas", cells)
+    except Exception as e:
+        logger.warning("train_demand_model: %s", e)
+
+
 def _notify_expiring_subscriptions_job(context):
     """Job diario: notifica a aliados cuya suscripcion vence en los proximos 3 dias."""
     try:
@@ -2730,8 +2863,23 @@ def main():
     logger.info("TOKEN fingerprint: hash=%s suffix=...%s", token_hash, token_suffix)
     logger.info("Ambiente: %s", ENV)
 
+    webhook_mode = BOT_UPDATE_MODE == "webhook"
+    if webhook_mode and not TELEGRAM_WEBHOOK_SECRET:
+        raise RuntimeError("BOT_UPDATE_MODE=webhook requiere TELEGRAM_WEBHOOK_SECRET.")
+    # Varios workers: despacho por shards con leases; jobs globales solo en el worker 0.
+    # El callback de un repartidor lo atiende el worker de su chat, no el que publico el
+    # pedido: varios workers solo son correctos con colas, bot_data y timers compartidos
+    # (install_dispatch_sharding), que deben estar activos antes de consumir updates.
+    multi_worker = webhook_mode and BOT_WORKER_COUNT > 1
+    if BOT_WORKER_COUNT > 1 and not webhook_mode:
+        logger.warning("BOT_WORKER_COUNT=%s se ignora en modo polling: un solo worker.", BOT_WORKER_COUNT)
+    if multi_worker and not 0 <= BOT_WORKER_INDEX < BOT_WORKER_COUNT:
+        raise RuntimeError("BOT_WORKER_INDEX debe estar entre 0 y BOT_WORKER_COUNT - 1.")
+    singleton_jobs = not multi_worker or BOT_WORKER_INDEX == 0
+
     polling_lock_conn = None
-    if bot_polling_lock_supported():
+    # En modo webhook no hay getUpdates: varios workers conviven sin el lock de polling.
+    if not webhook_mode and bot_polling_lock_supported():
         logger.info("Polling lock distribuido activo para Telegram (PostgreSQL).")
         while polling_lock_conn is None:
             polling_lock_conn = try_acquire_bot_polling_lock()
@@ -2747,9 +2895,16 @@ def main():
     persistence = PicklePersistence(filename=persistence_path)
     logger.info("Persistencia: %s", persistence_path)
 
-    updater = Updater(BOT_TOKEN, use_context=True, persistence=persistence)
+    # Pool HTTP del bot dimensionado para los workers que envian mensajes en paralelo.
+    updater = Updater(
+        BOT_TOKEN,
+        use_context=True,
+        persistence=persistence,
+        request_kwargs={"con_pool_size": BOT_UPDATE_WORKERS + 4},
+    )
     dp = updater.dispatcher
     dp.add_error_handler(global_error_handler)
+    update_runner = install_chat_ordered_processing(dp, workers=BOT_UPDATE_WORKERS)
 
     # -------------------------
     # Comandos básicos
@@ -2848,6 +3003,7 @@ def main():
     dp.add_handler(CallbackQueryHandler(offer_suggest_inc_fixed_callback, pattern=r"^offer_inc_\d+x(1500|2000|3000)$"))
     dp.add_handler(CallbackQueryHandler(route_suggest_inc_fixed_callback, pattern=r"^ruta_inc_\d+x(1500|2000|3000)$"))
     dp.add_handler(CallbackQueryHandler(courier_earnings_callback, pattern=r"^courier_earn_"))
+    dp.add_handler(CallbackQueryHandler(courier_history_page_callback, pattern=r"^courierhist_"))
     dp.add_handler(CallbackQueryHandler(courier_activate_callback, pattern=r"^courier_activate$"))
     dp.add_handler(CallbackQueryHandler(courier_deactivate_callback, pattern=r"^courier_deactivate$"))
     dp.add_handler(CallbackQueryHandler(admin_change_requests_callback, pattern=r"^chgreq_"))
@@ -2891,6 +3047,8 @@ def main():
     ))
 
     dp.add_handler(rechazar_conv)  # debe ir ANTES de admin_menu_callback
+    dp.add_handler(aviso_conv)  # Aviso masivo (boton Enviar aviso de /mi_admin)
+    dp.add_handler(CallbackQueryHandler(aviso_estado_callback, pattern=r"^aviso_(estado|detener)_\d+$"))
     dp.add_handler(CallbackQueryHandler(admin_menu_callback, pattern=r"^admin_(?!geo_|pedido_|ruta_pinissue_|ruta_pickup_)"))
 
     # Configuracion de tarifas (botones pricing_*)
@@ -2910,12 +3068,13 @@ def main():
     ), group=3)
 
     # Job periodico: expirar live locations cada 60 segundos
-    updater.job_queue.run_repeating(
-        courier_live_location_expired_check,
-        interval=60,
-        first=60,
-        name="expire_live_locations",
-    )
+    if singleton_jobs:
+        updater.job_queue.run_repeating(
+            courier_live_location_expired_check,
+            interval=60,
+            first=60,
+            name="expire_live_locations",
+        )
     dp.add_handler(CallbackQueryHandler(handle_route_callback, pattern=r"^ruta_(aceptar|rechazar|ocupado|entregar|liberar|liberar_motivo|liberar_confirmar|liberar_abort|pinissue|cancelar_aliado|find_another|wait_courier|repost|orden|pickup_confirm|pickupconfirm|arrival_enroute|arrival_release)_"))  # callbacks de rutas
     dp.add_handler(CallbackQueryHandler(handle_route_callback, pattern=r"^admin_ruta_pinissue_(fin|cancel_courier|cancel_ally)_"))
     dp.add_handler(CallbackQueryHandler(handle_route_callback, pattern=r"^order_(arrived_pickup|arrival_enroute|arrival_release)_\d+$"))  # llegada al pickup (pedidos normales)
@@ -2987,29 +3146,112 @@ def main():
     else:
         logger.info("ADMIN_USER_ID=0, se omite notificacion de arranque.")
 
-    # Recuperar jobs persistidos tras reinicio
-    recover_scheduled_jobs(updater.job_queue)
+    # Timers por servicio (ofertas, llegada, entrega, soporte) en una sola rueda de tiempo
+    install_timer_wheel(updater.job_queue)
 
-    # Job diario: notificar suscripciones proximas a vencer (cada 24 h, primer disparo en 1 h)
-    updater.job_queue.run_repeating(
-        _notify_expiring_subscriptions_job,
-        interval=86400,
-        first=3600,
-        name="notify_expiring_subscriptions",
-    )
+    # Recuperar jobs persistidos tras reinicio. Con varios workers, cada uno recupera
+    # los jobs y ofertas de sus shards al tomar los leases (y los de un worker caido).
+    dispatch_leases = None
+    if multi_worker:
+        dispatch_leases = install_dispatch_sharding(dp, updater.job_queue)
+    else:
+        recover_scheduled_jobs(updater.job_queue)
+
+    if singleton_jobs:
+        # Job diario: notificar suscripciones proximas a vencer (cada 24 h, primer disparo en 1 h)
+        updater.job_queue.run_repeating(
+            _notify_expiring_subscriptions_job,
+            interval=86400,
+            first=3600,
+            name="notify_expiring_subscriptions",
+        )
+        updater.job_queue.run_repeating(
+            _prune_dispatch_events_job,
+            interval=86400,
+            first=1800,
+            name="prune_dispatch_events",
+        )
+        updater.job_queue.run_repeating(
+            _train_demand_model_job,
+            interval=86400,
+            first=2700,
+            name="train_demand_model",
+        )
+        updater.job_queue.run_repeating(
+            _archive_finished_orders_job,
+            interval=86400,
+            first=3300,
+            name="archive_finished_orders",
+        )
+        updater.job_queue.run_repeating(
+            _reconcile_admin_inbox_job,
+            interval=ADMIN_INBOX_RECONCILE_SECONDS,
+            first=120,
+            name="reconcile_admin_inbox",
+        )
+    start_dispatch_analytics_flusher()
 
-    # Rehidratar ofertas activas que pudieron quedar a mitad del ciclo por reinicio
-    recover_active_offer_dispatches(updater)
+    if not multi_worker:
+        # Rehidratar ofertas activas que pudieron quedar a mitad del ciclo por reinicio
+        recover_active_offer_dispatches(updater)
 
-    # Reenviar notificaciones de cobros de fees pendientes (sobreviven reinicios)
-    _recover_pending_fee_collections(updater.bot)
+    if singleton_jobs:
+        # Reenviar notificaciones de cobros de fees pendientes (sobreviven reinicios)
+        _recover_pending_fee_collections(updater.bot)
+        # Emisor de avisos masivos: retoma los que quedaron a medias
+        start_broadcast_sender(updater.bot)
 
     # Iniciar el bot
+    update_consumer = None
     try:
-        updater.start_polling(drop_pending_updates=True)
-        logger.info("Polling iniciado. Bot activo.")
-        updater.idle()
+        if webhook_mode:
+            if singleton_jobs:
+                updater.job_queue.run_repeating(
+                    _prune_telegram_updates_job,
+                    interval=3600,
+                    first=600,
+                    name="prune_telegram_updates",
+                )
+            if TELEGRAM_WEBHOOK_URL and BOT_WORKER_INDEX == 0:
+                register_webhook(updater.bot, TELEGRAM_WEBHOOK_URL, TELEGRAM_WEBHOOK_SECRET)
+                logger.info("Webhook registrado: %s", TELEGRAM_WEBHOOK_URL)
+            if multi_worker and dispatch_leases is None:
+                raise RuntimeError("BOT_WORKER_COUNT > 1 requiere el despacho repartido (dispatch_shards).")
+            update_consumer = UpdateQueueConsumer(
+                update_runner,
+                lambda data: Update.de_json(data, updater.bot),
+                owned_partitions(BOT_WORKER_INDEX, BOT_WORKER_COUNT),
+                leases=ShardLeases(UPDATE_LEASE_RESOURCE, UPDATE_QUEUE_PARTITIONS) if multi_worker else None,
+            )
+            update_consumer.start()
+            # Sin start_polling el JobQueue no arranca solo.
+            updater.job_queue.start()
+            logger.info("Modo webhook: worker %s/%s activo.", BOT_WORKER_INDEX + 1, BOT_WORKER_COUNT)
+            # Updater.idle() sale con os._exit si no hay polling: se espera la senal aqui.
+            stop_requested = threading.Event()
+            for sig in (signal.SIGINT, signal.SIGTERM, signal.SIGABRT):
+                signal.signal(sig, lambda *_: stop_requested.set())
+            while not stop_requested.wait(1):
+                pass
+        else:
+            updater.start_polling(drop_pending_updates=True)
+            logger.info("Polling iniciado. Bot activo.")
+            updater.idle()
     finally:
+        if update_consumer is not None:
+            update_consumer.stop()
+            updater.job_queue.stop()
+        update_runner.shutdown(wait=True)
+        if update_consumer is not None:
+            update_consumer.flush_finished()
+            update_consumer.release_partitions()
+            if persistence:
+                dp.update_persistence()
+                persistence.flush()
+        if dispatch_leases is not None:
+            dispatch_leases.release_all()
+        flush_offer_queues()
+        flush_dispatch_analytics()
         release_bot_polling_lock(polling_lock_conn)
 
 
@@ -807,6 +807,7 @@ CREATE INDEX IF NOT EXISTS idx_admin_allies_admin_id ON admin_allies(admin_id);
 CREATE INDEX IF NOT EXISTS idx_admin_allies_ally_id ON admin_allies(ally_id);
 CREATE INDEX IF NOT EXISTS idx_admin_couriers_admin_id ON admin_couriers(admin_id);
 CREATE INDEX IF NOT EXISTS idx_admin_couriers_courier_id ON admin_couriers(courier_id);
+CREATE INDEX IF NOT EXISTS idx_admin_couriers_updated_at ON admin_couriers(updated_at);
 
 -- Orders
 CREATE INDEX IF NOT EXISTS idx_orders_ally_id ON orders(ally_id);
@@ -913,5 +914,136 @@ CREATE TABLE IF NOT EXISTS scheduled_jobs (
     job_data TEXT DEFAULT '{}',
     status TEXT DEFAULT 'PENDING',
     created_at TIMESTAMP DEFAULT NOW(),
-    updated_at TIMESTAMP DEFAULT NOW()
+    updated_at TIMESTAMP DEFAULT NOW(),
+    entity_id BIGINT
+);
+
+-- Feed incremental del mapa en vivo del panel web (escrito por el bot, leido por la API)
+CREATE TABLE IF NOT EXISTS ops_feed_events (
+    id BIGSERIAL PRIMARY KEY,
+    entity_type TEXT NOT NULL,
+    entity_id BIGINT NOT NULL,
+    admin_id BIGINT,
+    payload TEXT DEFAULT '{}',
+    created_at TIMESTAMP DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS idx_ops_feed_events_created_at ON ops_feed_events(created_at);
+
+-- Analitica de despacho: eventos de oferta (solo insercion) y agregados por hora/celda/equipo
+CREATE TABLE IF NOT EXISTS dispatch_events (
+    id BIGSERIAL PRIMARY KEY,
+    entity_type TEXT NOT NULL,
+    entity_id BIGINT NOT NULL,
+    event TEXT NOT NULL,
+    courier_id BIGINT,
+    position INTEGER,
+    distance_m INTEGER,
+    response_s INTEGER,
+    wait_s INTEGER,
+    supply INTEGER,
+    admin_id BIGINT,
+    cell TEXT,
+    created_at TIMESTAMP NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_dispatch_events_created_at ON dispatch_events(created_at);
+CREATE TABLE IF NOT EXISTS dispatch_rollups_hourly (
+    hour TIMESTAMP NOT NULL,
+    cell TEXT NOT NULL,
+    admin_id BIGINT NOT NULL DEFAULT 0,
+    entity_type TEXT NOT NULL,
+    published INTEGER NOT NULL DEFAULT 0,
+    offered INTEGER NOT NULL DEFAULT 0,
+    expired INTEGER NOT NULL DEFAULT 0,
+    rejected INTEGER NOT NULL DEFAULT 0,
+    busy INTEGER NOT NULL DEFAULT 0,
+    accepted INTEGER NOT NULL DEFAULT 0,
+    supply_sum BIGINT NOT NULL DEFAULT 0,
+    supply_samples INTEGER NOT NULL DEFAULT 0,
+    seen_sum BIGINT NOT NULL DEFAULT 0,
+    wait_sum_s BIGINT NOT NULL DEFAULT 0,
+    response_sum_s BIGINT NOT NULL DEFAULT 0,
+    responses INTEGER NOT NULL DEFAULT 0,
+    wait_lt_1m INTEGER NOT NULL DEFAULT 0,
+    wait_lt_3m INTEGER NOT NULL DEFAULT 0,
+    wait_lt_5m INTEGER NOT NULL DEFAULT 0,
+    wait_lt_10m INTEGER NOT NULL DEFAULT 0,
+    wait_ge_10m INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (hour, cell, admin_id, entity_type)
+);
+CREATE INDEX IF NOT EXISTS idx_dispatch_rollups_admin_hour ON dispatch_rollups_hourly(admin_id, hour);
+CREATE TABLE IF NOT EXISTS demand_model_cells (
+    level INTEGER NOT NULL,
+    bucket TEXT NOT NULL,
+    incentive INTEGER NOT NULL,
+    samples INTEGER NOT NULL DEFAULT 0,
+    accepted INTEGER NOT NULL DEFAULT 0,
+    accepted_target INTEGER NOT NULL DEFAULT 0,
+    median_wait_s INTEGER,
+    trained_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (level, bucket, incentive)
+);
+CREATE TABLE IF NOT EXISTS telegram_update_queue (
+    id BIGSERIAL PRIMARY KEY,
+    update_id BIGINT NOT NULL UNIQUE,
+    partition_no INTEGER NOT NULL,
+    chat_id BIGINT,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'PENDING',
+    claimed_by TEXT,
+    received_at TIMESTAMP NOT NULL,
+    processed_at TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_telegram_update_queue_partition ON telegram_update_queue(status, partition_no, id);
+CREATE TABLE IF NOT EXISTS broadcasts (
+    id BIGSERIAL PRIMARY KEY,
+    created_by_admin_id BIGINT NOT NULL,
+    created_by_telegram_id BIGINT,
+    scope_admin_id BIGINT,
+    role TEXT NOT NULL,
+    city TEXT,
+    barrio TEXT,
+    text TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'SENDING',
+    total INTEGER NOT NULL DEFAULT 0,
+    sent INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP NOT NULL,
+    finished_at TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS broadcast_recipients (
+    id BIGSERIAL PRIMARY KEY,
+    broadcast_id BIGINT NOT NULL,
+    telegram_id BIGINT NOT NULL,
+    role TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'PENDING',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    claimed_by TEXT,
+    error TEXT,
+    sent_at TIMESTAMP,
+    UNIQUE (broadcast_id, telegram_id)
+);
+CREATE INDEX IF NOT EXISTS idx_broadcast_recipients_status ON broadcast_recipients(status, broadcast_id, id);
+CREATE TABLE IF NOT EXISTS shard_leases (
+    resource TEXT NOT NULL,
+    shard_no INTEGER NOT NULL,
+    owner TEXT,
+    fencing_token BIGINT NOT NULL DEFAULT 0,
+    expires_at DOUBLE PRECISION NOT NULL DEFAULT 0,
+    PRIMARY KEY (resource, shard_no)
+);
+CREATE TABLE IF NOT EXISTS dispatch_state (
+    scope TEXT NOT NULL,
+    entity_id BIGINT NOT NULL,
+    payload TEXT NOT NULL,
+    fencing_token BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (scope, entity_id)
+);
+CREATE TABLE IF NOT EXISTS dispatch_commands (
+    id BIGSERIAL PRIMARY KEY,
+    shard_no INTEGER NOT NULL,
+    command TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL
 );
+CREATE INDEX IF NOT EXISTS idx_dispatch_commands_shard ON dispatch_commands(shard_no, id);
@@ -0,0 +1,486 @@
+"""
+Colas de ofertas secuenciales (pedidos y rutas) residentes en memoria.
+
+Cada cola activa vive en memoria como una lista compacta de entradas ordenadas por
+posicion. Las lecturas del motor de ofertas (siguiente PENDING, oferta OFFERED
+vigente) se resuelven sin BD; las transiciones (OFFERED, respuestas, reset, borrado)
+se acumulan y se escriben por lotes (executemany en una sola transaccion) cada
+OFFER_QUEUE_FLUSH_SECONDS o al crear una cola nueva.
+
+Las tablas order_offer_queue / route_offer_queue siguen siendo la fuente para
+recuperar tras un reinicio: una cola que no esta en memoria se reconstruye desde la
+tabla en el primer acceso (p.ej. desde recover_active_offer_dispatches). Si el
+proceso muere, se pierden como maximo las transiciones del ultimo intervalo de
+flush; en ese caso la recuperacion re-ofrece al courier cuya oferta no alcanzo a
+quedar registrada.
+
+Las funciones publicas conservan los nombres y el formato de retorno de las
+versiones de db.py, asi order_delivery no cambia.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from db import P, get_connection
+
+logger = logging.getLogger(__name__)
+
+OFFER_QUEUE_FLUSH_SECONDS = 1.0
+OFFER_QUEUE_MAX_PENDING_WRITES = 200
+OFFER_QUEUE_MAX_CACHED = 2000
+
+
+def _now_sql_value() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _db_key() -> str:
+    return os.getenv("DATABASE_URL") or os.getenv("DB_PATH", "domiquerendona.db")
+
+
+class _Entry:
+    __slots__ = ("queue_id", "courier_id", "position", "status", "offered_at", "full_name", "telegram_id")
+
+    def __init__(self, queue_id, courier_id, position, status, offered_at, full_name, telegram_id):
+        self.queue_id = queue_id
+        self.courier_id = courier_id
+        self.position = position
+        self.status = status
+        self.offered_at = offered_at
+        self.full_name = full_name
+        self.telegram_id = telegram_id
+
+
+class OfferQueueStore:
+    """Colas en memoria de una tabla (order_offer_queue o route_offer_queue) con write-behind."""
+
+    def __init__(self, table: str, owner_col: str, first_position: int):
+        self.table = table
+        self.owner_col = owner_col
+        self.first_position = first_position
+        self._lock = threading.RLock()
+        self._queues = {}    # owner_id -> [_Entry] ordenadas por posicion
+        self._owner_of = {}  # queue_id -> owner_id
+        self._pending = []   # [(sql, params)] en orden de llegada
+        self._db_key = None
+        # Despacho repartido (dispatch_shards): owns(owner_id) dice si este proceso es el
+        # duenio del servicio. Las colas ajenas no se cachean, toda escritura va directo a
+        # la tabla y las de colas ajenas se avisan con on_foreign_write(owner_id).
+        self.owns = None
+        self.on_foreign_write = None
+
+    # ---------------- carga / persistencia ----------------
+
+    def _check_db(self):
+        key = _db_key()
+        if self._db_key != key:
+            if self._pending:
+                logger.warning("offer_queue: cambio de BD con %s escrituras pendientes descartadas", len(self._pending))
+            self._queues.clear()
+            self._owner_of.clear()
+            self._pending = []
+            self._db_key = key
+
+    def _select_sql(self, owners: int = 1) -> str:
+        if owners == 1:
+            where = f"q.{self.owner_col} = {P}"
+        else:
+            where = f"q.{self.owner_col} IN ({', '.join([P] * owners)})"
+        return f"""
+            SELECT q.{self.owner_col} AS owner_id, q.id, q.courier_id, q.position, q.status,
+                   q.offered_at, c.full_name, u.telegram_id
+            FROM {self.table} q
+            JOIN couriers c ON c.id = q.courier_id
+            JOIN users u ON u.id = c.user_id
+            WHERE {where}
+            ORDER BY q.position ASC, q.id ASC
+        """
+
+    @staticmethod
+    def _entries(rows):
+        return [
+            _Entry(row["id"], row["courier_id"], row["position"], row["status"],
+                   row["offered_at"], row["full_name"], row["telegram_id"])
+            for row in rows
+        ]
+
+    def _is_foreign(self, owner_id):
+        return self.owns is not None and not self.owns(owner_id)
+
+    def _store(self, owner_id, rows):
+        old = self._queues.pop(owner_id, None) or []
+        for entry in old:
+            self._owner_of.pop(entry.queue_id, None)
+        entries = self._entries(rows)
+        if self._is_foreign(owner_id):
+            return entries
+        self._queues[owner_id] = entries
+        for entry in entries:
+            self._owner_of[entry.queue_id] = owner_id
+        if len(self._queues) > OFFER_QUEUE_MAX_CACHED:
+            # Se descarta la cola mas antigua; si se vuelve a usar, se recarga desde la tabla.
+            oldest = next(iter(self._queues))
+            for entry in self._queues.pop(oldest):
+                self._owner_of.pop(entry.queue_id, None)
+        return entries
+
+    def _load(self, owner_id):
+        """Cola desde memoria o reconstruida desde la tabla (aplicando antes lo pendiente)."""
+        self._check_db()
+        entries = self._queues.get(owner_id)
+        if entries is not None:
+            return entries
+        def select(cur):
+            cur.execute(self._select_sql(), (owner_id,))
+            return cur.fetchall()
+
+        return self._store(owner_id, self._run_in_tx(select))
+
+    def preload(self, owner_ids) -> int:
+        """Reconstruye desde la tabla, en una sola consulta, las colas que no estan en memoria."""
+        with self._lock:
+            self._check_db()
+            missing = [oid for oid in dict.fromkeys(owner_ids) if oid not in self._queues]
+            if not missing:
+                return 0
+            def select(cur):
+                cur.execute(self._select_sql(len(missing)), tuple(missing))
+                return cur.fetchall()
+
+            rows = self._run_in_tx(select)
+            grouped = {oid: [] for oid in missing}
+            for row in rows:
+                grouped[row["owner_id"]].append(row)
+            for owner_id, owner_rows in grouped.items():
+                self._store(owner_id, owner_rows)
+            return len(rows)
+
+    def _enqueue(self, sql, params, owner_id=None):
+        self._pending.append((sql, params))
+        if self.owns is not None:
+            # Con varios procesos la tabla es la fuente comun: sin write-behind.
+            self._run_in_tx()
+            if owner_id is not None and self.on_foreign_write is not None and not self.owns(owner_id):
+                self.on_foreign_write(owner_id)
+        elif len(self._pending) >= OFFER_QUEUE_MAX_PENDING_WRITES:
+            self.flush()
+        else:
+            _ensure_flusher()
+
+    def _run_in_tx(self, fn=None):
+        """Aplica lo pendiente y luego fn(cur) en una sola transaccion.
+
+        Las sentencias iguales consecutivas se agrupan en un executemany. Si algo
+        falla, lo pendiente se conserva para el siguiente intento.
+        """
+        pending, self._pending = self._pending, []
+        conn = get_connection()
+        try:
+            cur = conn.cursor()
+            i = 0
+            while i < len(pending):
+                sql = pending[i][0]
+                batch = []
+                while i < len(pending) and pending[i][0] == sql:
+                    batch.append(pending[i][1])
+                    i += 1
+                cur.executemany(sql, batch)
+            result = fn(cur) if fn is not None else len(pending)
+            conn.commit()
+            return result
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            self._pending = pending + self._pending
+            raise
+        finally:
+            conn.close()
+
+    def flush(self) -> int:
+        """Escribe en BD las transiciones acumuladas. Retorna cuantas se aplicaron."""
+        with self._lock:
+            self._check_db()
+            if not self._pending:
+                return 0
+            return self._run_in_tx()
+
+    def pending_writes(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def forget(self):
+        """Olvida el estado en memoria (lo pendiente se descarta). Simula un reinicio."""
+        with self._lock:
+            self._queues.clear()
+            self._owner_of.clear()
+            self._pending = []
+
+    def forget_owners(self, predicate) -> int:
+        """Escribe lo pendiente y olvida las colas en memoria cuyo owner_id cumple predicate."""
+        with self._lock:
+            self._check_db()
+            if self._pending:
+                self._run_in_tx()
+            dropped = [owner_id for owner_id in self._queues if predicate(owner_id)]
+            for owner_id in dropped:
+                for entry in self._queues.pop(owner_id):
+                    self._owner_of.pop(entry.queue_id, None)
+            return len(dropped)
+
+    # ---------------- operaciones de cola ----------------
+
+    def create(self, owner_id, courier_ids):
+        """Inserta la cola en un solo lote y la deja cargada en memoria."""
+        def insert_and_select(cur):
+            cur.executemany(
+                f"INSERT INTO {self.table} ({self.owner_col}, courier_id, position, status) "
+                f"VALUES ({P}, {P}, {P}, 'PENDING')",
+                [(owner_id, courier_id, pos)
+                 for pos, courier_id in enumerate(courier_ids, start=self.first_position)],
+            )
+            cur.execute(self._select_sql(), (owner_id,))
+            return cur.fetchall()
+
+        with self._lock:
+            self._check_db()
+            self._store(owner_id, self._run_in_tx(insert_and_select))
+            if self._is_foreign(owner_id) and self.on_foreign_write is not None:
+                self.on_foreign_write(owner_id)
+
+    def next_pending(self, owner_id):
+        with self._lock:
+            for entry in self._load(owner_id):
+                if entry.status == "PENDING":
+                    return entry
+            return None
+
+    def pending_courier_ids(self, owner_id):
+        """Couriers aun PENDING de la cola, en orden de posicion."""
+        with self._lock:
+            return [entry.courier_id for entry in self._load(owner_id) if entry.status == "PENDING"]
+
+    def current(self, owner_id):
+        with self._lock:
+            for entry in self._load(owner_id):
+                if entry.status == "OFFERED":
+                    return entry
+            return None
+
+    def _entry(self, queue_id):
+        self._check_db()
+        owner_id = self._owner_of.get(queue_id)
+        if owner_id is None:
+            return None
+        for entry in self._queues.get(owner_id, ()):
+            if entry.queue_id == queue_id:
+                return entry
+        return None
+
+    def mark_offered(self, queue_id):
+        now = _now_sql_value()
+        with self._lock:
+            entry = self._entry(queue_id)
+            if entry is not None:
+                entry.status = "OFFERED"
+                entry.offered_at = now
+            self._enqueue(
+                f"UPDATE {self.table} SET status = 'OFFERED', offered_at = {P} WHERE id = {P}",
+                (now, queue_id),
+            )
+
+    def mark_response(self, queue_id, response):
+        now = _now_sql_value()
+        with self._lock:
+            entry = self._entry(queue_id)
+            if entry is not None:
+                entry.status = response
+            self._enqueue(
+                f"UPDATE {self.table} SET status = {P}, response = {P}, responded_at = {P} WHERE id = {P}",
+                (response, response, now, queue_id),
+            )
+
+    def reset(self, owner_id, statuses=None):
+        """Vuelve a PENDING las entradas (todas, o solo las de `statuses`)."""
+        with self._lock:
+            self._check_db()
+            for entry in self._queues.get(owner_id, ()):
+                if statuses is None or entry.status in statuses:
+                    entry.status = "PENDING"
+                    entry.offered_at = None
+            where_status = ""
+            if statuses:
+                where_status = " AND status IN ({})".format(", ".join("'{}'".format(s) for s in statuses))
+            self._enqueue(
+                f"UPDATE {self.table} SET status = 'PENDING', offered_at = NULL, responded_at = NULL, "
+                f"response = NULL WHERE {self.owner_col} = {P}{where_status}",
+                (owner_id,),
+                owner_id,
+            )
+
+    def delete(self, owner_id):
+        with self._lock:
+            self._check_db()
+            for entry in self._queues.pop(owner_id, None) or []:
+                self._owner_of.pop(entry.queue_id, None)
+            self._enqueue(f"DELETE FROM {self.table} WHERE {self.owner_col} = {P}", (owner_id,), owner_id)
+
+
+# Una sola implementacion, una instancia por tabla. No se unifican en un solo store
+# (entity, id) a proposito: los queue_id salen de dos secuencias distintas (chocan
+# entre tablas) y las tablas, los nombres de job persistidos en scheduled_jobs y las
+# claves de bot_data sobreviven reinicios; unirlos exige migrar datos en produccion.
+order_offer_store = OfferQueueStore("order_offer_queue", "order_id", first_position=0)
+route_offer_store = OfferQueueStore("route_offer_queue", "route_id", first_position=1)
+_STORES = (order_offer_store, route_offer_store)
+
+
+def flush_offer_queues():
+    """Escribe todas las transiciones pendientes de ambas colas."""
+    applied = 0
+    for store in _STORES:
+        try:
+            applied += store.flush()
+        except Exception as e:
+            logger.warning("offer_queue: flush de %s fallo, se reintentara: %s", store.table, e)
+    return applied
+
+
+_flusher_lock = threading.Lock()
+_flusher_thread = None
+
+
+def _flusher_loop():
+    while True:
+        time.sleep(OFFER_QUEUE_FLUSH_SECONDS)
+        flush_offer_queues()
+
+
+def _ensure_flusher():
+    global _flusher_thread
+    if _flusher_thread is not None:
+        return
+    with _flusher_lock:
+        if _flusher_thread is None:
+            _flusher_thread = threading.Thread(target=_flusher_loop, name="offer-queue-flush", daemon=True)
+            _flusher_thread.start()
+
+
+atexit.register(flush_offer_queues)
+
+
+# ---------------- API compatible con db.py: pedidos ----------------
+
+def create_offer_queue(order_id: int, courier_ids: list):
+    """Crea la cola de ofertas para un pedido. courier_ids ya viene ordenado por prioridad."""
+    order_offer_store.create(order_id, courier_ids)
+
+
+def get_next_pending_offer(order_id: int):
+    """Devuelve el siguiente courier en cola con status PENDING."""
+    entry = order_offer_store.next_pending(order_id)
+    if entry is None:
+        return None
+    return {
+        "queue_id": entry.queue_id,
+        "courier_id": entry.courier_id,
+        "position": entry.position,
+        "full_name": entry.full_name,
+        "telegram_id": entry.telegram_id,
+    }
+
+
+def mark_offer_as_offered(queue_id: int):
+    order_offer_store.mark_offered(queue_id)
+
+
+def mark_offer_response(queue_id: int, response: str):
+    """response: 'ACCEPTED', 'REJECTED', o 'EXPIRED'"""
+    order_offer_store.mark_response(queue_id, response)
+
+
+def get_current_offer_for_order(order_id: int):
+    """Devuelve la oferta actualmente en status OFFERED para un pedido."""
+    entry = order_offer_store.current(order_id)
+    if entry is None:
+        return None
+    return {
+        "queue_id": entry.queue_id,
+        "courier_id": entry.courier_id,
+        "position": entry.position,
+        "offered_at": entry.offered_at,
+        "telegram_id": entry.telegram_id,
+    }
+
+
+def reset_offer_queue(order_id: int):
+    """Resetea toda la cola a PENDING para reiniciar el ciclo."""
+    order_offer_store.reset(order_id, statuses=("REJECTED", "EXPIRED"))
+
+
+def clear_offer_queue(order_id: int):
+    """Elimina todos los registros de la cola de ofertas de un pedido para permitir re-oferta completa."""
+    order_offer_store.delete(order_id)
+
+
+def delete_offer_queue(order_id: int):
+    """Elimina la cola de ofertas de un pedido (al cancelar o completar)."""
+    order_offer_store.delete(order_id)
+
+
+# ---------------- API compatible con db.py: rutas ----------------
+
+def create_route_offer_queue(route_id, courier_ids):
+    """Crea entradas en la cola de ofertas de la ruta."""
+    route_offer_store.create(route_id, courier_ids)
+
+
+def get_next_pending_route_offer(route_id):
+    """Retorna el proximo courier pendiente en la cola de la ruta."""
+    entry = route_offer_store.next_pending(route_id)
+    if entry is None:
+        return None
+    return {
+        "queue_id": entry.queue_id,
+        "courier_id": entry.courier_id,
+        "position": entry.position,
+        "telegram_id": entry.telegram_id,
+    }
+
+
+def mark_route_offer_as_offered(queue_id):
+    """Marca una oferta de ruta como enviada."""
+    route_offer_store.mark_offered(queue_id)
+
+
+def mark_route_offer_response(queue_id, response):
+    """Marca la respuesta de una oferta de ruta (ACCEPTED, REJECTED, EXPIRED, BUSY)."""
+    route_offer_store.mark_response(queue_id, response)
+
+
+def get_current_route_offer(route_id):
+    """Retorna la oferta activa (OFFERED) de la ruta."""
+    entry = route_offer_store.current(route_id)
+    if entry is None:
+        return None
+    return {
+        "queue_id": entry.queue_id,
+        "courier_id": entry.courier_id,
+        "position": entry.position,
+        "offered_at": entry.offered_at,
+        "telegram_id": entry.telegram_id,
+    }
+
+
+def delete_route_offer_queue(route_id):
+    """Borra toda la cola de ofertas de una ruta."""
+    route_offer_store.delete(route_id)
+
+
+def reset_route_offer_queue(route_id):
+    """Reinicia todos los estados de la cola a PENDING para un nuevo ciclo."""
+    route_offer_store.reset(route_id)
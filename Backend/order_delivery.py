@@ -1,6 +1,8 @@
 import json
 import logging
 import re
+import time
+from types import SimpleNamespace
 
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
@@ -10,8 +12,6 @@ from db import (
     assign_order_to_courier,
     cancel_order,
     get_platform_admin,
-    create_offer_queue,
-    delete_offer_queue,
     get_all_orders,
     get_active_orders_by_ally,
     get_routes_by_status,
@@ -24,28 +24,22 @@ from db import (
     get_approved_admin_link_for_courier,
     get_courier_by_id,
     get_courier_by_telegram_id,
-    get_current_offer_for_order,
     get_default_ally_location,
     get_eligible_couriers_for_order,
-    get_next_pending_offer,
     get_order_by_id,
     get_orders_by_ally,
-    get_ally_orders_between,
-    get_ally_routes_between,
-    get_admin_special_orders_between,
+    get_history_day_totals,
+    get_history_page,
+    HISTORY_KIND_ROUTE,
     get_admin_special_orders_recent,
     get_orders_by_admin_team,
     get_setting,
     get_user_by_telegram_id,
     get_user_by_id,
-    mark_offer_as_offered,
-    mark_offer_response,
     release_order_from_courier,
     get_order_pickup_confirmation,
     upsert_order_pickup_confirmation,
     review_order_pickup_confirmation,
-    reset_offer_queue,
-    clear_offer_queue,
     set_order_status,
     upsert_order_accounting_settlement,
     get_courier_link_balance,
@@ -61,13 +55,44 @@ from db import (
     release_route_from_courier,
     deliver_route_stop,
     cancel_route,
+)
+from offer_queue import (
+    create_offer_queue,
+    delete_offer_queue,
+    get_current_offer_for_order,
+    get_next_pending_offer,
+    mark_offer_as_offered,
+    mark_offer_response,
+    reset_offer_queue,
+    clear_offer_queue,
     create_route_offer_queue,
     get_next_pending_route_offer,
     mark_route_offer_as_offered,
     mark_route_offer_response,
     get_current_route_offer,
     delete_route_offer_queue,
+    order_offer_store,
+    route_offer_store,
 )
+from candidate_tracker import order_candidates, route_candidates
+from timer_wheel import timer_wheel_for
+from dispatch_shards import (
+    DISPATCH_COMMAND_POLL_SECONDS,
+    DISPATCH_LEASE_RESOURCE,
+    DISPATCH_SHARDS,
+    SharedDispatchState,
+    ShardLeases,
+    ack_dispatch_commands,
+    dispatch_fence_holds,
+    dispatch_leases,
+    dispatch_shard,
+    forward_dispatch_command,
+    install_dispatch_leases,
+    owns_dispatch,
+    take_dispatch_commands,
+)
+from courier_ranking import detour_ratio, detour_ratios, distances_km, nearest_neighbor_order, path_length_km
+from dispatch_analytics import record_dispatch_event, record_dispatch_published
 from datetime import datetime, timezone, timedelta
 from db import (
     add_courier_rating,
@@ -89,6 +114,7 @@ from db import (
     get_active_route_for_courier,
     get_courier_delivery_time_stats,
     get_approved_admin_id_for_courier,
+    get_offer_courier_contexts,
     get_admin_by_telegram_id,
     create_or_get_pending_support_request,
     get_pending_support_request,
@@ -107,31 +133,77 @@ from db import (
     get_pending_fee_collection,
     republish_cancelled_order,
 )
-from services import apply_service_fee, check_service_fee_available, haversine_km, liquidate_route_additional_stops_fee, add_route_incentive, check_ally_active_subscription, get_fee_config, get_order_penalty_config, cancel_order_by_actor, cancel_route_by_actor, penalize_courier_for_delay_and_release, penalize_route_courier_for_delay_and_release, apply_special_order_commission, apply_special_order_creator_fees, check_special_commission_available, es_admin_plataforma, get_admin_telegram_id, increment_setting_counter, resolve_owned_admin_actor
+from services import apply_service_fee, check_service_fee_available, haversine_km, liquidate_route_additional_stops_fee, add_route_incentive, check_ally_active_subscription, get_fee_config, get_order_penalty_config, cancel_order_by_actor, cancel_route_by_actor, penalize_courier_for_delay_and_release, penalize_route_courier_for_delay_and_release, apply_special_order_commission, apply_special_order_creator_fees, es_admin_plataforma, get_admin_telegram_id, increment_setting_counter, resolve_owned_admin_actor
+
 
+def _schedule_persistent_job(context, callback, when_seconds, name, job_data=None, *, entity_id):
+    """Programa un job y lo persiste en BD para recuperacion tras reinicio.
 
-def _schedule_persistent_job(context, callback, when_seconds, name, job_data=None):
-    """Programa un job y lo persiste en BD para recuperacion tras reinicio."""
+    entity_id es el pedido o la ruta duenio del job (decide su shard del despacho)."""
     fire_at = (datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(seconds=when_seconds)).isoformat()
     try:
-        upsert_scheduled_job(name, callback.__name__, fire_at, json.dumps(job_data or {}))
+        upsert_scheduled_job(name, callback.__name__, fire_at, json.dumps(job_data or {}), entity_id=entity_id)
     except Exception as e:
         logger.warning("_schedule_persistent_job: no se pudo persistir job %s: %s", name, e)
-    context.job_queue.run_once(callback, when=when_seconds, context=job_data or {}, name=name)
+    _run_timer(context, callback, when_seconds, name, job_data, entity_id=entity_id)
 
 
-def _cancel_persistent_job(context, name):
+def _cancel_persistent_job(context, name, *, entity_id):
     """Cancela un job del queue y lo marca cancelado en BD."""
-    job_queue = getattr(context, "job_queue", None)
-    if job_queue and hasattr(job_queue, "get_jobs_by_name"):
-        for job in job_queue.get_jobs_by_name(name):
-            job.schedule_removal()
+    _cancel_timer(context, name, entity_id=entity_id)
     try:
         cancel_scheduled_job(name)
     except Exception as e:
         logger.warning("_cancel_persistent_job: no se pudo cancelar job %s: %s", name, e)
 
 
+def _shard_guarded(callback, entity_id):
+    """Con despacho repartido, el timer solo corre si el shard sigue siendo de este proceso
+    (si se perdio, el nuevo duenio ya lo reprogramo al tomar el shard)."""
+    def run(context):
+        if owns_dispatch(entity_id):
+            callback(context)
+    run.__name__ = callback.__name__
+    return run
+
+
+def _run_timer(context, callback, when_seconds, name, job_data=None, *, entity_id):
+    """Programa un timer en memoria: en la rueda de tiempo si esta instalada, si no en el JobQueue.
+
+    Con despacho repartido los timers de un servicio viven en el proceso duenio del shard
+    de entity_id (el pedido o la ruta): desde otro proceso se le pasan como comando."""
+    if not owns_dispatch(entity_id):
+        forward_dispatch_command(entity_id, "TIMER", {
+            "callback": callback.__name__,
+            "fire_at": time.time() + float(when_seconds or 0),
+            "name": name,
+            "data": job_data or {},
+            "entity_id": entity_id,
+        })
+        return
+    if dispatch_leases() is not None:
+        callback = _shard_guarded(callback, entity_id)
+    wheel = timer_wheel_for(getattr(context, "job_queue", None))
+    if wheel is not None:
+        wheel.schedule(name, callback, when_seconds, job_data or {})
+    else:
+        context.job_queue.run_once(callback, when=when_seconds, context=job_data or {}, name=name)
+
+
+def _cancel_timer(context, name, *, entity_id):
+    """Cancela el timer en memoria con ese nombre (O(1) en la rueda; sin ella, busqueda por nombre)."""
+    if not owns_dispatch(entity_id):
+        forward_dispatch_command(entity_id, "CANCEL_TIMER", {"name": name, "entity_id": entity_id})
+        return
+    job_queue = getattr(context, "job_queue", None)
+    wheel = timer_wheel_for(job_queue)
+    if wheel is not None:
+        wheel.cancel(name)
+    elif job_queue and hasattr(job_queue, "get_jobs_by_name"):
+        for job in job_queue.get_jobs_by_name(name):
+            job.schedule_removal()
+
+
 def _format_duration(seconds):
     """Convierte segundos a texto legible: 'X min' o 'Xh Ymin'. Retorna 'N/D' si es None."""
     if seconds is None or seconds < 0:
@@ -313,11 +385,7 @@ def _offer_reply_markup(order_id, special_commission=0):
 
 
 def _cancel_offer_jobs(context, order_id, queue_id):
-    timeout_jobs = context.job_queue.get_jobs_by_name(
-        "offer_timeout_{}_{}".format(order_id, queue_id)
-    )
-    for job in timeout_jobs:
-        job.schedule_removal()
+    _cancel_timer(context, "offer_timeout_{}_{}".format(order_id, queue_id), entity_id=order_id)
 
 
 def _cancel_arrival_jobs(context, order_id):
@@ -326,7 +394,7 @@ def _cancel_arrival_jobs(context, order_id):
         "arr_inactive_{}".format(order_id),
         "arr_warn_{}".format(order_id),
     ]:
-        _cancel_persistent_job(context, name)
+        _cancel_persistent_job(context, name, entity_id=order_id)
     _cancel_arrival_deadline_job(context, order_id)
     _cancel_wait_override_reminder_job(context, order_id)
     context.bot_data.get("arrival_manual_prompted", {}).pop(order_id, None)
@@ -334,12 +402,12 @@ def _cancel_arrival_jobs(context, order_id):
 
 def _cancel_arrival_deadline_job(context, order_id):
     """Cancela solo la liberacion automatica T+20 de llegada para un pedido."""
-    _cancel_persistent_job(context, "arr_deadline_{}".format(order_id))
+    _cancel_persistent_job(context, "arr_deadline_{}".format(order_id), entity_id=order_id)
 
 
 def _cancel_wait_override_reminder_job(context, order_id):
     """Cancela el recordatorio suave posterior a la espera manual del pedido."""
-    _cancel_persistent_job(context, "arr_wait_reminder_{}".format(order_id))
+    _cancel_persistent_job(context, "arr_wait_reminder_{}".format(order_id), entity_id=order_id)
 
 
 def _build_waiting_override_markup(callback_data):
@@ -356,6 +424,7 @@ def _schedule_wait_override_reminder_job(context, order_id):
         WAITING_OVERRIDE_REMINDER_SECONDS,
         "arr_wait_reminder_{}".format(order_id),
         {"order_id": order_id},
+        entity_id=order_id,
     )
 
 
@@ -376,7 +445,7 @@ def _cancel_delivery_reminder_jobs(context, order_id):
         "delivery_reminder_{}".format(order_id),
         "delivery_admin_alert_{}".format(order_id),
     ]:
-        _cancel_persistent_job(context, name)
+        _cancel_persistent_job(context, name, entity_id=order_id)
 
 
 def _delivery_reminder_job(context):
@@ -439,42 +508,42 @@ def _delivery_admin_alert_job(context):
 
 def _cancel_no_response_job(context, order_id):
     """Cancela el job de sugerencia de incentivo T+5 para un pedido."""
-    _cancel_persistent_job(context, "offer_no_response_{}".format(order_id))
+    _cancel_persistent_job(context, "offer_no_response_{}".format(order_id), entity_id=order_id)
 
 
 def _cancel_offer_retry_job(context, order_id):
     """Cancela el job de reintento cuando un pedido esta esperando couriers elegibles."""
-    _cancel_persistent_job(context, "offer_retry_{}".format(order_id))
+    _cancel_persistent_job(context, "offer_retry_{}".format(order_id), entity_id=order_id)
 
 
 def _cancel_pickup_autoconfirm_job(context, order_id):
     """Cancela el job de auto-confirmacion de llegada al pickup (pedido)."""
-    _cancel_persistent_job(context, "pickup_autoconfirm_{}".format(order_id))
+    _cancel_persistent_job(context, "pickup_autoconfirm_{}".format(order_id), entity_id=order_id)
 
 
 def _cancel_route_pickup_autoconfirm_job(context, route_id):
     """Cancela el job de auto-confirmacion de llegada al pickup (ruta)."""
-    _cancel_persistent_job(context, "route_pickup_autoconfirm_{}".format(route_id))
+    _cancel_persistent_job(context, "route_pickup_autoconfirm_{}".format(route_id), entity_id=route_id)
 
 
 def _cancel_route_no_response_job(context, route_id):
     """Cancela el job de sugerencia de incentivo T+5 para una ruta."""
-    _cancel_persistent_job(context, "route_no_response_{}".format(route_id))
+    _cancel_persistent_job(context, "route_no_response_{}".format(route_id), entity_id=route_id)
 
 
 def _cancel_route_offer_retry_job(context, route_id):
     """Cancela el job de reintento cuando una ruta esta esperando couriers elegibles."""
-    _cancel_persistent_job(context, "route_offer_retry_{}".format(route_id))
+    _cancel_persistent_job(context, "route_offer_retry_{}".format(route_id), entity_id=route_id)
 
 
 def _cancel_order_expire_job(context, order_id):
     """Cancela el job de expiración automática T+10 para un pedido."""
-    _cancel_persistent_job(context, "order_expire_{}".format(order_id))
+    _cancel_persistent_job(context, "order_expire_{}".format(order_id), entity_id=order_id)
 
 
 def _cancel_route_expire_job(context, route_id):
     """Cancela el job de expiracion automatica del mercado para una ruta."""
-    _cancel_persistent_job(context, "route_expire_{}".format(route_id))
+    _cancel_persistent_job(context, "route_expire_{}".format(route_id), entity_id=route_id)
 
 
 def _courier_is_within_pickup_radius(order, courier):
@@ -1013,6 +1082,7 @@ def _schedule_order_expire_job(context, order_id, reset_window=False, market_ret
         _schedule_persistent_job(
             context, _order_expire_job, cycle_seconds,
             "order_expire_{}".format(order_id), job_data,
+            entity_id=order_id,
         )
         return
 
@@ -1038,6 +1108,7 @@ def _schedule_order_expire_job(context, order_id, reset_window=False, market_ret
     _schedule_persistent_job(
         context, _order_expire_job, remaining,
         "order_expire_{}".format(order_id), job_data,
+        entity_id=order_id,
     )
 
 
@@ -1071,57 +1142,18 @@ def _schedule_offer_retry_job(context, order_id, delay_seconds=OFFER_RETRY_SECON
         delay_seconds,
         "offer_retry_{}".format(order_id),
         _build_market_job_data("order_id", order_id, market_retry_count),
+        entity_id=order_id,
     )
 
 
 def _offer_retry_job(context):
     """Reintenta publicar o reactivar la siguiente oferta de un pedido PUBLISHED."""
-    mark_job_executed(context.job.name)
-    data = context.job.context or {}
-    order_id = data.get("order_id")
-    if not order_id:
-        return
-
-    order = get_order_by_id(order_id)
-    if not order or order["status"] != "PUBLISHED":
-        return
-
-    cycle_info = context.bot_data.get("offer_cycles", {}).get(order_id)
-    if cycle_info is not None:
-        cycle_info["market_retry_count"] = max(
-            _coerce_market_retry_count(cycle_info.get("market_retry_count")),
-            _coerce_market_retry_count(data.get("market_retry_count")),
-        )
-
-    if get_current_offer_for_order(order_id):
-        return
-
-    _send_next_offer(order_id, context)
+    _ORDER_DISPATCH.retry(context)
 
 
 def _activate_order_offer_dispatch(order_id, context, cycle_info, courier_ids):
     """Deja el pedido activo aunque temporalmente no haya couriers relanzables."""
-    delete_offer_queue(order_id)
-    if courier_ids:
-        create_offer_queue(order_id, courier_ids)
-        _cancel_offer_retry_job(context, order_id)
-    else:
-        logger.info(
-            "publish_order_to_couriers: pedido %s activo sin couriers relanzables; reintentara en %ss",
-            order_id,
-            OFFER_RETRY_SECONDS,
-        )
-        _schedule_offer_retry_job(
-            context,
-            order_id,
-            market_retry_count=_coerce_market_retry_count(cycle_info.get("market_retry_count")),
-        )
-
-    set_order_status(order_id, "PUBLISHED", "published_at")
-    context.bot_data.setdefault("offer_cycles", {})[order_id] = cycle_info
-
-    if courier_ids:
-        _send_next_offer(order_id, context)
+    _ORDER_DISPATCH.activate(order_id, context, cycle_info, courier_ids)
 
 
 def _offer_no_response_job(context):
@@ -1686,32 +1718,13 @@ def _schedule_route_offer_retry_job(context, route_id, delay_seconds=None, marke
         delay_seconds,
         "route_offer_retry_{}".format(route_id),
         _build_market_job_data("route_id", route_id, market_retry_count),
+        entity_id=route_id,
     )
 
 
 def _route_offer_retry_job(context):
     """Reintenta publicar o reactivar la siguiente oferta de una ruta PUBLISHED."""
-    mark_job_executed(context.job.name)
-    data = context.job.context or {}
-    route_id = data.get("route_id")
-    if not route_id:
-        return
-
-    route = get_route_by_id(route_id)
-    if not route or route["status"] != "PUBLISHED":
-        return
-
-    cycle_info = context.bot_data.get("route_offer_cycles", {}).get(route_id)
-    if cycle_info is not None:
-        cycle_info["market_retry_count"] = max(
-            _coerce_market_retry_count(cycle_info.get("market_retry_count")),
-            _coerce_market_retry_count(data.get("market_retry_count")),
-        )
-
-    if get_current_route_offer(route_id):
-        return
-
-    _send_next_route_offer(route_id, context)
+    _ROUTE_DISPATCH.retry(context)
 
 
 def _schedule_route_expire_job(context, route_id, market_retry_count=0):
@@ -1754,6 +1767,7 @@ def _schedule_route_expire_job(context, route_id, market_retry_count=0):
         remaining,
         "route_expire_{}".format(route_id),
         job_data,
+        entity_id=route_id,
     )
 
 
@@ -1786,80 +1800,18 @@ def _get_route_candidate_courier_ids(route_id, ally_id, admin_id, excluded_couri
     route = get_route_by_id(route_id)
     if not route:
         return None, [], 0
-
-    pickup_lat = route["pickup_lat"]
-    pickup_lng = route["pickup_lng"]
-    requires_cash = bool(_row_value(route, "requires_cash", False))
-    cash_amount = int(_row_value(route, "cash_required_amount", 0) or 0)
-
-    route_max_dist_km = None
-    try:
-        import math as _rmath
-        route_destinations = get_route_destinations(route_id)
-        for destination in route_destinations:
-            d_lat = destination.get("dropoff_lat") if hasattr(destination, "get") else destination["dropoff_lat"]
-            d_lng = destination.get("dropoff_lng") if hasattr(destination, "get") else destination["dropoff_lng"]
-            if d_lat is not None and d_lng is not None and pickup_lat is not None and pickup_lng is not None:
-                r_lat = _rmath.radians(d_lat - pickup_lat)
-                r_lng = _rmath.radians(d_lng - pickup_lng)
-                a_val = (_rmath.sin(r_lat / 2) ** 2
-                         + _rmath.cos(_rmath.radians(pickup_lat)) * _rmath.cos(_rmath.radians(d_lat))
-                         * _rmath.sin(r_lng / 2) ** 2)
-                seg_km = 6371.0 * 2 * _rmath.atan2(_rmath.sqrt(a_val), _rmath.sqrt(1 - a_val))
-                if route_max_dist_km is None or seg_km > route_max_dist_km:
-                    route_max_dist_km = seg_km
-    except Exception:
-        route_max_dist_km = None
-
-    excluded_courier_ids = {int(cid) for cid in (excluded_courier_ids or []) if cid}
-    eligible = get_eligible_couriers_for_order(
-        admin_id=admin_id,
-        ally_id=ally_id,
-        requires_cash=requires_cash,
-        cash_required_amount=cash_amount,
-        pickup_lat=pickup_lat,
-        pickup_lng=pickup_lng,
-        order_distance_km=route_max_dist_km,
+    courier_ids, eligible_count, _ = _ROUTE_DISPATCH.candidate_ids(
+        route_id,
+        route,
+        {"ally_id": ally_id, "admin_id": admin_id},
+        excluded_courier_ids,
     )
-
-    courier_ids = []
-    for courier in eligible:
-        courier_id = courier["courier_id"]
-        if courier_id in excluded_courier_ids:
-            continue
-        courier_admin_id = get_approved_admin_id_for_courier(courier_id)
-        if not courier_admin_id:
-            continue
-        fee_ok, _ = check_service_fee_available("COURIER", courier_id, courier_admin_id)
-        if fee_ok:
-            courier_ids.append(courier_id)
-
-    return route, courier_ids, len(eligible)
+    return route, courier_ids, eligible_count
 
 
 def _activate_route_offer_dispatch(route_id, context, cycle_info, courier_ids):
     """Deja la ruta activa aunque temporalmente no haya couriers relanzables."""
-    delete_route_offer_queue(route_id)
-    if courier_ids:
-        create_route_offer_queue(route_id, courier_ids)
-        _cancel_route_offer_retry_job(context, route_id)
-    else:
-        logger.info(
-            "publish_route_to_couriers: ruta %s activa sin couriers relanzables; reintentara en %ss",
-            route_id,
-            ROUTE_OFFER_RETRY_SECONDS,
-        )
-        _schedule_route_offer_retry_job(
-            context,
-            route_id,
-            market_retry_count=_coerce_market_retry_count(cycle_info.get("market_retry_count")),
-        )
-
-    update_route_status(route_id, "PUBLISHED", "published_at")
-    context.bot_data.setdefault("route_offer_cycles", {})[route_id] = cycle_info
-
-    if courier_ids:
-        _send_next_route_offer(route_id, context)
+    _ROUTE_DISPATCH.activate(route_id, context, cycle_info, courier_ids)
 
 
 def repost_route_to_couriers(route_id, context, excluded_courier_ids=None):
@@ -2070,16 +2022,8 @@ def publish_order_to_couriers(
     d_lat = order["dropoff_lat"] if "dropoff_lat" in order.keys() else None
     d_lng = order["dropoff_lng"] if "dropoff_lng" in order.keys() else None
     if p_lat is not None and p_lng is not None and d_lat is not None and d_lng is not None:
-        import math as _math
-        _dlat = _math.radians(d_lat - p_lat)
-        _dlng = _math.radians(d_lng - p_lng)
-        _a = (_math.sin(_dlat / 2) ** 2
-              + _math.cos(_math.radians(p_lat)) * _math.cos(_math.radians(d_lat))
-              * _math.sin(_dlng / 2) ** 2)
-        _order_distance_km = 6371.0 * 2 * _math.atan2(_math.sqrt(_a), _math.sqrt(1 - _a))
-
-    # Leer campos especiales del pedido para pedidos de admin
-    special_commission = int(order["special_commission"] or 0) if "special_commission" in order.keys() else 0
+        _order_distance_km = haversine_km(float(p_lat), float(p_lng), float(d_lat), float(d_lng))
+
     team_only = int(order["team_only"] or 0) if "team_only" in order.keys() else 0
 
     missing_visibility = _get_order_missing_courier_visibility_fields(
@@ -2110,54 +2054,6 @@ def publish_order_to_couriers(
         )
         return MARKET_PUBLISH_BLOCKED
 
-    # Red cooperativa: buscar en TODOS los couriers activos, sin filtro de equipo.
-    # Cada courier opera bajo su propio admin; el fee se cobra a cada uno por separado.
-    eligible = get_eligible_couriers_for_order(
-        ally_id=ally_id,
-        requires_cash=requires_cash,
-        cash_required_amount=cash_amount,
-        pickup_lat=p_lat,
-        pickup_lng=p_lng,
-        order_distance_km=_order_distance_km,
-    )
-    eligible_count = len(eligible)
-
-    # Filtro team_only: pedidos especiales que el admin quiere ofrecer solo a su equipo.
-    if team_only and admin_id:
-        eligible = [c for c in eligible if get_approved_admin_id_for_courier(c["courier_id"]) == admin_id]
-
-    # Verificacion previa de saldo por courier usando el admin PROPIO de cada courier.
-    # Siempre se verifica saldo para el fee estandar ($300).
-    # Si hay comision especial: se verifica saldo para fee_estandar + comision (ambos se cobran al entregar).
-    fee_cfg_pub = get_fee_config()
-    filtered = []
-    couriers_without_balance = []
-    for c in eligible:
-        courier_id = c["courier_id"]
-        courier_admin_id = get_approved_admin_id_for_courier(courier_id)
-        if courier_admin_id is None:
-            couriers_without_balance.append(courier_id)
-            continue
-        if special_commission > 0:
-            ok, code = check_special_commission_available(
-                courier_id, special_commission, fee_cfg_pub["fee_service_total"]
-            )
-        else:
-            ok, code = check_service_fee_available(
-                target_type="COURIER",
-                target_id=courier_id,
-                admin_id=courier_admin_id,
-            )
-        if ok:
-            filtered.append(c)
-        else:
-            couriers_without_balance.append(courier_id)
-
-    for courier_id in couriers_without_balance:
-        _notify_recharge_needed_to_courier(context, courier_id)
-
-    courier_ids = [c["courier_id"] for c in filtered]
-
     # Guardar datos del ciclo para re-consulta en reintentos
     if pickup_loc_row is None and pickup_location_id and ally_id is not None:
         try:
@@ -2181,7 +2077,7 @@ def publish_order_to_couriers(
         dropoff_barrio = _row_value(order, "customer_barrio")
 
     cycle_info = {
-        "started_at": __import__("time").time(),
+        "started_at": time.time(),
         "admin_id": admin_id,
         "ally_id": ally_id,
         "market_retry_count": _coerce_market_retry_count(market_retry_count),
@@ -2197,17 +2093,36 @@ def publish_order_to_couriers(
         "order_distance_km": _order_distance_km,
     }
 
+    # Red cooperativa: candidatos de TODOS los couriers activos (salvo team_only). Cada
+    # courier opera bajo su propio admin y debe cubrir el fee estandar mas la comision
+    # especial del pedido; vinculo y saldo salen de una consulta por lotes (mismo
+    # camino que el reinicio del ciclo).
+    courier_ids, eligible_count, _ = _ORDER_DISPATCH.candidate_ids(
+        order_id, order, cycle_info, cycle_info["excluded_couriers"],
+    )
+    couriers_without_balance = _ORDER_DISPATCH.candidates.unfunded(order_id)
+    for courier_id in couriers_without_balance:
+        _notify_recharge_needed_to_courier(context, courier_id)
+
     if not courier_ids:
         logger.info(
-            "publish_order_to_couriers: pedido %s sin couriers relanzables (eligible=%s filtered=%s team_only=%s)",
+            "publish_order_to_couriers: pedido %s sin couriers relanzables (eligible=%s sin_saldo=%s team_only=%s)",
             order_id,
             eligible_count,
-            len(filtered),
+            len(couriers_without_balance),
             int(bool(team_only)),
         )
-        if ally_id is not None and eligible and not filtered:
+        if ally_id is not None and couriers_without_balance:
             _notify_recharge_needed_to_ally(context, ally_id)
 
+    try:
+        record_dispatch_published(
+            "ORDER", order_id, admin_id=admin_id, pickup_lat=p_lat, pickup_lng=p_lng,
+            supply=len(courier_ids), first=_coerce_market_retry_count(market_retry_count) == 0,
+        )
+    except Exception as e:
+        logger.warning("record_dispatch_published pedido %s: %s", order_id, e)
+
     _activate_order_offer_dispatch(order_id, context, cycle_info, courier_ids)
 
     # Programar sugerencia de incentivo si nadie acepta en T+5
@@ -2217,6 +2132,7 @@ def publish_order_to_couriers(
             context, _offer_no_response_job, OFFER_NO_RESPONSE_SECONDS,
             "offer_no_response_{}".format(order_id),
             _build_market_job_data("order_id", order_id, market_retry_count),
+            entity_id=order_id,
         )
 
     # Programar expiracion automatica del mercado.
@@ -2230,260 +2146,652 @@ def publish_order_to_couriers(
     return len(courier_ids)
 
 
-def _send_next_offer(order_id, context):
-    """Envía la oferta al siguiente courier en la cola."""
-    order = get_order_by_id(order_id)
-    if not order or order["status"] not in ("PUBLISHED",):
-        return
+OFFER_COURIER_CONTEXT_TTL_SECONDS = 60
 
-    next_offer = get_next_pending_offer(order_id)
-    if not next_offer:
-        # No quedan couriers en la cola, intentar reiniciar ciclo
-        logger.info("_send_next_offer: pedido %s sin couriers pendientes; se intentara reiniciar el ciclo", order_id)
-        _try_restart_cycle(order_id, context)
-        return
 
-    _cancel_offer_retry_job(context, order_id)
-    mark_offer_as_offered(next_offer["queue_id"])
+class _OrderOfferContext:
+    """
+    Lo que necesita una oferta de pedido, armado una vez por ciclo: snapshot del pedido,
+    coordenadas de recogida, textos de zona/ganancia y teclado. Los datos por courier
+    (ubicacion y servicios activos) se cargan por lotes para toda la cola y se refrescan
+    cada OFFER_COURIER_CONTEXT_TTL_SECONDS. Renderizar una oferta no consulta la BD.
+    """
 
-    pickup_lat, pickup_lng = _get_pickup_coords(order)
+    def __init__(self, order, cycle_info):
+        self.order = dict(order)
+        self.overrides = _offer_context_overrides(cycle_info)
+        self.pickup_lat, self.pickup_lng = _get_pickup_coords(order)
+        self.head, self.body = _build_offer_text_parts(order, *self.overrides)
+        special_commission = int(order["special_commission"] or 0) if "special_commission" in order.keys() else 0
+        self.reply_markup = _offer_reply_markup(order["id"], special_commission=special_commission)
+        self.couriers = {}
+        self.detours = {}
+        self.couriers_loaded_at = None
+
+    def matches(self, order, cycle_info):
+        return self.order == dict(order) and self.overrides == _offer_context_overrides(cycle_info)
+
+    def load_couriers(self, courier_ids):
+        import time
+        self.couriers = get_offer_courier_contexts(courier_ids)
+        self.detours = _bulk_offer_detour_ratios(self.couriers, self.pickup_lat, self.pickup_lng)
+        self.couriers_loaded_at = time.monotonic()
+
+    def courier_context(self, courier_id, queue_courier_ids):
+        import time
+        stale = (
+            self.couriers_loaded_at is None
+            or time.monotonic() - self.couriers_loaded_at >= OFFER_COURIER_CONTEXT_TTL_SECONDS
+        )
+        if stale or courier_id not in self.couriers:
+            self.load_couriers([courier_id] + list(queue_courier_ids))
+        return self.couriers.get(courier_id)
+
+    def courier_distance_km(self, courier_ctx):
+        courier = courier_ctx["courier"] if courier_ctx else None
+        try:
+            if courier is not None:
+                c_lat = _row_value(courier, "live_lat") or _row_value(courier, "residence_lat")
+                c_lng = _row_value(courier, "live_lng") or _row_value(courier, "residence_lng")
+                if c_lat and c_lng and self.pickup_lat is not None and self.pickup_lng is not None:
+                    return haversine_km(float(c_lat), float(c_lng),
+                                        float(self.pickup_lat), float(self.pickup_lng))
+        except Exception:
+            pass
+        return None
 
-    # Calcular distancia y ETA del courier al punto de recogida
-    courier_dist_km = None
-    courier_data = None
-    try:
-        courier_data = get_courier_by_id(next_offer["courier_id"])
-        if courier_data:
-            c_lat = _row_value(courier_data, "live_lat") or _row_value(courier_data, "residence_lat")
-            c_lng = _row_value(courier_data, "live_lng") or _row_value(courier_data, "residence_lng")
-            if c_lat and c_lng and pickup_lat is not None and pickup_lng is not None:
-                courier_dist_km = haversine_km(float(c_lat), float(c_lng),
-                                               float(pickup_lat), float(pickup_lng))
-    except Exception:
-        pass
+    def render(self, courier_id, courier_ctx):
+        courier_dist_km = self.courier_distance_km(courier_ctx)
+        return (
+            "SERVICIO DISPONIBLE\n\n"
+            + self.head
+            + _offer_courier_distance_text(courier_dist_km)
+            + self.body
+            + _offer_detour_label(self.detours.get(courier_id))
+        )
 
-    cycle_info = context.bot_data.get("offer_cycles", {}).get(order_id, {}) or {}
 
-    # Cargar servicios activos del courier para mostrar desvio en la oferta
-    _courier_active_services = []
-    try:
-        _c_active_orders = get_active_orders_for_courier(next_offer["courier_id"])
-        _c_active_route = get_active_route_for_courier(next_offer["courier_id"])
-        _courier_active_services = list(_c_active_orders) + ([_c_active_route] if _c_active_route else [])
-    except Exception:
-        pass
+_order_offer_contexts = {}
 
-    offer_text = "SERVICIO DISPONIBLE\n\n" + _build_offer_text(
-        order,
-        courier_dist_km=courier_dist_km,
-        pickup_city_override=cycle_info.get("pickup_city"),
-        pickup_barrio_override=cycle_info.get("pickup_barrio"),
-        dropoff_city_override=cycle_info.get("dropoff_city"),
-        dropoff_barrio_override=cycle_info.get("dropoff_barrio"),
-        courier_id=next_offer["courier_id"],
-        courier=courier_data if courier_data else None,
-        active_services=_courier_active_services if _courier_active_services else None,
-    )
-    special_commission_offer = int(order["special_commission"] or 0) if "special_commission" in order.keys() else 0
-    reply_markup = _offer_reply_markup(order_id, special_commission=special_commission_offer)
 
+def _offer_context_overrides(cycle_info):
+    return (
+        cycle_info.get("pickup_city"),
+        cycle_info.get("pickup_barrio"),
+        cycle_info.get("dropoff_city"),
+        cycle_info.get("dropoff_barrio"),
+    )
+
+
+def _record_dispatch_event(entity_type, entity_id, event, cycle_info, courier_id=None,
+                           position=None, distance_km=None):
+    """Registra un paso del mercado en la analitica de despacho (nunca interrumpe el flujo)."""
+    cycle_info = cycle_info or {}
     try:
-        msg = context.bot.send_message(
-            chat_id=next_offer["telegram_id"],
-            text=offer_text,
-            reply_markup=reply_markup,
-        )
-        # Guardar message_id para poder editar al expirar
-        context.bot_data.setdefault("offer_messages", {})[order_id] = {
-            "chat_id": next_offer["telegram_id"],
-            "message_id": msg.message_id,
-        }
+        record_dispatch_event(
+            entity_type,
+            entity_id,
+            event,
+            courier_id=courier_id,
+            position=position,
+            distance_km=distance_km,
+            admin_id=cycle_info.get("admin_id"),
+            pickup_lat=cycle_info.get("pickup_lat"),
+            pickup_lng=cycle_info.get("pickup_lng"),
+        )
     except Exception as e:
-        logger.warning("No se pudo enviar oferta a courier %s: %s", next_offer["courier_id"], e)
-        mark_offer_response(next_offer["queue_id"], "EXPIRED")
-        _send_next_offer(order_id, context)
-        return
+        logger.warning("_record_dispatch_event %s %s %s: %s", entity_type, entity_id, event, e)
 
-    # Programar timeout de 30 segundos
-    context.job_queue.run_once(
-        _offer_timeout_job,
-        OFFER_TIMEOUT_SECONDS,
-        context=_build_market_job_data(
-            "order_id",
-            order_id,
-            _coerce_market_retry_count(cycle_info.get("market_retry_count")),
-            extra={"queue_id": next_offer["queue_id"]},
-        ),
-        name="offer_timeout_{}_{}".format(order_id, next_offer["queue_id"]),
-    )
 
+# ---------- NUCLEO DE DESPACHO (PEDIDOS Y RUTAS) ----------
 
 
-def _offer_timeout_job(context):
-    """Job ejecutado cuando expira el timeout de 30s para un courier."""
-    job_data = context.job.context
-    order_id = job_data["order_id"]
-    queue_id = job_data["queue_id"]
+class _ServiceDispatch:
+    """
+    Maquina de estados de ofertas comun a pedidos y rutas.
+
+    Un solo flujo para: enviar la siguiente oferta de la cola, vencerla por timeout,
+    registrar rechazo/ocupado, reiniciar el ciclo con candidatos frescos, reintentar
+    cuando no hay candidatos y, al agotar el ciclo, relanzar el mercado o cancelar.
+    Las subclases (_OrderDispatch, _RouteDispatch) solo aportan lo propio de cada
+    servicio: carga, cola, jobs, textos y notificaciones. Los hooks llaman a las
+    funciones del modulo por nombre en cada uso (los tests las parchean).
+
+    Cola, nombres de job y claves de bot_data siguen separados por servicio (ver
+    offer_queue.order_offer_store): son estado persistido que un cambio de nombre dejaria
+    huerfano tras un despliegue.
+    """
 
-    order = get_order_by_id(order_id)
-    if not order or order["status"] != "PUBLISHED":
-        return
+    entity_type = None
+    id_key = None
+    label = None
+    cycles_key = None
+    messages_key = None
+    timeout_job_name = None
+    expired_offer_text = None
+    # respuesta -> (texto si no es courier, texto de confirmacion)
+    response_texts = {}
+    # respuesta -> estado que queda en la cola
+    queue_statuses = {"REJECTED": "REJECTED", "BUSY": "BUSY"}
+    contexts = None
+    candidates = None
+
+    # ---- estado del ciclo en bot_data ----
+
+    def cycle_info(self, context, service_id):
+        return context.bot_data.get(self.cycles_key, {}).get(service_id)
+
+    def _drop_cycle(self, context, service_id):
+        context.bot_data.get(self.cycles_key, {}).pop(service_id, None)
+        context.bot_data.get(self.messages_key, {}).pop(service_id, None)
+
+    def _sync_retry_count(self, context, service_id, job_data):
+        cycle_info = self.cycle_info(context, service_id)
+        if cycle_info is not None:
+            retry_count = max(
+                _coerce_market_retry_count(cycle_info.get("market_retry_count")),
+                _coerce_market_retry_count(job_data.get("market_retry_count")),
+            )
+            if retry_count != cycle_info.get("market_retry_count"):
+                cycle_info["market_retry_count"] = retry_count
+                # Con estado compartido (SharedDispatchState) el ciclo leido es una copia.
+                context.bot_data[self.cycles_key][service_id] = cycle_info
+        return cycle_info
+
+    @staticmethod
+    def _is_published(service):
+        return bool(service) and service["status"] == "PUBLISHED"
+
+    def offer_context(self, service_id, service, context):
+        """Contexto de oferta del ciclo actual; se reconstruye si el servicio cambio (p.ej. incentivo)."""
+        cycles = context.bot_data.get(self.cycles_key, {})
+        cycle_info = cycles.get(service_id, {}) or {}
+        offer_ctx = self.contexts.get(service_id)
+        if offer_ctx is None or not offer_ctx.matches(service, cycle_info):
+            # Los contextos de ciclos que ya terminaron se descartan al crear uno nuevo.
+            live = set(cycles)
+            for stale_id in [sid for sid in self.contexts if sid not in live]:
+                self.contexts.pop(stale_id, None)
+            offer_ctx = self.new_offer_context(service_id, service, cycle_info)
+            self.contexts[service_id] = offer_ctx
+        return offer_ctx
+
+    # ---- candidatos ----
+
+    def _candidate_ids(self, service_id, admin_id, ally_id, pickup_lat, pickup_lng, requires_cash,
+                       cash_amount, distance_km, required_balance, excluded, team_admin_id=None):
+        """
+        Reglas duras de elegibilidad (get_eligible_couriers_for_order) y luego vinculo y
+        saldo re-evaluando solo los couriers que cambiaron (CandidateTracker del tipo), en
+        una consulta por lotes. Con team_admin_id solo quedan los couriers de ese admin.
+        Lo usan la publicacion y el reinicio del ciclo.
+        Retorna (courier_ids, elegibles, reevaluados).
+        """
+        excluded = {int(cid) for cid in (excluded or []) if cid}
+        eligible = get_eligible_couriers_for_order(
+            admin_id=admin_id,
+            ally_id=ally_id,
+            requires_cash=requires_cash,
+            cash_required_amount=cash_amount,
+            pickup_lat=pickup_lat,
+            pickup_lng=pickup_lng,
+            order_distance_km=distance_km,
+        )
+        courier_ids, evaluated = self.candidates.refresh(
+            service_id,
+            [c["courier_id"] for c in eligible if c["courier_id"] not in excluded],
+            required_balance,
+            admin_id=team_admin_id,
+        )
+        return courier_ids, len(eligible), evaluated
 
-    current = get_current_offer_for_order(order_id)
-    if not current or current["queue_id"] != queue_id:
-        return
+    # ---- despacho repartido ----
 
-    cycle_info = context.bot_data.get("offer_cycles", {}).get(order_id)
-    if cycle_info is not None:
-        cycle_info["market_retry_count"] = max(
-            _coerce_market_retry_count(cycle_info.get("market_retry_count")),
-            _coerce_market_retry_count(job_data.get("market_retry_count")),
+    def _forward(self, service_id, method, **args):
+        """Si el servicio es de otro proceso (dispatch_shards), le pasa la llamada. True si la paso."""
+        if owns_dispatch(service_id):
+            return False
+        forward_dispatch_command(service_id, "CALL", {
+            "entity": self.entity_type, "method": method, "id": service_id, "args": args,
+        })
+        return True
+
+    # ---- maquina de estados ----
+
+    def send_next(self, service_id, context):
+        """Envia la oferta al siguiente courier de la cola.
+
+        Si el envio falla, la oferta queda EXPIRED y se pasa al siguiente courier en el
+        mismo bucle, reutilizando el contexto de oferta ya armado. Con la cola agotada
+        se intenta reiniciar el ciclo.
+        """
+        if self._forward(service_id, "send_next"):
+            return
+        service = self.load(service_id)
+        if not self._is_published(service):
+            return
+        if not dispatch_fence_holds(service_id):
+            logger.warning("send_next: %s %s sin lease vigente de su shard; no se despacha", self.label, service_id)
+            return
+
+        cycle_info = self.cycle_info(context, service_id) or {}
+        offer_ctx = self.offer_context(service_id, service, context)
+
+        while True:
+            next_offer = self.next_pending(service_id)
+            if not next_offer:
+                logger.info(
+                    "send_next: %s %s sin couriers pendientes; se intentara reiniciar el ciclo",
+                    self.label,
+                    service_id,
+                )
+                self.restart(service_id, context)
+                return
+
+            self.cancel_retry_job(context, service_id)
+            self.mark_offered(next_offer["queue_id"])
+
+            try:
+                courier_ctx = offer_ctx.courier_context(
+                    next_offer["courier_id"],
+                    self.pending_courier_ids(service_id),
+                )
+            except Exception:
+                courier_ctx = None
+            offer_text = offer_ctx.render(next_offer["courier_id"], courier_ctx)
+
+            try:
+                msg = context.bot.send_message(
+                    chat_id=next_offer["telegram_id"],
+                    text=offer_text,
+                    reply_markup=offer_ctx.reply_markup,
+                )
+                # Guardar message_id para poder editar al expirar
+                context.bot_data.setdefault(self.messages_key, {})[service_id] = {
+                    "chat_id": next_offer["telegram_id"],
+                    "message_id": msg.message_id,
+                }
+                _record_dispatch_event(
+                    self.entity_type, service_id, "OFFERED", cycle_info,
+                    courier_id=next_offer["courier_id"],
+                    position=next_offer["position"],
+                    distance_km=offer_ctx.courier_distance_km(courier_ctx),
+                )
+                break
+            except Exception as e:
+                logger.warning(
+                    "No se pudo enviar oferta de %s %s a courier %s: %s",
+                    self.label,
+                    service_id,
+                    next_offer["courier_id"],
+                    e,
+                )
+                self.mark_response(next_offer["queue_id"], "EXPIRED")
+                _record_dispatch_event(
+                    self.entity_type, service_id, "EXPIRED", cycle_info,
+                    courier_id=next_offer["courier_id"],
+                )
+
+        _run_timer(
+            context,
+            self.timeout_job(),
+            self.timeout_seconds(),
+            self.timeout_job_name.format(service_id, next_offer["queue_id"]),
+            _build_market_job_data(
+                self.id_key,
+                service_id,
+                _coerce_market_retry_count(cycle_info.get("market_retry_count")),
+                extra={"queue_id": next_offer["queue_id"]},
+            ),
+            entity_id=service_id,
         )
 
-    _cancel_offer_jobs(context, order_id, queue_id)
-    mark_offer_response(queue_id, "EXPIRED")
+    def offer_timeout(self, context):
+        """Job del timeout de la oferta actual: la marca EXPIRED y pasa al siguiente."""
+        job_data = context.job.context
+        service_id = job_data[self.id_key]
+        queue_id = job_data["queue_id"]
 
-    # Editar mensaje del courier para indicar que expiró
-    msg_info = context.bot_data.get("offer_messages", {}).get(order_id)
-    if msg_info:
-        try:
-            context.bot.edit_message_text(
-                chat_id=msg_info["chat_id"],
-                message_id=msg_info["message_id"],
-                text="Oferta #{} expirada. No respondiste a tiempo.".format(order_id),
-            )
-        except Exception:
-            pass
+        if not self._is_published(self.load(service_id)):
+            return
+
+        current = self.current_offer(service_id)
+        if not current or current["queue_id"] != queue_id:
+            return
 
-    _send_next_offer(order_id, context)
+        cycle_info = self._sync_retry_count(context, service_id, job_data)
 
+        self.cancel_offer_jobs(context, service_id, queue_id)
+        self.mark_response(queue_id, "EXPIRED")
+        _record_dispatch_event(self.entity_type, service_id, "EXPIRED", cycle_info, courier_id=current["courier_id"])
 
-def _try_restart_cycle(order_id, context):
-    """Reinicia el ciclo re-consultando couriers elegibles actuales dentro del radio.
-    Captura repartidores que hayan entrado al radio desde el inicio del ciclo."""
-    cycle_info = context.bot_data.get("offer_cycles", {}).get(order_id)
-    if not cycle_info:
-        order = get_order_by_id(order_id)
-        if not order or order["status"] != "PUBLISHED":
-            logger.warning("_try_restart_cycle: pedido %s sin cycle_info y fuera de PUBLISHED", order_id)
+        # Editar mensaje del courier para indicar que expiro
+        msg_info = context.bot_data.get(self.messages_key, {}).get(service_id)
+        if msg_info:
+            try:
+                context.bot.edit_message_text(
+                    chat_id=msg_info["chat_id"],
+                    message_id=msg_info["message_id"],
+                    text=self.expired_offer_text.format(service_id),
+                )
+            except Exception:
+                pass
+
+        self.send(service_id, context)
+
+    def respond(self, update, context, service_id, response):
+        """Rechazo (REJECTED) u ocupado (BUSY) del courier con la oferta actual."""
+        query = update.callback_query
+        if not owns_dispatch(service_id):
+            message = query.message
+            forward_dispatch_command(service_id, "RESPOND", {
+                "entity": self.entity_type,
+                "id": service_id,
+                "response": response,
+                "user_id": update.effective_user.id,
+                "chat_id": message.chat_id,
+                "message_id": message.message_id,
+            })
+            return
+        if not self._is_published(self.load(service_id)):
+            query.edit_message_text("Esta oferta ya no esta disponible.")
             return
-        cycle_info = _build_recovered_order_cycle_info(order)
-        context.bot_data.setdefault("offer_cycles", {})[order_id] = cycle_info
-        logger.warning("_try_restart_cycle: pedido %s sin cycle_info; reconstruido desde BD", order_id)
 
-    import time
-    elapsed = time.time() - cycle_info["started_at"]
-    cycle_seconds = _get_order_market_cycle_seconds()
+        no_courier_text, done_text = self.response_texts[response]
+        courier = get_courier_by_telegram_id(update.effective_user.id)
+        if not courier:
+            query.edit_message_text(no_courier_text.format(service_id))
+            return
 
-    if elapsed >= cycle_seconds:
+        current = self.current_offer(service_id)
+        if not current or current["courier_id"] != courier["id"]:
+            query.edit_message_text("Esta oferta ya no esta disponible para ti.")
+            return
+
+        # Cancelar el job de timeout
+        self.cancel_offer_jobs(context, service_id, current["queue_id"])
+        self.mark_response(current["queue_id"], self.queue_statuses[response])
+        _record_dispatch_event(
+            self.entity_type, service_id, response,
+            self.cycle_info(context, service_id),
+            courier_id=courier["id"],
+        )
+        query.edit_message_text(done_text.format(service_id))
+
+        # Enviar al siguiente courier
+        self.send(service_id, context)
+
+    def restart_cycle(self, service_id, context):
+        """Reinicia el ciclo re-consultando couriers elegibles actuales dentro del radio.
+        Captura repartidores que hayan entrado al radio desde el inicio del ciclo."""
+        if self._forward(service_id, "restart_cycle"):
+            return
+        cycle_info = self.cycle_info(context, service_id)
+        if not cycle_info:
+            service = self.load(service_id)
+            if not self._is_published(service):
+                logger.warning("restart_cycle: %s %s sin cycle_info y fuera de PUBLISHED", self.label, service_id)
+                return
+            cycle_info = self.recovered_cycle_info(service)
+            context.bot_data.setdefault(self.cycles_key, {})[service_id] = cycle_info
+            logger.warning("restart_cycle: %s %s sin cycle_info; reconstruido desde BD", self.label, service_id)
+
+        import time
+        elapsed = time.time() - cycle_info["started_at"]
+        cycle_seconds = self.cycle_seconds()
+
+        if elapsed >= cycle_seconds:
+            logger.info(
+                "restart_cycle: %s %s elapsed=%.0fs supera max=%ss; se expirara",
+                self.label,
+                service_id,
+                elapsed,
+                cycle_seconds,
+            )
+            self.expire_now(service_id, cycle_info, context)
+            return
+
+        service = self.load(service_id)
+        if not self._is_published(service):
+            logger.warning("restart_cycle: %s %s ya no esta en PUBLISHED al recalcular", self.label, service_id)
+            return
+
+        excluded = cycle_info.get("excluded_couriers", set())
+        courier_ids, eligible_count, evaluated = self.candidate_ids(service_id, service, cycle_info, excluded)
         logger.info(
-            "_try_restart_cycle: pedido %s elapsed=%.0fs supera max=%ss; se expirara",
-            order_id,
+            "restart_cycle: %s %s elapsed=%.0fs eligible=%s excluded=%s reevaluados=%s relanzables=%s",
+            self.label,
+            service_id,
             elapsed,
-            cycle_seconds,
+            eligible_count,
+            len(excluded),
+            evaluated,
+            len(courier_ids),
         )
-        _expire_order(order_id, cycle_info, context)
-        return
-
-    admin_id = cycle_info["admin_id"]
-    ally_id = cycle_info["ally_id"]
-    order = get_order_by_id(order_id)
-    if not order or order["status"] != "PUBLISHED":
-        logger.warning("_try_restart_cycle: pedido %s ya no esta en PUBLISHED al recalcular", order_id)
-        return
-    p_lat = cycle_info.get("pickup_lat")
-    p_lng = cycle_info.get("pickup_lng")
-    requires_cash = cycle_info.get("requires_cash", False)
-    cash_amount = cycle_info.get("cash_amount", 0)
-    excluded = cycle_info.get("excluded_couriers", set())
 
-    fresh = get_eligible_couriers_for_order(
-        admin_id=admin_id,
-        ally_id=ally_id,
-        requires_cash=requires_cash,
-        cash_required_amount=cash_amount,
-        pickup_lat=p_lat,
-        pickup_lng=p_lng,
-        order_distance_km=cycle_info.get("order_distance_km"),
-    )
-    special_commission = int(order["special_commission"] or 0) if "special_commission" in order.keys() else 0
-    fee_cfg_pub = get_fee_config() if special_commission > 0 else None
-    courier_ids = []
-    for courier in fresh:
-        courier_id = courier["courier_id"]
-        if courier_id in excluded:
-            continue
-        courier_admin_id = get_approved_admin_id_for_courier(courier_id)
-        if courier_admin_id is None:
-            continue
-        if special_commission > 0:
-            ok, _ = check_special_commission_available(
-                courier_id, special_commission, fee_cfg_pub["fee_service_total"]
+        self.delete_queue(service_id)
+        if not courier_ids:
+            logger.info(
+                "restart_cycle: %s %s sigue activo sin couriers relanzables; reintentara en %ss",
+                self.label,
+                service_id,
+                self.retry_seconds(),
+            )
+            self.schedule_retry_job(
+                context,
+                service_id,
+                _coerce_market_retry_count(cycle_info.get("market_retry_count")),
             )
+            return
+
+        self.create_queue(service_id, courier_ids)
+        self.send(service_id, context)
+
+    def retry(self, context):
+        """Job de reintento: reactiva la siguiente oferta de un servicio PUBLISHED sin oferta activa."""
+        mark_job_executed(context.job.name)
+        data = context.job.context or {}
+        service_id = data.get(self.id_key)
+        if not service_id:
+            return
+
+        if not self._is_published(self.load(service_id)):
+            return
+
+        self._sync_retry_count(context, service_id, data)
+        if self.current_offer(service_id):
+            return
+
+        self.send(service_id, context)
+
+    def activate(self, service_id, context, cycle_info, courier_ids):
+        """Deja el servicio activo aunque temporalmente no haya couriers relanzables."""
+        if not owns_dispatch(service_id):
+            # El estado PUBLISHED queda ya (los jobs del mercado lo verifican al programarse);
+            # la cola y las ofertas las arma el duenio del shard.
+            self.set_published(service_id)
+            self._forward(service_id, "activate", cycle_info=cycle_info, courier_ids=list(courier_ids or []))
+            return
+        self.delete_queue(service_id)
+        if courier_ids:
+            self.create_queue(service_id, courier_ids)
+            self.cancel_retry_job(context, service_id)
         else:
-            ok, _ = check_service_fee_available(
-                target_type="COURIER",
-                target_id=courier_id,
-                admin_id=courier_admin_id,
+            logger.info(
+                "activate: %s %s activo sin couriers relanzables; reintentara en %ss",
+                self.label,
+                service_id,
+                self.retry_seconds(),
+            )
+            self.schedule_retry_job(
+                context,
+                service_id,
+                _coerce_market_retry_count(cycle_info.get("market_retry_count")),
             )
-        if ok:
-            courier_ids.append(courier_id)
-    logger.info(
-        "_try_restart_cycle: pedido %s elapsed=%.0fs fresh=%s excluded=%s relanzables=%s",
-        order_id,
-        elapsed,
-        len(fresh),
-        len(excluded),
-        len(courier_ids),
-    )
 
-    if not courier_ids:
-        delete_offer_queue(order_id)
-        logger.info(
-            "_try_restart_cycle: pedido %s sigue activo sin couriers relanzables; reintentara en %ss",
-            order_id,
-            OFFER_RETRY_SECONDS,
-        )
-        _schedule_offer_retry_job(
-            context,
-            order_id,
-            market_retry_count=_coerce_market_retry_count(cycle_info.get("market_retry_count")),
-        )
-        return
+        self.set_published(service_id)
+        context.bot_data.setdefault(self.cycles_key, {})[service_id] = cycle_info
 
-    delete_offer_queue(order_id)
-    create_offer_queue(order_id, courier_ids)
-    _send_next_offer(order_id, context)
+        if courier_ids:
+            self.send(service_id, context)
 
+    def expire(self, service_id, cycle_info, context):
+        """Reintenta el mercado y solo cancela al agotar los ciclos configurados."""
+        if self._forward(service_id, "expire", cycle_info=cycle_info):
+            return
+        service = self.load(service_id)
+        if not self._is_published(service):
+            return
 
-def _expire_order(order_id, cycle_info, context):
-    """Reintenta el mercado y solo cancela al agotar los ciclos configurados."""
-    order = get_order_by_id(order_id)
-    if not order or order["status"] != "PUBLISHED":
-        return
+        retry_limit = _get_market_retry_limit()
+        market_retry_count = _coerce_market_retry_count(cycle_info.get("market_retry_count"))
+        self.cancel_market_jobs(context, service_id)
+        current = self.current_offer(service_id)
+        if current:
+            self.cancel_offer_jobs(context, service_id, current["queue_id"])
+
+        if market_retry_count < retry_limit:
+            next_retry_count = market_retry_count + 1
+            logger.info(
+                "expire: %s %s agoto ciclo sin aceptacion; reintento de mercado %s/%s",
+                self.label,
+                service_id,
+                next_retry_count,
+                retry_limit,
+            )
+            self.delete_queue(service_id)
+            self._drop_cycle(context, service_id)
+            self.notify_market_retry(context, service, next_retry_count, retry_limit)
+            self.republish(service_id, service, context, next_retry_count)
+            return
 
-    retry_limit = _get_market_retry_limit()
-    market_retry_count = _coerce_market_retry_count(cycle_info.get("market_retry_count"))
-    if market_retry_count < retry_limit:
-        next_retry_count = market_retry_count + 1
         logger.info(
-            "_expire_order: pedido %s agotó ciclo sin aceptacion; reintento de mercado %s/%s",
-            order_id,
-            next_retry_count,
+            "expire: %s %s en PUBLISHED sera cancelado sin cargo tras %s reintentos de mercado",
+            self.label,
+            service_id,
             retry_limit,
         )
+        self.cancel_service(service_id)
+        self.delete_queue(service_id)
+        self._drop_cycle(context, service_id)
+        # Sin cobro: si nadie toma el servicio, no se cobra al aliado
+        self.notify_expired(context, service_id, service, cycle_info, retry_limit)
+
+
+class _OrderDispatch(_ServiceDispatch):
+    entity_type = "ORDER"
+    id_key = "order_id"
+    label = "pedido"
+    cycles_key = "offer_cycles"
+    messages_key = "offer_messages"
+    timeout_job_name = "offer_timeout_{}_{}"
+    expired_offer_text = "Oferta #{} expirada. No respondiste a tiempo."
+    response_texts = {
+        "REJECTED": ("Oferta #{} rechazada.", "Oferta #{} rechazada."),
+        "BUSY": (
+            "Oferta #{} marcada como ocupado.",
+            "Oferta #{} marcada como ocupado. Se asignara a otro repartidor.",
+        ),
+    }
+    # Ocupado se registra como REJECTED para mantener el flujo actual de cola y reinicio.
+    queue_statuses = {"REJECTED": "REJECTED", "BUSY": "REJECTED"}
+    contexts = _order_offer_contexts
+    candidates = order_candidates
 
+    def load(self, order_id):
+        return get_order_by_id(order_id)
+
+    def recovered_cycle_info(self, order):
+        return _build_recovered_order_cycle_info(order)
+
+    def new_offer_context(self, order_id, order, cycle_info):
+        return _OrderOfferContext(order, cycle_info)
+
+    def cycle_seconds(self):
+        return _get_order_market_cycle_seconds()
+
+    def timeout_seconds(self):
+        return OFFER_TIMEOUT_SECONDS
+
+    def retry_seconds(self):
+        return OFFER_RETRY_SECONDS
+
+    def timeout_job(self):
+        return _offer_timeout_job
+
+    def next_pending(self, order_id):
+        return get_next_pending_offer(order_id)
+
+    def pending_courier_ids(self, order_id):
+        return order_offer_store.pending_courier_ids(order_id)
+
+    def current_offer(self, order_id):
+        return get_current_offer_for_order(order_id)
+
+    def mark_offered(self, queue_id):
+        mark_offer_as_offered(queue_id)
+
+    def mark_response(self, queue_id, response):
+        mark_offer_response(queue_id, response)
+
+    def create_queue(self, order_id, courier_ids):
+        create_offer_queue(order_id, courier_ids)
+
+    def delete_queue(self, order_id):
+        delete_offer_queue(order_id)
+
+    def set_published(self, order_id):
+        set_order_status(order_id, "PUBLISHED", "published_at")
+
+    def cancel_offer_jobs(self, context, order_id, queue_id):
+        _cancel_offer_jobs(context, order_id, queue_id)
+
+    def cancel_retry_job(self, context, order_id):
+        _cancel_offer_retry_job(context, order_id)
+
+    def schedule_retry_job(self, context, order_id, market_retry_count):
+        _schedule_offer_retry_job(context, order_id, market_retry_count=market_retry_count)
+
+    def cancel_market_jobs(self, context, order_id):
         _cancel_no_response_job(context, order_id)
         _cancel_order_expire_job(context, order_id)
         _cancel_offer_retry_job(context, order_id)
-        current = get_current_offer_for_order(order_id)
-        if current:
-            _cancel_offer_jobs(context, order_id, current["queue_id"])
-        delete_offer_queue(order_id)
-        context.bot_data.get("offer_cycles", {}).pop(order_id, None)
-        context.bot_data.get("offer_messages", {}).pop(order_id, None)
 
-        _notify_order_market_retry(context, order, next_retry_count, retry_limit)
+    def send(self, order_id, context):
+        _send_next_offer(order_id, context)
+
+    def restart(self, order_id, context):
+        _try_restart_cycle(order_id, context)
+
+    def expire_now(self, order_id, cycle_info, context):
+        _expire_order(order_id, cycle_info, context)
+
+    def candidate_ids(self, order_id, order, cycle_info, excluded):
+        special_commission = int(order["special_commission"] or 0) if "special_commission" in order.keys() else 0
+        # Mismo umbral que check_service_fee_available / check_special_commission_available:
+        # el courier debe cubrir el fee estandar mas la comision especial del pedido.
+        required_balance = get_fee_config()["fee_service_total"] + max(special_commission, 0)
+        # team_only: pedidos especiales que el admin ofrece solo a su equipo.
+        team_only = int(order["team_only"] or 0) if "team_only" in order.keys() else 0
+        admin_id = cycle_info["admin_id"]
+        return self._candidate_ids(
+            order_id,
+            admin_id,
+            cycle_info["ally_id"],
+            cycle_info.get("pickup_lat"),
+            cycle_info.get("pickup_lng"),
+            cycle_info.get("requires_cash", False),
+            cycle_info.get("cash_amount", 0),
+            cycle_info.get("order_distance_km"),
+            required_balance,
+            excluded,
+            team_admin_id=admin_id if team_only and admin_id else None,
+        )
+
+    def notify_market_retry(self, context, order, retry_count, retry_limit):
+        _notify_order_market_retry(context, order, retry_count, retry_limit)
+
+    def republish(self, order_id, order, context, market_retry_count):
         creator_admin_id = _row_value(order, "creator_admin_id")
         publish_order_to_couriers(
             order_id=order_id,
@@ -2492,50 +2800,32 @@ def _expire_order(order_id, cycle_info, context):
             admin_id_override=int(creator_admin_id) if creator_admin_id else None,
             skip_fee_check=True,
             reset_expire_window=True,
-            market_retry_count=next_retry_count,
+            market_retry_count=market_retry_count,
             schedule_no_response=False,
         )
-        return
 
-    logger.info(
-        "_expire_order: pedido %s en PUBLISHED sera cancelado sin cargo tras %s reintentos de mercado",
-        order_id,
-        retry_limit,
-    )
-
-    _cancel_no_response_job(context, order_id)
-    _cancel_order_expire_job(context, order_id)
-    _cancel_offer_retry_job(context, order_id)
-    current = get_current_offer_for_order(order_id)
-    if current:
-        _cancel_offer_jobs(context, order_id, current["queue_id"])
-
-    cancel_order(order_id, "SYSTEM")
-    delete_offer_queue(order_id)
+    def cancel_service(self, order_id):
+        cancel_order(order_id, "SYSTEM")
 
-    # Limpiar bot_data
-    context.bot_data.get("offer_cycles", {}).pop(order_id, None)
-    context.bot_data.get("offer_messages", {}).pop(order_id, None)
-
-    ally_id = cycle_info["ally_id"]
+    def notify_expired(self, context, order_id, order, cycle_info, retry_limit):
+        ally_id = cycle_info["ally_id"]
+        if ally_id is not None:
+            try:
+                ally = get_ally_by_id(ally_id)
+                if ally:
+                    ally_user = get_user_by_id(ally["user_id"])
+                    if ally_user and ally_user["telegram_id"]:
+                        context.bot.send_message(
+                            chat_id=ally_user["telegram_id"],
+                            text=(
+                                "El pedido #{} no fue tomado por ningun repartidor despues de {} reintentos del mercado y fue cancelado automaticamente.\n"
+                                "No se aplico ningun cargo."
+                            ).format(order_id, retry_limit),
+                        )
+            except Exception as e:
+                logger.warning("No se pudo notificar expiracion al aliado: %s", e)
+            return
 
-    # Notificar sin cobro: si nadie toma el servicio, no se cobra al aliado
-    if ally_id is not None:
-        try:
-            ally = get_ally_by_id(ally_id)
-            if ally:
-                ally_user = get_user_by_id(ally["user_id"])
-                if ally_user and ally_user["telegram_id"]:
-                    context.bot.send_message(
-                        chat_id=ally_user["telegram_id"],
-                        text=(
-                            "El pedido #{} no fue tomado por ningun repartidor despues de {} reintentos del mercado y fue cancelado automaticamente.\n"
-                            "No se aplico ningun cargo."
-                        ).format(order_id, retry_limit),
-                    )
-        except Exception as e:
-            logger.warning("No se pudo notificar expiracion al aliado: %s", e)
-    else:
         # Notificar al admin creador (pedido especial)
         try:
             creator_admin_id = _row_value(order, "creator_admin_id")
@@ -2555,6 +2845,29 @@ def _expire_order(order_id, cycle_info, context):
             logger.warning("No se pudo notificar expiración al admin creador: %s", e)
 
 
+_ORDER_DISPATCH = _OrderDispatch()
+
+
+def _send_next_offer(order_id, context):
+    """Envía la oferta al siguiente courier en la cola (ver _ServiceDispatch.send_next)."""
+    _ORDER_DISPATCH.send_next(order_id, context)
+
+
+def _offer_timeout_job(context):
+    """Job ejecutado cuando expira el timeout de 30s para un courier."""
+    _ORDER_DISPATCH.offer_timeout(context)
+
+
+def _try_restart_cycle(order_id, context):
+    """Reinicia el ciclo del pedido con los couriers elegibles actuales."""
+    _ORDER_DISPATCH.restart_cycle(order_id, context)
+
+
+def _expire_order(order_id, cycle_info, context):
+    """Reintenta el mercado y solo cancela al agotar los ciclos configurados."""
+    _ORDER_DISPATCH.expire(order_id, cycle_info, context)
+
+
 _DIAS_ES = ["Lun", "Mar", "Mie", "Jue", "Vie", "Sab", "Dom"]
 _MESES_ES = ["ene", "feb", "mar", "abr", "may", "jun", "jul", "ago", "sep", "oct", "nov", "dic"]
 
@@ -2611,104 +2924,107 @@ def _ally_history_period_keyboard():
     ])
 
 
-def _ally_history_flat_text(orders, routes, label):
-    """Genera un bloque de texto con todos los pedidos/rutas del periodo (para Hoy/Ayer)."""
-    delivered_orders = [o for o in orders if _row_value(o, "status", "") == "DELIVERED"]
-    cancelled_orders = [o for o in orders if _row_value(o, "status", "") == "CANCELLED"]
-    delivered_routes = [r for r in routes if r["status"] == "DELIVERED"]
-    cancelled_routes = [r for r in routes if r["status"] == "CANCELLED"]
+_HISTORY_STATUS_LABELS = {"DELIVERED": "Entregado", "CANCELLED": "Cancelado"}
 
-    total = len(orders) + len(routes)
-    total_delivered = len(delivered_orders) + len(delivered_routes)
-    total_cancelled = len(cancelled_orders) + len(cancelled_routes)
-    total_pesos = sum(int(_row_value(o, "total_fee", 0) or 0) for o in delivered_orders)
-    total_pesos += sum(int(r["total_fee"] or 0) for r in delivered_routes)
+# Periodo padre con una letra en callback_data (Telegram admite 64 bytes)
+_HISTORY_PERIOD_CODES = {"hoy": "h", "ayer": "a", "semana": "s", "mes": "m"}
+_HISTORY_PERIODS_BY_CODE = {code: period for period, code in _HISTORY_PERIOD_CODES.items()}
 
-    STATUS_LABELS = {"DELIVERED": "Entregado", "CANCELLED": "Cancelado"}
+_HISTORY_TITLES = {"ally": "Historial", "admin": "Mis pedidos especiales"}
+_HISTORY_FEE_LABELS = {"ally": "Total domicilios entregados", "admin": "Total tarifas cobradas"}
+
+
+def _history_header_lines(scope, label, day_totals):
+    """Encabezado del historial con los totales del periodo (los dias ya vienen agregados de la BD)."""
     lines = [
-        "Historial — {} ({} pedidos)".format(label, total),
-        "Entregados: {} | Cancelados: {}".format(total_delivered, total_cancelled),
-        "Total domicilios entregados: {}".format(_fmt_pesos_ally(total_pesos)),
-        "",
+        "{} — {} ({} pedidos)".format(_HISTORY_TITLES[scope], label, sum(d["total"] for d in day_totals)),
+        "Entregados: {} | Cancelados: {}".format(
+            sum(d["delivered"] for d in day_totals), sum(d["cancelled"] for d in day_totals),
+        ),
+        "{}: {}".format(_HISTORY_FEE_LABELS[scope], _fmt_pesos_ally(sum(d["pesos"] for d in day_totals))),
     ]
+    commission = sum(d["commission"] for d in day_totals)
+    if scope == "admin" and commission > 0:
+        lines.append("Total comisiones: {}".format(_fmt_pesos_ally(commission)))
+    return lines
 
-    all_items = []
-    for o in orders:
-        created = str(_row_value(o, "created_at", "") or "")
-        hour = created[11:16] if len(created) >= 16 else "--:--"
-        status = _row_value(o, "status", "") or ""
-        fee = int(_row_value(o, "total_fee", 0) or 0)
-        name = _row_value(o, "customer_name", "N/A") or "N/A"
-        all_items.append((created, "#{} {} — {} — {} — {}".format(
-            _row_value(o, "id", "?"),
-            hour,
-            name,
-            _fmt_pesos_ally(fee),
-            STATUS_LABELS.get(status, status),
-        )))
-    for r in routes:
-        created = str(r["created_at"] or "")
-        hour = created[11:16] if len(created) >= 16 else "--:--"
-        status = r["status"] or ""
-        fee = int(r["total_fee"] or 0)
-        all_items.append((created, "Ruta #{} {} — {} — {}".format(
-            r["id"], hour, _fmt_pesos_ally(fee), STATUS_LABELS.get(status, status),
-        )))
-
-    all_items.sort(key=lambda x: x[0], reverse=True)
-    for _, line in all_items:
-        lines.append(line)
 
-    return "\n".join(lines)
+def _history_item_line(scope, item):
+    """Una linea del detalle del historial (pedido o ruta)."""
+    created = str(item.get("created_at") or "")
+    hour = created[11:16] if len(created) >= 16 else "--:--"
+    status = _HISTORY_STATUS_LABELS.get(item.get("status"), item.get("status") or "")
+    fee = _fmt_pesos_ally(item.get("total_fee"))
+    if item.get("kind") == HISTORY_KIND_ROUTE:
+        return "Ruta #{} {} — {} — {}".format(item["id"], hour, fee, status)
+    name = item.get("customer_name") or "N/A"
+    if scope == "admin":
+        commission = int(item.get("special_commission") or 0)
+        commission_str = " (+comision ${:,})".format(commission) if commission > 0 else ""
+        return "#{} {} — {} — {}{}  [{}]".format(item["id"], hour, name, fee, commission_str, status)
+    return "#{} {} — {} — {} — {}".format(item["id"], hour, name, fee, status)
 
 
-def _ally_history_grouped_text(orders, routes, label):
+def _history_day_view(scope, owner_id, date_key, label, page_callback, cursor=None, direction="older"):
     """
-    Genera texto agrupado por dia para Esta semana / Este mes.
-    Retorna (text, lista_de_date_keys_en_orden_desc).
+    Totales del dia y una pagina del detalle (HISTORY_PAGE_SIZE filas).
+    page_callback(direccion, cursor) arma el callback_data de Anteriores / Mas recientes.
+    Retorna (texto, filas de botones de navegacion).
     """
-    days = {}
-    for o in orders:
-        created = str(_row_value(o, "created_at", "") or "")
-        dk = created[:10] if len(created) >= 10 else "-"
-        d = days.setdefault(dk, {"total": 0, "delivered": 0, "cancelled": 0, "pesos": 0})
-        d["total"] += 1
-        if _row_value(o, "status", "") == "DELIVERED":
-            d["delivered"] += 1
-            d["pesos"] += int(_row_value(o, "total_fee", 0) or 0)
-        else:
-            d["cancelled"] += 1
-    for r in routes:
-        created = str(r["created_at"] or "")
-        dk = created[:10] if len(created) >= 10 else "-"
-        d = days.setdefault(dk, {"total": 0, "delivered": 0, "cancelled": 0, "pesos": 0})
-        d["total"] += 1
-        if r["status"] == "DELIVERED":
-            d["delivered"] += 1
-            d["pesos"] += int(r["total_fee"] or 0)
-        else:
-            d["cancelled"] += 1
-
-    grand_total = sum(d["total"] for d in days.values())
-    grand_delivered = sum(d["delivered"] for d in days.values())
-    grand_cancelled = sum(d["cancelled"] for d in days.values())
-    grand_pesos = sum(d["pesos"] for d in days.values())
+    day = datetime.strptime(date_key, "%Y-%m-%d")
+    start_s = day.strftime("%Y-%m-%d 00:00:00")
+    end_s = (day + timedelta(days=1)).strftime("%Y-%m-%d 00:00:00")
+    day_totals = get_history_day_totals(scope, owner_id, start_s, end_s)
+    if not day_totals:
+        return "{} — {}\nNo hay pedidos en este periodo.".format(_HISTORY_TITLES[scope], label), []
+
+    page = get_history_page(scope, owner_id, start_s, end_s, cursor=cursor, direction=direction)
+    lines = _history_header_lines(scope, label, day_totals) + [""]
+    lines.extend(_history_item_line(scope, item) for item in page["items"])
+    nav = []
+    if page["items"] and page["has_newer"]:
+        nav.append(InlineKeyboardButton("« Mas recientes", callback_data=page_callback("n", page["items"][0]["cursor"])))
+    if page["items"] and page["has_older"]:
+        nav.append(InlineKeyboardButton("Anteriores »", callback_data=page_callback("o", page["items"][-1]["cursor"])))
+    return "\n".join(lines), ([nav] if nav else [])
+
+
+def _history_period_view(scope, owner_id, start_s, end_s, label, day_callback):
+    """
+    Semana/mes: totales por dia calculados en la BD y un boton por dia.
+    Retorna (texto, filas de botones); texto None si no hay pedidos.
+    """
+    day_totals = get_history_day_totals(scope, owner_id, start_s, end_s)
+    if not day_totals:
+        return None, []
+    lines = _history_header_lines(scope, label, day_totals) + ["", "Toca un dia para ver el detalle:"]
+    rows = []
+    for d in day_totals:
+        lines.append("{} — {} pedidos — {}".format(_fmt_date_es(d["day"]), d["total"], _fmt_pesos_ally(d["pesos"])))
+        rows.append([InlineKeyboardButton(_fmt_date_es(d["day"]), callback_data=day_callback(d["day"].replace("-", "")))])
+    return "\n".join(lines), rows
+
+
+def _history_page_request(data, prefix):
+    """
+    Parsea {prefix}{periodo padre}_{n|o}_{cursor}[_{admin_id}].
+    Retorna (periodo padre, fecha YYYY-MM-DD, cursor, direccion, admin_id) o None.
+    La fecha sale del cursor: la pagina siempre es de un solo dia.
+    """
+    match = re.fullmatch(re.escape(prefix) + r"([hasm])_([no])_(\d{14,20}[or]\d+)(?:_(\d+))?", data)
+    if not match:
+        return None
+    cursor = match.group(3)
+    date_key = "{}-{}-{}".format(cursor[:4], cursor[4:6], cursor[6:8])
+    direction = "newer" if match.group(2) == "n" else "older"
+    admin_id = int(match.group(4)) if match.group(4) else None
+    return _HISTORY_PERIODS_BY_CODE[match.group(1)], date_key, cursor, direction, admin_id
 
-    lines = [
-        "Historial — {} ({} pedidos)".format(label, grand_total),
-        "Entregados: {} | Cancelados: {}".format(grand_delivered, grand_cancelled),
-        "Total domicilios entregados: {}".format(_fmt_pesos_ally(grand_pesos)),
-        "",
-        "Toca un dia para ver el detalle:",
-    ]
-    sorted_keys = sorted(days.keys(), reverse=True)
-    for dk in sorted_keys:
-        d = days[dk]
-        lines.append("{} — {} pedidos — {}".format(
-            _fmt_date_es(dk), d["total"], _fmt_pesos_ally(d["pesos"])
-        ))
 
-    return "\n".join(lines), sorted_keys
+def _history_day_label(date_key, parent_period):
+    if parent_period in ("hoy", "ayer"):
+        return _ally_period_range(parent_period)[2]
+    return _fmt_date_es(date_key)
 
 
 def ally_active_orders(update, context):
@@ -2818,6 +3134,7 @@ def ally_active_orders(update, context):
 def ally_orders_history_callback(update, context):
     """Callback para navegacion del historial de pedidos del aliado por periodo.
     Patrones: allyhist_periodo_{period} | allyhist_dia_{YYYYMMDD}_{period}
+              | allyhist_pg_{h|a|s|m}_{n|o}_{cursor} (pagina anterior/siguiente de un dia)
     """
     query = update.callback_query
     query.answer()
@@ -2851,6 +3168,15 @@ def ally_orders_history_callback(update, context):
             query.edit_message_text("Fecha invalida.", reply_markup=_ally_history_period_keyboard())
         return
 
+    if data.startswith("allyhist_pg_"):
+        page_request = _history_page_request(data, "allyhist_pg_")
+        if not page_request:
+            query.edit_message_text("Pagina invalida.", reply_markup=_ally_history_period_keyboard())
+            return
+        parent, date_key, cursor, direction, _ = page_request
+        _ally_show_day(query, ally["id"], date_key, parent, cursor=cursor, direction=direction)
+        return
+
     query.edit_message_text(
         "Historial de pedidos\nSelecciona un periodo:",
         reply_markup=_ally_history_period_keyboard(),
@@ -2864,51 +3190,43 @@ def _ally_show_period(query, ally_id, period):
         query.edit_message_text("Periodo invalido.", reply_markup=_ally_history_period_keyboard())
         return
 
-    orders = get_ally_orders_between(ally_id, start_s, end_s)
-    routes = get_ally_routes_between(ally_id, start_s, end_s)
+    if period in ("hoy", "ayer"):
+        _ally_show_day(query, ally_id, start_s[:10], period)
+        return
 
-    if not orders and not routes:
+    text, day_buttons = _history_period_view(
+        "ally", ally_id, start_s, end_s, label,
+        lambda compact: "allyhist_dia_{}_{}".format(compact, period),
+    )
+    if text is None:
         query.edit_message_text(
             "Historial — {}\nNo hay pedidos en este periodo.".format(label),
             reply_markup=_ally_history_period_keyboard(),
         )
         return
-
-    if period in ("hoy", "ayer"):
-        text = _ally_history_flat_text(orders, routes, label)
-        query.edit_message_text(text, reply_markup=_ally_history_period_keyboard())
-    else:
-        text, sorted_keys = _ally_history_grouped_text(orders, routes, label)
-        day_buttons = []
-        for dk in sorted_keys:
-            compact = dk.replace("-", "")
-            day_buttons.append([InlineKeyboardButton(
-                _fmt_date_es(dk),
-                callback_data="allyhist_dia_{}_{}".format(compact, period),
-            )])
-        full_kb = InlineKeyboardMarkup(day_buttons + _ally_history_period_keyboard().inline_keyboard)
-        query.edit_message_text(text, reply_markup=full_kb)
+    full_kb = InlineKeyboardMarkup(day_buttons + _ally_history_period_keyboard().inline_keyboard)
+    query.edit_message_text(text, reply_markup=full_kb)
 
 
-def _ally_show_day(query, ally_id, date_key, parent_period):
-    """Muestra detalle de un dia especifico del historial del aliado."""
+def _ally_show_day(query, ally_id, date_key, parent_period, cursor=None, direction="older"):
+    """Muestra una pagina del detalle de un dia del historial del aliado."""
     try:
-        dt = datetime.strptime(date_key, "%Y-%m-%d")
+        datetime.strptime(date_key, "%Y-%m-%d")
     except ValueError:
         query.edit_message_text("Fecha invalida.", reply_markup=_ally_history_period_keyboard())
         return
 
-    start_s = dt.strftime("%Y-%m-%d 00:00:00")
-    end_s = (dt + timedelta(days=1)).strftime("%Y-%m-%d 00:00:00")
-    orders = get_ally_orders_between(ally_id, start_s, end_s)
-    routes = get_ally_routes_between(ally_id, start_s, end_s)
-
-    text = _ally_history_flat_text(orders, routes, _fmt_date_es(date_key))
-    back_label = "Volver a semana" if parent_period == "semana" else "Volver a mes"
-    full_kb = InlineKeyboardMarkup(
-        [[InlineKeyboardButton(back_label, callback_data="allyhist_periodo_{}".format(parent_period))]]
-        + _ally_history_period_keyboard().inline_keyboard
+    code = _HISTORY_PERIOD_CODES.get(parent_period, "s")
+    text, nav_rows = _history_day_view(
+        "ally", ally_id, date_key, _history_day_label(date_key, parent_period),
+        lambda nav, page_cursor: "allyhist_pg_{}_{}_{}".format(code, nav, page_cursor),
+        cursor=cursor, direction=direction,
     )
+    back_rows = []
+    if parent_period in ("semana", "mes"):
+        back_label = "Volver a semana" if parent_period == "semana" else "Volver a mes"
+        back_rows = [[InlineKeyboardButton(back_label, callback_data="allyhist_periodo_{}".format(parent_period))]]
+    full_kb = InlineKeyboardMarkup(nav_rows + back_rows + _ally_history_period_keyboard().inline_keyboard)
     query.edit_message_text(text, reply_markup=full_kb)
 
 
@@ -2929,82 +3247,6 @@ def _admin_history_period_keyboard(admin_id=None):
     ])
 
 
-def _admin_history_flat_text(orders, label):
-    """Texto plano de pedidos especiales del admin para Hoy/Ayer."""
-    delivered = [o for o in orders if _row_value(o, "status", "") == "DELIVERED"]
-    cancelled = [o for o in orders if _row_value(o, "status", "") == "CANCELLED"]
-
-    total_fee = sum(int(_row_value(o, "total_fee", 0) or 0) for o in delivered)
-    total_commission = sum(
-        int(_row_value(o, "special_commission", 0) or 0) for o in delivered
-    )
-
-    STATUS_LABELS = {"DELIVERED": "Entregado", "CANCELLED": "Cancelado"}
-    lines = [
-        "Mis pedidos especiales — {} ({} pedidos)".format(label, len(orders)),
-        "Entregados: {} | Cancelados: {}".format(len(delivered), len(cancelled)),
-        "Total tarifas cobradas: {}".format(_fmt_pesos_ally(total_fee)),
-    ]
-    if total_commission > 0:
-        lines.append("Total comisiones: {}".format(_fmt_pesos_ally(total_commission)))
-    lines.append("")
-
-    items = []
-    for o in orders:
-        created = str(_row_value(o, "created_at", "") or "")
-        hour = created[11:16] if len(created) >= 16 else "--:--"
-        status = _row_value(o, "status", "") or ""
-        fee = int(_row_value(o, "total_fee", 0) or 0)
-        commission = int(_row_value(o, "special_commission", 0) or 0)
-        name = _row_value(o, "customer_name", "N/A") or "N/A"
-        commission_str = " (+comision ${:,})".format(commission) if commission > 0 else ""
-        items.append((created, "#{} {} — {} — {}{}  [{}]".format(
-            _row_value(o, "id", "?"), hour, name,
-            _fmt_pesos_ally(fee), commission_str,
-            STATUS_LABELS.get(status, status),
-        )))
-    items.sort(key=lambda x: x[0], reverse=True)
-    for _, line in items:
-        lines.append(line)
-
-    return "\n".join(lines)
-
-
-def _admin_history_grouped_text(orders, label):
-    """Texto agrupado por dia para semana/mes. Retorna (text, sorted_day_keys)."""
-    days = {}
-    for o in orders:
-        created = str(_row_value(o, "created_at", "") or "")
-        dk = created[:10] if len(created) >= 10 else "-"
-        d = days.setdefault(dk, {"total": 0, "delivered": 0, "cancelled": 0, "pesos": 0})
-        d["total"] += 1
-        if _row_value(o, "status", "") == "DELIVERED":
-            d["delivered"] += 1
-            d["pesos"] += int(_row_value(o, "total_fee", 0) or 0)
-        else:
-            d["cancelled"] += 1
-
-    grand_total = sum(d["total"] for d in days.values())
-    grand_delivered = sum(d["delivered"] for d in days.values())
-    grand_cancelled = sum(d["cancelled"] for d in days.values())
-    grand_pesos = sum(d["pesos"] for d in days.values())
-
-    lines = [
-        "Mis pedidos especiales — {} ({} pedidos)".format(label, grand_total),
-        "Entregados: {} | Cancelados: {}".format(grand_delivered, grand_cancelled),
-        "Total tarifas: {}".format(_fmt_pesos_ally(grand_pesos)),
-        "",
-        "Toca un dia para ver el detalle:",
-    ]
-    sorted_keys = sorted(days.keys(), reverse=True)
-    for dk in sorted_keys:
-        d = days[dk]
-        lines.append("{} — {} pedidos — {}".format(
-            _fmt_date_es(dk), d["total"], _fmt_pesos_ally(d["pesos"])
-        ))
-    return "\n".join(lines), sorted_keys
-
-
 def _admin_show_special_recent(query, admin_id, nav_admin_id=None):
     """Muestra los ultimos 15 pedidos especiales del admin (todos los estados)."""
     nav_admin_id = nav_admin_id or admin_id
@@ -3048,9 +3290,31 @@ def _admin_show_special_recent(query, admin_id, nav_admin_id=None):
     query.edit_message_text("\n".join(lines), reply_markup=full_kb)
 
 
+def _resolve_history_admin(query, telegram_id, selected_admin_id):
+    """Admin dueno del historial o None (ya respondio el mensaje de error)."""
+    admin = resolve_owned_admin_actor(
+        telegram_id,
+        selected_admin_id=selected_admin_id,
+        prefer_platform=False,
+        legacy_counter_key="admin_history_legacy_callback_count",
+        invalid_counter_key="admin_history_invalid_selected_count",
+    )
+    if selected_admin_id is not None and not admin:
+        query.edit_message_text(
+            "No se pudo validar este historial.\n\n"
+            "Vuelve a abrir Mi admin y entra de nuevo desde el boton actualizado."
+        )
+        return None
+    if not admin:
+        query.edit_message_text("No tienes perfil de administrador.")
+        return None
+    return admin
+
+
 def admin_special_orders_history_callback(update, context):
     """Callback historial de pedidos especiales del admin.
     Patrones: adminhist_periodo_{period} | adminhist_dia_{YYYYMMDD}_{period} | adminhist_periodo_recientes
+              | adminhist_pg_{h|a|s|m}_{n|o}_{cursor}_{admin_id} (pagina anterior/siguiente de un dia)
     """
     query = update.callback_query
     query.answer()
@@ -3062,24 +3326,9 @@ def admin_special_orders_history_callback(update, context):
         if not match:
             query.edit_message_text("Periodo invalido.", reply_markup=_admin_history_period_keyboard())
             return
-        selected_admin_id = int(match.group(1)) if match.group(1) else None
-        admin = resolve_owned_admin_actor(
-            telegram_id,
-            selected_admin_id=selected_admin_id,
-            prefer_platform=False,
-            legacy_counter_key="admin_history_legacy_callback_count",
-            invalid_counter_key="admin_history_invalid_selected_count",
-        )
-        if selected_admin_id is not None and not admin:
-            query.edit_message_text(
-                "No se pudo validar este historial.\n\n"
-                "Vuelve a abrir Mi admin y entra de nuevo desde el boton actualizado."
-            )
-            return
-        if not admin:
-            query.edit_message_text("No tienes perfil de administrador.")
-            return
-        _admin_show_special_recent(query, admin["id"], nav_admin_id=admin["id"])
+        admin = _resolve_history_admin(query, telegram_id, int(match.group(1)) if match.group(1) else None)
+        if admin:
+            _admin_show_special_recent(query, admin["id"], nav_admin_id=admin["id"])
         return
 
     if data.startswith("adminhist_periodo_"):
@@ -3087,25 +3336,9 @@ def admin_special_orders_history_callback(update, context):
         if not match:
             query.edit_message_text("Periodo invalido.", reply_markup=_admin_history_period_keyboard())
             return
-        period = match.group(1)
-        selected_admin_id = int(match.group(2)) if match.group(2) else None
-        admin = resolve_owned_admin_actor(
-            telegram_id,
-            selected_admin_id=selected_admin_id,
-            prefer_platform=False,
-            legacy_counter_key="admin_history_legacy_callback_count",
-            invalid_counter_key="admin_history_invalid_selected_count",
-        )
-        if selected_admin_id is not None and not admin:
-            query.edit_message_text(
-                "No se pudo validar este historial.\n\n"
-                "Vuelve a abrir Mi admin y entra de nuevo desde el boton actualizado."
-            )
-            return
-        if not admin:
-            query.edit_message_text("No tienes perfil de administrador.")
-            return
-        _admin_show_special_period(query, admin["id"], period, nav_admin_id=admin["id"])
+        admin = _resolve_history_admin(query, telegram_id, int(match.group(2)) if match.group(2) else None)
+        if admin:
+            _admin_show_special_period(query, admin["id"], match.group(1), nav_admin_id=admin["id"])
         return
 
     if data.startswith("adminhist_dia_"):
@@ -3113,30 +3346,23 @@ def admin_special_orders_history_callback(update, context):
         if not match:
             query.edit_message_text("Fecha invalida.", reply_markup=_admin_history_period_keyboard())
             return
-        compact = match.group(1)
-        parent = match.group(2)
-        selected_admin_id = int(match.group(3)) if match.group(3) else None
-        admin = resolve_owned_admin_actor(
-            telegram_id,
-            selected_admin_id=selected_admin_id,
-            prefer_platform=False,
-            legacy_counter_key="admin_history_legacy_callback_count",
-            invalid_counter_key="admin_history_invalid_selected_count",
-        )
-        if selected_admin_id is not None and not admin:
-            query.edit_message_text(
-                "No se pudo validar este historial.\n\n"
-                "Vuelve a abrir Mi admin y entra de nuevo desde el boton actualizado."
-            )
-            return
-        if not admin:
-            query.edit_message_text("No tienes perfil de administrador.")
-            return
-        if len(compact) == 8 and compact.isdigit():
+        admin = _resolve_history_admin(query, telegram_id, int(match.group(3)) if match.group(3) else None)
+        if admin:
+            compact = match.group(1)
             date_key = "{}-{}-{}".format(compact[:4], compact[4:6], compact[6:8])
-            _admin_show_special_day(query, admin["id"], date_key, parent, nav_admin_id=admin["id"])
-        else:
-            query.edit_message_text("Fecha invalida.", reply_markup=_admin_history_period_keyboard())
+            _admin_show_special_day(query, admin["id"], date_key, match.group(2), nav_admin_id=admin["id"])
+        return
+
+    if data.startswith("adminhist_pg_"):
+        page_request = _history_page_request(data, "adminhist_pg_")
+        if not page_request:
+            query.edit_message_text("Pagina invalida.", reply_markup=_admin_history_period_keyboard())
+            return
+        parent, date_key, cursor, direction, selected_admin_id = page_request
+        admin = _resolve_history_admin(query, telegram_id, selected_admin_id)
+        if admin:
+            _admin_show_special_day(query, admin["id"], date_key, parent, nav_admin_id=admin["id"],
+                                    cursor=cursor, direction=direction)
         return
 
     query.edit_message_text(
@@ -3152,46 +3378,45 @@ def _admin_show_special_period(query, admin_id, period, nav_admin_id=None):
         query.edit_message_text("Periodo invalido.", reply_markup=_admin_history_period_keyboard(nav_admin_id))
         return
 
-    orders = get_admin_special_orders_between(admin_id, start_s, end_s)
-    if not orders:
+    if period in ("hoy", "ayer"):
+        _admin_show_special_day(query, admin_id, start_s[:10], period, nav_admin_id=nav_admin_id)
+        return
+
+    text, day_buttons = _history_period_view(
+        "admin", admin_id, start_s, end_s, label,
+        lambda compact: "adminhist_dia_{}_{}_{}".format(compact, period, nav_admin_id),
+    )
+    if text is None:
         query.edit_message_text(
             "Mis pedidos especiales — {}\nNo hay pedidos en este periodo.".format(label),
             reply_markup=_admin_history_period_keyboard(nav_admin_id),
         )
         return
-
-    if period in ("hoy", "ayer"):
-        text = _admin_history_flat_text(orders, label)
-        query.edit_message_text(text, reply_markup=_admin_history_period_keyboard(nav_admin_id))
-    else:
-        text, sorted_keys = _admin_history_grouped_text(orders, label)
-        day_buttons = []
-        for dk in sorted_keys:
-            compact = dk.replace("-", "")
-            day_buttons.append([InlineKeyboardButton(
-                _fmt_date_es(dk),
-                callback_data="adminhist_dia_{}_{}_{}".format(compact, period, nav_admin_id),
-            )])
-        full_kb = InlineKeyboardMarkup(day_buttons + _admin_history_period_keyboard(nav_admin_id).inline_keyboard)
-        query.edit_message_text(text, reply_markup=full_kb)
+    full_kb = InlineKeyboardMarkup(day_buttons + _admin_history_period_keyboard(nav_admin_id).inline_keyboard)
+    query.edit_message_text(text, reply_markup=full_kb)
 
 
-def _admin_show_special_day(query, admin_id, date_key, parent_period, nav_admin_id=None):
+def _admin_show_special_day(query, admin_id, date_key, parent_period, nav_admin_id=None,
+                            cursor=None, direction="older"):
     nav_admin_id = nav_admin_id or admin_id
     try:
-        dt = datetime.strptime(date_key, "%Y-%m-%d")
+        datetime.strptime(date_key, "%Y-%m-%d")
     except ValueError:
         query.edit_message_text("Fecha invalida.", reply_markup=_admin_history_period_keyboard(nav_admin_id))
         return
-    start_s = dt.strftime("%Y-%m-%d 00:00:00")
-    end_s = (dt + timedelta(days=1)).strftime("%Y-%m-%d 00:00:00")
-    orders = get_admin_special_orders_between(admin_id, start_s, end_s)
-    text = _admin_history_flat_text(orders, _fmt_date_es(date_key))
-    back_label = "Volver a semana" if parent_period == "semana" else "Volver a mes"
-    full_kb = InlineKeyboardMarkup(
-        [[InlineKeyboardButton(back_label, callback_data="adminhist_periodo_{}_{}".format(parent_period, nav_admin_id))]]
-        + _admin_history_period_keyboard(nav_admin_id).inline_keyboard
-    )
+    code = _HISTORY_PERIOD_CODES.get(parent_period, "s")
+    text, nav_rows = _history_day_view(
+        "admin", admin_id, date_key, _history_day_label(date_key, parent_period),
+        lambda nav, page_cursor: "adminhist_pg_{}_{}_{}_{}".format(code, nav, page_cursor, nav_admin_id),
+        cursor=cursor, direction=direction,
+    )
+    back_rows = []
+    if parent_period in ("semana", "mes"):
+        back_label = "Volver a semana" if parent_period == "semana" else "Volver a mes"
+        back_rows = [[InlineKeyboardButton(
+            back_label, callback_data="adminhist_periodo_{}_{}".format(parent_period, nav_admin_id),
+        )]]
+    full_kb = InlineKeyboardMarkup(nav_rows + back_rows + _admin_history_period_keyboard(nav_admin_id).inline_keyboard)
     query.edit_message_text(text, reply_markup=full_kb)
 
 
@@ -3567,11 +3792,7 @@ def _admin_order_cancel(update, context, data):
     _cancel_no_response_job(context, order_id)
     _cancel_order_expire_job(context, order_id)
     if current_offer:
-        jobs = context.job_queue.get_jobs_by_name(
-            "offer_timeout_{}_{}".format(order_id, current_offer["queue_id"])
-        )
-        for job in jobs:
-            job.schedule_removal()
+        _cancel_timer(context, "offer_timeout_{}_{}".format(order_id, current_offer["queue_id"]), entity_id=order_id)
 
     _cancel_delivery_reminder_jobs(context, order_id)
     delete_offer_queue(order_id)
@@ -4244,11 +4465,13 @@ def _handle_courier_arrival_button(update, context, order_id):
 
     upsert_order_pickup_confirmation(order_id, courier["id"], order["ally_id"], "PENDING")
     _notify_ally_courier_arrived(context, order, courier_name)
-    context.job_queue.run_once(
+    _run_timer(
+        context,
         _pickup_autoconfirm_job,
         PICKUP_AUTOCONFIRM_SECONDS,
-        context={"order_id": order_id},
-        name="pickup_autoconfirm_{}".format(order_id),
+        "pickup_autoconfirm_{}".format(order_id),
+        {"order_id": order_id},
+        entity_id=order_id,
     )
     query.edit_message_text(
         "Llegada confirmada. Avisamos al aliado — se confirmara automaticamente en 2 minutos si no hay novedad."
@@ -4448,6 +4671,12 @@ def _handle_accept(update, context, order_id, commission_confirmed=False):
 
     # Marcar oferta como aceptada
     mark_offer_response(current["queue_id"], "ACCEPTED")
+    _record_dispatch_event(
+        "ORDER", order_id, "ACCEPTED",
+        context.bot_data.get("offer_cycles", {}).get(order_id),
+        courier_id=courier["id"],
+        position=current.get("position"),
+    )
 
     # Asignar courier al pedido y guardar snapshot de admin del courier
     courier_id = courier["id"]
@@ -4509,14 +4738,17 @@ def _handle_accept(update, context, order_id, commission_confirmed=False):
     _schedule_persistent_job(
         context, _arrival_inactivity_job, ARRIVAL_INACTIVITY_SECONDS,
         "arr_inactive_{}".format(order_id), {"order_id": order_id},
+        entity_id=order_id,
     )
     _schedule_persistent_job(
         context, _arrival_warn_ally_job, ARRIVAL_WARN_SECONDS,
         "arr_warn_{}".format(order_id), {"order_id": order_id},
+        entity_id=order_id,
     )
     _schedule_persistent_job(
         context, _arrival_deadline_job, ARRIVAL_DEADLINE_SECONDS,
         "arr_deadline_{}".format(order_id), {"order_id": order_id},
+        entity_id=order_id,
     )
 
     # Limpiar bot_data del ciclo de ofertas
@@ -4540,57 +4772,11 @@ def _handle_accept(update, context, order_id, commission_confirmed=False):
 
 
 def _handle_reject(update, context, order_id):
-    query = update.callback_query
-    order = get_order_by_id(order_id)
-    if not order or order["status"] != "PUBLISHED":
-        query.edit_message_text("Esta oferta ya no esta disponible.")
-        return
-
-    telegram_id = update.effective_user.id
-    courier = get_courier_by_telegram_id(telegram_id)
-    if not courier:
-        query.edit_message_text("Oferta #{} rechazada.".format(order_id))
-        return
-
-    current = get_current_offer_for_order(order_id)
-    if not current or current["courier_id"] != courier["id"]:
-        query.edit_message_text("Esta oferta ya no esta disponible para ti.")
-        return
-
-    # Cancelar el job de timeout
-    _cancel_offer_jobs(context, order_id, current["queue_id"])
-
-    mark_offer_response(current["queue_id"], "REJECTED")
-    query.edit_message_text("Oferta #{} rechazada.".format(order_id))
-
-    # Enviar al siguiente courier
-    _send_next_offer(order_id, context)
+    _ORDER_DISPATCH.respond(update, context, order_id, "REJECTED")
 
 
 def _handle_busy(update, context, order_id):
-    query = update.callback_query
-    order = get_order_by_id(order_id)
-    if not order or order["status"] != "PUBLISHED":
-        query.edit_message_text("Esta oferta ya no esta disponible.")
-        return
-
-    telegram_id = update.effective_user.id
-    courier = get_courier_by_telegram_id(telegram_id)
-    if not courier:
-        query.edit_message_text("Oferta #{} marcada como ocupado.".format(order_id))
-        return
-
-    current = get_current_offer_for_order(order_id)
-    if not current or current["courier_id"] != courier["id"]:
-        query.edit_message_text("Esta oferta ya no esta disponible para ti.")
-        return
-
-    _cancel_offer_jobs(context, order_id, current["queue_id"])
-
-    # Se registra como REJECTED para mantener el flujo actual de cola y reinicio.
-    mark_offer_response(current["queue_id"], "REJECTED")
-    query.edit_message_text("Oferta #{} marcada como ocupado. Se asignara a otro repartidor.".format(order_id))
-    _send_next_offer(order_id, context)
+    _ORDER_DISPATCH.respond(update, context, order_id, "BUSY")
 
 
 def _handle_cancel_ally_abort(update, context, order_id):
@@ -4902,11 +5088,7 @@ def _handle_cancel_ally(update, context, order_id, confirm=False):
     _cancel_no_response_job(context, order_id)
     _cancel_order_expire_job(context, order_id)
     if current_offer:
-        jobs = context.job_queue.get_jobs_by_name(
-            "offer_timeout_{}_{}".format(order_id, current_offer["queue_id"])
-        )
-        for job in jobs:
-            job.schedule_removal()
+        _cancel_timer(context, "offer_timeout_{}_{}".format(order_id, current_offer["queue_id"]), entity_id=order_id)
 
     delete_offer_queue(order_id)
     context.bot_data.get("offer_cycles", {}).pop(order_id, None)
@@ -5090,11 +5272,13 @@ def _handle_pickup(update, context, order_id):
 
     upsert_order_pickup_confirmation(order_id, courier["id"], order["ally_id"], "PENDING")
     _notify_ally_courier_arrived(context, order, courier_name)
-    context.job_queue.run_once(
+    _run_timer(
+        context,
         _pickup_autoconfirm_job,
         PICKUP_AUTOCONFIRM_SECONDS,
-        context={"order_id": order_id},
-        name="pickup_autoconfirm_{}".format(order_id),
+        "pickup_autoconfirm_{}".format(order_id),
+        {"order_id": order_id},
+        entity_id=order_id,
     )
 
     keyboard = [[InlineKeyboardButton("Liberar pedido", callback_data="order_release_{}".format(order_id))]]
@@ -5532,18 +5716,17 @@ def _notify_courier_visibility_blocked(
         )
 
 
-def _build_offer_text(
+def _build_offer_text_parts(
     order,
-    courier_dist_km=None,
     pickup_city_override=None,
     pickup_barrio_override=None,
     dropoff_city_override=None,
     dropoff_barrio_override=None,
-    courier_id=None,
-    courier=None,
-    active_services=None,
 ):
-    """Construye el texto de oferta para el courier."""
+    """
+    Partes del texto de oferta que solo dependen del pedido: (encabezado, cuerpo).
+    La linea de distancia del courier va entre ambas y el desvio al final.
+    """
     distance_km = order["distance_km"] or 0
     pickup_area_line = _get_order_visible_pickup_line(
         order,
@@ -5560,7 +5743,7 @@ def _build_offer_text(
         include_base_required=False,
     )
 
-    text = (
+    head = (
         "OFERTA DISPONIBLE\n\n"
         "Pedido: #{}\n"
         "Recoges en: {}\n"
@@ -5575,58 +5758,98 @@ def _build_offer_text(
         earnings_block,
     )
 
-    if courier_dist_km is not None:
-        eta_min = max(1, round(courier_dist_km / 25 * 60))
-        text += "Tu distancia al punto de recogida: {:.1f} km (~{} min)\n".format(
-            courier_dist_km, eta_min
-        )
-
+    body = ""
     cash_amount = int(_row_value(order, "cash_required_amount", 0) or 0)
     requires_cash = bool(_row_value(order, "requires_cash", False))
     payment_method = _row_value(order, "payment_method", "UNCONFIRMED") or "UNCONFIRMED"
     cash_confirmed = payment_method == "CASH_CONFIRMED" or (requires_cash and cash_amount > 0)
 
     if cash_confirmed:
-        text += "Metodo de pago: efectivo confirmado\n"
+        body += "Metodo de pago: efectivo confirmado\n"
         if cash_amount > 0:
-            text += "Base requerida: ${:,}\n".format(int(cash_amount))
-            text += "\nADVERTENCIA: Si no tienes base suficiente, NO tomes este servicio.\n"
+            body += "Base requerida: ${:,}\n".format(int(cash_amount))
+            body += "\nADVERTENCIA: Si no tienes base suficiente, NO tomes este servicio.\n"
     elif payment_method == "TRANSFER_CONFIRMED":
-        text += "Metodo de pago: transferencia confirmada\n"
+        body += "Metodo de pago: transferencia confirmada\n"
     else:
-        text += "Metodo de pago: no confirmado (no debes adelantar dinero)\n"
+        body += "Metodo de pago: no confirmado (no debes adelantar dinero)\n"
 
     instructions = order["instructions"] or ""
     if instructions.strip():
-        text += "\nInstrucciones: {}\n".format(instructions.strip())
+        body += "\nInstrucciones: {}\n".format(instructions.strip())
 
-    text += "\nAviso: una vez aceptado tienes 15 min para llegar al punto de recogida.\n"
+    body += "\nAviso: una vez aceptado tienes 15 min para llegar al punto de recogida.\n"
 
     parking_fee = int(order["parking_fee"] or 0) if "parking_fee" in order.keys() else 0
     if parking_fee > 0:
-        text += (
+        body += (
             "\nATENCION: El punto de entrega tiene dificultad para parquear moto o bicicleta. "
             "Se incluyen ${:,} para que cubras el parqueo o cualquier imprevisto con tu vehiculo. "
             "No dejes tu moto o bici en lugar prohibido — comparendos o inmovilizaciones "
             "son tu responsabilidad.\n".format(parking_fee)
         )
+    return head, body
+
+
+def _offer_courier_distance_text(courier_dist_km):
+    if courier_dist_km is None:
+        return ""
+    eta_min = max(1, round(courier_dist_km / 25 * 60))
+    return "Tu distancia al punto de recogida: {:.1f} km (~{} min)\n".format(
+        courier_dist_km, eta_min
+    )
+
+
+def _offer_detour_text(courier, new_pickup_lat, new_pickup_lng, active_services):
+    """Indicador de desvio si el courier ya tiene servicios activos."""
+    if courier is None or not active_services:
+        return ""
+    try:
+        _ok, _err, ratio = _check_multi_order_detour(
+            courier, new_pickup_lat, new_pickup_lng, active_services, count_block=False
+        )
+        return _offer_detour_label(ratio)
+    except Exception:
+        return ""
+
+
+def _offer_detour_label(ratio):
+    if ratio is None:
+        return ""
+    desvio_pct = max(0.0, (ratio - 1.0) * 100)
+    if desvio_pct <= 5:
+        return "\nDesvio de tu ruta actual: minimo ({:.0f}%) — esta en tu camino.\n".format(desvio_pct)
+    if desvio_pct <= 15:
+        return "\nDesvio de tu ruta actual: moderado ({:.0f}%).\n".format(desvio_pct)
+    return "\nDesvio de tu ruta actual: alto ({:.0f}%) — considera si vale la pena.\n".format(desvio_pct)
+
 
-    # Indicador de desvio si el courier ya tiene servicios activos
+def _build_offer_text(
+    order,
+    courier_dist_km=None,
+    pickup_city_override=None,
+    pickup_barrio_override=None,
+    dropoff_city_override=None,
+    dropoff_barrio_override=None,
+    courier_id=None,
+    courier=None,
+    active_services=None,
+):
+    """Construye el texto de oferta para el courier."""
+    head, body = _build_offer_text_parts(
+        order,
+        pickup_city_override,
+        pickup_barrio_override,
+        dropoff_city_override,
+        dropoff_barrio_override,
+    )
+    text = head + _offer_courier_distance_text(courier_dist_km) + body
     if courier is not None and active_services:
         try:
             new_pickup_lat, new_pickup_lng = _get_pickup_coords(order)
-            _ok, _err, ratio = _check_multi_order_detour(courier, new_pickup_lat, new_pickup_lng, active_services)
-            if ratio is not None:
-                desvio_pct = max(0.0, (ratio - 1.0) * 100)
-                if desvio_pct <= 5:
-                    text += "\nDesvio de tu ruta actual: minimo ({:.0f}%) — esta en tu camino.\n".format(desvio_pct)
-                elif desvio_pct <= 15:
-                    text += "\nDesvio de tu ruta actual: moderado ({:.0f}%).\n".format(desvio_pct)
-                else:
-                    text += "\nDesvio de tu ruta actual: alto ({:.0f}%) — considera si vale la pena.\n".format(desvio_pct)
         except Exception:
-            pass
-
+            return text
+        text += _offer_detour_text(courier, new_pickup_lat, new_pickup_lng, active_services)
     return text
 
 
@@ -5666,13 +5889,9 @@ def _calculate_detour_ratio(c_lat, c_lng, new_pickup_lat, new_pickup_lng, dest_l
     Calcula cuanto desvio añade ir al nuevo pickup antes de llegar al destino actual.
     Formula: (courier→new_pickup + new_pickup→dest) / (courier→dest)
     1.0 = sin desvio. 1.30 = 30% extra. <1.0 = el pickup esta en el camino (atajo).
+    Si el destino esta casi encima del courier retorna 1.0 (cualquier desvio es aceptable).
     """
-    direct = haversine_km(float(c_lat), float(c_lng), float(dest_lat), float(dest_lng))
-    if direct < 0.05:
-        return 1.0  # destino casi encima del courier, cualquier desvio es aceptable
-    via = (haversine_km(float(c_lat), float(c_lng), float(new_pickup_lat), float(new_pickup_lng)) +
-           haversine_km(float(new_pickup_lat), float(new_pickup_lng), float(dest_lat), float(dest_lng)))
-    return via / direct
+    return detour_ratio(c_lat, c_lng, new_pickup_lat, new_pickup_lng, dest_lat, dest_lng)
 
 
 def _get_service_destination(service):
@@ -5717,11 +5936,46 @@ def _get_service_id_label(service):
     return sid, tipo, label
 
 
-def _check_multi_order_detour(courier, new_pickup_lat, new_pickup_lng, active_services):
+def _detour_reference_service(active_services):
+    """Servicio que fija el destino actual: PICKED_UP primero (ya comprometido), luego ACCEPTED."""
+    for service in active_services:
+        if _row_value(service, "status") == "PICKED_UP":
+            return service
+    return active_services[0]
+
+
+def _bulk_offer_detour_ratios(courier_contexts, new_pickup_lat, new_pickup_lng):
+    """
+    Desvios de oferta para todos los couriers con servicios activos en una pasada
+    (courier_ranking.detour_ratios). Mismas reglas que _check_multi_order_detour:
+    sin GPS activo o sin destino conocido no hay indicador.
+    Retorna {courier_id: ratio}.
+    """
+    if new_pickup_lat is None or new_pickup_lng is None:
+        return {}
+    ids, origins, destinations = [], [], []
+    for courier_id, ctx in courier_contexts.items():
+        courier = ctx["courier"] if ctx else None
+        services = ctx["active_services"] if ctx else None
+        if courier is None or not services:
+            continue
+        live_lat = _row_value(courier, "live_lat")
+        live_lng = _row_value(courier, "live_lng")
+        if not int(_row_value(courier, "live_location_active", 0) or 0) or not live_lat or not live_lng:
+            continue
+        ids.append(courier_id)
+        origins.append((float(live_lat), float(live_lng)))
+        destinations.append(_get_service_destination(_detour_reference_service(services)))
+    ratios = detour_ratios(new_pickup_lat, new_pickup_lng, origins, destinations)
+    return {cid: ratio for cid, ratio in zip(ids, ratios) if ratio is not None}
+
+
+def _check_multi_order_detour(courier, new_pickup_lat, new_pickup_lng, active_services, count_block=True):
     """
     Verifica si añadir un nuevo servicio implica un desvio aceptable (<=30%) sobre la ruta actual.
     Funciona con listas mixtas de pedidos y rutas activas.
     Prioriza siempre el servicio en PICKED_UP (ya comprometido con el cliente).
+    count_block=False para solo mostrar el desvio (oferta) sin contar un bloqueo.
 
     Retorna (permitido: bool, mensaje_error: str | None, ratio: float | None)
     """
@@ -5739,15 +5993,7 @@ def _check_multi_order_detour(courier, new_pickup_lat, new_pickup_lng, active_se
     if new_pickup_lat is None or new_pickup_lng is None:
         return False, "No se pudo verificar la ubicacion del pickup de este servicio.", None
 
-    # Prioridad: PICKED_UP primero (ya comprometido), luego ACCEPTED
-    ref_service = None
-    for s in active_services:
-        if _row_value(s, "status") == "PICKED_UP":
-            ref_service = s
-            break
-    if ref_service is None:
-        ref_service = active_services[0]
-
+    ref_service = _detour_reference_service(active_services)
     dest_lat, dest_lng = _get_service_destination(ref_service)
 
     if dest_lat is None or dest_lng is None:
@@ -5773,10 +6019,11 @@ def _check_multi_order_detour(courier, new_pickup_lat, new_pickup_lng, active_se
         desvio_pct = (ratio - 1.0) * 100
         sid, tipo, label = _get_service_id_label(ref_service)
         # Registrar bloqueo para calibracion del umbral
-        try:
-            increment_setting_counter("multiorder_detour_blocks_total")
-        except Exception:
-            pass
+        if count_block:
+            try:
+                increment_setting_counter("multiorder_detour_blocks_total")
+            except Exception:
+                pass
         return False, (
             "Este pickup esta demasiado fuera de tu ruta actual.\n\n"
             "Desvio estimado: {:.0f}% extra para {} el {} #{} que ya tienes.\n"
@@ -5815,16 +6062,7 @@ def _build_delivery_order_suggestion(active_orders, new_order):
             if d_lat is not None and d_lng is not None:
                 area = _get_order_visible_dropoff_line(o) or "#{}".format(_row_value(o, "id"))
                 items.append({"id": _row_value(o, "id"), "lat": float(d_lat), "lng": float(d_lng), "area": area})
-        if not items:
-            return items
-        ordered = []
-        remaining = list(items)
-        cur_lat, cur_lng = remaining[0]["lat"], remaining[0]["lng"]
-        while remaining:
-            nearest = min(remaining, key=lambda d: haversine_km(cur_lat, cur_lng, d["lat"], d["lng"]))
-            ordered.append(nearest)
-            cur_lat, cur_lng = nearest["lat"], nearest["lng"]
-            remaining.remove(nearest)
+        ordered, _km = nearest_neighbor_order(items)
         return ordered
 
     if len(all_orders) < 2:
@@ -5857,9 +6095,7 @@ def _build_delivery_order_suggestion(active_orders, new_order):
     # Calcular ahorro si hay suficientes dropoffs
     all_dropoffs = nearest_neighbor_dropoffs(all_orders)
     if len(all_dropoffs) >= 2:
-        def total_dist(seq):
-            return sum(haversine_km(seq[i]["lat"], seq[i]["lng"], seq[i+1]["lat"], seq[i+1]["lng"]) for i in range(len(seq)-1))
-        ahorro = total_dist(list(reversed(all_dropoffs))) - total_dist(all_dropoffs)
+        ahorro = path_length_km(list(reversed(all_dropoffs))) - path_length_km(all_dropoffs)
         if ahorro > 0.15:
             lines.append("\nAhorra ~{:.1f} km vs el orden inverso.".format(ahorro))
 
@@ -6059,10 +6295,12 @@ def _handle_confirm_pickup(update, context, order_id):
     _schedule_persistent_job(
         context, _delivery_reminder_job, DELIVERY_REMINDER_SECONDS,
         "delivery_reminder_{}".format(order_id), {"order_id": order_id},
+        entity_id=order_id,
     )
     _schedule_persistent_job(
         context, _delivery_admin_alert_job, DELIVERY_ADMIN_ALERT_SECONDS,
         "delivery_admin_alert_{}".format(order_id), {"order_id": order_id},
+        entity_id=order_id,
     )
 
 
@@ -6633,237 +6871,200 @@ def _build_route_offer_text(route, destinations):
 
 
 def _cancel_route_offer_jobs(context, route_id, queue_id):
-    timeout_jobs = context.job_queue.get_jobs_by_name(
-        "route_offer_timeout_{}_{}".format(route_id, queue_id)
-    )
-    for job in timeout_jobs:
-        job.schedule_removal()
+    _cancel_timer(context, "route_offer_timeout_{}_{}".format(route_id, queue_id), entity_id=route_id)
 
 
-def _route_offer_timeout_job(context):
-    """Job ejecutado cuando expira el timeout de oferta de ruta."""
-    job_data = context.job.context
-    route_id = job_data["route_id"]
-    queue_id = job_data["queue_id"]
+class _RouteOfferContext:
+    """Texto y teclado de la oferta de ruta: no dependen del courier, se arman una vez por ciclo."""
 
-    route = get_route_by_id(route_id)
-    if not route or route["status"] != "PUBLISHED":
-        return
+    def __init__(self, route_id, route):
+        self.route = dict(route)
+        self.text = "SERVICIO DISPONIBLE\n\n" + _build_route_offer_text(route, get_route_destinations(route_id))
+        self.reply_markup = _route_offer_reply_markup(route_id)
 
-    current = get_current_route_offer(route_id)
-    if not current or current["queue_id"] != queue_id:
-        return
+    def matches(self, route, cycle_info):
+        return self.route == dict(route)
 
-    cycle_info = context.bot_data.get("route_offer_cycles", {}).get(route_id)
-    if cycle_info is not None:
-        cycle_info["market_retry_count"] = max(
-            _coerce_market_retry_count(cycle_info.get("market_retry_count")),
-            _coerce_market_retry_count(job_data.get("market_retry_count")),
-        )
+    def courier_context(self, courier_id, queue_courier_ids):
+        return None
 
-    _cancel_route_offer_jobs(context, route_id, queue_id)
-    mark_route_offer_response(queue_id, "EXPIRED")
+    def courier_distance_km(self, courier_ctx):
+        return None
 
-    msg_info = context.bot_data.get("route_offer_messages", {}).get(route_id)
-    if msg_info:
-        try:
-            context.bot.edit_message_text(
-                chat_id=msg_info["chat_id"],
-                message_id=msg_info["message_id"],
-                text="Ruta #{} expirada. No respondiste a tiempo.".format(route_id),
-            )
-        except Exception:
-            pass
+    def render(self, courier_id, courier_ctx):
+        return self.text
+
+
+_route_offer_contexts = {}
+
+
+class _RouteDispatch(_ServiceDispatch):
+    entity_type = "ROUTE"
+    id_key = "route_id"
+    label = "ruta"
+    cycles_key = "route_offer_cycles"
+    messages_key = "route_offer_messages"
+    timeout_job_name = "route_offer_timeout_{}_{}"
+    expired_offer_text = "Ruta #{} expirada. No respondiste a tiempo."
+    response_texts = {
+        "REJECTED": ("Oferta de ruta #{} rechazada.", "Oferta de ruta #{} rechazada."),
+        "BUSY": ("Oferta de ruta #{} rechazada.", "Registrado. Te saltamos esta ruta."),
+    }
+    contexts = _route_offer_contexts
+    candidates = route_candidates
+
+    def load(self, route_id):
+        return get_route_by_id(route_id)
+
+    def recovered_cycle_info(self, route):
+        return _build_recovered_route_cycle_info(route)
+
+    def new_offer_context(self, route_id, route, cycle_info):
+        return _RouteOfferContext(route_id, route)
+
+    def cycle_seconds(self):
+        return _get_route_market_cycle_seconds()
+
+    def timeout_seconds(self):
+        return ROUTE_OFFER_TIMEOUT_SECONDS
 
-    _send_next_route_offer(route_id, context)
+    def retry_seconds(self):
+        return ROUTE_OFFER_RETRY_SECONDS
 
+    def timeout_job(self):
+        return _route_offer_timeout_job
 
-def _try_restart_route_cycle(route_id, context):
-    cycle_info = context.bot_data.get("route_offer_cycles", {}).get(route_id)
-    if not cycle_info:
-        route = get_route_by_id(route_id)
-        if not route or route["status"] != "PUBLISHED":
-            logger.warning("_try_restart_route_cycle: ruta %s sin cycle_info y fuera de PUBLISHED", route_id)
-            return
-        cycle_info = _build_recovered_route_cycle_info(route)
-        context.bot_data.setdefault("route_offer_cycles", {})[route_id] = cycle_info
-        logger.warning("_try_restart_route_cycle: ruta %s sin cycle_info; reconstruida desde BD", route_id)
+    def next_pending(self, route_id):
+        return get_next_pending_route_offer(route_id)
 
-    import time
-    elapsed = time.time() - cycle_info["started_at"]
-    cycle_seconds = _get_route_market_cycle_seconds()
-    logger.info("_try_restart_route_cycle: ruta %s elapsed=%.0fs", route_id, elapsed)
+    def pending_courier_ids(self, route_id):
+        return route_offer_store.pending_courier_ids(route_id)
 
-    if elapsed >= cycle_seconds:
-        logger.info(
-            "_try_restart_route_cycle: ruta %s elapsed=%.0fs supera max=%ss; se expirara",
-            route_id,
-            elapsed,
-            cycle_seconds,
-        )
-        _expire_route(route_id, cycle_info, context)
-        return
+    def current_offer(self, route_id):
+        return get_current_route_offer(route_id)
 
-    admin_id = cycle_info.get("admin_id")
-    ally_id = cycle_info.get("ally_id")
-    excluded = cycle_info.get("excluded_couriers", set())
-    route, courier_ids, eligible_count = _get_route_candidate_courier_ids(
-        route_id,
-        ally_id,
-        admin_id,
-        excluded_courier_ids=excluded,
-    )
-    if not route or route["status"] != "PUBLISHED":
-        logger.warning("_try_restart_route_cycle: ruta %s ya no esta en PUBLISHED al recalcular", route_id)
-        return
+    def mark_offered(self, queue_id):
+        mark_route_offer_as_offered(queue_id)
 
-    logger.info(
-        "_try_restart_route_cycle: ruta %s elapsed=%.0fs eligible=%s excluded=%s relanzables=%s",
-        route_id,
-        elapsed,
-        eligible_count,
-        len(excluded),
-        len(courier_ids),
-    )
+    def mark_response(self, queue_id, response):
+        mark_route_offer_response(queue_id, response)
 
-    if not courier_ids:
+    def create_queue(self, route_id, courier_ids):
+        create_route_offer_queue(route_id, courier_ids)
+
+    def delete_queue(self, route_id):
         delete_route_offer_queue(route_id)
-        logger.info(
-            "_try_restart_route_cycle: ruta %s sigue activa sin couriers relanzables; reintentara en %ss",
-            route_id,
-            ROUTE_OFFER_RETRY_SECONDS,
-        )
-        _schedule_route_offer_retry_job(
-            context,
-            route_id,
-            market_retry_count=_coerce_market_retry_count(cycle_info.get("market_retry_count")),
-        )
-        return
 
-    delete_route_offer_queue(route_id)
-    create_route_offer_queue(route_id, courier_ids)
-    _cancel_route_offer_retry_job(context, route_id)
-    _send_next_route_offer(route_id, context)
+    def set_published(self, route_id):
+        update_route_status(route_id, "PUBLISHED", "published_at")
 
+    def cancel_offer_jobs(self, context, route_id, queue_id):
+        _cancel_route_offer_jobs(context, route_id, queue_id)
 
-def _expire_route(route_id, cycle_info, context):
-    """Reintenta el mercado de la ruta y solo cancela al agotar los ciclos configurados."""
-    route = get_route_by_id(route_id)
-    if not route or route["status"] != "PUBLISHED":
-        return
+    def cancel_retry_job(self, context, route_id):
+        _cancel_route_offer_retry_job(context, route_id)
 
-    retry_limit = _get_market_retry_limit()
-    market_retry_count = _coerce_market_retry_count(cycle_info.get("market_retry_count"))
-    if market_retry_count < retry_limit:
-        next_retry_count = market_retry_count + 1
-        logger.info(
-            "_expire_route: ruta %s agotó ciclo sin aceptacion; reintento de mercado %s/%s",
-            route_id,
-            next_retry_count,
-            retry_limit,
-        )
+    def schedule_retry_job(self, context, route_id, market_retry_count):
+        _schedule_route_offer_retry_job(context, route_id, market_retry_count=market_retry_count)
+
+    def cancel_market_jobs(self, context, route_id):
         _cancel_route_no_response_job(context, route_id)
         _cancel_route_offer_retry_job(context, route_id)
         _cancel_route_expire_job(context, route_id)
-        current = get_current_route_offer(route_id)
-        if current:
-            _cancel_route_offer_jobs(context, route_id, current["queue_id"])
-        delete_route_offer_queue(route_id)
-        context.bot_data.get("route_offer_cycles", {}).pop(route_id, None)
-        context.bot_data.get("route_offer_messages", {}).pop(route_id, None)
 
-        _notify_route_market_retry(context, route, next_retry_count, retry_limit)
+    def send(self, route_id, context):
+        _send_next_route_offer(route_id, context)
+
+    def restart(self, route_id, context):
+        _try_restart_route_cycle(route_id, context)
+
+    def expire_now(self, route_id, cycle_info, context):
+        _expire_route(route_id, cycle_info, context)
+
+    def candidate_ids(self, route_id, route, cycle_info, excluded, destinations=None):
+        pickup_lat = route["pickup_lat"]
+        pickup_lng = route["pickup_lng"]
+        # La distancia de la ruta para los limites por distancia es la del destino mas lejano.
+        route_max_dist_km = None
+        if pickup_lat is not None and pickup_lng is not None:
+            try:
+                if destinations is None:
+                    destinations = get_route_destinations(route_id)
+                points = [(_row_value(d, "dropoff_lat"), _row_value(d, "dropoff_lng")) for d in destinations]
+                dists = [km for km in distances_km(pickup_lat, pickup_lng, points) if km is not None]
+                route_max_dist_km = max(dists) if dists else None
+            except Exception:
+                route_max_dist_km = None
+
+        return self._candidate_ids(
+            route_id,
+            cycle_info.get("admin_id"),
+            cycle_info.get("ally_id"),
+            pickup_lat,
+            pickup_lng,
+            bool(_row_value(route, "requires_cash", False)),
+            int(_row_value(route, "cash_required_amount", 0) or 0),
+            route_max_dist_km,
+            get_fee_config()["fee_service_total"],
+            excluded,
+        )
+
+    def notify_market_retry(self, context, route, retry_count, retry_limit):
+        _notify_route_market_retry(context, route, retry_count, retry_limit)
+
+    def republish(self, route_id, route, context, market_retry_count):
         admin_id_override = _row_value(route, "ally_admin_id_snapshot")
         publish_route_to_couriers(
             route_id=route_id,
             ally_id=_row_value(route, "ally_id"),
             context=context,
             admin_id_override=int(admin_id_override) if admin_id_override else None,
-            market_retry_count=next_retry_count,
+            market_retry_count=market_retry_count,
             schedule_no_response=False,
         )
-        return
 
-    logger.info(
-        "_expire_route: ruta %s en PUBLISHED sera cancelada sin cargo tras %s reintentos de mercado",
-        route_id,
-        retry_limit,
-    )
-    _cancel_route_no_response_job(context, route_id)
-    _cancel_route_offer_retry_job(context, route_id)
-    _cancel_route_expire_job(context, route_id)
-    cancel_route(route_id, "SYSTEM")
-    delete_route_offer_queue(route_id)
+    def cancel_service(self, route_id):
+        cancel_route(route_id, "SYSTEM")
 
-    context.bot_data.get("route_offer_cycles", {}).pop(route_id, None)
-    context.bot_data.get("route_offer_messages", {}).pop(route_id, None)
+    def notify_expired(self, context, route_id, route, cycle_info, retry_limit):
+        try:
+            ally = get_ally_by_id(cycle_info.get("ally_id"))
+            if ally:
+                ally_user = get_user_by_id(ally["user_id"])
+                if ally_user and ally_user["telegram_id"]:
+                    context.bot.send_message(
+                        chat_id=ally_user["telegram_id"],
+                        text=(
+                            "Tu ruta #{} fue cancelada porque ningun repartidor "
+                            "la acepto despues de {} reintentos del mercado.\n"
+                            "No se aplico ningun cargo."
+                        ).format(route_id, retry_limit),
+                    )
+        except Exception as e:
+            logger.warning("No se pudo notificar expiracion de ruta al aliado: %s", e)
 
-    ally_id = cycle_info.get("ally_id")
-    try:
-        ally = get_ally_by_id(ally_id)
-        if ally:
-            ally_user = get_user_by_id(ally["user_id"])
-            if ally_user and ally_user["telegram_id"]:
-                context.bot.send_message(
-                    chat_id=ally_user["telegram_id"],
-                    text=(
-                        "Tu ruta #{} fue cancelada porque ningun repartidor "
-                        "la acepto despues de {} reintentos del mercado.\n"
-                        "No se aplico ningun cargo."
-                    ).format(route_id, retry_limit),
-                )
-    except Exception as e:
-        logger.warning("No se pudo notificar expiracion de ruta al aliado: %s", e)
 
+_ROUTE_DISPATCH = _RouteDispatch()
 
-def _send_next_route_offer(route_id, context):
-    """Envia la oferta de ruta al siguiente courier en la cola."""
-    route = get_route_by_id(route_id)
-    if not route or route["status"] != "PUBLISHED":
-        return
 
-    cycle_info = context.bot_data.get("route_offer_cycles", {}).get(route_id, {}) or {}
+def _route_offer_timeout_job(context):
+    """Job ejecutado cuando expira el timeout de oferta de ruta."""
+    _ROUTE_DISPATCH.offer_timeout(context)
 
-    next_offer = get_next_pending_route_offer(route_id)
-    if not next_offer:
-        logger.info("_send_next_route_offer: ruta %s sin couriers pendientes; se intentara reiniciar el ciclo", route_id)
-        _try_restart_route_cycle(route_id, context)
-        return
 
-    _cancel_route_offer_retry_job(context, route_id)
-    mark_route_offer_as_offered(next_offer["queue_id"])
+def _try_restart_route_cycle(route_id, context):
+    """Reinicia el ciclo de la ruta con los couriers elegibles actuales."""
+    _ROUTE_DISPATCH.restart_cycle(route_id, context)
 
-    destinations = get_route_destinations(route_id)
-    offer_text = "SERVICIO DISPONIBLE\n\n" + _build_route_offer_text(route, destinations)
-    reply_markup = _route_offer_reply_markup(route_id)
 
-    try:
-        msg = context.bot.send_message(
-            chat_id=next_offer["telegram_id"],
-            text=offer_text,
-            reply_markup=reply_markup,
-        )
-        context.bot_data.setdefault("route_offer_messages", {})[route_id] = {
-            "chat_id": next_offer["telegram_id"],
-            "message_id": msg.message_id,
-        }
-    except Exception as e:
-        logger.warning("No se pudo enviar oferta de ruta a courier %s: %s", next_offer["courier_id"], e)
-        mark_route_offer_response(next_offer["queue_id"], "EXPIRED")
-        _send_next_route_offer(route_id, context)
-        return
+def _expire_route(route_id, cycle_info, context):
+    """Reintenta el mercado de la ruta y solo cancela al agotar los ciclos configurados."""
+    _ROUTE_DISPATCH.expire(route_id, cycle_info, context)
 
-    context.job_queue.run_once(
-        _route_offer_timeout_job,
-        ROUTE_OFFER_TIMEOUT_SECONDS,
-        context=_build_market_job_data(
-            "route_id",
-            route_id,
-            _coerce_market_retry_count(cycle_info.get("market_retry_count")),
-            extra={"queue_id": next_offer["queue_id"]},
-        ),
-        name="route_offer_timeout_{}_{}".format(route_id, next_offer["queue_id"]),
-    )
+
+def _send_next_route_offer(route_id, context):
+    """Envia la oferta de ruta al siguiente courier en la cola (ver _ServiceDispatch.send_next)."""
+    _ROUTE_DISPATCH.send_next(route_id, context)
 
 
 def publish_route_to_couriers(
@@ -6891,28 +7092,6 @@ def publish_route_to_couriers(
 
     pickup_lat = route["pickup_lat"]
     pickup_lng = route["pickup_lng"]
-    requires_cash = bool(_row_value(route, "requires_cash", False))
-    cash_amount = int(_row_value(route, "cash_required_amount", 0) or 0)
-
-    # Calcular distancia máxima pickup→parada para filtrar bicicletas >3 km
-    _route_max_dist_km = None
-    try:
-        import math as _rmath
-        for _d in route_destinations:
-            _dlat = _d.get("dropoff_lat") if hasattr(_d, "get") else _d["dropoff_lat"]
-            _dlng = _d.get("dropoff_lng") if hasattr(_d, "get") else _d["dropoff_lng"]
-            if _dlat is not None and _dlng is not None and pickup_lat is not None and pickup_lng is not None:
-                _rlat = _rmath.radians(_dlat - pickup_lat)
-                _rlng = _rmath.radians(_dlng - pickup_lng)
-                _a = (_rmath.sin(_rlat / 2) ** 2
-                      + _rmath.cos(_rmath.radians(pickup_lat)) * _rmath.cos(_rmath.radians(_dlat))
-                      * _rmath.sin(_rlng / 2) ** 2)
-                _seg_km = 6371.0 * 2 * _rmath.atan2(_rmath.sqrt(_a), _rmath.sqrt(1 - _a))
-                if _route_max_dist_km is None or _seg_km > _route_max_dist_km:
-                    _route_max_dist_km = _seg_km
-    except Exception:
-        pass
-
     excluded_courier_ids = {int(cid) for cid in (excluded_courier_ids or []) if cid}
 
     missing_visibility = _get_route_missing_courier_visibility_fields(route, route_destinations)
@@ -6937,46 +7116,35 @@ def publish_route_to_couriers(
         )
         return MARKET_PUBLISH_BLOCKED
 
-    eligible = get_eligible_couriers_for_order(
-        admin_id=admin_id,
-        ally_id=ally_id,
-        requires_cash=requires_cash,
-        cash_required_amount=cash_amount,
-        pickup_lat=pickup_lat,
-        pickup_lng=pickup_lng,
-        order_distance_km=_route_max_dist_km,
-    )
-
-    # Filtrar couriers sin saldo suficiente para el fee de servicio ($300)
-    # El sistema no ofrece el servicio a couriers que no puedan pagarlo al finalizar
-    couriers_con_saldo = []
-    for c in eligible:
-        c_id = c["courier_id"]
-        if c_id in excluded_courier_ids:
-            continue
-        c_admin_id = get_approved_admin_id_for_courier(c_id)
-        if not c_admin_id:
-            continue
-        fee_ok, _ = check_service_fee_available("COURIER", c_id, c_admin_id)
-        if fee_ok:
-            couriers_con_saldo.append(c_id)
-
-    courier_ids = couriers_con_saldo
-
-    import time
     cycle_info = {
         "started_at": time.time(),
         "admin_id": admin_id,
         "ally_id": ally_id,
         "excluded_couriers": excluded_courier_ids,
         "market_retry_count": _coerce_market_retry_count(market_retry_count),
+        "pickup_lat": pickup_lat,
+        "pickup_lng": pickup_lng,
     }
 
+    # Mismo camino que el reinicio del ciclo: elegibilidad y luego vinculo y saldo para
+    # el fee de servicio en una consulta por lotes. El sistema no ofrece la ruta a
+    # couriers que no puedan pagar el fee al finalizar.
+    courier_ids, eligible_count, _ = _ROUTE_DISPATCH.candidate_ids(
+        route_id, route, cycle_info, excluded_courier_ids, destinations=route_destinations,
+    )
+    try:
+        record_dispatch_published(
+            "ROUTE", route_id, admin_id=admin_id, pickup_lat=pickup_lat, pickup_lng=pickup_lng,
+            supply=len(courier_ids), first=_coerce_market_retry_count(market_retry_count) == 0,
+        )
+    except Exception as e:
+        logger.warning("record_dispatch_published ruta %s: %s", route_id, e)
+
     if not courier_ids:
         logger.info(
             "publish_route_to_couriers: ruta %s sin couriers relanzables (eligible=%s excluded=%s)",
             route_id,
-            len(eligible),
+            eligible_count,
             len(excluded_courier_ids),
         )
 
@@ -6989,6 +7157,7 @@ def publish_route_to_couriers(
             context, _route_no_response_job, OFFER_NO_RESPONSE_SECONDS,
             "route_no_response_{}".format(route_id),
             _build_market_job_data("route_id", route_id, market_retry_count),
+            entity_id=route_id,
         )
 
     _schedule_route_expire_job(context, route_id, market_retry_count=market_retry_count)
@@ -7142,6 +7311,12 @@ def _handle_route_accept(update, context, route_id):
     _cancel_route_no_response_job(context, route_id)
     _cancel_route_expire_job(context, route_id)
     mark_route_offer_response(current["queue_id"], "ACCEPTED")
+    _record_dispatch_event(
+        "ROUTE", route_id, "ACCEPTED",
+        context.bot_data.get("route_offer_cycles", {}).get(route_id),
+        courier_id=courier_id,
+        position=current.get("position"),
+    )
     assign_route_to_courier(route_id, courier_id, courier_admin_id_snapshot)
 
     context.bot_data.get("route_offer_cycles", {}).pop(route_id, None)
@@ -7167,14 +7342,17 @@ def _handle_route_accept(update, context, route_id):
     _schedule_persistent_job(
         context, _route_arrival_inactivity_job, ARRIVAL_INACTIVITY_SECONDS,
         "ruta_arr_inactive_{}".format(route_id), {"route_id": route_id, "courier_id": courier_id},
+        entity_id=route_id,
     )
     _schedule_persistent_job(
         context, _route_arrival_warn_job, ARRIVAL_WARN_SECONDS,
         "ruta_arr_warn_{}".format(route_id), {"route_id": route_id, "courier_id": courier_id},
+        entity_id=route_id,
     )
     _schedule_persistent_job(
         context, _route_arrival_deadline_job, ARRIVAL_DEADLINE_SECONDS,
         "ruta_arr_deadline_{}".format(route_id), {"route_id": route_id, "courier_id": courier_id},
+        entity_id=route_id,
     )
 
     _notify_ally_route_accepted(context, route, courier["full_name"] or "Repartidor")
@@ -7383,19 +7561,19 @@ def _cancel_route_arrival_jobs(context, route_id):
     for suffix in ("inactive", "warn", "deadline"):
         if suffix == "deadline":
             continue
-        _cancel_persistent_job(context, "ruta_arr_{}_{}".format(suffix, route_id))
+        _cancel_persistent_job(context, "ruta_arr_{}_{}".format(suffix, route_id), entity_id=route_id)
     _cancel_route_arrival_deadline_job(context, route_id)
     _cancel_route_wait_override_reminder_job(context, route_id)
 
 
 def _cancel_route_arrival_deadline_job(context, route_id):
     """Cancela solo la liberacion automatica T+20 de llegada para una ruta."""
-    _cancel_persistent_job(context, "ruta_arr_deadline_{}".format(route_id))
+    _cancel_persistent_job(context, "ruta_arr_deadline_{}".format(route_id), entity_id=route_id)
 
 
 def _cancel_route_wait_override_reminder_job(context, route_id):
     """Cancela el recordatorio suave posterior a la espera manual de la ruta."""
-    _cancel_persistent_job(context, "ruta_arr_wait_reminder_{}".format(route_id))
+    _cancel_persistent_job(context, "ruta_arr_wait_reminder_{}".format(route_id), entity_id=route_id)
 
 
 def _schedule_route_wait_override_reminder_job(context, route_id):
@@ -7406,6 +7584,7 @@ def _schedule_route_wait_override_reminder_job(context, route_id):
         WAITING_OVERRIDE_REMINDER_SECONDS,
         "ruta_arr_wait_reminder_{}".format(route_id),
         {"route_id": route_id},
+        entity_id=route_id,
     )
 
 
@@ -7470,11 +7649,13 @@ def _handle_route_pickup_confirm(update, context, route_id):
 
     courier_name = courier["full_name"] or "El repartidor"
     _notify_ally_route_courier_arrived(context, route, courier_name)
-    context.job_queue.run_once(
+    _run_timer(
+        context,
         _route_pickup_autoconfirm_job,
         PICKUP_AUTOCONFIRM_SECONDS,
-        context={"route_id": route_id},
-        name="route_pickup_autoconfirm_{}".format(route_id),
+        "route_pickup_autoconfirm_{}".format(route_id),
+        {"route_id": route_id},
+        entity_id=route_id,
     )
     query.edit_message_text(
         "Llegada confirmada. Avisamos al aliado — se confirmara automaticamente en 2 minutos si no hay novedad."
@@ -7998,51 +8179,11 @@ def _handle_route_arrival_release(update, context, route_id):
 
 
 def _handle_route_reject(update, context, route_id):
-    query = update.callback_query
-    route = get_route_by_id(route_id)
-    if not route or route["status"] != "PUBLISHED":
-        query.edit_message_text("Esta oferta ya no esta disponible.")
-        return
-
-    telegram_id = update.effective_user.id
-    courier = get_courier_by_telegram_id(telegram_id)
-    if not courier:
-        query.edit_message_text("Oferta de ruta #{} rechazada.".format(route_id))
-        return
-
-    current = get_current_route_offer(route_id)
-    if not current or current["courier_id"] != courier["id"]:
-        query.edit_message_text("Esta oferta ya no esta disponible para ti.")
-        return
-
-    _cancel_route_offer_jobs(context, route_id, current["queue_id"])
-    mark_route_offer_response(current["queue_id"], "REJECTED")
-    query.edit_message_text("Oferta de ruta #{} rechazada.".format(route_id))
-    _send_next_route_offer(route_id, context)
+    _ROUTE_DISPATCH.respond(update, context, route_id, "REJECTED")
 
 
 def _handle_route_busy(update, context, route_id):
-    query = update.callback_query
-    route = get_route_by_id(route_id)
-    if not route or route["status"] != "PUBLISHED":
-        query.edit_message_text("Esta oferta ya no esta disponible.")
-        return
-
-    telegram_id = update.effective_user.id
-    courier = get_courier_by_telegram_id(telegram_id)
-    if not courier:
-        query.edit_message_text("Oferta de ruta #{} rechazada.".format(route_id))
-        return
-
-    current = get_current_route_offer(route_id)
-    if not current or current["courier_id"] != courier["id"]:
-        query.edit_message_text("Esta oferta ya no esta disponible para ti.")
-        return
-
-    _cancel_route_offer_jobs(context, route_id, current["queue_id"])
-    mark_route_offer_response(current["queue_id"], "BUSY")
-    query.edit_message_text("Registrado. Te saltamos esta ruta.")
-    _send_next_route_offer(route_id, context)
+    _ROUTE_DISPATCH.respond(update, context, route_id, "BUSY")
 
 
 def _handle_route_deliver_stop(update, context, route_id, seq):
@@ -8583,54 +8724,14 @@ def _handle_route_release_confirm(update, context, route_id, reason_code):
     if not admin_id or not ally_id:
         return
 
-    pickup_lat = route["pickup_lat"]
-    pickup_lng = route["pickup_lng"]
-
-    # Calcular distancia máxima pickup→parada para filtrar bicicletas >3 km
-    _rrel_max_dist_km = None
-    try:
-        import math as _rrelmath
-        _rreldests = get_route_destinations(route_id)
-        for _d in _rreldests:
-            _dlat = _d.get("dropoff_lat") if hasattr(_d, "get") else _d["dropoff_lat"]
-            _dlng = _d.get("dropoff_lng") if hasattr(_d, "get") else _d["dropoff_lng"]
-            if _dlat is not None and _dlng is not None and pickup_lat is not None and pickup_lng is not None:
-                _rlat = _rrelmath.radians(_dlat - pickup_lat)
-                _rlng = _rrelmath.radians(_dlng - pickup_lng)
-                _a = (_rrelmath.sin(_rlat / 2) ** 2
-                      + _rrelmath.cos(_rrelmath.radians(pickup_lat)) * _rrelmath.cos(_rrelmath.radians(_dlat))
-                      * _rrelmath.sin(_rlng / 2) ** 2)
-                _seg_km = 6371.0 * 2 * _rrelmath.atan2(_rrelmath.sqrt(_a), _rrelmath.sqrt(1 - _a))
-                if _rrel_max_dist_km is None or _seg_km > _rrel_max_dist_km:
-                    _rrel_max_dist_km = _seg_km
-    except Exception:
-        pass
-
-    eligible = get_eligible_couriers_for_order(
-        admin_id=admin_id,
-        ally_id=ally_id,
-        requires_cash=bool(_row_value(route, "requires_cash", False)),
-        cash_required_amount=int(_row_value(route, "cash_required_amount", 0) or 0),
-        pickup_lat=pickup_lat,
-        pickup_lng=pickup_lng,
-        order_distance_km=_rrel_max_dist_km,
-    )
-    # Excluir al courier que liberó y a los sin saldo suficiente
-    couriers_re_oferta = []
-    for c in eligible:
-        c_id = c["courier_id"]
-        if c_id == courier["id"]:
-            continue
-        c_admin_id = get_approved_admin_id_for_courier(c_id)
-        if not c_admin_id:
-            continue
-        fee_ok, _ = check_service_fee_available("COURIER", c_id, c_admin_id)
-        if fee_ok:
-            couriers_re_oferta.append(c_id)
-    if not couriers_re_oferta:
+    # Excluir al courier que liberó y a los sin saldo suficiente (mismo camino que la
+    # publicacion de la ruta)
+    courier_ids, _, _ = _ROUTE_DISPATCH.candidate_ids(
+        route_id, route, {"admin_id": admin_id, "ally_id": ally_id}, {courier["id"]},
+    )
+    if not courier_ids:
         return
 
-    courier_ids = couriers_re_oferta
     create_route_offer_queue(route_id, courier_ids)
     update_route_status(route_id, "PUBLISHED", "published_at")
 
@@ -8786,12 +8887,13 @@ def _admin_can_resolve_support_request(admin, telegram_id, support_admin_id):
     return es_admin_plataforma(telegram_id)
 
 
-def _cancel_support_follow_up_jobs(context, support_id):
+def _cancel_support_follow_up_jobs(context, support_id, entity_id):
+    """entity_id: pedido o ruta de la solicitud (el shard de sus timers)."""
     for name in [
         "support_reminder_{}".format(support_id),
         "support_escalation_{}".format(support_id),
     ]:
-        _cancel_persistent_job(context, name)
+        _cancel_persistent_job(context, name, entity_id=entity_id)
 
 
 def _log_support_request_event(event, **data):
@@ -8806,14 +8908,15 @@ def _log_support_request_event(event, **data):
         logger.info("support_request_%s", event)
 
 
-def _schedule_support_follow_up_jobs(context, support_id):
-    _cancel_support_follow_up_jobs(context, support_id)
+def _schedule_support_follow_up_jobs(context, support_id, entity_id):
+    _cancel_support_follow_up_jobs(context, support_id, entity_id)
     _schedule_persistent_job(
         context,
         _support_request_reminder_job,
         SUPPORT_REQUEST_REMINDER_SECONDS,
         "support_reminder_{}".format(support_id),
         {"support_id": support_id},
+        entity_id=entity_id,
     )
     _schedule_persistent_job(
         context,
@@ -8821,6 +8924,7 @@ def _schedule_support_follow_up_jobs(context, support_id):
         SUPPORT_REQUEST_ESCALATION_SECONDS,
         "support_escalation_{}".format(support_id),
         {"support_id": support_id},
+        entity_id=entity_id,
     )
     _log_support_request_event(
         "jobs_scheduled",
@@ -8830,8 +8934,8 @@ def _schedule_support_follow_up_jobs(context, support_id):
     )
 
 
-def _handle_duplicate_support_request(query, context, support_id, support_type, admin_id, target_label):
-    _schedule_support_follow_up_jobs(context, support_id)
+def _handle_duplicate_support_request(query, context, support_id, support_type, admin_id, target_label, entity_id):
+    _schedule_support_follow_up_jobs(context, support_id, entity_id)
     notified = _dispatch_support_request_notification(context, support_id, admin_id)
     _log_support_request_event(
         "duplicate_retry",
@@ -9027,6 +9131,7 @@ def _handle_pin_issue_report(update, context, order_id):
             SUPPORT_TYPE_DELIVERY_PIN,
             admin_id,
             "este pedido",
+            order_id,
         )
         return
 
@@ -9038,7 +9143,7 @@ def _handle_pin_issue_report(update, context, order_id):
         order_id=order_id,
         courier_id=courier["id"],
     )
-    _schedule_support_follow_up_jobs(context, support_id)
+    _schedule_support_follow_up_jobs(context, support_id, order_id)
     notified = _notify_admin_pin_issue(context, order, courier, admin_id, support_id)
     if notified:
         query.edit_message_text(
@@ -9164,7 +9269,7 @@ def _handle_admin_pinissue_action(update, context, order_id, action):
         return
 
     if action == "fin":
-        _cancel_support_follow_up_jobs(context, support["id"])
+        _cancel_support_follow_up_jobs(context, support["id"], order_id)
         resolve_support_request(support["id"], "DELIVERED", admin["id"])
         _cancel_delivery_reminder_jobs(context, order_id)
         _do_deliver_order(context, order, support["courier_id"])
@@ -9175,7 +9280,7 @@ def _handle_admin_pinissue_action(update, context, order_id, action):
         _notify_courier_support_resolved(context, support["courier_id"], order_id, "fin")
 
     elif action == "cancel_courier":
-        _cancel_support_follow_up_jobs(context, support["id"])
+        _cancel_support_follow_up_jobs(context, support["id"], order_id)
         resolve_support_request(support["id"], "CANCELLED_COURIER", admin["id"])
         _cancel_delivery_reminder_jobs(context, order_id)
         cancel_order(order_id, "ADMIN")
@@ -9196,7 +9301,7 @@ def _handle_admin_pinissue_action(update, context, order_id, action):
         _notify_courier_support_resolved(context, support["courier_id"], order_id, "cancel_courier")
 
     elif action == "cancel_ally":
-        _cancel_support_follow_up_jobs(context, support["id"])
+        _cancel_support_follow_up_jobs(context, support["id"], order_id)
         resolve_support_request(support["id"], "CANCELLED_ALLY", admin["id"])
         _cancel_delivery_reminder_jobs(context, order_id)
         cancel_order(order_id, "ADMIN")
@@ -9390,6 +9495,7 @@ def _handle_route_pin_issue(update, context, route_id, seq):
             SUPPORT_TYPE_ROUTE_STOP_PIN,
             admin_id,
             "esta parada",
+            route_id,
         )
         return
 
@@ -9402,7 +9508,7 @@ def _handle_route_pin_issue(update, context, route_id, seq):
         route_seq=seq,
         courier_id=courier["id"],
     )
-    _schedule_support_follow_up_jobs(context, support_id)
+    _schedule_support_follow_up_jobs(context, support_id, route_id)
     notified = _notify_admin_route_pin_issue(context, route, stop, courier, admin_id, support_id)
     if notified:
         query.edit_message_text(
@@ -9533,7 +9639,7 @@ def _handle_admin_route_pinissue_action(update, context, route_id, seq, action):
     courier_id = support["courier_id"]
 
     if action == "fin":
-        _cancel_support_follow_up_jobs(context, support["id"])
+        _cancel_support_follow_up_jobs(context, support["id"], route_id)
         resolve_support_request(support["id"], "DELIVERED", admin["id"])
         deliver_route_stop(route_id, seq)
         query.edit_message_text("Parada {} de la ruta #{} finalizada.".format(seq, route_id))
@@ -9541,7 +9647,7 @@ def _handle_admin_route_pinissue_action(update, context, route_id, seq, action):
 
     elif action in ("cancel_courier", "cancel_ally"):
         resolution = "CANCELLED_COURIER" if action == "cancel_courier" else "CANCELLED_ALLY"
-        _cancel_support_follow_up_jobs(context, support["id"])
+        _cancel_support_follow_up_jobs(context, support["id"], route_id)
         resolve_support_request(support["id"], resolution, admin["id"])
         cancel_route_stop(route_id, seq, resolution)
 
@@ -9759,6 +9865,7 @@ def _handle_order_pickup_pinissue(update, context, order_id):
             SUPPORT_TYPE_PICKUP_PIN,
             admin_id,
             "este pedido",
+            order_id,
         )
         return
 
@@ -9770,7 +9877,7 @@ def _handle_order_pickup_pinissue(update, context, order_id):
         order_id=order_id,
         courier_id=courier["id"],
     )
-    _schedule_support_follow_up_jobs(context, support_id)
+    _schedule_support_follow_up_jobs(context, support_id, order_id)
     notified = _notify_admin_pickup_pinissue(context, order, courier, admin_id, support_id)
     if notified:
         query.edit_message_text(
@@ -9882,7 +9989,7 @@ def _handle_admin_pickup_pinissue_action(update, context, order_id, support_id,
         return
 
     resolution = "CONFIRMED_ARRIVAL" if action == "confirm" else "RELEASED"
-    _cancel_support_follow_up_jobs(context, support["id"])
+    _cancel_support_follow_up_jobs(context, support["id"], order_id)
     ok = resolve_support_request(support["id"], resolution, admin["id"])
     if not ok:
         query.edit_message_text("Esta solicitud ya fue resuelta.")
@@ -9901,11 +10008,13 @@ def _handle_admin_pickup_pinissue_action(update, context, order_id, support_id,
             courier_name = courier["full_name"] if courier else "El repartidor"
             upsert_order_pickup_confirmation(order_id, courier_id, order["ally_id"], "PENDING")
             _notify_ally_courier_arrived(context, order, courier_name)
-            context.job_queue.run_once(
+            _run_timer(
+                context,
                 _pickup_autoconfirm_job,
                 PICKUP_AUTOCONFIRM_SECONDS,
-                context={"order_id": order_id},
-                name="pickup_autoconfirm_{}".format(order_id),
+                "pickup_autoconfirm_{}".format(order_id),
+                {"order_id": order_id},
+                entity_id=order_id,
             )
         try:
             if courier:
@@ -9970,6 +10079,7 @@ def _handle_route_pickup_pinissue(update, context, route_id):
             SUPPORT_TYPE_ROUTE_PICKUP_PIN,
             admin_id,
             "esta ruta",
+            route_id,
         )
         return
 
@@ -9982,7 +10092,7 @@ def _handle_route_pickup_pinissue(update, context, route_id):
         route_seq=0,
         courier_id=courier["id"],
     )
-    _schedule_support_follow_up_jobs(context, support_id)
+    _schedule_support_follow_up_jobs(context, support_id, route_id)
     notified = _notify_admin_route_pickup_pinissue(context, route, courier, admin_id, support_id)
     if notified:
         query.edit_message_text(
@@ -10099,7 +10209,7 @@ def _handle_admin_route_pickup_pinissue_action(update, context, route_id, suppor
         return
 
     resolution = "CONFIRMED_ARRIVAL" if action == "confirm" else "RELEASED"
-    _cancel_support_follow_up_jobs(context, support["id"])
+    _cancel_support_follow_up_jobs(context, support["id"], route_id)
     ok = resolve_support_request(support["id"], resolution, admin["id"])
     if not ok:
         query.edit_message_text("Esta solicitud ya fue resuelta.")
@@ -10114,11 +10224,13 @@ def _handle_admin_route_pickup_pinissue_action(update, context, route_id, suppor
         query.edit_message_text("Llegada confirmada para ruta #{}.".format(route_id))
         courier_name = courier["full_name"] if courier else "El repartidor"
         _notify_ally_route_courier_arrived(context, route, courier_name)
-        context.job_queue.run_once(
+        _run_timer(
+            context,
             _route_pickup_autoconfirm_job,
             PICKUP_AUTOCONFIRM_SECONDS,
-            context={"route_id": route_id},
-            name="route_pickup_autoconfirm_{}".format(route_id),
+            "route_pickup_autoconfirm_{}".format(route_id),
+            {"route_id": route_id},
+            entity_id=route_id,
         )
         try:
             if courier:
@@ -10161,12 +10273,24 @@ JOB_REGISTRY = {
     "_route_wait_override_reminder_job": _route_wait_override_reminder_job,
 }
 
+# Timers que otro proceso puede pedir por nombre (comando TIMER del despacho repartido):
+# los persistentes mas los que solo viven en memoria.
+TIMER_CALLBACKS = dict(
+    JOB_REGISTRY,
+    _offer_timeout_job=_offer_timeout_job,
+    _route_offer_timeout_job=_route_offer_timeout_job,
+    _pickup_autoconfirm_job=_pickup_autoconfirm_job,
+    _route_pickup_autoconfirm_job=_route_pickup_autoconfirm_job,
+)
+
 
-def recover_scheduled_jobs(job_queue):
+def recover_scheduled_jobs(job_queue, shards=None):
     """Al arrancar, reprograma en memoria los jobs persistidos que no fueron ejecutados.
 
-    Llama a esta funcion justo despues de crear el Updater y antes de start_polling().
-    Los jobs cuyo fire_at ya paso se disparan inmediatamente (when=0).
+    Llama a esta funcion justo despues de crear el Updater (y de install_timer_wheel,
+    si se usa) y antes de start_polling(). Los jobs cuyo fire_at ya paso se disparan
+    inmediatamente (when=0); con la rueda instalada, en el siguiente tick. Con shards,
+    solo los de esos shards del despacho repartido (al tomar sus leases).
     """
     from datetime import datetime, timezone
     try:
@@ -10175,25 +10299,36 @@ def recover_scheduled_jobs(job_queue):
         logger.warning("recover_scheduled_jobs: no se pudo leer scheduled_jobs: %s", e)
         return
 
+    wheel = timer_wheel_for(job_queue)
     recovered = 0
     skipped = 0
+    if shards is not None:
+        shards = set(shards)
+    guarded = dispatch_leases() is not None
     for row in pending:
         job_name = row["job_name"]
         callback_name = row["callback_name"]
         fire_at_str = row["fire_at"]
         job_data_json = row["job_data"] or "{}"
 
+        try:
+            job_data = json.loads(job_data_json)
+        except Exception:
+            job_data = {}
+
+        entity_id = row.get("entity_id")
+        if entity_id is None:
+            # Filas anteriores a la columna entity_id
+            entity_id = job_data.get("order_id") or job_data.get("route_id") or 0
+        if shards is not None and dispatch_shard(entity_id) not in shards:
+            continue
+
         callback = JOB_REGISTRY.get(callback_name)
         if callback is None:
             logger.warning("recover_scheduled_jobs: callback desconocido %s (job %s) - omitido", callback_name, job_name)
             skipped += 1
             continue
 
-        try:
-            job_data = json.loads(job_data_json)
-        except Exception:
-            job_data = {}
-
         try:
             fire_at = datetime.fromisoformat(fire_at_str)
         except Exception:
@@ -10202,8 +10337,13 @@ def recover_scheduled_jobs(job_queue):
         now = datetime.now(timezone.utc).replace(tzinfo=None)
         delay = max(0, (fire_at - now).total_seconds())
 
+        if guarded:
+            callback = _shard_guarded(callback, entity_id)
         try:
-            job_queue.run_once(callback, when=delay, context=job_data, name=job_name)
+            if wheel is not None:
+                wheel.schedule(job_name, callback, delay, job_data)
+            else:
+                job_queue.run_once(callback, when=delay, context=job_data, name=job_name)
             recovered += 1
             logger.info("recover_scheduled_jobs: reprogramado %s en %.0fs", job_name, delay)
         except Exception as e:
@@ -10287,18 +10427,32 @@ def recover_active_offer_dispatches(updater):
     """Rehidrata ofertas activas tras reinicio para que pedidos y rutas no queden huerfanos."""
     from types import SimpleNamespace
 
-    retry_counts = _get_pending_market_retry_counts()
-    runtime = SimpleNamespace(
+    _recover_offer_dispatches(SimpleNamespace(
         bot=updater.bot,
         job_queue=updater.job_queue,
         bot_data=updater.dispatcher.bot_data,
-    )
+    ))
+
 
+def _recover_offer_dispatches(runtime, shards=None):
+    """Rehidrata las ofertas activas (todas, o las de esos shards del despacho repartido)."""
+    def in_shards(record):
+        return shards is None or dispatch_shard(_row_value(record, "id")) in shards
+
+    retry_counts = _get_pending_market_retry_counts()
     recovered_orders = 0
     rescheduled_order_timeouts = 0
-    for order in get_all_orders(status_filter="ACTIVE", limit=500):
-        if _row_value(order, "status") != "PUBLISHED":
-            continue
+    published_orders = [
+        order for order in get_all_orders(status_filter="ACTIVE", limit=500)
+        if _row_value(order, "status") == "PUBLISHED" and in_shards(order)
+    ]
+    # Reconstruye en memoria, con una sola consulta, las colas de ofertas desde la tabla.
+    # Si falla, cada cola se reconstruye sola en su primer acceso.
+    try:
+        order_offer_store.preload([int(_row_value(order, "id")) for order in published_orders])
+    except Exception as e:
+        logger.warning("recover_active_offer_dispatches: preload de colas de pedidos fallo: %s", e)
+    for order in published_orders:
 
         order_id = int(_row_value(order, "id"))
         order_cycles = runtime.bot_data.setdefault("offer_cycles", {})
@@ -10314,24 +10468,25 @@ def recover_active_offer_dispatches(updater):
             )
             cycle_info = existing_cycle
         else:
-            order_cycles[order_id] = recovered_cycle
             cycle_info = recovered_cycle
+        order_cycles[order_id] = cycle_info
 
         current = get_current_offer_for_order(order_id)
         if current:
             job_name = "offer_timeout_{}_{}".format(order_id, current["queue_id"])
-            for job in runtime.job_queue.get_jobs_by_name(job_name):
-                job.schedule_removal()
-            runtime.job_queue.run_once(
+            _cancel_timer(runtime, job_name, entity_id=order_id)
+            _run_timer(
+                runtime,
                 _offer_timeout_job,
-                when=_remaining_timeout_seconds(current.get("offered_at"), OFFER_TIMEOUT_SECONDS),
-                context=_build_market_job_data(
+                _remaining_timeout_seconds(current.get("offered_at"), OFFER_TIMEOUT_SECONDS),
+                job_name,
+                _build_market_job_data(
                     "order_id",
                     order_id,
                     _coerce_market_retry_count(cycle_info.get("market_retry_count")),
                     extra={"queue_id": current["queue_id"]},
                 ),
-                name=job_name,
+                entity_id=order_id,
             )
             rescheduled_order_timeouts += 1
             continue
@@ -10341,7 +10496,12 @@ def recover_active_offer_dispatches(updater):
 
     recovered_routes = 0
     rescheduled_route_timeouts = 0
-    for route in get_routes_by_status("PUBLISHED", limit=500):
+    published_routes = [route for route in get_routes_by_status("PUBLISHED", limit=500) if in_shards(route)]
+    try:
+        route_offer_store.preload([int(_row_value(route, "id")) for route in published_routes])
+    except Exception as e:
+        logger.warning("recover_active_offer_dispatches: preload de colas de rutas fallo: %s", e)
+    for route in published_routes:
         route_id = int(_row_value(route, "id"))
         route_cycles = runtime.bot_data.setdefault("route_offer_cycles", {})
         recovered_cycle = _build_recovered_route_cycle_info(
@@ -10356,24 +10516,25 @@ def recover_active_offer_dispatches(updater):
             )
             cycle_info = existing_cycle
         else:
-            route_cycles[route_id] = recovered_cycle
             cycle_info = recovered_cycle
+        route_cycles[route_id] = cycle_info
 
         current = get_current_route_offer(route_id)
         if current:
             job_name = "route_offer_timeout_{}_{}".format(route_id, current["queue_id"])
-            for job in runtime.job_queue.get_jobs_by_name(job_name):
-                job.schedule_removal()
-            runtime.job_queue.run_once(
+            _cancel_timer(runtime, job_name, entity_id=route_id)
+            _run_timer(
+                runtime,
                 _route_offer_timeout_job,
-                when=_remaining_timeout_seconds(current.get("offered_at"), ROUTE_OFFER_TIMEOUT_SECONDS),
-                context=_build_market_job_data(
+                _remaining_timeout_seconds(current.get("offered_at"), ROUTE_OFFER_TIMEOUT_SECONDS),
+                job_name,
+                _build_market_job_data(
                     "route_id",
                     route_id,
                     _coerce_market_retry_count(cycle_info.get("market_retry_count")),
                     extra={"queue_id": current["queue_id"]},
                 ),
-                name=job_name,
+                entity_id=route_id,
             )
             rescheduled_route_timeouts += 1
             continue
@@ -10390,3 +10551,139 @@ def recover_active_offer_dispatches(updater):
         len(retry_counts["orders"]),
         len(retry_counts["routes"]),
     )
+
+
+# ---------------------------------------------------------------------------
+# Despacho repartido entre procesos (dispatch_shards)
+# ---------------------------------------------------------------------------
+
+_SERVICE_DISPATCHES = {"ORDER": _ORDER_DISPATCH, "ROUTE": _ROUTE_DISPATCH}
+_OFFER_STORES = {"ORDER": order_offer_store, "ROUTE": route_offer_store}
+
+# Claves de bot_data que pasan a dispatch_state; las de ciclos y mensajes de oferta solo
+# las escribe el duenio del shard (con token de fencing).
+SHARED_DISPATCH_STATE_KEYS = (
+    "offer_cycles",
+    "offer_messages",
+    "route_offer_cycles",
+    "route_offer_messages",
+    "route_accepted_pos",
+    "arrival_manual_prompted",
+)
+_FENCED_DISPATCH_STATE_KEYS = ("offer_cycles", "offer_messages", "route_offer_cycles", "route_offer_messages")
+
+
+class _ForwardedCallbackQuery:
+    """callback_query minimo para contestar, desde el proceso duenio, al courier que
+    toco la oferta en otro proceso."""
+
+    def __init__(self, bot, chat_id, message_id):
+        self._bot = bot
+        self.message = SimpleNamespace(chat_id=chat_id, message_id=message_id)
+
+    def edit_message_text(self, text, **kwargs):
+        self._bot.edit_message_text(
+            chat_id=self.message.chat_id, message_id=self.message.message_id, text=text, **kwargs
+        )
+
+
+def _run_dispatch_command(context, command, payload):
+    if command == "CALL":
+        dispatch = _SERVICE_DISPATCHES[payload["entity"]]
+        service_id, method, args = int(payload["id"]), payload["method"], payload.get("args") or {}
+        if method == "send_next":
+            dispatch.send_next(service_id, context)
+        elif method == "restart_cycle":
+            dispatch.restart_cycle(service_id, context)
+        elif method == "activate":
+            dispatch.activate(service_id, context, args["cycle_info"], args["courier_ids"])
+        elif method == "expire":
+            dispatch.expire(service_id, args["cycle_info"], context)
+        else:
+            logger.warning("dispatch_commands: metodo desconocido %s", method)
+    elif command == "RESPOND":
+        update = SimpleNamespace(
+            callback_query=_ForwardedCallbackQuery(context.bot, payload["chat_id"], payload["message_id"]),
+            effective_user=SimpleNamespace(id=payload["user_id"]),
+        )
+        _SERVICE_DISPATCHES[payload["entity"]].respond(update, context, int(payload["id"]), payload["response"])
+    elif command == "TIMER":
+        callback = TIMER_CALLBACKS.get(payload["callback"])
+        if callback is None:
+            logger.warning("dispatch_commands: callback desconocido %s", payload["callback"])
+            return
+        delay = max(0, payload["fire_at"] - time.time())
+        _run_timer(context, callback, delay, payload["name"], payload.get("data") or {}, entity_id=payload["entity_id"])
+    elif command == "CANCEL_TIMER":
+        _cancel_timer(context, payload["name"], entity_id=payload["entity_id"])
+    elif command == "FORGET_QUEUE":
+        entity_id = int(payload["id"])
+        _OFFER_STORES[payload["entity"]].forget_owners(lambda owner_id: owner_id == entity_id)
+    else:
+        logger.warning("dispatch_commands: comando desconocido %s", command)
+
+
+def process_dispatch_commands(context) -> int:
+    """Ejecuta, en orden, los comandos que otros procesos dejaron para los shards propios."""
+    commands = take_dispatch_commands()
+    for command_id, command, payload in commands:
+        try:
+            _run_dispatch_command(context, command, payload)
+        except Exception:
+            logger.exception("dispatch_commands: error ejecutando %s #%s", command, command_id)
+    if commands:
+        ack_dispatch_commands([command_id for command_id, _command, _payload in commands])
+    return len(commands)
+
+
+def _adopt_dispatch_shards(context, shards):
+    """Al tomar shards (arranque o caida de otro worker): descarta lo cacheado de esos
+    servicios y recupera sus jobs persistidos y sus ofertas activas."""
+    shards = set(shards)
+    for store in _OFFER_STORES.values():
+        store.forget_owners(lambda owner_id: dispatch_shard(owner_id) in shards)
+    recover_scheduled_jobs(context.job_queue, shards=shards)
+    _recover_offer_dispatches(context, shards=shards)
+
+
+def _dispatch_shards_job(context):
+    """Job del despacho repartido: renueva leases, adopta shards nuevos y atiende comandos."""
+    leases = dispatch_leases()
+    if leases is None:
+        return
+    try:
+        acquired, lost = leases.maybe_refresh()
+    except Exception as e:
+        logger.warning("dispatch_shards: no se pudieron renovar los leases: %s", e)
+        acquired, lost = [], []
+    if lost:
+        logger.warning("dispatch_shards: shards perdidos %s; sus timers se descartan al vencer", lost)
+    if acquired:
+        _adopt_dispatch_shards(context, acquired)
+    process_dispatch_commands(context)
+
+
+def install_dispatch_sharding(dispatcher, job_queue, worker_id=None):
+    """
+    Activa el despacho repartido en este proceso: leases de shards, estado compartido de
+    bot_data en dispatch_state, colas de oferta sin cache para servicios ajenos y el job
+    que renueva leases y atiende comandos. Los jobs y ofertas de cada shard se recuperan
+    al tomar su lease (en vez de recover_scheduled_jobs / recover_active_offer_dispatches).
+    """
+    leases = install_dispatch_leases(ShardLeases(DISPATCH_LEASE_RESOURCE, DISPATCH_SHARDS, worker_id))
+    for key in SHARED_DISPATCH_STATE_KEYS:
+        dispatcher.bot_data[key] = SharedDispatchState(key, fenced=key in _FENCED_DISPATCH_STATE_KEYS)
+    for entity_type, store in _OFFER_STORES.items():
+        store.owns = owns_dispatch
+        store.on_foreign_write = (
+            lambda owner_id, entity_type=entity_type:
+            forward_dispatch_command(owner_id, "FORGET_QUEUE", {"entity": entity_type, "id": owner_id})
+        )
+    job_queue.run_repeating(
+        _dispatch_shards_job,
+        interval=DISPATCH_COMMAND_POLL_SECONDS,
+        first=0,
+        name="dispatch_shards",
+    )
+    logger.info("dispatch_shards: despacho repartido activo (worker %s)", leases.worker_id)
+    return leases
@@ -5,8 +5,13 @@ import logging
 import math
 import os
 import re
+import threading
+import time
 import unicodedata
 import urllib.request
+from bisect import bisect_right
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
 from datetime import datetime, timedelta, timezone
 
 logger = logging.getLogger(__name__)
@@ -46,6 +51,10 @@ from db import (
     P,
     DB_ENGINE,
     _row_value,
+    _refresh_admin_inbox,
+    _refresh_ally_inbox,
+    _refresh_courier_inbox,
+    INBOX_RECHARGES,
     SUPPORT_TYPE_DELIVERY_PIN,
     SUPPORT_TYPE_ROUTE_STOP_PIN,
     SUPPORT_TYPE_PICKUP_PIN,
@@ -171,9 +180,8 @@ from db import (
     add_route_incentive,
     update_order_payment,
     get_orders_by_ally,
-    get_ally_orders_between,
-    get_ally_routes_between,
-    get_orders_by_courier,
+    get_history_day_totals,
+    get_history_page,
     get_courier_daily_earnings_history,
     get_courier_earnings_by_date,
     get_courier_earnings_between,
@@ -243,15 +251,31 @@ from db import (
     assign_route_to_courier,
     deliver_route_stop,
     cancel_route,
-    create_route_offer_queue,
-    get_next_pending_route_offer,
-    mark_route_offer_as_offered,
-    mark_route_offer_response,
-    get_current_route_offer,
-    delete_route_offer_queue,
-    reset_route_offer_queue,
     get_all_online_couriers,
     get_active_orders_without_courier,
+    get_ops_feed_last_event_id,
+    list_ops_feed_events_since,
+    prune_ops_feed_events,
+    get_change_versions,
+    prune_dispatch_events,
+    archive_finished_orders,
+    get_admin_inbox_counts,
+    reconcile_admin_inbox_counters,
+    INBOX_PLATFORM_ADMIN_ID,
+    INBOX_COURIERS,
+    INBOX_ALLIES,
+    INBOX_SUPPORT,
+    INBOX_CHANGE_REQUESTS,
+    INBOX_REFERENCES,
+    INBOX_PARKING,
+    count_broadcast_audience,
+    create_broadcast,
+    get_broadcast,
+    cancel_broadcast,
+    BROADCAST_ROLE_COURIER,
+    BROADCAST_ROLE_ALLY,
+    BROADCAST_ROLE_ALL,
+    get_courier_dispatch_links,
     block_courier_for_ally,
     unblock_courier_for_ally,
     get_blocked_courier_ids_for_ally,
@@ -288,8 +312,6 @@ from db import (
     list_admin_customer_addresses,
     increment_admin_customer_usage,
     increment_admin_customer_address_usage,
-    # Re-exports offer queue
-    clear_offer_queue,
     # Re-exports order_support_requests
     create_or_get_pending_support_request,
     create_order_support_request,
@@ -313,8 +335,8 @@ from db import (
     increment_order_template_usage,
     delete_order_template,
     # Re-exports pedidos especiales admin y couriers excluidos
-    get_admin_special_orders_between,
     get_admin_special_orders_recent,
+    get_special_orders_metrics,
     get_order_excluded_couriers,
     reset_order_excluded_couriers,
     add_order_excluded_courier,
@@ -356,7 +378,28 @@ from db import (
     get_all_local_admins_approved,
     # Re-exports suscripciones
     get_expiring_ally_subscriptions,
+)
+# Colas de ofertas: motor en memoria con escritura por lotes (offer_queue.py)
+from offer_queue import (
+    clear_offer_queue,
+    create_route_offer_queue,
+    get_next_pending_route_offer,
+    mark_route_offer_as_offered,
+    mark_route_offer_response,
+    get_current_route_offer,
+    delete_route_offer_queue,
+    reset_route_offer_queue,
+)
+# Analitica de despacho: eventos por lotes + agregados horarios (dispatch_analytics.py)
+from dispatch_analytics import (
+    build_dispatch_funnel,
+    build_dispatch_heatmap,
+    record_dispatch_signal,
 )
+# Modelo de demanda: curvas de aceptacion entrenadas desde el historico (demand_model.py)
+from demand_model import DEMAND_TARGET_PROBABILITY, suggest_incentive, train_demand_model
+# Modo webhook: cola durable de updates de Telegram por particion de chat (update_queue.py)
+from update_queue import ingest_telegram_update
 
 
 BOT_POLLING_LOCK_ID = 42010
@@ -750,28 +793,84 @@ def _parse_local_alias_point(raw_value: Any) -> Optional[Dict[str, Any]]:
     return None
 
 
-def _resolve_local_reference(text: str) -> Optional[Dict[str, Any]]:
+class _LocalAliasIndex:
     """
-    Busca referencias locales de barrio/conjunto/punto desde settings.
-    Formato esperado en `location_reference_aliases_json`:
-    {
-      "alfonso lopez": {"lat": 4.81, "lng": -75.69, "label": "Barrio Alfonso Lopez"},
-      "terminal": [4.816, -75.69]
-    }
+    Índice compilado de aliases locales ya normalizados.
+
+    - Aliases contenidos en el texto: automata Aho-Corasick (una pasada sobre el texto).
+    - Texto contenido en un alias: búsqueda sobre todos los aliases concatenados.
+    En ambos casos gana el alias más largo; en empate, el primero configurado.
     """
-    normalized_text = _normalize_reference_key(text)
-    if not normalized_text:
-        return None
 
-    raw = get_setting("location_reference_aliases_json", "")
+    def __init__(self, points: Dict[str, Dict[str, Any]]):
+        self.points = points
+        self._order = {key: i for i, key in enumerate(points)}
+        self._goto = [{}]
+        self._fail = [0]
+        self._best = [None]
+        for key in points:
+            state = 0
+            for ch in key:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._best.append(None)
+                state = nxt
+            self._best[state] = key
+        queue = list(self._goto[0].values())
+        for state in queue:
+            # BFS: el mejor alias de un estado hereda el de su enlace de fallo.
+            self._best[state] = self._pick(self._best[state], self._best[self._fail[state]])
+            for ch, nxt in self._goto[state].items():
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                queue.append(nxt)
+        self._keys = list(points)
+        self._starts = []
+        offset = 0
+        for key in self._keys:
+            self._starts.append(offset)
+            offset += len(key) + 1
+        self._joined = "\n".join(self._keys)
+
+    def _pick(self, a: Optional[str], b: Optional[str]) -> Optional[str]:
+        if a is None or b is None:
+            return a or b
+        if len(a) != len(b):
+            return a if len(a) > len(b) else b
+        return a if self._order[a] < self._order[b] else b
+
+    def lookup(self, normalized_text: str) -> Optional[str]:
+        if normalized_text in self.points:
+            return normalized_text
+        best = None
+        state = 0
+        for ch in normalized_text:
+            while state and ch not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(ch, 0)
+            if self._best[state] is not None:
+                best = self._pick(best, self._best[state])
+        pos = self._joined.find(normalized_text)
+        while pos != -1:
+            idx = bisect_right(self._starts, pos) - 1
+            best = self._pick(best, self._keys[idx])
+            pos = self._joined.find(normalized_text, self._starts[idx] + len(self._keys[idx]) + 1)
+        return best
+
+
+def _build_local_alias_index(raw: str) -> Optional[_LocalAliasIndex]:
     if not raw:
         return None
-
     try:
         aliases = json.loads(raw)
     except Exception:
         return None
-
     if not isinstance(aliases, dict):
         return None
 
@@ -781,19 +880,61 @@ def _resolve_local_reference(text: str) -> Optional[Dict[str, Any]]:
         parsed_point = _parse_local_alias_point(point)
         if key and parsed_point:
             normalized_aliases[key] = parsed_point
-
     if not normalized_aliases:
         return None
+    return _LocalAliasIndex(normalized_aliases)
+
+
+# El setting se relee como máximo cada LOCAL_ALIAS_INDEX_TTL_SECONDS y el índice
+# solo se recompila si el JSON cambió. Aprobar una referencia desde este proceso
+# invalida de inmediato; otros procesos (API web) la ven al vencer el TTL.
+LOCAL_ALIAS_INDEX_TTL_SECONDS = 60
+_local_alias_index_state = {"key": None, "raw": None, "index": None, "checked_at": 0.0}
+_local_alias_index_lock = threading.Lock()
+
+
+def _get_local_alias_index() -> Optional[_LocalAliasIndex]:
+    state = _local_alias_index_state
+    db_key = os.getenv("DATABASE_URL") or os.getenv("DB_PATH", "")
+    now = time.monotonic()
+    if state["key"] == db_key and state["checked_at"] and now - state["checked_at"] < LOCAL_ALIAS_INDEX_TTL_SECONDS:
+        return state["index"]
+    raw = get_setting("location_reference_aliases_json", "") or ""
+    with _local_alias_index_lock:
+        if state["key"] != db_key or raw != state["raw"]:
+            state["index"] = _build_local_alias_index(raw)
+            state["raw"] = raw
+            state["key"] = db_key
+        state["checked_at"] = now
+        return state["index"]
+
+
+def invalidate_local_reference_index():
+    """Fuerza a releer location_reference_aliases_json en la próxima resolución."""
+    _local_alias_index_state["checked_at"] = 0.0
+
 
-    if normalized_text in normalized_aliases:
-        point = normalized_aliases[normalized_text]
-        return {"lat": point["lat"], "lng": point["lng"], "method": "local_alias", "label": point["label"]}
+def _resolve_local_reference(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Busca referencias locales de barrio/conjunto/punto desde settings.
+    Formato esperado en `location_reference_aliases_json`:
+    {
+      "alfonso lopez": {"lat": 4.81, "lng": -75.69, "label": "Barrio Alfonso Lopez"},
+      "terminal": [4.816, -75.69]
+    }
+    """
+    normalized_text = _normalize_reference_key(text)
+    if not normalized_text:
+        return None
 
-    candidates = [k for k in normalized_aliases if k in normalized_text or normalized_text in k]
-    if not candidates:
+    index = _get_local_alias_index()
+    if index is None:
         return None
-    best = max(candidates, key=len)
-    point = normalized_aliases[best]
+
+    best = index.lookup(normalized_text)
+    if best is None:
+        return None
+    point = index.points[best]
     return {"lat": point["lat"], "lng": point["lng"], "method": "local_alias", "label": point["label"]}
 
 
@@ -1027,22 +1168,156 @@ def google_places_text_search(query: str) -> Optional[Dict[str, Any]]:
 
 # ---------- PARSER DE LINKS / COORDS ----------
 
-def expand_short_url(text: str) -> Optional[str]:
-    """Expande links cortos de Google Maps (maps.app.goo.gl / goo.gl)."""
+# ---------- LINKS CORTOS DE GOOGLE MAPS ----------
+# Cada link corto se expande una sola vez: el resultado (URL expandida + coords/place_id
+# extraidos) queda en memoria y en map_link_cache. La expansion corre en un pool acotado
+# (HEAD primero, GET solo si HEAD no redirige) y el hilo que atiende al usuario espera
+# como maximo LINK_EXPAND_WAIT_SECONDS; si el redirect es lento, la expansion termina en
+# segundo plano y el siguiente intento con el mismo link resuelve desde cache.
+
+LINK_EXPAND_WAIT_SECONDS = 4
+LINK_EXPAND_HTTP_TIMEOUT_SECONDS = 6
+LINK_EXPAND_MAX_WORKERS = 4
+LINK_MEMORY_CACHE_MAX = 2000
+_link_memory_cache = OrderedDict()  # raw_link -> dict
+_link_inflight = {}                 # raw_link -> Future
+_link_lock = threading.Lock()
+_link_executor = None
+
+
+def _is_short_maps_link(text: str) -> bool:
+    return "http" in text and ("maps.app.goo.gl" in text or "goo.gl" in text)
+
+
+def _first_url(text: str) -> Optional[str]:
+    return next((t for t in text.split() if t.startswith("http")), None)
+
+
+def _follow_redirects(url: str) -> Optional[str]:
+    """URL final tras los redirects. HEAD primero (sin cuerpo); GET como respaldo."""
+    try:
+        import requests
+    except ImportError:
+        return None
+    headers = {"User-Agent": "Mozilla/5.0 (compatible; DomiBot/1.0)"}
+    try:
+        r = requests.head(url, allow_redirects=True, timeout=LINK_EXPAND_HTTP_TIMEOUT_SECONDS, headers=headers)
+        if r.url and r.url != url and r.status_code < 400:
+            return r.url
+    except Exception:
+        pass
+    try:
+        r = requests.get(url, allow_redirects=True, timeout=LINK_EXPAND_HTTP_TIMEOUT_SECONDS,
+                         headers=headers, stream=True)
+        r.close()
+        if r.url and r.url != url and r.status_code < 400:
+            return r.url
+    except Exception:
+        pass
+    return None
+
+
+def _remember_link(raw_link: str, entry: Dict[str, Any]):
+    with _link_lock:
+        _link_memory_cache[raw_link] = entry
+        _link_memory_cache.move_to_end(raw_link)
+        while len(_link_memory_cache) > LINK_MEMORY_CACHE_MAX:
+            _link_memory_cache.popitem(last=False)
+
+
+def _expand_and_cache_link(raw_link: str) -> Optional[Dict[str, Any]]:
+    try:
+        expanded = _follow_redirects(raw_link)
+        if not expanded:
+            return None
+        coords = extract_lat_lng_from_text(expanded)
+        entry = {
+            "raw_link": raw_link,
+            "expanded_link": expanded,
+            "lat": coords[0] if coords else None,
+            "lng": coords[1] if coords else None,
+            "place_id": extract_place_id_from_url(expanded),
+        }
+        _remember_link(raw_link, entry)
+        try:
+            upsert_link_cache(
+                raw_link, expanded_link=expanded, lat=entry["lat"], lng=entry["lng"],
+                provider="regex" if coords else None, place_id=entry["place_id"],
+            )
+        except Exception as e:
+            logger.warning("[LINK] no se pudo guardar map_link_cache: %s", e)
+        return entry
+    finally:
+        with _link_lock:
+            _link_inflight.pop(raw_link, None)
+
+
+def _get_link_executor() -> ThreadPoolExecutor:
+    global _link_executor
+    with _link_lock:
+        if _link_executor is None:
+            _link_executor = ThreadPoolExecutor(
+                max_workers=LINK_EXPAND_MAX_WORKERS, thread_name_prefix="link-expand"
+            )
+        return _link_executor
+
+
+def resolve_map_link(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Resuelve un link corto de Google Maps: memoria -> map_link_cache -> expansion.
+    Retorna {raw_link, expanded_link, lat, lng, place_id} (lat/lng/place_id pueden
+    ser None) o None si el texto no es link corto o la expansion no termino a tiempo.
+    """
     if not text:
         return None
     text = text.strip()
-    if "http" in text and ("maps.app.goo.gl" in text or "goo.gl" in text):
-        try:
-            import requests
-            url = next((t for t in text.split() if t.startswith("http")), None)
-            if url:
-                headers = {"User-Agent": "Mozilla/5.0 (compatible; DomiBot/1.0)"}
-                r = requests.get(url, allow_redirects=True, timeout=10, headers=headers)
-                return r.url or url
-        except Exception:
-            return None
-    return None
+    if not _is_short_maps_link(text):
+        return None
+    raw_link = _first_url(text)
+    if not raw_link:
+        return None
+
+    with _link_lock:
+        entry = _link_memory_cache.get(raw_link)
+        if entry is not None:
+            _link_memory_cache.move_to_end(raw_link)
+            return dict(entry)
+
+    try:
+        cached = get_link_cache(raw_link)
+    except Exception:
+        cached = None
+    if cached and cached.get("expanded_link"):
+        entry = {
+            "raw_link": raw_link,
+            "expanded_link": cached["expanded_link"],
+            "lat": cached.get("lat"),
+            "lng": cached.get("lng"),
+            "place_id": cached.get("place_id") or extract_place_id_from_url(cached["expanded_link"]),
+        }
+        _remember_link(raw_link, entry)
+        return dict(entry)
+
+    executor = _get_link_executor()
+    with _link_lock:
+        future = _link_inflight.get(raw_link)
+        if future is None:
+            future = executor.submit(_expand_and_cache_link, raw_link)
+            _link_inflight[raw_link] = future
+    try:
+        entry = future.result(timeout=LINK_EXPAND_WAIT_SECONDS)
+    except FuturesTimeoutError:
+        logger.info("[LINK] expansion lenta, continua en segundo plano: %s", raw_link)
+        return None
+    except Exception:
+        return None
+    return dict(entry) if entry else None
+
+
+def expand_short_url(text: str) -> Optional[str]:
+    """Expande links cortos de Google Maps (maps.app.goo.gl / goo.gl), usando cache."""
+    entry = resolve_map_link(text)
+    return entry["expanded_link"] if entry else None
 
 
 def extract_lat_lng_from_text(text: str) -> Optional[Tuple[float, float]]:
@@ -1452,6 +1727,79 @@ def get_fee_config() -> dict:
     }
 
 
+# ---------- METRICAS DE PEDIDOS ESPECIALES (panel) ----------
+# El reporte sale de una sola consulta (get_special_orders_metrics). El panel de
+# plataforma lo pide seguido y con los mismos parametros: se guarda por (alcance,
+# periodo) durante SPECIAL_ORDERS_METRICS_TTL_SECONDS. Un pedido recien cerrado aparece
+# como maximo con ese retraso. 0 desactiva la cache.
+
+SPECIAL_ORDERS_METRICS_TTL_SECONDS = 30
+_special_orders_metrics_cache = {}  # (bd, admin_id, periodo) -> (monotonic de expiracion, reporte)
+_special_orders_metrics_lock = threading.Lock()
+
+
+def special_orders_period_bounds(periodo: str, now: datetime = None) -> Tuple[str, str]:
+    """Rango [inicio, fin) en UTC de un periodo del panel: hoy | ayer | semana | mes | todo."""
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+    if periodo == "hoy":
+        start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        end = now
+    elif periodo == "ayer":
+        yesterday = now - timedelta(days=1)
+        start = yesterday.replace(hour=0, minute=0, second=0, microsecond=0)
+        end = yesterday.replace(hour=23, minute=59, second=59, microsecond=999999)
+    elif periodo == "semana":
+        start = (now - timedelta(days=now.weekday())).replace(hour=0, minute=0, second=0, microsecond=0)
+        end = now
+    elif periodo == "mes":
+        start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        end = now
+    else:  # todo
+        start = datetime(2024, 1, 1)
+        end = now
+    return start.strftime("%Y-%m-%d %H:%M:%S"), end.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def get_special_orders_metrics_report(periodo: str = "semana", admin_id: int = None,
+                                      use_cache: bool = True) -> dict:
+    """
+    Metricas de rentabilidad de pedidos especiales para el panel.
+
+    admin_id: alcance (None = todos los admins + plataforma). Con use_cache, un reporte
+    del mismo alcance y periodo se reutiliza mientras no venza el TTL.
+    """
+    key = (os.getenv("DATABASE_URL") or os.getenv("DB_PATH", ""), admin_id, periodo)
+    ttl = SPECIAL_ORDERS_METRICS_TTL_SECONDS
+    if use_cache and ttl > 0:
+        cached = _special_orders_metrics_cache.get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+
+    start_s, end_s = special_orders_period_bounds(periodo)
+    fee_cfg = get_fee_config()
+    report = get_special_orders_metrics(
+        start_s, end_s,
+        fee_cfg.get("fee_platform_share", 100),
+        fee_cfg.get("fee_special_order_tech_dev_pct", 2),
+        admin_id=admin_id,
+    )
+    report = {"periodo": periodo, "resumen": report["resumen"], "pedidos": report["pedidos"]}
+
+    if use_cache and ttl > 0:
+        now = time.monotonic()
+        with _special_orders_metrics_lock:
+            for stale in [k for k, (exp, _r) in _special_orders_metrics_cache.items() if exp <= now]:
+                del _special_orders_metrics_cache[stale]
+            _special_orders_metrics_cache[key] = (now + ttl, report)
+    return report
+
+
+def clear_special_orders_metrics_cache():
+    """Descarta los reportes guardados: el proximo pedido de cada alcance va a la BD."""
+    with _special_orders_metrics_lock:
+        _special_orders_metrics_cache.clear()
+
+
 def get_buy_pricing_config():
     """Carga la configuracion de recargos por productos (Compras) desde BD.
 
@@ -1644,13 +1992,16 @@ def build_offer_demand_preview(
     requires_cash: bool = False,
     cash_required_amount: int = 0,
     current_incentive: int = 0,
+    entity_type: str = "ORDER",
 ) -> dict:
     """
     Estima la salud del mercado antes de publicar un servicio y sugiere incentivo.
 
-    La recomendacion se basa en la cantidad real de couriers elegibles para el
-    pickup actual, respetando radio, base requerida y filtro team_only cuando
-    aplica.
+    Cuenta los couriers elegibles reales para el pickup (radio, base requerida,
+    saldo para el fee y filtro team_only) y con eso consulta las curvas de
+    aceptacion del historico (demand_model.py) para sugerir incentivo y tiempo
+    estimado hasta aceptacion; sin historico suficiente aplica las reglas fijas.
+    La muestra de oferta queda en la analitica de despacho (entity_type ORDER o ROUTE).
     """
     preview = {
         "signal_code": "UNAVAILABLE",
@@ -1661,6 +2012,8 @@ def build_offer_demand_preview(
         "extra_incentive_suggested": 0,
         "current_incentive": max(0, int(current_incentive or 0)),
         "reason": "No pudimos estimar la demanda sin coordenadas validas de recogida.",
+        "eta_accept_s": None,
+        "model": None,
     }
 
     if not has_valid_coords(pickup_lat, pickup_lng):
@@ -1676,25 +2029,17 @@ def build_offer_demand_preview(
             order_distance_km=float(distance_km or 0),
         )
 
-        if team_only and admin_id:
-            eligible = [
-                c for c in eligible
-                if get_approved_admin_id_for_courier(int(c["courier_id"])) == int(admin_id)
-            ]
-
+        # Vinculo aprobado + saldo para el fee en una sola consulta por lotes.
+        links = get_courier_dispatch_links([c["courier_id"] for c in eligible])
+        required_balance = get_fee_config()["fee_service_total"]
         relanzables = []
         for courier in eligible:
-            courier_id = int(courier["courier_id"])
-            courier_admin_id = get_approved_admin_id_for_courier(courier_id)
-            if courier_admin_id is None:
+            link = links.get(int(courier["courier_id"]))
+            if link is None or link[1] < required_balance:
                 continue
-            fee_ok, _ = check_service_fee_available(
-                target_type="COURIER",
-                target_id=courier_id,
-                admin_id=courier_admin_id,
-            )
-            if fee_ok:
-                relanzables.append(courier)
+            if team_only and admin_id and link[0] != int(admin_id):
+                continue
+            relanzables.append(courier)
 
         eligible_count = len(relanzables)
         nearest_km = None
@@ -1710,37 +2055,61 @@ def build_offer_demand_preview(
                     float(clng),
                 )
 
-        # Modo red pequena (2026-04-04): con una red aun chica, el semaforo se
-        # mantiene deliberadamente suave para orientar sin alarmar al aliado.
-        # Recordatorio: recalibrar estos umbrales cuando la operacion crezca y
-        # el mercado tenga volumen sostenido de pedidos/couriers.
-        suggested = 0
-        if eligible_count == 0:
-            signal_code = "HIGH"
-            signal_label = "ALTA"
-            reason = "Ahora mismo no vemos repartidores elegibles dentro del radio operativo."
-            suggested = 2000
-        elif eligible_count <= 2:
-            signal_code = "MEDIUM"
-            signal_label = "MEDIA"
-            reason = "Hay pocos repartidores elegibles cerca del pickup, pero el pedido igual puede salir."
-            suggested = 1000
+        distance_km = float(distance_km or 0)
+        model = suggest_incentive(pickup_lat, pickup_lng, distance_km, eligible_count)
+        eta_accept_s = None
+        if model is not None:
+            # Curvas de aceptacion del historico propio (demand_model.py).
+            suggested = int(model["suggested_incentive"])
+            eta_accept_s = model["eta_accept_s"]
+            p_base = model["p_accept_base"]
+            if eligible_count == 0 or p_base < DEMAND_TARGET_PROBABILITY / 2:
+                signal_code, signal_label = "HIGH", "ALTA"
+            elif p_base < DEMAND_TARGET_PROBABILITY:
+                signal_code, signal_label = "MEDIUM", "MEDIA"
+            else:
+                signal_code, signal_label = "LOW", "BAJA"
+            if eligible_count == 0:
+                reason = "Ahora mismo no vemos repartidores elegibles dentro del radio operativo."
+            elif eligible_count <= 2:
+                reason = "Hay pocos repartidores elegibles cerca del pickup."
+            else:
+                reason = "Hay una disponibilidad razonable de repartidores para este pickup."
+            if eta_accept_s is not None:
+                reason += " En servicios parecidos un repartidor acepta en ~{} min{}.".format(
+                    max(1, int(round(eta_accept_s / 60.0))),
+                    " con ese incentivo" if suggested > 0 else "",
+                )
         else:
-            signal_code = "LOW"
-            signal_label = "BAJA"
-            reason = "Hay una disponibilidad razonable de repartidores para este pickup."
+            # Sin historico suficiente: modo red pequena (2026-04-04). Con una red aun
+            # chica, el semaforo se mantiene deliberadamente suave para orientar sin
+            # alarmar al aliado.
+            suggested = 0
+            if eligible_count == 0:
+                signal_code = "HIGH"
+                signal_label = "ALTA"
+                reason = "Ahora mismo no vemos repartidores elegibles dentro del radio operativo."
+                suggested = 2000
+            elif eligible_count <= 2:
+                signal_code = "MEDIUM"
+                signal_label = "MEDIA"
+                reason = "Hay pocos repartidores elegibles cerca del pickup, pero el pedido igual puede salir."
+                suggested = 1000
+            else:
+                signal_code = "LOW"
+                signal_label = "BAJA"
+                reason = "Hay una disponibilidad razonable de repartidores para este pickup."
 
-        distance_km = float(distance_km or 0)
-        if distance_km >= 10:
-            suggested = max(suggested, 1500)
-            reason += " La distancia del servicio es larga."
-        elif distance_km >= 5:
-            suggested = max(suggested, 1000)
-            reason += " La distancia del servicio es media."
+            if distance_km >= 10:
+                suggested = max(suggested, 1500)
+                reason += " La distancia del servicio es larga."
+            elif distance_km >= 5:
+                suggested = max(suggested, 1000)
+                reason += " La distancia del servicio es media."
 
-        if requires_cash and int(cash_required_amount or 0) > 0:
-            suggested = max(suggested, 1500 if eligible_count <= 2 else 1000)
-            reason += " La base requerida reduce el grupo elegible."
+            if requires_cash and int(cash_required_amount or 0) > 0:
+                suggested = max(suggested, 1500 if eligible_count <= 2 else 1000)
+                reason += " La base requerida reduce el grupo elegible."
 
         if team_only and admin_id:
             reason += " La visibilidad limitada a tu equipo reduce el mercado disponible."
@@ -1756,19 +2125,23 @@ def build_offer_demand_preview(
                 "extra_incentive_suggested": max(0, suggested - current_incentive),
                 "current_incentive": current_incentive,
                 "reason": reason.strip(),
+                "eta_accept_s": eta_accept_s,
+                "model": "HISTORICO" if model is not None else "REGLAS",
             }
         )
         logger.info(
-            "offer_demand_preview signal=%s eligible=%s suggested=%s ally_id=%s admin_id=%s team_only=%s distance_km=%.1f requires_cash=%s",
+            "offer_demand_preview signal=%s eligible=%s suggested=%s model=%s ally_id=%s admin_id=%s team_only=%s distance_km=%.1f requires_cash=%s",
             preview["signal_label"],
             eligible_count,
             suggested,
+            preview["model"],
             ally_id,
             admin_id,
             int(bool(team_only)),
             distance_km,
             int(bool(requires_cash)),
         )
+        record_dispatch_signal(entity_type, admin_id, pickup_lat, pickup_lng, eligible_count, nearest_km)
     except Exception as e:
         logger.warning("build_offer_demand_preview: %s", e)
 
@@ -2303,7 +2676,8 @@ def resolve_location(text: str, city_hint: str = None) -> Optional[Dict[str, Any
     Intenta extraer lat/lng de cualquier entrada del usuario:
     1. Coordenadas directas (4.81,-75.69)
     2. Link de Google Maps (corto o largo)
-    3. Geocoding con Google API (solo si hay cuota)
+    3. Geocoding con Google API (solo si hay cuota; los textos que no se lograron
+       ubicar recientemente no se reintentan, ver GEOCODE_NEGATIVE_TTL_SECONDS)
 
     city_hint: contexto geografico opcional (ej: "Barrio El Jardin, Pereira").
     Cuando se provee, se usa como primer sufijo de busqueda en la API para mayor precision.
@@ -2322,18 +2696,27 @@ def resolve_location(text: str, city_hint: str = None) -> Optional[Dict[str, Any
     if coords:
         return {"lat": coords[0], "lng": coords[1], "method": "coords"}
 
-    # 2. Si es link corto, expandir primero
-    expanded = expand_short_url(text)
-    if expanded:
-        coords = extract_lat_lng_from_text(expanded)
-        if coords:
-            return {"lat": coords[0], "lng": coords[1], "method": "link"}
+    # 2. Si es link corto: cache de links (memoria/BD) o expansion acotada
+    link = resolve_map_link(text)
+    if link:
+        if link.get("lat") is not None and link.get("lng") is not None:
+            return {"lat": link["lat"], "lng": link["lng"], "method": "link"}
 
-        # Intentar extraer place_id del link expandido
-        place_id = extract_place_id_from_url(expanded)
+        # Intentar con el place_id del link expandido
+        place_id = link.get("place_id")
         if place_id and can_call_google_today():
             details = google_place_details(place_id)
             if details and details.get("lat") and details.get("lng"):
+                link.update(lat=details["lat"], lng=details["lng"])
+                _remember_link(link["raw_link"], link)
+                try:
+                    upsert_link_cache(
+                        link["raw_link"], lat=details["lat"], lng=details["lng"],
+                        formatted_address=details.get("formatted_address"),
+                        provider=details.get("provider"), place_id=place_id,
+                    )
+                except Exception:
+                    pass
                 return {"lat": details["lat"], "lng": details["lng"], "method": "places_api"}
 
     # 3. Si es link largo de Google Maps
@@ -2366,103 +2749,187 @@ def resolve_location(text: str, city_hint: str = None) -> Optional[Dict[str, Any
             pass
 
     # 6. Geocoding por texto (ultimo recurso, cuesta API)
+    if is_url_like:
+        return None
+    negative_key = _text_cache_key(normalized_text, _normalize_reference_key(city_hint or ""))
+    if _geocode_negative_hit(negative_key):
+        return None
+    return _coalesced_geocode(negative_key, text, normalized_text, city_hint)
+
+
+# ---------- GEOCODING REMOTO: CACHE NEGATIVA + COALESCING ----------
+# Un texto que Google no logró ubicar (habiendo cuota) no se reintenta durante
+# GEOCODE_NEGATIVE_TTL_SECONDS y tampoco vuelve a escribir su candidato "unresolved".
+# Búsquedas idénticas simultáneas (varios usuarios, mismo texto) comparten una sola
+# cascada de llamadas: los demás hilos esperan el resultado del primero.
+
+GEOCODE_NEGATIVE_TTL_SECONDS = 600
+GEOCODE_NEGATIVE_MAX_ENTRIES = 5000
+GEOCODE_INFLIGHT_WAIT_SECONDS = 30
+_geocode_negative_cache = {}   # key -> monotonic de expiracion
+_geocode_inflight = {}         # key -> {"event": threading.Event, "result": ...}
+_geocode_lock = threading.Lock()
+
+
+def _geocode_negative_hit(key: str) -> bool:
+    expires_at = _geocode_negative_cache.get(key)
+    if expires_at is None:
+        return False
+    if expires_at <= time.monotonic():
+        _geocode_negative_cache.pop(key, None)
+        return False
+    return True
+
+
+def _remember_geocode_miss(key: str):
+    now = time.monotonic()
+    with _geocode_lock:
+        if len(_geocode_negative_cache) >= GEOCODE_NEGATIVE_MAX_ENTRIES:
+            for stale in [k for k, exp in _geocode_negative_cache.items() if exp <= now]:
+                del _geocode_negative_cache[stale]
+            if len(_geocode_negative_cache) >= GEOCODE_NEGATIVE_MAX_ENTRIES:
+                oldest = min(_geocode_negative_cache, key=_geocode_negative_cache.get)
+                del _geocode_negative_cache[oldest]
+        _geocode_negative_cache[key] = now + GEOCODE_NEGATIVE_TTL_SECONDS
+
+
+def clear_geocode_negative_cache(normalized_text: str = None):
+    """Olvida fallos recientes (todos, o los de un texto normalizado en cualquier ciudad)."""
+    with _geocode_lock:
+        if normalized_text is None:
+            _geocode_negative_cache.clear()
+            return
+        suffix = "|" + normalized_text
+        for key in [k for k in _geocode_negative_cache if k.endswith(suffix)]:
+            del _geocode_negative_cache[key]
+
+
+def _coalesced_geocode(key: str, text: str, normalized_text: str, city_hint: str = None):
+    with _geocode_lock:
+        inflight = _geocode_inflight.get(key)
+        leader = inflight is None
+        if leader:
+            inflight = {"event": threading.Event(), "result": None}
+            _geocode_inflight[key] = inflight
+    if not leader:
+        if inflight["event"].wait(GEOCODE_INFLIGHT_WAIT_SECONDS):
+            return inflight["result"]
+        return None
+
+    try:
+        result, consulted = _geocode_text_remote(text, normalized_text, city_hint)
+        inflight["result"] = result
+        if result is None:
+            try:
+                upsert_reference_alias_candidate(
+                    raw_text=text,
+                    normalized_text=normalized_text,
+                    source="unresolved",
+                )
+            except Exception:
+                pass
+            if consulted:
+                _remember_geocode_miss(key)
+        return result
+    finally:
+        with _geocode_lock:
+            _geocode_inflight.pop(key, None)
+        inflight["event"].set()
+
+
+def _geocode_text_remote(text: str, normalized_text: str, city_hint: str = None):
+    """
+    Cascada Geocoding -> Places Text Search con cuota.
+    Retorna (resultado | None, consulted) donde consulted indica si se llamo a Google.
+    """
     try:
         quota_ok = can_call_google_today()
     except Exception:
         quota_ok = False
+    if not quota_ok:
+        return None, False
 
-    if quota_ok and not is_url_like:
-        # Cascada de consultas: texto original + sufijo geografico.
-        # city_hint provee contexto especifico del aliado/admin (barrio, ciudad).
-        # Si city_hint ya aparece en el texto, la variante es redundante pero inofensiva.
-        if city_hint and city_hint.lower() not in text.lower():
-            _queries = [
-                f"{text}, {city_hint}",
-                text,
-            ]
-        else:
-            _queries = [
-                text,
-                f"{text}, Pereira, Risaralda, Colombia",
-            ]
-        for _q in _queries:
-            geo = google_geocode_forward(_q)
-            if geo and geo.get("lat") and geo.get("lng"):
-                if _is_allowed_city(geo.get("formatted_address", "")):
-                    try:
-                        upsert_reference_alias_candidate(
-                            raw_text=text,
-                            normalized_text=normalized_text,
-                            suggested_lat=geo["lat"],
-                            suggested_lng=geo["lng"],
-                            source="geocode",
-                        )
-                    except Exception:
-                        pass
-                    try:
-                        upsert_geocoding_text_cache(
-                            normalized_text, geo["lat"], geo["lng"],
-                            formatted_address=geo.get("formatted_address"),
-                            place_id=geo.get("place_id"),
-                            source="geocode",
-                        )
-                    except Exception:
-                        pass
-                    return {
-                        "lat": geo["lat"],
-                        "lng": geo["lng"],
-                        "method": "geocode",
-                        "formatted_address": geo.get("formatted_address", ""),
-                        "place_id": geo.get("place_id"),
-                    }
-
-            try:
-                quota_ok2 = can_call_google_today()
-            except Exception:
-                quota_ok2 = False
-            if not quota_ok2:
-                break
-
-            places = google_places_text_search(_q)
-            if places and places.get("lat") and places.get("lng"):
-                if _is_allowed_city(places.get("formatted_address", "")):
-                    try:
-                        upsert_reference_alias_candidate(
-                            raw_text=text,
-                            normalized_text=normalized_text,
-                            suggested_lat=places["lat"],
-                            suggested_lng=places["lng"],
-                            source="textsearch",
-                        )
-                    except Exception:
-                        pass
-                    try:
-                        upsert_geocoding_text_cache(
-                            normalized_text, places["lat"], places["lng"],
-                            formatted_address=places.get("formatted_address"),
-                            place_id=places.get("place_id"),
-                            source="textsearch",
-                        )
-                    except Exception:
-                        pass
-                    return {
-                        "lat": places["lat"],
-                        "lng": places["lng"],
-                        "method": "geocode",
-                        "formatted_address": places.get("formatted_address", ""),
-                        "place_id": places.get("place_id"),
-                    }
+    # Cascada de consultas: texto original + sufijo geografico.
+    # city_hint provee contexto especifico del aliado/admin (barrio, ciudad).
+    # Si city_hint ya aparece en el texto, la variante es redundante pero inofensiva.
+    if city_hint and city_hint.lower() not in text.lower():
+        _queries = [
+            f"{text}, {city_hint}",
+            text,
+        ]
+    else:
+        _queries = [
+            text,
+            f"{text}, Pereira, Risaralda, Colombia",
+        ]
+    for _q in _queries:
+        geo = google_geocode_forward(_q)
+        if geo and geo.get("lat") and geo.get("lng"):
+            if _is_allowed_city(geo.get("formatted_address", "")):
+                try:
+                    upsert_reference_alias_candidate(
+                        raw_text=text,
+                        normalized_text=normalized_text,
+                        suggested_lat=geo["lat"],
+                        suggested_lng=geo["lng"],
+                        source="geocode",
+                    )
+                except Exception:
+                    pass
+                try:
+                    upsert_geocoding_text_cache(
+                        normalized_text, geo["lat"], geo["lng"],
+                        formatted_address=geo.get("formatted_address"),
+                        place_id=geo.get("place_id"),
+                        source="geocode",
+                    )
+                except Exception:
+                    pass
+                return {
+                    "lat": geo["lat"],
+                    "lng": geo["lng"],
+                    "method": "geocode",
+                    "formatted_address": geo.get("formatted_address", ""),
+                    "place_id": geo.get("place_id"),
+                }, True
 
-    if not is_url_like:
         try:
-            upsert_reference_alias_candidate(
-                raw_text=text,
-                normalized_text=normalized_text,
-                source="unresolved",
-            )
+            quota_ok2 = can_call_google_today()
         except Exception:
-            pass
-    return None
+            quota_ok2 = False
+        if not quota_ok2:
+            break
+
+        places = google_places_text_search(_q)
+        if places and places.get("lat") and places.get("lng"):
+            if _is_allowed_city(places.get("formatted_address", "")):
+                try:
+                    upsert_reference_alias_candidate(
+                        raw_text=text,
+                        normalized_text=normalized_text,
+                        suggested_lat=places["lat"],
+                        suggested_lng=places["lng"],
+                        source="textsearch",
+                    )
+                except Exception:
+                    pass
+                try:
+                    upsert_geocoding_text_cache(
+                        normalized_text, places["lat"], places["lng"],
+                        formatted_address=places.get("formatted_address"),
+                        place_id=places.get("place_id"),
+                        source="textsearch",
+                    )
+                except Exception:
+                    pass
+                return {
+                    "lat": places["lat"],
+                    "lng": places["lng"],
+                    "method": "geocode",
+                    "formatted_address": places.get("formatted_address", ""),
+                    "place_id": places.get("place_id"),
+                }, True
+    return None, True
 
 
 def resolve_location_next(text: str, seen_ids: list, city_hint: str = None) -> Optional[Dict[str, Any]]:
@@ -2741,6 +3208,13 @@ def approve_recharge_request(request_id: int, decided_by_admin_id: int) -> Tuple
             conn.rollback()
             return False, "Solicitud ya procesada."
 
+        # La recarga sale de la bandeja y el vinculo del destinatario pudo quedar APPROVED
+        _refresh_admin_inbox(cur, (INBOX_RECHARGES,), [admin_id])
+        if target_type == "COURIER":
+            _refresh_courier_inbox(cur, target_id)
+        elif target_type == "ALLY":
+            _refresh_ally_inbox(cur, target_id)
+
         conn.commit()
     except Exception:
         conn.rollback()
@@ -2780,6 +3254,7 @@ def reject_recharge_request(request_id: int, decided_by_admin_id: int, note: str
         if cur.rowcount != 1:
             conn.rollback()
             return False, "Solicitud ya procesada."
+        _refresh_admin_inbox(cur, (INBOX_RECHARGES,), [req["admin_id"]])
         conn.commit()
     finally:
         conn.close()
@@ -4335,12 +4810,15 @@ def get_reference_candidate(candidate_id: int):
 def review_reference_candidate(candidate_id: int, new_status: str,
                                 reviewed_by_admin_id, note: str = ""):
     """Aprueba o rechaza un candidato de referencia.  Devuelve (ok, msg)."""
-    return review_reference_alias_candidate(
+    result = review_reference_alias_candidate(
         candidate_id,
         new_status,
         reviewed_by_admin_id=reviewed_by_admin_id,
         note=note,
     )
+    if result[0]:
+        invalidate_local_reference_index()
+    return result
 
 
 def set_reference_candidate_coords(candidate_id: int, lat: float, lng: float) -> bool:
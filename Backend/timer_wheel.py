@@ -0,0 +1,232 @@
+"""
+Rueda de tiempo jerarquica para los timers por servicio del motor de despacho.
+
+Cada pedido/ruta activo programa varios timers (timeout y reintento de oferta, sin
+respuesta, expiracion del mercado, llegada, recordatorios de entrega, autoconfirmacion
+de recogida, soporte). Con un run_once por timer el heap del JobQueue crece con los
+servicios activos y cada cancelacion recorre los jobs con get_jobs_by_name.
+
+Aqui todos esos timers viven en una sola rueda, indexados por su nombre de job (que ya
+codifica tipo de timer + entidad, p.ej. "offer_retry_15"):
+
+- programar, cancelar y reprogramar son O(1): un dict por ranura y un indice por nombre;
+- 4 niveles de 64 ranuras (1 tick = 1 s por defecto, alcance ~194 dias); los timers
+  lejanos bajan de nivel (cascada) a medida que se acercan;
+- un solo job repetitivo del JobQueue avanza la rueda y reparte lo vencido al pool
+  run_async del dispatcher, asi un timer lento (p.ej. editar mensajes) no atrasa al resto.
+
+La persistencia (scheduled_jobs) y la recuperacion con JOB_REGISTRY siguen en
+order_delivery; la rueda solo reemplaza al JobQueue como almacen en memoria.
+"""
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+TIMER_WHEEL_TICK_SECONDS = 1.0
+_SLOT_BITS = 6
+_SLOTS = 1 << _SLOT_BITS
+_MASK = _SLOTS - 1
+_LEVELS = 4
+_MAX_CASCADE_TICKS = 4096  # mas atraso que esto: se re-ubica todo en vez de avanzar tick a tick
+
+
+class Timer:
+    """Timer programado. Expone name/context como un Job de PTB para los callbacks existentes."""
+
+    __slots__ = ("name", "callback", "context", "tick", "level", "slot", "removed", "_wheel")
+
+    def __init__(self, wheel, name, callback, context, tick):
+        self._wheel = wheel
+        self.name = name
+        self.callback = callback
+        self.context = context
+        self.tick = tick
+        self.level = None
+        self.slot = None
+        self.removed = False
+
+    def schedule_removal(self):
+        self._wheel.cancel(self.name, timer=self)
+
+
+class _TimerCallbackContext:
+    """Contexto del callback: el del tick de la rueda, con job = el timer que vence."""
+
+    def __init__(self, base, timer):
+        self._base = base
+        self.job = timer
+
+    def __getattr__(self, name):
+        return getattr(self._base, name)
+
+
+class TimerWheel:
+    """Rueda jerarquica (4 x 64 ranuras). Thread-safe: los handlers programan y cancelan
+    mientras el tick corre en el hilo del JobQueue."""
+
+    def __init__(self, tick_seconds=TIMER_WHEEL_TICK_SECONDS, clock=time.monotonic):
+        self.tick_seconds = float(tick_seconds)
+        self._clock = clock
+        self._origin = clock()
+        self._current = 0
+        self._lock = threading.Lock()
+        self._wheels = [[{} for _ in range(_SLOTS)] for _ in range(_LEVELS)]
+        self._timers = {}
+        self._due = {}
+        self.job_queue = None
+
+    def __len__(self):
+        return len(self._timers)
+
+    def __contains__(self, name):
+        return name in self._timers
+
+    def _now_tick(self):
+        return int((self._clock() - self._origin) / self.tick_seconds)
+
+    def _place(self, timer):
+        delta = timer.tick - self._current
+        if delta <= 0:
+            timer.level, timer.slot = None, None
+            self._due[timer.name] = timer
+            return
+        level = 0
+        while level < _LEVELS - 1 and delta >= 1 << (_SLOT_BITS * (level + 1)):
+            level += 1
+        slot = (timer.tick >> (_SLOT_BITS * level)) & _MASK
+        timer.level, timer.slot = level, slot
+        self._wheels[level][slot][timer.name] = timer
+
+    def _unplace(self, timer):
+        if timer.level is None:
+            self._due.pop(timer.name, None)
+        else:
+            self._wheels[timer.level][timer.slot].pop(timer.name, None)
+
+    def schedule(self, name, callback, when_seconds, context=None):
+        """Programa (o reprograma, si el nombre ya existe) un timer a when_seconds."""
+        with self._lock:
+            tick = self._now_tick() + max(1, math.ceil(float(when_seconds or 0) / self.tick_seconds))
+            previous = self._timers.get(name)
+            if previous is not None:
+                self._unplace(previous)
+                previous.removed = True
+            timer = Timer(self, name, callback, context if context is not None else {}, tick)
+            self._timers[name] = timer
+            self._place(timer)
+            return timer
+
+    def reschedule(self, name, when_seconds):
+        """Mueve un timer existente sin cambiar callback ni datos. False si no existe."""
+        with self._lock:
+            timer = self._timers.get(name)
+            if timer is None:
+                return False
+            self._unplace(timer)
+            timer.tick = self._now_tick() + max(1, math.ceil(float(when_seconds or 0) / self.tick_seconds))
+            self._place(timer)
+            return True
+
+    def cancel(self, name, timer=None):
+        """Cancela el timer con ese nombre. True si habia uno."""
+        with self._lock:
+            current = self._timers.get(name)
+            if current is None or (timer is not None and current is not timer):
+                return False
+            del self._timers[name]
+            self._unplace(current)
+            current.removed = True
+            return True
+
+    def get(self, name):
+        return self._timers.get(name)
+
+    def _cascade(self, level):
+        slot = (self._current >> (_SLOT_BITS * level)) & _MASK
+        bucket = self._wheels[level][slot]
+        if bucket:
+            self._wheels[level][slot] = {}
+            for timer in bucket.values():
+                self._place(timer)
+
+    def _collect(self, bucket, fired):
+        for timer in bucket.values():
+            del self._timers[timer.name]
+            timer.removed = True
+            fired.append(timer)
+
+    def advance(self, now_tick=None):
+        """Avanza la rueda hasta now_tick y retorna los timers vencidos, ordenados por tick."""
+        with self._lock:
+            target = self._now_tick() if now_tick is None else now_tick
+            fired = []
+            if self._due:
+                due, self._due = self._due, {}
+                self._collect(due, fired)
+            if target - self._current > _MAX_CASCADE_TICKS:
+                # Atraso grande (p.ej. proceso suspendido): re-ubicar todo es mas barato.
+                self._current = target
+                pending = [timer for timer in self._timers.values() if not timer.removed]
+                self._wheels = [[{} for _ in range(_SLOTS)] for _ in range(_LEVELS)]
+                for timer in pending:
+                    self._place(timer)
+                if self._due:
+                    due, self._due = self._due, {}
+                    self._collect(due, fired)
+            while self._current < target:
+                self._current += 1
+                for level in range(_LEVELS - 1, 0, -1):
+                    if self._current & ((1 << (_SLOT_BITS * level)) - 1) == 0:
+                        self._cascade(level)
+                bucket = self._wheels[0][self._current & _MASK]
+                if bucket:
+                    self._wheels[0][self._current & _MASK] = {}
+                    self._collect(bucket, fired)
+                if self._due:
+                    due, self._due = self._due, {}
+                    self._collect(due, fired)
+            fired.sort(key=lambda timer: timer.tick)
+            return fired
+
+    def tick(self, context):
+        """Callback del job repetitivo: entrega los timers vencidos al pool run_async del
+        dispatcher (concurrentes, como con un run_once por timer). Sin dispatcher corren aqui."""
+        dispatcher = getattr(context, "dispatcher", None)
+        for timer in self.advance():
+            if dispatcher is not None:
+                dispatcher.run_async(_fire, context, timer)
+            else:
+                _fire(context, timer)
+
+
+def _fire(context, timer):
+    try:
+        timer.callback(_TimerCallbackContext(context, timer))
+    except Exception:
+        logger.exception("TimerWheel: error en timer %s", timer.name)
+
+
+_installed_wheel = None
+
+
+def install_timer_wheel(job_queue, tick_seconds=TIMER_WHEEL_TICK_SECONDS):
+    """Instala la rueda sobre un JobQueue (un job repetitivo por tick). Idempotente."""
+    global _installed_wheel
+    if _installed_wheel is not None and _installed_wheel.job_queue is job_queue:
+        return _installed_wheel
+    wheel = TimerWheel(tick_seconds=tick_seconds)
+    wheel.job_queue = job_queue
+    job_queue.run_repeating(wheel.tick, interval=tick_seconds, first=tick_seconds, name="timer_wheel_tick")
+    _installed_wheel = wheel
+    return wheel
+
+
+def timer_wheel_for(job_queue):
+    """La rueda instalada sobre ese JobQueue, o None (se usa el JobQueue directamente)."""
+    wheel = _installed_wheel
+    if wheel is not None and job_queue is not None and wheel.job_queue is job_queue:
+        return wheel
+    return None
@@ -0,0 +1,215 @@
+"""
+Modo webhook: cola durable de updates de Telegram particionada por chat.
+
+Con long polling solo una instancia puede recibir updates (lock de polling en
+PostgreSQL) y drop_pending_updates descarta lo acumulado en cada reinicio. En modo
+webhook (BOT_UPDATE_MODE=webhook):
+
+- La API (web/api/telegram.py) valida el token secreto de Telegram y guarda cada
+  update en telegram_update_queue con su particion (chat_id mod
+  UPDATE_QUEUE_PARTITIONS). Responde 200 apenas queda guardado.
+- Cada proceso del bot consume solo sus particiones (BOT_WORKER_INDEX de
+  BOT_WORKER_COUNT). Un chat siempre cae en la misma particion, asi su orden y su
+  user_data/estado de conversacion quedan en un solo proceso. Dentro del proceso,
+  ChatOrderedUpdateRunner mantiene el orden por chat.
+- Con leases (dispatch_shards.ShardLeases sobre UPDATE_LEASE_RESOURCE) las particiones
+  no son fijas: si un worker cae, los demas toman las suyas al vencer el lease. El
+  estado de conversacion de esos chats (persistencia local del worker caido) no viaja.
+- Un update se marca DONE cuando termino de procesarse. Los que quedaron en
+  PROCESSING por una caida vuelven a PENDING al arrancar el worker de esa particion,
+  asi un reinicio no pierde updates.
+"""
+import itertools
+import json
+import logging
+import os
+import threading
+import uuid
+
+from db import (
+    claim_telegram_updates,
+    complete_telegram_updates,
+    enqueue_telegram_update,
+    requeue_telegram_updates,
+)
+
+logger = logging.getLogger(__name__)
+
+UPDATE_QUEUE_PARTITIONS = 64
+UPDATE_QUEUE_BATCH = 100
+UPDATE_QUEUE_POLL_SECONDS = 0.25
+UPDATE_QUEUE_MAX_IN_FLIGHT = 400
+UPDATE_QUEUE_RETENTION_HOURS = 24
+UPDATE_LEASE_RESOURCE = "updates"
+
+# Campos del update con chat propio / solo usuario (mismo criterio que update_chat_key).
+_CHAT_FIELDS = (
+    "message", "edited_message", "channel_post", "edited_channel_post",
+    "my_chat_member", "chat_member", "chat_join_request",
+)
+_USER_FIELDS = (
+    "inline_query", "chosen_inline_result", "shipping_query", "pre_checkout_query", "poll_answer",
+)
+
+
+def update_chat_id(payload: dict):
+    """Chat del update crudo (o usuario si no hay chat); None si no tiene ninguno."""
+    for field in _CHAT_FIELDS:
+        chat = (payload.get(field) or {}).get("chat") or {}
+        if chat.get("id") is not None:
+            return int(chat["id"])
+    callback = payload.get("callback_query")
+    if callback:
+        chat = (callback.get("message") or {}).get("chat") or {}
+        if chat.get("id") is not None:
+            return int(chat["id"])
+        if (callback.get("from") or {}).get("id") is not None:
+            return int(callback["from"]["id"])
+    for field in _USER_FIELDS:
+        body = payload.get(field) or {}
+        user = body.get("from") or body.get("user") or {}
+        if user.get("id") is not None:
+            return int(user["id"])
+    return None
+
+
+def update_partition(chat_id) -> int:
+    return int(chat_id) % UPDATE_QUEUE_PARTITIONS if chat_id is not None else 0
+
+
+def owned_partitions(worker_index: int, worker_count: int) -> list:
+    """Particiones que atiende el worker worker_index de worker_count."""
+    worker_count = max(1, int(worker_count))
+    worker_index = int(worker_index) % worker_count
+    return [p for p in range(UPDATE_QUEUE_PARTITIONS) if p % worker_count == worker_index]
+
+
+def ingest_telegram_update(payload: dict) -> bool:
+    """Guarda un update del webhook en su particion. False si era un reintento ya guardado."""
+    chat_id = update_chat_id(payload)
+    return enqueue_telegram_update(
+        int(payload["update_id"]),
+        update_partition(chat_id),
+        chat_id,
+        json.dumps(payload, separators=(",", ":")),
+    )
+
+
+def register_webhook(bot, url: str, secret_token: str):
+    """Registra el webhook en Telegram (setWebhook) sin descartar updates pendientes."""
+    return bot.request.post(
+        "{}/setWebhook".format(bot.base_url),
+        {"url": url, "secret_token": secret_token, "drop_pending_updates": False},
+    )
+
+
+class UpdateQueueConsumer:
+    """
+    Hilo que toma updates de las particiones propias y los entrega al runner por chat.
+    Confirma (DONE) por lotes los que el runner ya termino. Con leases, las particiones
+    propias son las que el worker tiene tomadas (partitions se ignora).
+    """
+
+    def __init__(self, runner, decode, partitions=(), worker_id: str = None,
+                 batch_size: int = UPDATE_QUEUE_BATCH, poll_seconds: float = UPDATE_QUEUE_POLL_SECONDS,
+                 max_in_flight: int = UPDATE_QUEUE_MAX_IN_FLIGHT, leases=None):
+        self._runner = runner
+        self._decode = decode
+        self._leases = leases
+        self.partitions = list(partitions)
+        self.worker_id = worker_id or "{}-{}".format(os.getpid(), uuid.uuid4().hex[:8])
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self.max_in_flight = max_in_flight
+        self._claims = itertools.count(1)
+        self._lock = threading.Lock()
+        self._finished = []
+        self._in_flight = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _done(self, row_id):
+        with self._lock:
+            self._finished.append(row_id)
+            self._in_flight -= 1
+
+    def flush_finished(self):
+        """Confirma (DONE) los updates ya procesados. Al apagar, llamar despues del runner."""
+        with self._lock:
+            finished, self._finished = self._finished, []
+        if not finished:
+            return
+        try:
+            complete_telegram_updates(finished)
+        except Exception as e:
+            logger.warning("update_queue: no se pudieron confirmar %s updates: %s", len(finished), e)
+            with self._lock:
+                self._finished.extend(finished)
+
+    def _refresh_partitions(self, force=False):
+        """Renueva los leases de particiones; las recien tomadas recuperan lo que el
+        duenio anterior dejo en PROCESSING."""
+        if self._leases is None:
+            return
+        acquired, lost = self._leases.refresh() if force else self._leases.maybe_refresh()
+        if acquired:
+            requeued = requeue_telegram_updates(acquired)
+            if requeued:
+                logger.info("update_queue: %s updates de particiones tomadas devueltos a la cola", requeued)
+        self.partitions = self._leases.owned()
+
+    def poll_once(self) -> int:
+        """Confirma lo terminado y entrega un lote nuevo. Retorna cuantos updates entrego."""
+        self.flush_finished()
+        self._refresh_partitions()
+        with self._lock:
+            room = min(self.batch_size, self.max_in_flight - self._in_flight)
+        if room <= 0:
+            return 0
+        token = "{}:{}".format(self.worker_id, next(self._claims))
+        rows = claim_telegram_updates(self.partitions, token, limit=room)
+        for row_id, payload in rows:
+            try:
+                update = self._decode(json.loads(payload))
+            except Exception as e:
+                logger.warning("update_queue: update %s ilegible, se descarta: %s", row_id, e)
+                with self._lock:
+                    self._finished.append(row_id)
+                continue
+            with self._lock:
+                self._in_flight += 1
+            self._runner.submit(update, on_done=lambda row_id=row_id: self._done(row_id))
+        return len(rows)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                delivered = self.poll_once()
+            except Exception as e:
+                logger.warning("update_queue: error leyendo la cola: %s", e)
+                delivered = 0
+            if not delivered:
+                self._stop.wait(self.poll_seconds)
+        self.flush_finished()
+
+    def start(self):
+        """Recupera lo que quedo a medias en estas particiones y arranca el hilo consumidor."""
+        if self._leases is not None:
+            self._refresh_partitions(force=True)
+        else:
+            requeued = requeue_telegram_updates(self.partitions)
+            if requeued:
+                logger.info("update_queue: %s updates en proceso devueltos a la cola", requeued)
+        self._thread = threading.Thread(target=self._run, name="update-queue", daemon=True)
+        self._thread.start()
+        logger.info("update_queue: worker %s consumiendo %s particiones", self.worker_id, len(self.partitions))
+
+    def stop(self, timeout: float = 10.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def release_partitions(self):
+        """Cede los leases de particiones. Llamar despues de flush_finished al apagar."""
+        if self._leases is not None:
+            self._leases.release_all()
@@ -0,0 +1,149 @@
+"""
+Procesamiento concurrente de updates de Telegram con orden estricto por chat.
+
+El Dispatcher de python-telegram-bot procesa los updates uno a uno en su hilo:
+un handler lento (geocoding, optimizacion de ruta, consultas pesadas del panel)
+retrasa a todos los demas usuarios. Este modulo reemplaza `process_update` del
+dispatcher por un enrutador que:
+
+- reparte updates de chats distintos en un pool de N hilos (en paralelo);
+- mantiene una fila FIFO por chat: un chat nunca tiene dos updates en ejecucion
+  a la vez y se procesan en el orden en que llegaron, asi el estado de los
+  ConversationHandler y de context.user_data se conserva igual que antes.
+
+La capa de BD es segura para esto: get_connection() abre una conexion por
+llamada (SQLite en WAL con busy_timeout; PostgreSQL una conexion propia), nunca
+se comparte una conexion entre hilos.
+"""
+import logging
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+BOT_UPDATE_WORKERS = max(1, int(os.getenv("BOT_UPDATE_WORKERS", "8")))
+
+
+def update_chat_key(update):
+    """Clave de orden del update: chat, o usuario si no hay chat. None = sin orden."""
+    chat = getattr(update, "effective_chat", None)
+    if chat is not None and getattr(chat, "id", None) is not None:
+        return ("chat", chat.id)
+    user = getattr(update, "effective_user", None)
+    if user is not None and getattr(user, "id", None) is not None:
+        return ("user", user.id)
+    return None
+
+
+class ChatOrderedUpdateRunner:
+    """Pool de hilos con una fila serial por chat."""
+
+    def __init__(self, process, workers: int = BOT_UPDATE_WORKERS, key_func=update_chat_key):
+        self._process = process
+        self._key_func = key_func
+        self.workers = max(1, int(workers))
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bot-update")
+        self._lock = threading.Lock()
+        self._lanes = {}  # clave -> deque de updates pendientes (existe mientras el chat esta activo)
+
+    def submit(self, update, on_done=None):
+        """Encola el update; on_done() se llama al terminar de procesarlo (con o sin error)."""
+        key = self._key_func(update)
+        if key is None:
+            self._executor.submit(self._run_one, update, on_done)
+            return
+        with self._lock:
+            lane = self._lanes.get(key)
+            if lane is not None:
+                # Ya hay un hilo drenando este chat: se encola detras.
+                lane.append((update, on_done))
+                return
+            self._lanes[key] = deque([(update, on_done)])
+        self._executor.submit(self._drain, key)
+
+    def _run_one(self, update, on_done=None):
+        try:
+            self._process(update)
+        except Exception:
+            # process_update ya enruta errores a los error handlers; esto es la ultima red.
+            logger.exception("Error no controlado procesando update")
+        finally:
+            if on_done is not None:
+                try:
+                    on_done()
+                except Exception:
+                    logger.exception("Error en on_done de update")
+
+    def _drain(self, key):
+        while True:
+            with self._lock:
+                lane = self._lanes[key]
+                if not lane:
+                    del self._lanes[key]
+                    return
+                update, on_done = lane.popleft()
+            self._run_one(update, on_done)
+
+    def pending(self) -> int:
+        with self._lock:
+            return sum(len(lane) for lane in self._lanes.values())
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+
+def install_chat_ordered_processing(dispatcher, workers: int = BOT_UPDATE_WORKERS) -> ChatOrderedUpdateRunner:
+    """
+    Hace que el dispatcher entregue cada update al runner en lugar de procesarlo
+    en su propio hilo. Errores que no son Update (p.ej. TelegramError del polling)
+    siguen el camino original.
+    """
+    original_process_update = dispatcher.process_update
+    runner = ChatOrderedUpdateRunner(original_process_update, workers=workers)
+
+    def process_update(update):
+        if isinstance(update, Exception):
+            original_process_update(update)
+            return
+        runner.submit(update)
+
+    dispatcher.process_update = process_update
+    _serialize_persistence_writes(dispatcher.persistence)
+    logger.info("Updates concurrentes por chat: %s workers", runner.workers)
+    return runner
+
+
+_PERSISTENCE_WRITE_METHODS = (
+    "update_user_data", "update_chat_data", "update_bot_data",
+    "update_callback_data", "update_conversation", "flush",
+)
+
+
+def _serialize_persistence_writes(persistence, attempts: int = 3):
+    """
+    PicklePersistence reescribe el archivo completo en cada update_*; con varios
+    hilos esas escrituras se serializan con un lock. Si un handler de otro chat
+    modifica su user_data justo mientras se serializa el pickle, se reintenta.
+    """
+    if persistence is None:
+        return
+    lock = threading.RLock()
+
+    def wrap(method):
+        def locked(*args, **kwargs):
+            with lock:
+                for attempt in range(attempts):
+                    try:
+                        return method(*args, **kwargs)
+                    except RuntimeError as exc:
+                        if attempt == attempts - 1:
+                            raise
+                        logger.debug("Reintentando escritura de persistencia: %s", exc)
+        return locked
+
+    for name in _PERSISTENCE_WRITE_METHODS:
+        method = getattr(persistence, name, None)
+        if method is not None:
+            setattr(persistence, name, wrap(method))
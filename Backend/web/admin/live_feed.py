@@ -0,0 +1,231 @@
+"""
+Feed en vivo del mapa de operaciones del panel web.
+
+El bot registra en `ops_feed_events` cada movimiento de courier y cada
+transicion de pedido relevante para el mapa. Este modulo mantiene UNA sola
+lectura incremental de ese feed por proceso de la API (sin importar cuantos
+paneles esten abiertos), conserva en memoria el estado actual del mapa y
+reparte a cada suscriptor solo los deltas de su equipo.
+
+Costo en BD: 1 consulta por tick (WHERE id > ultimo_id) + lecturas puntuales
+de las filas que aparecen por primera vez; el snapshot inicial de cada nuevo
+panel sale de memoria.
+"""
+import asyncio
+import logging
+
+from services import (
+    get_all_online_couriers,
+    get_active_orders_without_courier,
+    get_ops_feed_last_event_id,
+    list_ops_feed_events_since,
+)
+
+logger = logging.getLogger(__name__)
+
+LIVE_FEED_POLL_SECONDS = 1.0
+LIVE_FEED_MAX_ORDERS = 200
+LIVE_FEED_QUEUE_SIZE = 1000
+
+_CLOSED_ORDER_STATUSES = {"ACCEPTED", "PICKED_UP", "DELIVERED", "CANCELLED"}
+
+
+def serialize_live_courier(c) -> dict:
+    """Fila de get_all_online_couriers -> dict del mapa (mismo formato que /couriers/active-locations)."""
+    return {
+        "courier_id": c["courier_id"],
+        "full_name": c["full_name"],
+        "telegram_id": c["telegram_id"],
+        "phone": c["phone"],
+        "lat": float(c["live_lat"]) if c["live_lat"] else None,
+        "lng": float(c["live_lng"]) if c["live_lng"] else None,
+        "admin_city": c["admin_city"],
+        "admin_id": c["admin_id"],
+        "last_updated": str(c["live_location_updated_at"]) if c["live_location_updated_at"] else None,
+    }
+
+
+def serialize_unassigned_order(o) -> dict:
+    """Fila de get_active_orders_without_courier -> dict del mapa (mismo formato que /orders/unassigned)."""
+    return {
+        "order_id": o["id"],
+        "status": o["status"],
+        "pickup_address": o["pickup_address"],
+        "pickup_lat": float(o["pickup_lat"]) if o["pickup_lat"] else None,
+        "pickup_lng": float(o["pickup_lng"]) if o["pickup_lng"] else None,
+        "customer_name": o["customer_name"],
+        "ally_name": o["ally_name"],
+        "admin_id": o["admin_id"],
+        "created_at": str(o["created_at"]) if o["created_at"] else None,
+    }
+
+
+def _in_scope(admin_id, scope_admin_id) -> bool:
+    """scope_admin_id None = plataforma (ve todo); ADMIN_LOCAL solo ve su equipo."""
+    return scope_admin_id is None or admin_id == scope_admin_id
+
+
+class LiveOpsHub:
+    """Estado compartido del mapa + fan-out de deltas a los paneles suscritos."""
+
+    def __init__(self, poll_seconds: float = LIVE_FEED_POLL_SECONDS):
+        self.poll_seconds = poll_seconds
+        self.couriers = {}   # courier_id -> dict serializado
+        self.orders = {}     # order_id -> dict serializado
+        self.last_event_id = 0
+        self._subscribers = {}  # asyncio.Queue -> scope_admin_id
+        self._task = None
+        self._ready = None
+
+    # ---------------- carga y aplicacion de eventos (sincrono, corre en thread) ----------------
+
+    def load_state(self):
+        """Carga el estado completo. El cursor se toma ANTES de leer para no perder eventos."""
+        last_id = get_ops_feed_last_event_id()
+        self.couriers = {
+            row["courier_id"]: serialize_live_courier(row) for row in get_all_online_couriers()
+        }
+        self.orders = {
+            row["id"]: serialize_unassigned_order(row)
+            for row in get_active_orders_without_courier(limit=LIVE_FEED_MAX_ORDERS)
+        }
+        self.last_event_id = last_id
+
+    def apply_events(self, events: list) -> list:
+        """Aplica eventos del feed al estado en memoria y retorna los deltas resultantes.
+
+        Movimientos de couriers ya conocidos se resuelven sin BD; couriers y pedidos que
+        aparecen por primera vez se leen en una sola consulta por tipo.
+        """
+        deltas = []
+        new_courier_ids = []
+        order_ids = []
+        for event in events:
+            self.last_event_id = max(self.last_event_id, int(event["id"]))
+            entity_id = int(event["entity_id"])
+            payload = event.get("payload") or {}
+            if event["entity_type"] == "COURIER":
+                if payload.get("state") == "offline":
+                    if entity_id in new_courier_ids:
+                        new_courier_ids.remove(entity_id)
+                    known = self.couriers.pop(entity_id, None)
+                    if known is not None:
+                        deltas.append({"type": "courier_offline", "courier_id": entity_id,
+                                       "admin_id": known["admin_id"]})
+                    continue
+                known = self.couriers.get(entity_id)
+                if known is None:
+                    if entity_id not in new_courier_ids:
+                        new_courier_ids.append(entity_id)
+                    continue
+                known["lat"] = payload.get("lat")
+                known["lng"] = payload.get("lng")
+                known["last_updated"] = str(event.get("created_at") or "") or known["last_updated"]
+                deltas.append({"type": "courier_moved", "courier": dict(known),
+                               "admin_id": known["admin_id"]})
+            else:
+                status = payload.get("status")
+                if status in _CLOSED_ORDER_STATUSES:
+                    if entity_id in order_ids:
+                        order_ids.remove(entity_id)
+                    known = self.orders.pop(entity_id, None)
+                    if known is not None:
+                        deltas.append({"type": "order_removed", "order_id": entity_id,
+                                       "status": status, "admin_id": known["admin_id"]})
+                elif entity_id not in order_ids:
+                    order_ids.append(entity_id)
+
+        if new_courier_ids:
+            for row in get_all_online_couriers(courier_ids=new_courier_ids):
+                courier = serialize_live_courier(row)
+                self.couriers[courier["courier_id"]] = courier
+                deltas.append({"type": "courier_moved", "courier": dict(courier),
+                               "admin_id": courier["admin_id"]})
+        if order_ids:
+            found = set()
+            for row in get_active_orders_without_courier(limit=len(order_ids), order_ids=order_ids):
+                order = serialize_unassigned_order(row)
+                found.add(order["order_id"])
+                self.orders[order["order_id"]] = order
+                deltas.append({"type": "order_upsert", "order": dict(order),
+                               "admin_id": order["admin_id"]})
+            for order_id in order_ids:
+                known = self.orders.pop(order_id, None) if order_id not in found else None
+                if known is not None:
+                    deltas.append({"type": "order_removed", "order_id": order_id,
+                                   "status": None, "admin_id": known["admin_id"]})
+        return deltas
+
+    def poll_once(self) -> list:
+        """Lee los eventos nuevos del feed y retorna los deltas (sincrono)."""
+        events = list_ops_feed_events_since(self.last_event_id)
+        if not events:
+            return []
+        return self.apply_events(events)
+
+    def snapshot(self, scope_admin_id=None) -> dict:
+        """Estado actual del mapa filtrado por equipo, desde memoria."""
+        orders = [o for o in self.orders.values() if _in_scope(o["admin_id"], scope_admin_id)]
+        orders.sort(key=lambda o: o["created_at"] or "")
+        return {
+            "type": "snapshot",
+            "couriers": [c for c in self.couriers.values() if _in_scope(c["admin_id"], scope_admin_id)],
+            "orders": orders,
+        }
+
+    # ---------------- suscripciones (asyncio) ----------------
+
+    async def subscribe(self, scope_admin_id=None):
+        """Registra un panel. Retorna (queue, snapshot inicial)."""
+        self._ensure_running()
+        await self._ready.wait()
+        queue = asyncio.Queue(maxsize=LIVE_FEED_QUEUE_SIZE)
+        self._subscribers[queue] = scope_admin_id
+        return queue, self.snapshot(scope_admin_id)
+
+    def unsubscribe(self, queue):
+        self._subscribers.pop(queue, None)
+
+    def is_subscribed(self, queue) -> bool:
+        return queue in self._subscribers
+
+    def publish(self, deltas: list):
+        """Reparte deltas a cada suscriptor segun su equipo."""
+        for queue, scope_admin_id in list(self._subscribers.items()):
+            for delta in deltas:
+                if not _in_scope(delta.get("admin_id"), scope_admin_id):
+                    continue
+                try:
+                    queue.put_nowait(delta)
+                except asyncio.QueueFull:
+                    # Panel demasiado lento: se descarta y el cliente reconecta con snapshot nuevo.
+                    logger.warning("live_feed: cola llena, se desconecta un suscriptor")
+                    self.unsubscribe(queue)
+                    break
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._ready = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        try:
+            await asyncio.to_thread(self.load_state)
+        except Exception as exc:
+            logger.error("live_feed: no se pudo cargar el estado inicial: %s", exc)
+        self._ready.set()
+        await asyncio.sleep(0)
+        while self._subscribers:
+            await asyncio.sleep(self.poll_seconds)
+            try:
+                deltas = await asyncio.to_thread(self.poll_once)
+            except Exception as exc:
+                logger.warning("live_feed: error leyendo el feed: %s", exc)
+                continue
+            if deltas:
+                self.publish(deltas)
+        # Sin suscriptores: se detiene la lectura y el proximo panel recarga el estado.
+        self._task = None
+
+
+live_ops_hub = LiveOpsHub()
@@ -1,5 +1,9 @@
 # Importa utilidades de FastAPI para definir rutas, dependencias y errores HTTP
-from fastapi import APIRouter, Depends, HTTPException
+import asyncio
+import json
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from typing import List
 
 # Guards de autorización
@@ -12,7 +16,13 @@ from web.admin.services import approve_user, reject_user, deactivate_user
 from web.users.repository import get_user_by_id, list_users as list_web_panel_users
 
 # Dependencias de autenticación y permisos
-from web.auth.dependencies import get_current_user, require_permission
+from web.auth.dependencies import get_current_user, get_current_user_async, invalidate_principal, require_permission
+
+# Lecturas del panel fuera del threadpool de Starlette
+from web.async_db import read_all, run_read
+
+# Feed en vivo del mapa (estado compartido + deltas por equipo)
+from web.admin.live_feed import live_ops_hub, serialize_live_courier, serialize_unassigned_order
 from web.users.roles import Permission
 from web.users.models import UserRole
 
@@ -39,9 +49,8 @@ from services import (
     update_admin_panel_pricing_settings, cancel_order_from_admin_panel,
     resolve_support_request_from_admin_panel,
     create_web_user, update_web_user_status,
-    get_admin_special_orders_between, get_fee_config,
-    get_courier_by_id, get_admin_by_id, get_all_local_admins,
-    get_platform_admin,
+    get_special_orders_metrics_report, get_admin_by_id,
+    build_dispatch_funnel, build_dispatch_heatmap,
 )
 
 
@@ -211,7 +220,7 @@ def reactivate_ally(ally_id: int, admin=Depends(get_current_user)):
 
 
 @router.get("/couriers/active-locations")
-def get_active_courier_locations(admin=Depends(get_current_user)):
+async def get_active_courier_locations(admin=Depends(get_current_user_async)):
     """
     Retorna todos los repartidores con ubicacion en vivo activa (ONLINE).
     Incluye lat/lng, nombre, equipo y timestamp de ultima actualizacion.
@@ -219,25 +228,11 @@ def get_active_courier_locations(admin=Depends(get_current_user)):
     """
     require_panel_admin(admin)
 
-    couriers = get_all_online_couriers()
-    result = []
-    for c in couriers:
-        result.append({
-            "courier_id": c["courier_id"],
-            "full_name": c["full_name"],
-            "telegram_id": c["telegram_id"],
-            "phone": c["phone"],
-            "lat": float(c["live_lat"]) if c["live_lat"] else None,
-            "lng": float(c["live_lng"]) if c["live_lng"] else None,
-            "admin_city": c["admin_city"],
-            "admin_id": c["admin_id"],
-            "last_updated": str(c["live_location_updated_at"]) if c["live_location_updated_at"] else None,
-        })
-    return result
+    return [serialize_live_courier(c) for c in await run_read(get_all_online_couriers)]
 
 
 @router.get("/orders/unassigned")
-def get_unassigned_orders(admin=Depends(get_current_user)):
+async def get_unassigned_orders(admin=Depends(get_current_user_async)):
     """
     Retorna pedidos activos sin courier asignado que tienen coordenadas de pickup.
     Usado por el mapa del panel para mostrar pedidos en espera.
@@ -245,32 +240,62 @@ def get_unassigned_orders(admin=Depends(get_current_user)):
     """
     require_panel_admin(admin)
 
-    orders = get_active_orders_without_courier(limit=30)
-    result = []
-    for o in orders:
-        result.append({
-            "order_id": o["id"],
-            "status": o["status"],
-            "pickup_address": o["pickup_address"],
-            "pickup_lat": float(o["pickup_lat"]) if o["pickup_lat"] else None,
-            "pickup_lng": float(o["pickup_lng"]) if o["pickup_lng"] else None,
-            "customer_name": o["customer_name"],
-            "ally_name": o["ally_name"],
-            "created_at": str(o["created_at"]) if o["created_at"] else None,
-        })
-    return result
+    return [serialize_unassigned_order(o) for o in await run_read(get_active_orders_without_courier, limit=30)]
+
+
+@router.get("/live/feed")
+async def live_operations_feed(request: Request, token: str = ""):
+    """
+    Feed en vivo del mapa (Server-Sent Events).
+    Envia un snapshot inicial (couriers online + pedidos sin asignar) y luego solo deltas:
+    courier_moved, courier_offline, order_upsert, order_removed.
+    ADMIN_LOCAL solo recibe eventos de su equipo.
+
+    EventSource no permite headers: el token va en ?token= (o en Authorization).
+    """
+    authorization = request.headers.get("authorization") or (f"Bearer {token}" if token else "")
+    admin = await asyncio.to_thread(get_current_user, authorization)
+    require_panel_admin(admin)
+    scope_admin_id = _scoped_admin_id(admin)
+
+    queue, snapshot = await live_ops_hub.subscribe(scope_admin_id)
+
+    async def event_stream():
+        try:
+            yield f"data: {json.dumps(snapshot)}\n\n"
+            while live_ops_hub.is_subscribed(queue):
+                if await request.is_disconnected():
+                    break
+                try:
+                    delta = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                yield f"data: {json.dumps(delta)}\n\n"
+        finally:
+            live_ops_hub.unsubscribe(queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @router.get("/orders", response_model=list[OrderResponse])
-def list_orders(status: str = None, admin=Depends(get_current_user)):
+async def list_orders(status: str = None, admin=Depends(get_current_user_async)):
     """Lista todos los pedidos del sistema con nombre de courier y aliado."""
     require_panel_admin(admin)
 
-    # Construir lookups de nombres usando funciones que ya funcionan
-    courier_names = {r["id"]: r["full_name"] for r in get_all_couriers()}
-    ally_names = {r["id"]: r["business_name"] for r in get_all_allies()}
+    # Las tres lecturas son independientes: van a la BD a la vez
+    couriers, allies, rows = await read_all(
+        (get_all_couriers,),
+        (get_all_allies,),
+        (get_all_orders, status, 200),
+    )
+    courier_names = {r["id"]: r["full_name"] for r in couriers}
+    ally_names = {r["id"]: r["business_name"] for r in allies}
 
-    rows = get_all_orders(status_filter=status, limit=200)
     result = []
     for o in rows:
         result.append({
@@ -293,10 +318,10 @@ def list_orders(status: str = None, admin=Depends(get_current_user)):
 
 
 @router.get("/saldos")
-def get_saldos(admin=Depends(get_current_user)):
+async def get_saldos(admin=Depends(get_current_user_async)):
     """Retorna saldos filtrados por equipo (ADMIN_LOCAL) o globales (PLATFORM_ADMIN)."""
     require_panel_admin(admin)
-    return get_admin_panel_balances(admin_id=_scoped_admin_id(admin))
+    return await run_read(get_admin_panel_balances, admin_id=_scoped_admin_id(admin))
 
 
 @router.get("/users")
@@ -344,18 +369,18 @@ def update_pricing_settings(payload: dict, admin=Depends(require_permission(Perm
 # ---------------------------------------------------------------------------
 
 @router.get("/support-requests")
-def list_support_requests(admin=Depends(get_current_user)):
+async def list_support_requests(admin=Depends(get_current_user_async)):
     """Lista todas las solicitudes de ayuda pendientes con datos de courier y pedido."""
     require_panel_admin(admin)
-    rows = get_all_pending_support_requests()
+    rows = await run_read(get_all_pending_support_requests)
     return rows
 
 
 @router.get("/support-requests/{support_id}")
-def get_support_request(support_id: int, admin=Depends(get_current_user)):
+async def get_support_request(support_id: int, admin=Depends(get_current_user_async)):
     """Retorna detalle completo de una solicitud de ayuda."""
     require_panel_admin(admin)
-    req = get_support_request_full(support_id)
+    req = await run_read(get_support_request_full, support_id)
     if not req:
         raise HTTPException(status_code=404, detail="Solicitud no encontrada")
     return req
@@ -440,6 +465,45 @@ def create_web_user_endpoint(
     return {"ok": True, "id": new_id}
 
 
+def _dispatch_entity_type(tipo: str):
+    if not tipo:
+        return None
+    entity_type = tipo.strip().upper()
+    if entity_type not in ("ORDER", "ROUTE"):
+        raise HTTPException(status_code=400, detail="tipo debe ser ORDER o ROUTE")
+    return entity_type
+
+
+@router.get("/despacho/embudo")
+def get_dispatch_funnel_endpoint(horas: int = 24, tipo: str = None, current_user=Depends(get_current_user)):
+    """Embudo de despacho (publicado -> ofrecido -> aceptado) y tiempos de espera.
+
+    Se calcula desde los agregados horarios (dispatch_rollups_hourly), sin leer
+    pedidos ni colas de ofertas. ADMIN_LOCAL solo ve su equipo.
+    """
+    require_panel_admin(current_user)
+    return build_dispatch_funnel(
+        hours=horas,
+        admin_id=_scoped_admin_id(current_user),
+        entity_type=_dispatch_entity_type(tipo),
+    )
+
+
+@router.get("/despacho/mapa-calor")
+def get_dispatch_heatmap_endpoint(horas: int = 24, tipo: str = None, current_user=Depends(get_current_user)):
+    """Demanda vs oferta por celda geohash (~barrio) desde los agregados horarios.
+
+    starving=True marca celdas con pedidos publicados, menos de un courier elegible
+    en promedio y pedidos sin aceptar. ADMIN_LOCAL solo ve su equipo.
+    """
+    require_panel_admin(current_user)
+    return build_dispatch_heatmap(
+        hours=horas,
+        admin_id=_scoped_admin_id(current_user),
+        entity_type=_dispatch_entity_type(tipo),
+    )
+
+
 @router.get("/pedidos-especiales/metricas")
 def get_pedidos_especiales_metricas(
     periodo: str = "semana",
@@ -452,143 +516,9 @@ def get_pedidos_especiales_metricas(
     admin_filter: solo ADMIN_PLATFORM puede filtrar por admin_id (None = todos)
     ADMIN_LOCAL solo ve sus propios pedidos.
     """
-    from datetime import datetime, timezone, timedelta
-
-    now = datetime.now(timezone.utc).replace(tzinfo=None)
-
-    if periodo == "hoy":
-        start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-        end = now
-    elif periodo == "ayer":
-        yesterday = now - timedelta(days=1)
-        start = yesterday.replace(hour=0, minute=0, second=0, microsecond=0)
-        end = yesterday.replace(hour=23, minute=59, second=59, microsecond=999999)
-    elif periodo == "semana":
-        start = (now - timedelta(days=now.weekday())).replace(hour=0, minute=0, second=0, microsecond=0)
-        end = now
-    elif periodo == "mes":
-        start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        end = now
-    else:  # todo
-        start = datetime(2024, 1, 1)
-        end = now
-
-    start_s = start.strftime("%Y-%m-%d %H:%M:%S")
-    end_s = end.strftime("%Y-%m-%d %H:%M:%S")
-
-    fee_cfg = get_fee_config()
-    platform_share = fee_cfg.get("fee_platform_share", 100)
-    tech_dev_pct = fee_cfg.get("fee_special_order_tech_dev_pct", 2)
-
-    # Determinar qué admins mostrar
     scoped_admin_id = _scoped_admin_id(current_user)
-    if scoped_admin_id is not None:
-        admin_ids = [scoped_admin_id]
-    elif admin_filter:
-        admin_ids = [admin_filter]
-    else:
-        # PLATFORM_ADMIN sin filtro: todos los admins locales + plataforma
-        all_admins = get_all_local_admins()
-        admin_ids = [a["id"] for a in all_admins]
-        platform_admin = get_platform_admin()
-        if platform_admin:
-            pa_id = platform_admin["id"] if isinstance(platform_admin, dict) else platform_admin[0]
-            if pa_id not in admin_ids:
-                admin_ids.append(pa_id)
-
-    orders_all = []
-    seen_order_ids = set()
-    for aid in admin_ids:
-        rows = get_admin_special_orders_between(aid, start_s, end_s)
-        for r in rows:
-            row = dict(r) if not isinstance(r, dict) else r
-            oid = row.get("id")
-            if oid in seen_order_ids:
-                continue
-            seen_order_ids.add(oid)
-            row["_creator_admin_id"] = aid
-            orders_all.append(row)
-
-    # Batch-lookup de nombres de courier (1 query por courier único, no por pedido)
-    unique_courier_ids = {int(o["courier_id"]) for o in orders_all if o.get("courier_id")}
-    courier_names = {}
-    for cid in unique_courier_ids:
-        try:
-            c = get_courier_by_id(cid)
-            if c:
-                courier_names[cid] = c["full_name"] if isinstance(c, dict) else c[0]
-        except Exception:
-            pass
-
-    # Calcular métricas por pedido
-    result_orders = []
-    total_tarifas = 0
-    total_comisiones = 0
-    total_fees_admin = 0
-    total_ganancia_neta = 0
-    total_delivered = 0
-    total_cancelled = 0
-
-    for order in orders_all:
-        total_fee = int(order.get("total_fee") or 0)
-        special_commission = int(order.get("special_commission") or 0)
-        status = order.get("status", "")
-
-        # Calcular fees del admin creador (solo aplica en DELIVERED)
-        if status == "DELIVERED":
-            platform_fee = platform_share
-            tech_dev_fee = round(total_fee * tech_dev_pct / 100) if special_commission > 0 else 0
-            fee_admin_pagado = platform_fee + tech_dev_fee
-            ganancia_neta = special_commission - fee_admin_pagado
-        else:
-            platform_fee = 0
-            tech_dev_fee = 0
-            fee_admin_pagado = 0
-            ganancia_neta = 0
-
-        # Nombre del courier desde el dict pre-cargado
-        courier_id = order.get("courier_id")
-        courier_name = courier_names.get(int(courier_id)) if courier_id else None
-
-        if status == "DELIVERED":
-            total_tarifas += total_fee
-            total_comisiones += special_commission
-            total_fees_admin += fee_admin_pagado
-            total_ganancia_neta += ganancia_neta
-            total_delivered += 1
-        else:
-            total_cancelled += 1
-
-        result_orders.append({
-            "id": order.get("id"),
-            "created_at": str(order.get("created_at") or ""),
-            "status": status,
-            "total_fee": total_fee,
-            "special_commission": special_commission,
-            "platform_fee": platform_fee,
-            "tech_dev_fee": tech_dev_fee,
-            "fee_admin_pagado": fee_admin_pagado,
-            "ganancia_neta": ganancia_neta,
-            "courier_name": courier_name,
-            "customer_name": order.get("customer_name"),
-            "customer_barrio": order.get("customer_barrio"),
-            "customer_city": order.get("customer_city"),
-            "creator_admin_id": order.get("creator_admin_id"),
-        })
-
-    return {
-        "periodo": periodo,
-        "resumen": {
-            "total_pedidos": len(result_orders),
-            "entregados": total_delivered,
-            "cancelados": total_cancelled,
-            "total_tarifas": total_tarifas,
-            "total_comisiones": total_comisiones,
-            "total_fees_admin": total_fees_admin,
-            "ganancia_neta": total_ganancia_neta,
-        },
-        "pedidos": result_orders,
-    }
+    scope_admin_id = scoped_admin_id if scoped_admin_id is not None else (admin_filter or None)
+    return get_special_orders_metrics_report(periodo, admin_id=scope_admin_id)
 
 
 @router.patch("/web-users/{user_id}/status")
@@ -602,4 +532,5 @@ def update_web_user_status_endpoint(
     if status not in ("APPROVED", "INACTIVE"):
         raise HTTPException(status_code=400, detail="status debe ser APPROVED o INACTIVE")
     update_web_user_status(user_id, status)
+    invalidate_principal(user_id=user_id)
     return {"ok": True}
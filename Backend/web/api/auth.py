@@ -3,18 +3,23 @@ Endpoints de autenticación para el panel web administrativo.
 - POST /auth/login: login con usuario/contraseña
 - POST /auth/forgot-password: reset via Telegram
 """
+import asyncio
+import math
 import os
 import random
 import string
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
-import bcrypt
 import requests
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel
 
+from web.auth.dependencies import invalidate_principal
+from web.auth.passwords import PasswordHashBusy, check_password, hash_password
+from web.auth.throttle import TokenBucketLimiter, client_ip
 from web.auth.token import create_token
-from web.users.repository import get_web_user_by_username
+from web.users.repository import get_web_user_with_password_hash
 from web.users.status import ACTIVE_USERS
 
 logger = logging.getLogger(__name__)
@@ -23,6 +28,14 @@ router = APIRouter(prefix="/auth", tags=["Auth"])
 
 _GENERIC_RESET_MSG = "Si el usuario existe, recibirás una contraseña temporal en Telegram."
 
+# Intentos de login: rafaga de 20 por IP (varios usuarios detras de una misma red) que
+# se recupera a 1 cada 6 s, y 5 seguidos por usuario con 1 cada 30 s. Un login correcto
+# devuelve al usuario sus fichas. Reset de contrasena: 3 por IP y por usuario, 1 cada 5 min.
+_login_ip_limiter = TokenBucketLimiter(capacity=20, refill_per_second=1 / 6)
+_login_user_limiter = TokenBucketLimiter(capacity=5, refill_per_second=1 / 30)
+_reset_limiter = TokenBucketLimiter(capacity=3, refill_per_second=1 / 300)
+_reset_delivery_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="reset-telegram")
+
 
 class LoginRequest(BaseModel):
     username: str
@@ -38,38 +51,67 @@ def _random_password(length: int = 10) -> str:
     return "".join(random.choices(chars, k=length))
 
 
+def _throttle(limiter: TokenBucketLimiter, keys):
+    """Gasta una ficha de cada clave; 429 con Retry-After si alguna se quedo sin fichas."""
+    wait = max(limiter.take(key) for key in keys)
+    if wait > 0:
+        raise HTTPException(
+            status_code=429,
+            detail="Demasiados intentos. Intenta de nuevo en unos minutos.",
+            headers={"Retry-After": str(int(math.ceil(wait)))},
+        )
+
+
+def _send_reset_message(bot_token: str, telegram_id, msg: str):
+    try:
+        resp = requests.post(
+            f"https://api.telegram.org/bot{bot_token}/sendMessage",
+            json={"chat_id": telegram_id, "text": msg},
+            timeout=10,
+        )
+        if not resp.ok:
+            logger.error("forgot-password: Telegram API error %s: %s", resp.status_code, resp.text)
+    except Exception as e:
+        logger.error("forgot-password: error enviando mensaje Telegram: %s", e)
+
+
 @router.post("/login")
-def login(body: LoginRequest):
+async def login(body: LoginRequest, request: Request):
     """
     Autentica un usuario del panel web.
-    Verifica contraseña con bcrypt contra web_users en BD.
+    Verifica contraseña con bcrypt contra web_users en BD (pool propio, ver
+    web/auth/passwords.py). Limita intentos por IP y por usuario.
     """
-    user = get_web_user_by_username(body.username.strip())
+    username = body.username.strip()
+    _throttle(_login_ip_limiter, ["ip:" + client_ip(request)])
+    _throttle(_login_user_limiter, ["user:" + username.lower()])
+
+    user, stored_hash = await asyncio.to_thread(get_web_user_with_password_hash, username)
     if not user:
         raise HTTPException(status_code=401, detail="Credenciales incorrectas")
 
     if user.status not in ACTIVE_USERS:
         raise HTTPException(status_code=403, detail="Usuario inactivo o bloqueado")
 
-    from db import get_web_user_by_username as _db_get
-    row = _db_get(body.username.strip())
-    if row is None:
-        raise HTTPException(status_code=401, detail="Credenciales incorrectas")
-
-    stored_hash = row["password_hash"] if isinstance(row, dict) else row[2]
-    if not bcrypt.checkpw(body.password.encode(), stored_hash.encode()):
+    try:
+        valid = await check_password(body.password, stored_hash)
+    except PasswordHashBusy:
+        raise HTTPException(status_code=503, detail="Servicio ocupado. Intenta de nuevo.")
+    if not valid:
         raise HTTPException(status_code=401, detail="Credenciales incorrectas")
 
-    token = create_token(body.username.strip())
-    return {"token": token, "username": body.username.strip(), "role": user.role.value}
+    _login_user_limiter.reset("user:" + username.lower())
+    token = create_token(username)
+    return {"token": token, "username": username, "role": user.role.value}
 
 
 @router.post("/forgot-password")
-def forgot_password(body: ForgotPasswordRequest):
+async def forgot_password(body: ForgotPasswordRequest, request: Request):
     """
     Genera una contraseña temporal y la envía al Telegram del usuario.
     Siempre retorna el mismo mensaje para evitar enumeración de usuarios.
     Requiere la variable TELEGRAM_BOT_TOKEN en el servicio API de Railway.
+    El envío a Telegram sale en segundo plano: la respuesta no lo espera.
     """
     bot_token = os.getenv("TELEGRAM_BOT_TOKEN", "").strip()
     if not bot_token:
@@ -80,26 +122,29 @@ def forgot_password(body: ForgotPasswordRequest):
         )
 
     username = body.username.strip()
+    _throttle(_reset_limiter, ["ip:" + client_ip(request), "user:" + username.lower()])
 
-    from db import get_web_user_by_username as _db_get, get_telegram_id_for_web_user, update_web_user_password
-    row = _db_get(username)
-    if row is None:
+    from db import get_telegram_id_for_web_user, update_web_user_password
+    user, _stored_hash = await asyncio.to_thread(get_web_user_with_password_hash, username)
+    if user is None:
         # Respuesta genérica — no revelar si el usuario existe
         return {"message": _GENERIC_RESET_MSG}
 
-    user_id = row["id"] if isinstance(row, dict) else row[0]
-    status = row["status"] if isinstance(row, dict) else row[4]
-    if status not in ACTIVE_USERS:
+    if user.status not in ACTIVE_USERS:
         return {"message": _GENERIC_RESET_MSG}
 
-    telegram_id = get_telegram_id_for_web_user(username)
+    telegram_id = await asyncio.to_thread(get_telegram_id_for_web_user, username)
     if not telegram_id:
         logger.warning("forgot-password: no se encontró telegram_id para '%s'", username)
         return {"message": _GENERIC_RESET_MSG}
 
     temp_password = _random_password(10)
-    hashed = bcrypt.hashpw(temp_password.encode(), bcrypt.gensalt()).decode()
-    update_web_user_password(user_id, hashed)
+    try:
+        hashed = await hash_password(temp_password)
+    except PasswordHashBusy:
+        raise HTTPException(status_code=503, detail="Servicio ocupado. Intenta de nuevo.")
+    await asyncio.to_thread(update_web_user_password, user.id, hashed)
+    invalidate_principal(user_id=user.id)
 
     msg = (
         "Solicitaste restablecer tu contrasena del panel web.\n\n"
@@ -107,16 +152,6 @@ def forgot_password(body: ForgotPasswordRequest):
         "{}\n\n"
         "Ingresa con ella y cambiala desde Mi perfil."
     ).format(temp_password)
-
-    try:
-        resp = requests.post(
-            f"https://api.telegram.org/bot{bot_token}/sendMessage",
-            json={"chat_id": telegram_id, "text": msg},
-            timeout=10,
-        )
-        if not resp.ok:
-            logger.error("forgot-password: Telegram API error %s: %s", resp.status_code, resp.text)
-    except Exception as e:
-        logger.error("forgot-password: error enviando mensaje Telegram: %s", e)
+    _reset_delivery_executor.submit(_send_reset_message, bot_token, telegram_id, msg)
 
     return {"message": _GENERIC_RESET_MSG}
@@ -5,14 +5,15 @@ Solo lectura — no modifica nada del bot.
 from datetime import datetime, timezone, timedelta
 from fastapi import APIRouter, Depends, HTTPException
 
-from web.auth.dependencies import get_current_user
+from web.async_db import run_read
+from web.auth.dependencies import get_current_user_async
 from web.users.models import UserRole
 from db import get_courier_web_dashboard, get_courier_web_earnings, get_courier_web_profile
 
 router = APIRouter(prefix="/courier", tags=["Courier"])
 
 
-def _require_courier(current_user=Depends(get_current_user)):
+async def _require_courier(current_user=Depends(get_current_user_async)):
     """Exige que el usuario sea COURIER y tenga courier_id vinculado."""
     if current_user.role != UserRole.COURIER:
         raise HTTPException(status_code=403, detail="Solo accesible para repartidores")
@@ -22,13 +23,13 @@ def _require_courier(current_user=Depends(get_current_user)):
 
 
 @router.get("/dashboard")
-def courier_dashboard(user=Depends(_require_courier)):
+async def courier_dashboard(user=Depends(_require_courier)):
     """Dashboard del repartidor: entregas hoy/mes, tarifa mes, saldo."""
-    return get_courier_web_dashboard(user.courier_id)
+    return await run_read(get_courier_web_dashboard, user.courier_id)
 
 
 @router.get("/earnings")
-def courier_earnings(period: str = "mes", user=Depends(_require_courier)):
+async def courier_earnings(period: str = "mes", user=Depends(_require_courier)):
     """
     Ganancias del repartidor filtradas por periodo.
     period: hoy | semana | mes
@@ -44,7 +45,7 @@ def courier_earnings(period: str = "mes", user=Depends(_require_courier)):
 
     start_s = start.strftime("%Y-%m-%d %H:%M:%S")
     end_s = now.strftime("%Y-%m-%d %H:%M:%S")
-    orders = get_courier_web_earnings(user.courier_id, start_s, end_s)
+    orders = await run_read(get_courier_web_earnings, user.courier_id, start_s, end_s)
 
     total_tarifa = sum(o["total_fee"] for o in orders)
     total_incentivo = sum(o["incentivo"] for o in orders)
@@ -60,9 +61,9 @@ def courier_earnings(period: str = "mes", user=Depends(_require_courier)):
 
 
 @router.get("/profile")
-def courier_profile(user=Depends(_require_courier)):
+async def courier_profile(user=Depends(_require_courier)):
     """Perfil del repartidor."""
-    profile = get_courier_web_profile(user.courier_id)
+    profile = await run_read(get_courier_web_profile, user.courier_id)
     if not profile:
         raise HTTPException(status_code=404, detail="Perfil no encontrado")
     return {**profile, "username": user.username, "role": user.role.value}
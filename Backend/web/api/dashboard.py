@@ -1,6 +1,7 @@
 from fastapi import APIRouter, Depends
 
-from web.auth.dependencies import get_current_user
+from web.async_db import run_read
+from web.auth.dependencies import get_current_user_async
 from web.auth.guards import require_panel_admin
 from web.users.models import UserRole
 from services import get_dashboard_stats
@@ -10,10 +11,10 @@ router = APIRouter(prefix="/dashboard", tags=["Dashboard"])
 
 
 @router.get("/stats")
-def dashboard_stats(current_user=Depends(get_current_user)):
+async def dashboard_stats(current_user=Depends(get_current_user_async)):
     """
     Estadísticas del panel filtradas por equipo (ADMIN_LOCAL) o globales (PLATFORM_ADMIN).
     """
     require_panel_admin(current_user)
     admin_id = current_user.admin_id if current_user.role == UserRole.ADMIN_LOCAL else None
-    return get_dashboard_stats(admin_id=admin_id)
+    return await run_read(get_dashboard_stats, admin_id=admin_id)
@@ -10,21 +10,31 @@ Endpoints:
 """
 from typing import List, Optional
 
-from fastapi import APIRouter, HTTPException
+import math
+
+from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel
 
 from services import (
-    get_ally_by_public_token,
     get_ally_customer_by_phone,
     list_customer_addresses,
     create_ally_form_request,
-    get_default_ally_location,
-    quote_order_by_coords,
     compute_ally_subsidy,
 )
+from web.auth.throttle import TokenBucketLimiter, client_ip
+from web.form.cache import cached_form_quote, form_quote, get_form_profile
 
 router = APIRouter(prefix="/form", tags=["Form"])
 
+# Limites del formulario publico (token bucket en memoria, ver web/auth/throttle.py):
+# - por IP en todos los endpoints: rafaga de 60, 1 por segundo;
+# - busqueda por telefono por IP: 10 seguidas, 1 cada 6 s (evita enumerar la agenda);
+# - por token, solo las cotizaciones que no estan memorizadas (las que pueden llegar a
+#   Google/OSRM): rafaga de 120, 2 por segundo.
+_form_ip_limiter = TokenBucketLimiter(capacity=60, refill_per_second=1)
+_lookup_ip_limiter = TokenBucketLimiter(capacity=10, refill_per_second=1 / 6)
+_quote_token_limiter = TokenBucketLimiter(capacity=120, refill_per_second=2)
+
 
 # ─── Schemas ────────────────────────────────────────────────────────────────
 
@@ -98,14 +108,38 @@ class SubmitResponse(BaseModel):
 # ─── Helper interno ──────────────────────────────────────────────────────────
 
 
-def _resolve_ally(token: str) -> dict:
-    """Valida token y retorna el aliado. Lanza 404 si no es válido o inactivo."""
-    ally = get_ally_by_public_token(token)
+def _throttle(limiter: TokenBucketLimiter, key: str):
+    """Gasta una ficha de la clave; 429 con Retry-After si no quedan."""
+    wait = limiter.take(key)
+    if wait > 0:
+        raise HTTPException(
+            status_code=429,
+            detail="Demasiadas solicitudes. Intenta de nuevo en un momento.",
+            headers={"Retry-After": str(int(math.ceil(wait)))},
+        )
+
+
+def _resolve_ally(token: str, request: Request) -> dict:
+    """
+    Limita por IP, valida token y retorna el perfil del aliado (web/form/cache.py).
+    Lanza 404 si no es válido o inactivo.
+    """
+    _throttle(_form_ip_limiter, "ip:" + client_ip(request))
+    ally = get_form_profile(token)
     if not ally:
         raise HTTPException(status_code=404, detail="Enlace no válido o aliado inactivo.")
     return ally
 
 
+def _quote(token: str, ally: dict, lat: float, lng: float) -> dict:
+    """Cotizacion memorizada; si hay que calcularla gasta una ficha del token."""
+    cached = cached_form_quote(token, ally, lat, lng)
+    if cached is not None:
+        return cached
+    _throttle(_quote_token_limiter, "token:" + token)
+    return form_quote(token, ally, lat, lng)
+
+
 def _opt_str(value: Optional[str]) -> Optional[str]:
     """Aplica strip a un campo opcional; retorna None si queda vacío."""
     if value is None:
@@ -118,13 +152,13 @@ def _opt_str(value: Optional[str]) -> Optional[str]:
 
 
 @router.get("/{token}", response_model=FormInfoResponse)
-def get_form_info(token: str):
+def get_form_info(token: str, request: Request):
     """
     Valida el token y devuelve metadata mínima del aliado.
     El frontend usa esta respuesta para confirmar que el enlace es válido
     y mostrar el nombre del negocio antes de pedir el teléfono al cliente.
     """
-    ally = _resolve_ally(token)
+    ally = _resolve_ally(token, request)
     return FormInfoResponse(
         valid=True,
         ally_id=ally["id"],
@@ -141,7 +175,7 @@ def get_form_info(token: str):
 
 
 @router.post("/{token}/lookup-phone", response_model=LookupPhoneResponse)
-def lookup_phone(token: str, body: LookupPhoneRequest):
+def lookup_phone(token: str, body: LookupPhoneRequest, request: Request):
     """
     Busca si el cliente ya existe en la agenda del aliado.
     Solo lectura: no crea ni modifica ningún dato.
@@ -149,7 +183,8 @@ def lookup_phone(token: str, body: LookupPhoneRequest):
     if not body.phone.strip():
         raise HTTPException(status_code=422, detail="El teléfono es obligatorio.")
 
-    ally = _resolve_ally(token)
+    ally = _resolve_ally(token, request)
+    _throttle(_lookup_ip_limiter, "ip:" + client_ip(request))
     ally_id = ally["id"]
 
     customer = get_ally_customer_by_phone(ally_id, body.phone.strip())
@@ -183,22 +218,18 @@ def lookup_phone(token: str, body: LookupPhoneRequest):
 
 
 @router.post("/{token}/quote", response_model=QuoteResponse)
-def quote_form(token: str, body: QuoteRequest):
+def quote_form(token: str, body: QuoteRequest, request: Request):
     """
     Calcula una cotización estimada del domicilio.
     Requiere que el aliado tenga una ubicación de recogida con coordenadas.
     No crea pedido ni modifica ningún dato.
     """
-    ally = _resolve_ally(token)
-    delivery_subsidy = int(ally["delivery_subsidy"] or 0)
-    min_purchase = ally.get("min_purchase_for_subsidy")
+    ally = _resolve_ally(token, request)
+    delivery_subsidy = ally["delivery_subsidy"]
+    min_purchase = ally["min_purchase_for_subsidy"]
     is_conditional = (delivery_subsidy > 0 and min_purchase is not None)
 
-    pickup = get_default_ally_location(ally["id"])
-    pickup_lat = pickup["lat"] if pickup else None
-    pickup_lng = pickup["lng"] if pickup else None
-
-    if pickup_lat is None or pickup_lng is None:
+    if ally["pickup_lat"] is None or ally["pickup_lng"] is None:
         return QuoteResponse(
             ok=True,
             quoted_price=None,
@@ -209,7 +240,7 @@ def quote_form(token: str, body: QuoteRequest):
             message="Aún no podemos calcular el valor exacto del domicilio.",
         )
 
-    result = quote_order_by_coords(pickup_lat, pickup_lng, body.lat, body.lng)
+    result = _quote(token, ally, body.lat, body.lng)
 
     if not result.get("success") or result.get("price") is None:
         return QuoteResponse(
@@ -247,7 +278,7 @@ def quote_form(token: str, body: QuoteRequest):
 
 
 @router.post("/{token}/submit", response_model=SubmitResponse)
-def submit_form(token: str, body: SubmitRequest):
+def submit_form(token: str, body: SubmitRequest, request: Request):
     """
     Guarda la solicitud en la bandeja temporal ally_form_requests.
     No crea pedido. No escribe en agenda definitiva.
@@ -259,7 +290,7 @@ def submit_form(token: str, body: SubmitRequest):
     if not body.customer_name.strip():
         raise HTTPException(status_code=422, detail="El nombre del cliente es obligatorio.")
 
-    ally = _resolve_ally(token)
+    ally = _resolve_ally(token, request)
     ally_id = ally["id"]
 
     delivery_address = _opt_str(body.delivery_address)
@@ -299,17 +330,14 @@ def submit_form(token: str, body: SubmitRequest):
     total_cliente = None
 
     if has_location:
-        pickup = get_default_ally_location(ally_id)
-        pickup_lat = pickup["lat"] if pickup else None
-        pickup_lng = pickup["lng"] if pickup else None
-
-        if pickup_lat is not None and pickup_lng is not None:
+        if ally["pickup_lat"] is not None and ally["pickup_lng"] is not None:
             try:
-                result = quote_order_by_coords(pickup_lat, pickup_lng, body.lat, body.lng)
+                # Misma cotizacion memorizada que vio el cliente en /quote (celda del destino).
+                result = _quote(token, ally, body.lat, body.lng)
                 if result.get("success") and result.get("price") is not None:
                     quoted_price_real = int(result["price"])
-                    delivery_subsidy = int(ally["delivery_subsidy"] or 0)
-                    min_purchase = ally.get("min_purchase_for_subsidy")
+                    delivery_subsidy = ally["delivery_subsidy"]
+                    min_purchase = ally["min_purchase_for_subsidy"]
                     # purchase_amount_declared es dato del cliente, no fuente de verdad.
                     # El subsidio condicional solo se aplica cuando el aliado confirma
                     # el valor de compra en el bot (orders.purchase_amount).
@@ -3,7 +3,7 @@ Endpoints de perfil accesibles para todos los roles del panel web.
 """
 import bcrypt
 from fastapi import APIRouter, Depends, HTTPException
-from web.auth.dependencies import get_current_user
+from web.auth.dependencies import get_current_user, invalidate_principal
 from web.users.models import UserRole
 
 router = APIRouter(prefix="/profile", tags=["Profile"])
@@ -81,6 +81,7 @@ def change_password(payload: dict, current_user=Depends(get_current_user)):
 
     new_hash = bcrypt.hashpw(new_password.encode(), bcrypt.gensalt()).decode()
     update_web_user_password(current_user.id, new_hash)
+    invalidate_principal(user_id=current_user.id)
     return {"ok": True}
 
 
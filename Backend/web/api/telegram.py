@@ -0,0 +1,34 @@
+"""
+Webhook de Telegram (modo BOT_UPDATE_MODE=webhook).
+
+Endpoints:
+  POST /telegram/webhook — recibe updates; valida X-Telegram-Bot-Api-Secret-Token y
+                           los guarda en la cola durable que consumen los workers del bot
+"""
+import hmac
+import os
+from typing import Optional
+
+from fastapi import APIRouter, Body, Header, HTTPException
+
+from services import ingest_telegram_update
+
+router = APIRouter(prefix="/telegram", tags=["Telegram"])
+
+
+@router.post("/webhook")
+def telegram_webhook(
+    payload: dict = Body(...),
+    x_telegram_bot_api_secret_token: Optional[str] = Header(None),
+):
+    secret = os.getenv("TELEGRAM_WEBHOOK_SECRET", "")
+    if not secret:
+        # Sin secreto configurado el webhook no existe: nunca aceptar updates sin validar.
+        raise HTTPException(status_code=404, detail="Webhook no habilitado")
+    if not hmac.compare_digest((x_telegram_bot_api_secret_token or "").encode(), secret.encode()):
+        raise HTTPException(status_code=401, detail="Token secreto invalido")
+    if not isinstance(payload.get("update_id"), int):
+        raise HTTPException(status_code=400, detail="Update invalido")
+
+    ingest_telegram_update(payload)
+    return {"ok": True}
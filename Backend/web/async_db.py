@@ -0,0 +1,29 @@
+"""
+Lecturas de BD para los endpoints async del panel.
+
+db.py es sincronico (psycopg2 / sqlite3, una conexion por llamada) y compartido con el
+bot. Esto no lo vuelve asincrono: run_read ejecuta la misma llamada sincronica en el
+threadpool de Starlette (run_in_threadpool, el CapacityLimiter por defecto de anyio),
+el mismo que usan los endpoints `def`. No hay un pool propio: las lecturas del panel
+no suman hilos ni conexiones a Postgres por encima de ese limite.
+
+- el endpoint async no bloquea el event loop mientras espera la BD;
+- un endpoint con varias lecturas independientes las lanza a la vez con read_all.
+"""
+import asyncio
+import functools
+
+from starlette.concurrency import run_in_threadpool
+
+
+async def run_read(fn, *args, **kwargs):
+    """Ejecuta una lectura sincronica de db.py/services.py en el threadpool de Starlette."""
+    return await run_in_threadpool(functools.partial(fn, *args, **kwargs))
+
+
+async def read_all(*calls):
+    """
+    Varias lecturas independientes a la vez. Cada llamada es (fn, *args).
+    Retorna los resultados en el mismo orden.
+    """
+    return await asyncio.gather(*(run_read(fn, *args) for fn, *args in calls))
@@ -1,33 +1,112 @@
+import threading
+import time
+
 from fastapi import Header, HTTPException, Depends
 
-from web.auth.token import verify_token
+from web.async_db import run_read
+from web.auth.token import verify_token_claims
 from web.users.repository import get_user_by_id, get_web_user_by_username
 from web.users.roles import Permission
 from web.auth.guards import require_panel_access, has_permission
 
 
-def get_current_user(authorization: str = Header(default="")):
+# Cache de identidad: cada pantalla del panel dispara varias peticiones en paralelo con
+# el mismo token. El WebUser resuelto se guarda por (username, expiracion del token)
+# durante PRINCIPAL_CACHE_TTL_SECONDS; la firma y la expiracion se siguen verificando en
+# cada peticion. Cambiar el estado o la contrasena de un usuario lo invalida de
+# inmediato en este proceso (invalidate_principal); en otro proceso el cambio se ve al
+# vencer el TTL. Un usuario inexistente no se guarda.
+PRINCIPAL_CACHE_TTL_SECONDS = 30
+PRINCIPAL_CACHE_MAX_ENTRIES = 2000
+_principal_cache = {}  # (username, expiry) -> (monotonic de expiracion, WebUser)
+_principal_lock = threading.Lock()
+
+
+def _cached_principal(key):
+    entry = _principal_cache.get(key)
+    if entry is None:
+        return None
+    if entry[0] <= time.monotonic():
+        _principal_cache.pop(key, None)
+        return None
+    return entry[1]
+
+
+def _remember_principal(key, user):
+    now = time.monotonic()
+    with _principal_lock:
+        if len(_principal_cache) >= PRINCIPAL_CACHE_MAX_ENTRIES:
+            for stale in [k for k, (exp, _u) in _principal_cache.items() if exp <= now]:
+                del _principal_cache[stale]
+            if len(_principal_cache) >= PRINCIPAL_CACHE_MAX_ENTRIES:
+                oldest = min(_principal_cache, key=lambda k: _principal_cache[k][0])
+                del _principal_cache[oldest]
+        _principal_cache[key] = (now + PRINCIPAL_CACHE_TTL_SECONDS, user)
+
+
+def invalidate_principal(user_id: int = None, username: str = None):
     """
-    Dependencia FastAPI que valida el token del header Authorization.
-    Formato esperado: "Bearer <token>"
-    Resuelve el usuario desde la tabla web_users en BD.
+    Olvida la identidad cacheada de un usuario del panel (por id o username) en todos
+    sus tokens. Sin argumentos vacia la cache. Llamar despues de cambiar su estado o
+    su contrasena.
     """
+    with _principal_lock:
+        if user_id is None and username is None:
+            _principal_cache.clear()
+            return
+        for key in [
+            k for k, (_exp, user) in _principal_cache.items()
+            if (user_id is not None and user.id == user_id) or (username is not None and k[0] == username)
+        ]:
+            del _principal_cache[key]
+
+
+def _token_claims(authorization: str):
+    """Valida el header Authorization ("Bearer <token>"). Retorna (username, expiry) o 401."""
     if not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Token requerido")
 
     token = authorization.removeprefix("Bearer ").strip()
-    username = verify_token(token)
+    claims = verify_token_claims(token)
 
-    if not username:
+    if not claims:
         raise HTTPException(status_code=401, detail="Token invalido o expirado")
+    return claims
 
-    user = get_web_user_by_username(username)
+
+def get_current_user(authorization: str = Header(default="")):
+    """
+    Dependencia FastAPI que valida el token del header Authorization.
+    Formato esperado: "Bearer <token>"
+    Resuelve el usuario desde la tabla web_users en BD (o la cache de identidad).
+    """
+    claims = _token_claims(authorization)
+
+    user = _cached_principal(claims) if PRINCIPAL_CACHE_TTL_SECONDS > 0 else None
+    if user is not None:
+        return user
+
+    user = get_web_user_by_username(claims[0])
     if not user:
         raise HTTPException(status_code=401, detail="Usuario no encontrado")
 
+    if PRINCIPAL_CACHE_TTL_SECONDS > 0:
+        _remember_principal(claims, user)
     return user
 
 
+async def get_current_user_async(authorization: str = Header(default="")):
+    """
+    get_current_user para endpoints async (web/async_db.py): con la identidad en cache
+    responde sin salir del event loop; si no, la consulta va al pool de lecturas.
+    """
+    claims = _token_claims(authorization)
+    user = _cached_principal(claims) if PRINCIPAL_CACHE_TTL_SECONDS > 0 else None
+    if user is not None:
+        return user
+    return await run_read(get_current_user, authorization)
+
+
 def require_permission(permission: Permission):
     """
     Factory de dependencias FastAPI para RBAC fino.
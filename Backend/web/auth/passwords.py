@@ -0,0 +1,64 @@
+"""
+Hash y verificacion de contrasenas del panel fuera del threadpool de FastAPI.
+
+bcrypt tarda decenas de milisegundos por llamada a proposito. Corriendo en el hilo de
+la peticion, una rafaga de logins (o un intento de credential stuffing) ocupa todos
+los hilos del threadpool y deja esperando al resto del panel. Aqui corre en un pool
+propio de PASSWORD_HASH_WORKERS hilos; si ya hay PASSWORD_HASH_MAX_PENDING trabajos
+encolados se rechaza de inmediato (PasswordHashBusy) en vez de acumular espera.
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+PASSWORD_HASH_WORKERS = 2
+PASSWORD_HASH_MAX_PENDING = 32
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = threading.BoundedSemaphore(PASSWORD_HASH_MAX_PENDING)
+
+
+class PasswordHashBusy(Exception):
+    """El pool de bcrypt esta lleno: el endpoint responde 503."""
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+        return _executor
+
+
+def _checkpw(password: str, stored_hash: str) -> bool:
+    try:
+        return bcrypt.checkpw(password.encode(), stored_hash.encode())
+    except ValueError:
+        # Hash guardado con formato invalido: se trata como contrasena incorrecta.
+        return False
+
+
+def _hashpw(password: str) -> str:
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+
+
+async def _run(fn, *args):
+    if not _pending.acquire(blocking=False):
+        raise PasswordHashBusy()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_get_executor(), fn, *args)
+    finally:
+        _pending.release()
+
+
+async def check_password(password: str, stored_hash: str) -> bool:
+    """bcrypt.checkpw en el pool acotado."""
+    return await _run(_checkpw, password, stored_hash or "")
+
+
+async def hash_password(password: str) -> str:
+    """bcrypt.hashpw (salt nuevo) en el pool acotado."""
+    return await _run(_hashpw, password)
@@ -0,0 +1,73 @@
+"""
+Limitador token bucket en memoria para endpoints publicos de la API.
+
+Cada clave (p.ej. "ip:1.2.3.4" o "user:ana") tiene un balde de `capacity` fichas que
+se rellena a `refill_per_second`. Cada intento gasta una ficha; sin fichas, el intento
+se rechaza con el tiempo de espera hasta la proxima. La API corre en un solo proceso,
+asi que el estado vive en memoria; los baldes llenos se descartan al podar.
+"""
+import threading
+import time
+
+THROTTLE_MAX_KEYS = 10000
+
+
+class TokenBucketLimiter:
+
+    def __init__(self, capacity: float, refill_per_second: float, clock=time.monotonic,
+                 max_keys: int = THROTTLE_MAX_KEYS):
+        self.capacity = float(capacity)
+        self.refill_per_second = float(refill_per_second)
+        self.max_keys = max_keys
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._buckets = {}  # key -> [fichas, instante del ultimo calculo]
+
+    def _level(self, bucket, now) -> float:
+        return min(self.capacity, bucket[0] + (now - bucket[1]) * self.refill_per_second)
+
+    def _prune(self, now):
+        full = [key for key, bucket in self._buckets.items() if self._level(bucket, now) >= self.capacity]
+        for key in full:
+            del self._buckets[key]
+        if len(self._buckets) >= self.max_keys:
+            # Muchos baldes vaciandose a la vez (ataque distribuido): se descartan los mas viejos.
+            for key in sorted(self._buckets, key=lambda k: self._buckets[k][1])[:len(self._buckets) // 2]:
+                del self._buckets[key]
+
+    def take(self, key) -> float:
+        """Gasta una ficha. Retorna 0 si se permitio o los segundos de espera si no."""
+        now = self._clock()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_keys:
+                    self._prune(now)
+                bucket = self._buckets[key] = [self.capacity, now]
+            level = self._level(bucket, now)
+            if level < 1.0:
+                bucket[0], bucket[1] = level, now
+                return (1.0 - level) / self.refill_per_second
+            bucket[0], bucket[1] = level - 1.0, now
+            return 0.0
+
+    def reset(self, key=None):
+        """Olvida una clave (p.ej. tras un login correcto) o todas."""
+        with self._lock:
+            if key is None:
+                self._buckets.clear()
+            else:
+                self._buckets.pop(key, None)
+
+
+def client_ip(request) -> str:
+    """
+    IP del cliente. Detras del proxy de Railway la conexion llega desde el proxy y la IP
+    real es la ULTIMA de X-Forwarded-For (la que agrega el proxy); las anteriores las
+    puede escribir el propio cliente.
+    """
+    forwarded = (request.headers.get("x-forwarded-for") or "").split(",")
+    if forwarded[-1].strip():
+        return forwarded[-1].strip()
+    client = getattr(request, "client", None)
+    return getattr(client, "host", None) or "unknown"
@@ -10,7 +10,7 @@ import hashlib
 import base64
 import time
 import os
-from typing import Optional
+from typing import Optional, Tuple
 
 _TOKEN_TTL = 60 * 60 * 24  # 24 horas
 
@@ -34,8 +34,8 @@ def create_token(username: str) -> str:
     return f"{payload_b64}.{sig}"
 
 
-def verify_token(token: str) -> Optional[str]:
-    """Verifica el token. Retorna el username si es válido, None si no."""
+def verify_token_claims(token: str) -> Optional[Tuple[str, int]]:
+    """Verifica el token. Retorna (username, expiry) si es válido, None si no."""
     try:
         parts = token.split(".")
         if len(parts) != 2:
@@ -51,11 +51,18 @@ def verify_token(token: str) -> Optional[str]:
         padding = 4 - len(payload_b64) % 4
         payload = base64.urlsafe_b64decode(payload_b64 + "=" * padding).decode()
         username, expiry_str = payload.split("|", 1)
+        expiry = int(expiry_str)
 
         # Verificar expiración
-        if int(time.time()) > int(expiry_str):
+        if int(time.time()) > expiry:
             return None
 
-        return username
+        return username, expiry
     except Exception:
         return None
+
+
+def verify_token(token: str) -> Optional[str]:
+    """Verifica el token. Retorna el username si es válido, None si no."""
+    claims = verify_token_claims(token)
+    return claims[0] if claims else None
@@ -0,0 +1,121 @@
+"""
+Capa de servicio del formulario publico del aliado (/form/{token}).
+
+Los enlaces del formulario se comparten en WhatsApp y redes: un aliado popular recibe
+muchas visitas y cada arrastre del pin en el mapa pide una cotizacion. Sin esta capa,
+cada llamada resolvia el aliado y su punto de recogida en BD y cada cotizacion podia
+terminar en Google/OSRM.
+
+- Perfil del aliado por token (nombre, subsidio, coordenadas de recogida) en memoria
+  durante FORM_PROFILE_TTL_SECONDS. Un token invalido tambien se recuerda ese tiempo.
+  Un cambio del aliado desde el bot (subsidio, ubicacion, desactivacion) se ve en la
+  API al vencer el TTL.
+- Cotizacion memorizada por (token, recogida, celda del destino). El destino se ajusta
+  al centro de una celda de FORM_QUOTE_CELL_DEGREES (~55 m) y se cotiza ese centro:
+  todos los pines de la celda reciben el mismo valor y el submit cobra lo mismo que se
+  mostro.
+  Una estimacion haversine (Google/OSRM sin respuesta) se guarda menos tiempo para
+  reintentar pronto.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from services import get_ally_by_public_token, get_default_ally_location, quote_order_by_coords
+
+FORM_PROFILE_TTL_SECONDS = 60
+FORM_PROFILE_CACHE_MAX = 2000
+FORM_QUOTE_CELL_DEGREES = 0.0005
+FORM_QUOTE_TTL_SECONDS = 600
+FORM_QUOTE_ESTIMATE_TTL_SECONDS = 60
+FORM_QUOTE_CACHE_MAX = 5000
+
+_profiles = OrderedDict()  # token -> (monotonic de expiracion, perfil o None)
+_quotes = OrderedDict()    # (token, lat, lng de recogida, celda) -> (monotonic de expiracion, resultado)
+_lock = threading.Lock()
+
+
+def _get(cache, key):
+    with _lock:
+        entry = cache.get(key)
+        if entry is None:
+            return False, None
+        if entry[0] <= time.monotonic():
+            del cache[key]
+            return False, None
+        cache.move_to_end(key)
+        return True, entry[1]
+
+
+def _put(cache, key, value, ttl, max_entries):
+    with _lock:
+        cache[key] = (time.monotonic() + ttl, value)
+        cache.move_to_end(key)
+        while len(cache) > max_entries:
+            cache.popitem(last=False)
+
+
+def get_form_profile(token: str):
+    """
+    Perfil del aliado del formulario o None si el token no es valido:
+    {id, business_name, delivery_subsidy, min_purchase_for_subsidy, pickup_lat, pickup_lng}.
+    """
+    found, profile = _get(_profiles, token)
+    if found:
+        return profile
+    ally = get_ally_by_public_token(token)
+    profile = None
+    if ally:
+        pickup = get_default_ally_location(ally["id"])
+        profile = {
+            "id": ally["id"],
+            "business_name": ally["business_name"],
+            "delivery_subsidy": int(ally["delivery_subsidy"] or 0),
+            "min_purchase_for_subsidy": ally.get("min_purchase_for_subsidy"),
+            "pickup_lat": pickup["lat"] if pickup else None,
+            "pickup_lng": pickup["lng"] if pickup else None,
+        }
+    _put(_profiles, token, profile, FORM_PROFILE_TTL_SECONDS, FORM_PROFILE_CACHE_MAX)
+    return profile
+
+
+def quote_cell(lat: float, lng: float):
+    """Celda del destino: indices enteros de la grilla de FORM_QUOTE_CELL_DEGREES."""
+    return int(round(lat / FORM_QUOTE_CELL_DEGREES)), int(round(lng / FORM_QUOTE_CELL_DEGREES))
+
+
+def _quote_key(token: str, profile: dict, lat: float, lng: float):
+    # La recogida va en la clave: si el aliado la cambia, las cotizaciones viejas no aplican.
+    return token, profile["pickup_lat"], profile["pickup_lng"], quote_cell(lat, lng)
+
+
+def cached_form_quote(token: str, profile: dict, lat: float, lng: float):
+    """Cotizacion ya memorizada para la celda del destino o None."""
+    found, result = _get(_quotes, _quote_key(token, profile, lat, lng))
+    return result if found else None
+
+
+def form_quote(token: str, profile: dict, lat: float, lng: float) -> dict:
+    """
+    Cotizacion (resultado de quote_order_by_coords) desde la recogida del aliado al
+    centro de la celda del destino. Requiere pickup_lat/pickup_lng en el perfil.
+    """
+    key = _quote_key(token, profile, lat, lng)
+    found, result = _get(_quotes, key)
+    if found:
+        return result
+    cell = key[-1]
+    result = quote_order_by_coords(
+        profile["pickup_lat"], profile["pickup_lng"],
+        cell[0] * FORM_QUOTE_CELL_DEGREES, cell[1] * FORM_QUOTE_CELL_DEGREES,
+    )
+    ttl = FORM_QUOTE_ESTIMATE_TTL_SECONDS if result.get("is_estimated") else FORM_QUOTE_TTL_SECONDS
+    _put(_quotes, key, result, ttl, FORM_QUOTE_CACHE_MAX)
+    return result
+
+
+def clear_form_cache():
+    """Vacia perfiles y cotizaciones."""
+    with _lock:
+        _profiles.clear()
+        _quotes.clear()
@@ -0,0 +1,176 @@
+"""
+Cache HTTP de los listados del panel: ETag, 304 y gzip.
+
+El panel consulta cada pocos segundos saldos, usuarios, ganancias, repartidores,
+aliados, pedidos y estadisticas; antes cada consulta reconstruia la lista completa
+aunque nada hubiera cambiado. El middleware (registrado en web_app.py):
+
+- arma un ETag fuerte con la ruta, los parametros, el alcance del usuario
+  (equipo del ADMIN_LOCAL o plataforma) y las versiones de cambio de las tablas del
+  recurso (db.get_change_versions: una consulta a una tabla minima);
+- si el navegador manda If-None-Match con ese ETag responde 304 sin ejecutar el
+  endpoint;
+- si otro panel ya pidio el mismo ETag devuelve el cuerpo guardado en memoria;
+- comprime con gzip los cuerpos de GZIP_MIN_BYTES o mas.
+
+El ETag tambien cambia cada RESPONSE_CACHE_MAX_AGE_SECONDS: cubre los filtros por
+fecha ("hoy", "mes") que cambian sin escrituras y acota cualquier cambio que las
+versiones no vean.
+"""
+import gzip
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from fastapi import HTTPException, Response
+
+from services import get_change_versions
+from web.async_db import run_read
+from web.auth.dependencies import get_current_user_async
+from web.auth.guards import require_panel_admin
+from web.users.models import UserRole
+
+# Ruta -> tablas cuyas escrituras cambian la respuesta
+PANEL_CACHED_RESOURCES = {
+    "/admin/saldos": ("admins", "couriers", "allies", "admin_couriers", "admin_allies"),
+    "/admin/users": ("users", "admins", "couriers", "allies", "admin_couriers", "admin_allies"),
+    "/admin/ganancias": ("ledger", "admins"),
+    "/admin/couriers": ("couriers",),
+    "/admin/allies": ("allies",),
+    "/admin/orders": ("orders", "couriers", "allies"),
+    "/dashboard/stats": ("admins", "users", "couriers", "allies",
+                         "admin_couriers", "admin_allies", "orders", "ledger"),
+}
+
+RESPONSE_CACHE_MAX_AGE_SECONDS = 60
+RESPONSE_CACHE_MAX_ENTRIES = 128
+RESPONSE_CACHE_MAX_BODY_BYTES = 2 * 1024 * 1024
+GZIP_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+
+_GZIP_SUFFIX = "-gz"
+
+_bodies = OrderedDict()  # etag -> (monotonic de expiracion, media_type, cuerpo, cuerpo gzip o None)
+_lock = threading.Lock()
+
+
+def build_etag(path: str, query: str, scope_admin_id, versions: dict, now: float = None) -> str:
+    """ETag fuerte (entre comillas) de la representacion sin comprimir."""
+    bucket = int((time.time() if now is None else now) // RESPONSE_CACHE_MAX_AGE_SECONDS)
+    params = "&".join(sorted(query.split("&"))) if query else ""
+    key = "|".join([
+        path, params, str(scope_admin_id), str(bucket),
+        ",".join("{}={}".format(t, versions.get(t, 0)) for t in sorted(versions)),
+    ])
+    return '"{}"'.format(hashlib.sha1(key.encode("utf-8")).hexdigest())
+
+
+def _gzip_etag(etag: str) -> str:
+    # La version comprimida es otra representacion: su ETag fuerte debe ser distinto.
+    return etag[:-1] + _GZIP_SUFFIX + '"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """If-None-Match usa comparacion debil: ignora W/ y acepta la variante gzip."""
+    if not if_none_match:
+        return False
+    candidates = {etag, _gzip_etag(etag)}
+    for value in if_none_match.split(","):
+        value = value.strip()
+        if value == "*":
+            return True
+        if value.startswith("W/"):
+            value = value[2:]
+        if value in candidates:
+            return True
+    return False
+
+
+def _accepts_gzip(request) -> bool:
+    return "gzip" in (request.headers.get("accept-encoding") or "").lower()
+
+
+def _remember(etag: str, media_type: str, body: bytes):
+    if len(body) > RESPONSE_CACHE_MAX_BODY_BYTES:
+        return None
+    compressed = gzip.compress(body, GZIP_LEVEL) if len(body) >= GZIP_MIN_BYTES else None
+    entry = (time.monotonic() + RESPONSE_CACHE_MAX_AGE_SECONDS, media_type, body, compressed)
+    with _lock:
+        _bodies[etag] = entry
+        _bodies.move_to_end(etag)
+        while len(_bodies) > RESPONSE_CACHE_MAX_ENTRIES:
+            _bodies.popitem(last=False)
+    return entry
+
+
+def _cached(etag: str):
+    with _lock:
+        entry = _bodies.get(etag)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del _bodies[etag]
+            return None
+        _bodies.move_to_end(etag)
+        return entry
+
+
+def _cache_headers(etag: str) -> dict:
+    # no-cache: el navegador guarda la respuesta pero revalida en cada consulta del panel.
+    return {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Authorization, Accept-Encoding"}
+
+
+def _full_response(request, etag: str, media_type: str, body: bytes, compressed, extra_headers=None):
+    headers = dict(extra_headers or {})
+    headers.update(_cache_headers(etag))
+    if compressed is not None and _accepts_gzip(request):
+        headers["ETag"] = _gzip_etag(etag)
+        headers["Content-Encoding"] = "gzip"
+        body = compressed
+    return Response(content=body, status_code=200, headers=headers, media_type=media_type)
+
+
+def clear_response_cache():
+    """Vacia los cuerpos guardados."""
+    with _lock:
+        _bodies.clear()
+
+
+async def panel_response_cache(request, call_next):
+    """Middleware HTTP: ETag/304 y gzip para los listados de PANEL_CACHED_RESOURCES."""
+    tables = PANEL_CACHED_RESOURCES.get(request.url.path)
+    if request.method != "GET" or tables is None:
+        return await call_next(request)
+
+    # Sin usuario valido (o sin permiso) el endpoint responde el 401/403 de siempre.
+    try:
+        user = await get_current_user_async(request.headers.get("authorization", ""))
+        require_panel_admin(user)
+    except HTTPException:
+        return await call_next(request)
+    scope_admin_id = user.admin_id if user.role == UserRole.ADMIN_LOCAL else None
+
+    versions = await run_read(get_change_versions, tables)
+    etag = build_etag(request.url.path, request.url.query, scope_admin_id, versions)
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=_cache_headers(etag))
+
+    entry = _cached(etag)
+    if entry is not None:
+        _expires, media_type, body, compressed = entry
+        return _full_response(request, etag, media_type, body, compressed)
+
+    response = await call_next(request)
+    if response.status_code != 200:
+        return response
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    headers = {k: v for k, v in response.headers.items()
+               if k.lower() not in ("content-length", "content-encoding", "etag", "cache-control", "vary")}
+    media_type = response.media_type or response.headers.get("content-type")
+    # Las versiones se leyeron antes de la consulta: si hubo una escritura en medio, el
+    # cuerpo es mas nuevo que el ETag y la proxima consulta lo reconstruye (nunca al reves).
+    entry = _remember(etag, media_type, body)
+    compressed = entry[3] if entry else (gzip.compress(body, GZIP_LEVEL) if len(body) >= GZIP_MIN_BYTES else None)
+    return _full_response(request, etag, media_type, body, compressed, headers)
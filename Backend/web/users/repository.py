@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from typing import Optional
+from typing import Optional, Tuple
 
 from web.users.models import UserRole, UserStatus
 
@@ -46,6 +46,16 @@ def get_web_user_by_username(username: str) -> Optional[WebUser]:
     return _row_to_web_user(_db_get(username))
 
 
+def get_web_user_with_password_hash(username: str) -> Tuple[Optional[WebUser], Optional[str]]:
+    """Retorna (WebUser, password_hash) con una sola consulta, o (None, None)."""
+    from db import get_web_user_by_username as _db_get
+    row = _db_get(username)
+    if row is None:
+        return None, None
+    stored_hash = row["password_hash"] if isinstance(row, dict) else row[2]
+    return _row_to_web_user(row), stored_hash
+
+
 def get_user_by_id(user_id: int) -> Optional[WebUser]:
     """Retorna WebUser desde BD o None."""
     from db import get_web_user_by_id as _db_get
@@ -14,6 +14,8 @@ from web.api.users import router as users_router
 from web.api.form import router as form_router
 from web.api.courier import router as courier_router
 from web.api.profile import router as profile_router
+from web.api.telegram import router as telegram_router
+from web.response_cache import panel_response_cache
 
 
 load_dotenv()
@@ -46,6 +48,11 @@ app.include_router(dashboard_router)
 app.include_router(form_router)
 app.include_router(courier_router)
 app.include_router(profile_router)
+app.include_router(telegram_router)
+
+# ETag/304 y gzip para los listados del panel. Se registra antes que CORS para que
+# CORS quede por fuera y el 304 tambien lleve sus headers.
+app.middleware("http")(panel_response_cache)
 
 origins = [
     "http://localhost:4200",
@@ -34,6 +34,15 @@ export class ApiService {
     return this.http.get<any[]>(`${this.baseUrl}/admin/orders/unassigned`);
   }
 
+  /**
+   * URL del feed en vivo del mapa (Server-Sent Events).
+   * EventSource no permite headers, por eso el token viaja como query param.
+   */
+  getLiveFeedUrl(): string {
+    const token = localStorage.getItem('admin_token') ?? '';
+    return `${this.baseUrl}/admin/live/feed?token=${encodeURIComponent(token)}`;
+  }
+
   // ─── Formulario público del aliado ───────────────────────────────────────
 
   getFormInfo(token: string) {
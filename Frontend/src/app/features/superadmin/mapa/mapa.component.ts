@@ -118,6 +118,7 @@ export class MapaComponent implements OnInit, AfterViewInit, OnDestroy {
   private courierMarkers: any[] = [];
   private orderMarkers: any[] = [];
   private intervalo: any = null;
+  private feed: EventSource | null = null;
   private resizeObserver: ResizeObserver | null = null;
   private readonly centroDefault: [number, number] = [4.711, -74.0721];
   private readonly isBrowser: boolean;
@@ -131,10 +132,68 @@ export class MapaComponent implements OnInit, AfterViewInit, OnDestroy {
   }
 
   ngOnInit(): void {
+    if (this.isBrowser && typeof EventSource !== 'undefined') {
+      this.conectarFeed();
+    } else {
+      this.iniciarPolling();
+    }
+  }
+
+  private iniciarPolling(): void {
+    if (this.intervalo) return;
     this.cargarDatos();
     this.intervalo = setInterval(() => this.cargarDatos(), 30000);
   }
 
+  /**
+   * Feed en vivo: snapshot inicial + deltas. Si el feed falla se vuelve al polling de 30 s.
+   */
+  private conectarFeed(): void {
+    this.feed = new EventSource(this.api.getLiveFeedUrl());
+    this.feed.onmessage = (msg) => {
+      const evento = JSON.parse(msg.data);
+      this.zone.run(() => {
+        this.aplicarEvento(evento);
+        this.cargando = false;
+        this.ultimaActualizacion = new Date().toLocaleTimeString('es-CO');
+        this.actualizarMarcadores();
+      });
+    };
+    this.feed.onerror = () => {
+      if (this.feed && this.feed.readyState === EventSource.CLOSED) {
+        this.feed = null;
+        this.zone.run(() => this.iniciarPolling());
+      }
+    };
+  }
+
+  private aplicarEvento(evento: any): void {
+    switch (evento.type) {
+      case 'snapshot':
+        this.couriers = evento.couriers;
+        this.orders = evento.orders;
+        break;
+      case 'courier_moved':
+        this.couriers = [
+          evento.courier,
+          ...this.couriers.filter(c => c.courier_id !== evento.courier.courier_id),
+        ];
+        break;
+      case 'courier_offline':
+        this.couriers = this.couriers.filter(c => c.courier_id !== evento.courier_id);
+        break;
+      case 'order_upsert':
+        this.orders = [
+          ...this.orders.filter(o => o.order_id !== evento.order.order_id),
+          evento.order,
+        ];
+        break;
+      case 'order_removed':
+        this.orders = this.orders.filter(o => o.order_id !== evento.order_id);
+        break;
+    }
+  }
+
   ngAfterViewInit(): void {
     if (!this.isBrowser) return;
     // Doble rAF: garantiza que el browser completó layout y paint antes de inicializar Leaflet
@@ -147,6 +206,7 @@ export class MapaComponent implements OnInit, AfterViewInit, OnDestroy {
 
   ngOnDestroy(): void {
     if (this.intervalo) clearInterval(this.intervalo);
+    if (this.feed) this.feed.close();
     if (this.resizeObserver) this.resizeObserver.disconnect();
     if (this.map) this.map.remove();
   }
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark del ranking de couriers (courier_ranking.py).
+
+Compara, con 500 y 5.000 candidatos:
+- ranking: el ordenamiento anterior (sort_key con haversine por courier + segundo
+  pase de haversine para el radio) contra rank_candidates (una distancia por courier,
+  descarte por caja y orden solo de los que quedan en el radio);
+- desvios: haversine_km escalar por courier (tres llamadas con conversion y redondeo)
+  contra detour_ratios por lotes.
+
+Ejecutar desde Backend/:
+    python ../tests/bench_courier_ranking.py [repeticiones]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Backend"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import courier_ranking as cr  # noqa: E402
+from services import haversine_km  # noqa: E402
+from test_courier_ranking import _random_couriers, _reference_rank  # noqa: E402
+
+PICKUP = (4.81, -75.69)
+
+
+def _scalar_detours(origins, dests):
+    out = []
+    for (o_lat, o_lng), (d_lat, d_lng) in zip(origins, dests):
+        direct = haversine_km(o_lat, o_lng, d_lat, d_lng)
+        if direct < 0.05:
+            out.append(1.0)
+            continue
+        out.append((haversine_km(o_lat, o_lng, PICKUP[0], PICKUP[1])
+                    + haversine_km(PICKUP[0], PICKUP[1], d_lat, d_lng)) / direct)
+    return out
+
+
+def _timeit(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None or elapsed < best else best
+    return best * 1000.0
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    print("{:>10} {:>10} {:>12} {:>12} {:>8}".format("candidatos", "caso", "antes ms", "kernel ms", "x"))
+    for n in (500, 5000):
+        couriers = _random_couriers(n)
+        origins = [cr.courier_point(c) for c in couriers]
+        origins = [(lat, lng) if lat is not None else (PICKUP[0] + 0.01, PICKUP[1]) for lat, lng in origins]
+        dests = [(lat + 0.02, lng - 0.01) for lat, lng in origins]
+        cases = (
+            ("ranking",
+             lambda: _reference_rank(couriers, PICKUP[0], PICKUP[1]),
+             lambda: cr.rank_candidates(couriers, PICKUP[0], PICKUP[1])),
+            ("desvios",
+             lambda: _scalar_detours(origins, dests),
+             lambda: cr.detour_ratios(PICKUP[0], PICKUP[1], origins, dests)),
+        )
+        for name, before, after in cases:
+            t_before = _timeit(before, repeat)
+            t_after = _timeit(after, repeat)
+            print("{:>10} {:>10} {:>12.2f} {:>12.2f} {:>8.1f}".format(
+                n, name, t_before, t_after, t_before / t_after if t_after else 0.0))
+
+
+if __name__ == "__main__":
+    main()
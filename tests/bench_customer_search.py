@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Benchmark de la búsqueda de agenda de clientes (10.000 clientes por aliado).
+
+Compara la búsqueda indexada (search_ally_customers) contra la consulta anterior
+`name LIKE '%term%' OR phone LIKE '%term%'` sobre la misma BD SQLite temporal.
+
+Ejecutar desde Backend/:
+    python ../tests/bench_customer_search.py [clientes_por_aliado] [aliados]
+
+Ejemplo:
+    python ../tests/bench_customer_search.py 10000 5
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+_fd, _DB_PATH = tempfile.mkstemp(prefix="domi_bench_search_", suffix=".db")
+os.close(_fd)
+os.environ["DB_PATH"] = _DB_PATH
+os.environ.pop("DATABASE_URL", None)
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Backend"))
+
+import db  # noqa: E402
+
+NOMBRES = ["José", "María", "Ángela", "Andrés", "Camilo", "Valentina", "Sebastián", "Lucía",
+           "Julián", "Sofía", "Mateo", "Daniela", "Nicolás", "Isabella", "Tomás", "Mariana"]
+APELLIDOS = ["Peña", "Gómez", "Rodríguez", "Martínez", "López", "Hernández", "Muñoz", "Ríos",
+             "Castaño", "Ospina", "Zuluaga", "Giraldo", "Cardona", "Álvarez", "Quintero", "Vélez"]
+QUERIES = ["pena", "Gómez", "sebastian rios", "310555", "zulauga", "valentnia ospina", "xyz"]
+
+
+def _seed(customers_per_ally: int, allies: int):
+    rnd = random.Random(42)
+    conn = db.get_connection()
+    cur = conn.cursor()
+    for ally_id in range(1, allies + 1):
+        rows = []
+        for i in range(customers_per_ally):
+            name = "{} {} {}".format(rnd.choice(NOMBRES), rnd.choice(APELLIDOS), rnd.choice(APELLIDOS))
+            phone = "3{:09d}".format(rnd.randrange(10 ** 9))
+            name_search, phone_search = db._customer_search_values(name, phone)
+            rows.append((ally_id, name, db.normalize_phone(phone), name_search, phone_search,
+                         rnd.randrange(50)))
+        cur.executemany(
+            """
+            INSERT INTO ally_customers (ally_id, name, phone, status, name_search, phone_search, use_count)
+            VALUES (?, ?, ?, 'ACTIVE', ?, ?, ?)
+            """,
+            rows,
+        )
+    conn.commit()
+    conn.close()
+
+
+def _legacy_search(ally_id: int, query: str, limit: int = 10):
+    conn = db.get_connection()
+    cur = conn.cursor()
+    term = "%{}%".format(db._normalize_search_term(query.strip()))
+    phone_term = "%{}%".format(db._normalize_phone_query(query.strip()))
+    cur.execute(
+        """
+        SELECT id, ally_id, name, phone, notes, status, created_at, updated_at
+        FROM ally_customers
+        WHERE ally_id = ? AND status = 'ACTIVE'
+          AND (name LIKE ? OR phone LIKE ?)
+        ORDER BY use_count DESC, updated_at DESC
+        LIMIT ?
+        """,
+        (ally_id, term, phone_term, limit),
+    )
+    rows = cur.fetchall()
+    conn.close()
+    return rows
+
+
+def _time_ms(fn, *args, repeat: int = 20):
+    start = time.perf_counter()
+    result = None
+    for _ in range(repeat):
+        result = fn(*args)
+    return (time.perf_counter() - start) * 1000 / repeat, len(result)
+
+
+def main():
+    customers_per_ally = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    allies = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    try:
+        db.init_db()
+        t0 = time.perf_counter()
+        _seed(customers_per_ally, allies)
+        print("Seed: {} aliados x {} clientes en {:.1f}s".format(
+            allies, customers_per_ally, time.perf_counter() - t0))
+        print("{:<20} {:>14} {:>8} {:>14} {:>8}".format("query", "indexada ms", "filas", "anterior ms", "filas"))
+        for query in QUERIES:
+            new_ms, new_rows = _time_ms(db.search_ally_customers, 1, query)
+            old_ms, old_rows = _time_ms(_legacy_search, 1, query)
+            print("{:<20} {:>14.2f} {:>8} {:>14.2f} {:>8}".format(query, new_ms, new_rows, old_ms, old_rows))
+    finally:
+        try:
+            os.remove(_DB_PATH)
+        except FileNotFoundError:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Prueba de carga local del despacho repartido (dispatch_shards) con varios procesos.
+
+Encola N comandos de despacho repartidos en los 64 shards y levanta 1, 2 y 4
+procesos worker sobre la misma BD (SQLite temporal). Cada worker toma leases de
+shards (ShardLeases), atiende solo los comandos de sus shards y por cada uno hace lo
+que hace una oferta: chequeo de fencing en BD, espera de red (envio a Telegram) y
+escritura del estado compartido con su token. Mide comandos/segundo y verifica que
+ningun comando se atendio dos veces.
+
+Ejecutar desde Backend/:
+    python ../tests/bench_dispatch_shards.py [comandos] [latencia_ms]
+
+Ejemplo:
+    python ../tests/bench_dispatch_shards.py 400 20
+"""
+
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Backend"))
+
+
+def _worker(db_path, worker_id, latency_s, done_queue, start_event):
+    os.environ["DB_PATH"] = db_path
+    os.environ.pop("DATABASE_URL", None)
+    import db
+    from dispatch_shards import DISPATCH_SHARDS, ShardLeases
+
+    leases = ShardLeases("bench", DISPATCH_SHARDS, worker_id, ttl_seconds=10, renew_seconds=0.1)
+    start_event.wait()
+    handled = []
+    idle_since = None
+    while True:
+        leases.maybe_refresh()
+        batch = db.fetch_dispatch_commands(leases.owned(), limit=20)
+        if not batch:
+            idle_since = idle_since or time.perf_counter()
+            if time.perf_counter() - idle_since > 1.0:
+                break
+            time.sleep(0.02)
+            continue
+        idle_since = None
+        for command_id, _command, payload in batch:
+            shard_no = int(payload.split(":")[0])
+            if not leases.fence_holds(shard_no):
+                continue
+            time.sleep(latency_s)  # envio de la oferta a Telegram
+            db.put_dispatch_state("bench", command_id, payload, fencing_token=leases.fence(shard_no))
+            handled.append(command_id)
+        db.delete_dispatch_commands([command_id for command_id, _c, _p in batch])
+    leases.release_all()
+    done_queue.put(handled)
+
+
+def _run(workers, commands, latency_s):
+    fd, db_path = tempfile.mkstemp(prefix="domi_bench_shards_", suffix=".db")
+    os.close(fd)
+    os.environ["DB_PATH"] = db_path
+    os.environ.pop("DATABASE_URL", None)
+    import db
+    from dispatch_shards import DISPATCH_SHARDS
+
+    db.init_db()
+    for i in range(commands):
+        shard_no = i % DISPATCH_SHARDS
+        db.enqueue_dispatch_command(shard_no, "CALL", "{}:{}".format(shard_no, i))
+
+    ctx = multiprocessing.get_context("spawn")
+    done_queue = ctx.Queue()
+    start_event = ctx.Event()
+    procs = [
+        ctx.Process(target=_worker, args=(db_path, "w{}".format(i), latency_s, done_queue, start_event))
+        for i in range(workers)
+    ]
+    for proc in procs:
+        proc.start()
+    time.sleep(1.0)  # arranque de los procesos
+    start = time.perf_counter()
+    start_event.set()
+    handled = [done_queue.get() for _ in procs]
+    elapsed = time.perf_counter() - start - 1.0  # espera final sin comandos
+    for proc in procs:
+        proc.join()
+    os.remove(db_path)
+    ids = [command_id for chunk in handled for command_id in chunk]
+    return len(ids) / elapsed, len(ids), len(set(ids)) == len(ids)
+
+
+def main():
+    commands = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    latency_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 20.0
+    print("Comandos: {}  latencia por oferta: {:.0f} ms".format(commands, latency_ms))
+    base = None
+    for workers in (1, 2, 4):
+        rate, handled, unique = _run(workers, commands, latency_ms / 1000.0)
+        base = base or rate
+        print("workers={:<2d} {:8.1f} comandos/s  x{:.2f}  atendidos={} sin_duplicados={}".format(
+            workers, rate, rate / base, handled, unique))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Prueba de carga de las lecturas del panel: endpoints sync en el threadpool de Starlette
+(antes) contra endpoints async con las lecturas de web/async_db.py (despues).
+
+Cada usuario del panel repite en bucle la carga de una pantalla: estadisticas del
+dashboard y, como repartidor, dashboard y ganancias del mes. La BD es un SQLite
+temporal y cada conexion espera latencia_ms (ida y vuelta a Postgres en otra maquina).
+
+- antes: como FastAPI con `def`: la dependencia de identidad y el endpoint corren cada
+  uno en el threadpool de Starlette (40 hilos, CapacityLimiter por defecto de anyio).
+- despues: los endpoints `async def` reales (dashboard_stats, courier_dashboard,
+  courier_earnings) con get_current_user_async; las consultas van al mismo threadpool
+  de Starlette (run_in_threadpool). Se espera el mismo rendimiento: sirve para ver que
+  no haya regresiones.
+
+Mide peticiones/segundo con 50, 100 y 200 usuarios concurrentes.
+
+Ejecutar desde Backend/:
+    python ../tests/bench_panel_reads.py [segundos] [latencia_ms]
+
+Ejemplo:
+    python ../tests/bench_panel_reads.py 5 5
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+import types
+from datetime import datetime, timezone
+
+_fd, _DB_PATH = tempfile.mkstemp(prefix="domi_bench_panel_", suffix=".db")
+os.close(_fd)
+os.environ["DB_PATH"] = _DB_PATH
+os.environ.pop("DATABASE_URL", None)
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Backend"))
+
+# FastAPI no es necesario para llamar a los endpoints como funciones.
+if "fastapi" not in sys.modules:
+    try:
+        import fastapi  # noqa: F401
+    except ImportError:
+        fastapi_stub = types.ModuleType("fastapi")
+
+        class HTTPException(Exception):
+            def __init__(self, status_code, detail=None, headers=None):
+                super().__init__(detail)
+                self.status_code = status_code
+                self.detail = detail
+
+        class APIRouter:
+            def __init__(self, *args, **kwargs):
+                pass
+
+            def get(self, *args, **kwargs):
+                return lambda fn: fn
+
+        fastapi_stub.HTTPException = HTTPException
+        fastapi_stub.APIRouter = APIRouter
+        fastapi_stub.Depends = lambda dependency=None: dependency
+        fastapi_stub.Header = lambda default="": default
+        sys.modules["fastapi"] = fastapi_stub
+
+import db  # noqa: E402
+from services import get_dashboard_stats  # noqa: E402
+from starlette.concurrency import run_in_threadpool  # noqa: E402
+from web.api.courier import courier_dashboard, courier_earnings, _require_courier  # noqa: E402
+from web.api.dashboard import dashboard_stats  # noqa: E402
+from web.auth.dependencies import get_current_user, get_current_user_async  # noqa: E402
+from web.auth.guards import require_panel_admin  # noqa: E402
+from web.auth.token import create_token  # noqa: E402
+
+# CapacityLimiter por defecto de anyio (threadpool de Starlette)
+STARLETTE_THREADPOOL = 40
+
+
+def _seed():
+    db.init_db()
+    conn = db.get_connection()
+    cur = conn.cursor()
+    user = db.ensure_user(990001, "bench_courier")
+    cur.execute(
+        "INSERT INTO couriers (user_id, full_name, id_number, phone, city, barrio, status, code) "
+        "VALUES (?, 'Bench', 'CC990001', '3000000000', 'Pereira', 'Centro', 'APPROVED', 'R-990001')",
+        (user["id"],),
+    )
+    courier_id = cur.lastrowid
+    cur.execute("INSERT INTO web_users (username, password_hash, role, status) "
+                "VALUES ('bench_admin', 'x', 'ADMIN_PLATFORM', 'APPROVED')")
+    cur.execute("INSERT INTO web_users (username, password_hash, role, status, courier_id) "
+                "VALUES ('bench_courier', 'x', 'COURIER', 'APPROVED', ?)", (courier_id,))
+    conn.commit()
+    conn.close()
+
+
+class _PooledConnection:
+    """Conexion reutilizada por hilo (como un pool de Postgres): close() no la cierra."""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def close(self):
+        pass
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def _with_latency(latency_s):
+    real = db.get_connection
+    local = threading.local()
+
+    def get_connection():
+        # SQLite abriendo una conexion por consulta desde 200 hilos se traba en sus
+        # propios locks; Postgres no. Se reutiliza una conexion por hilo y la espera
+        # de red se simula.
+        time.sleep(latency_s)  # ida y vuelta a la BD
+        if getattr(local, "conn", None) is None:
+            local.conn = _PooledConnection(real())
+        return local.conn
+
+    db.get_connection = get_connection
+
+
+def _month_range():
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    return start.strftime("%Y-%m-%d %H:%M:%S"), now.strftime("%Y-%m-%d %H:%M:%S")
+
+
+async def _screen_before(admin_auth, courier_auth):
+    """Pantalla con endpoints sync: dependencia y endpoint, un hilo de Starlette cada uno."""
+    admin = await run_in_threadpool(get_current_user, admin_auth)
+    await run_in_threadpool(lambda: (require_panel_admin(admin), get_dashboard_stats(admin_id=None)))
+    courier = await run_in_threadpool(get_current_user, courier_auth)
+    await run_in_threadpool(db.get_courier_web_dashboard, courier.courier_id)
+    courier = await run_in_threadpool(get_current_user, courier_auth)
+    start_s, end_s = _month_range()
+    await run_in_threadpool(db.get_courier_web_earnings, courier.courier_id, start_s, end_s)
+    return 3
+
+
+async def _screen_after(admin_auth, courier_auth):
+    """Misma pantalla con los endpoints async reales."""
+    admin = await get_current_user_async(admin_auth)
+    await dashboard_stats(current_user=admin)
+    courier = await _require_courier(await get_current_user_async(courier_auth))
+    await courier_dashboard(user=courier)
+    courier = await _require_courier(await get_current_user_async(courier_auth))
+    await courier_earnings(period="mes", user=courier)
+    return 3
+
+
+async def _load(screen, users, seconds):
+    admin_auth = "Bearer " + create_token("bench_admin")
+    courier_auth = "Bearer " + create_token("bench_courier")
+    deadline = time.perf_counter() + seconds
+    done = [0]
+
+    async def user_loop():
+        while time.perf_counter() < deadline:
+            requests = await screen(admin_auth, courier_auth)
+            done[0] += requests  # sumar despues del await: `done[0] += await ...` pierde cuentas
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user_loop() for _ in range(users)))
+    elapsed = time.perf_counter() - start
+    return done[0] / elapsed
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+    latency_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+    _seed()
+    _with_latency(latency_ms / 1000.0)
+    print("Duracion: {:.0f} s por corrida  latencia BD: {:.0f} ms  threadpool Starlette: {}".format(
+        seconds, latency_ms, STARLETTE_THREADPOOL))
+    for users in (50, 100, 200):
+        before = asyncio.run(_load(_screen_before, users, seconds))
+        after = asyncio.run(_load(_screen_after, users, seconds))
+        print("usuarios={:<4d} antes {:8.1f} req/s   despues {:8.1f} req/s   x{:.2f}".format(
+            users, before, after, after / before if before else 0))
+    os.remove(_DB_PATH)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Prueba de carga del procesamiento de updates por chat (update_workers).
+
+Simula N chats enviando M updates cada uno. Cada update hace lo que hace un
+handler tipico: una lectura y una escritura en la BD (SQLite temporal, una
+conexion por llamada como en produccion) y una espera de red (Telegram/Google).
+Mide updates/segundo con 1, 2, 4, 8 y 16 workers y verifica el orden por chat.
+
+Ejecutar desde Backend/:
+    python ../tests/bench_update_workers.py [chats] [updates_por_chat] [latencia_ms]
+
+Ejemplo:
+    python ../tests/bench_update_workers.py 40 10 20
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+_fd, _DB_PATH = tempfile.mkstemp(prefix="domi_bench_updates_", suffix=".db")
+os.close(_fd)
+os.environ["DB_PATH"] = _DB_PATH
+os.environ.pop("DATABASE_URL", None)
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Backend"))
+
+import db  # noqa: E402
+from update_workers import ChatOrderedUpdateRunner  # noqa: E402
+
+
+def _run(workers: int, chats: int, per_chat: int, latency_s: float):
+    seen = {}
+    lock = threading.Lock()
+
+    def handler(update):
+        chat_id = update.effective_chat.id
+        db.ensure_user(chat_id, "bench_{}".format(chat_id))
+        db.get_user_by_telegram_id(chat_id)
+        time.sleep(latency_s)  # envio a Telegram / geocoding
+        with lock:
+            seen.setdefault(chat_id, []).append(update.seq)
+
+    runner = ChatOrderedUpdateRunner(handler, workers=workers)
+    start = time.perf_counter()
+    for seq in range(per_chat):
+        for chat_id in range(1, chats + 1):
+            runner.submit(SimpleNamespace(effective_chat=SimpleNamespace(id=900000 + chat_id),
+                                          effective_user=None, seq=seq))
+    runner.shutdown(wait=True)
+    elapsed = time.perf_counter() - start
+    ordered = all(v == list(range(per_chat)) for v in seen.values())
+    return chats * per_chat / elapsed, ordered
+
+
+def main():
+    chats = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    per_chat = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    latency_ms = float(sys.argv[3]) if len(sys.argv) > 3 else 20
+    try:
+        db.init_db()
+        print("{} chats x {} updates, latencia simulada {} ms".format(chats, per_chat, latency_ms))
+        print("{:>8} {:>14} {:>10}".format("workers", "updates/s", "orden ok"))
+        for workers in (1, 2, 4, 8, 16):
+            rate, ordered = _run(workers, chats, per_chat, latency_ms / 1000.0)
+            print("{:>8} {:>14.1f} {:>10}".format(workers, rate, "si" if ordered else "NO"))
+    finally:
+        try:
+            os.remove(_DB_PATH)
+        except FileNotFoundError:
+            pass
+
+
+if __name__ == "__main__":
+    main()
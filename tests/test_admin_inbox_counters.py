@@ -0,0 +1,114 @@
+"""Tests de la bandeja de pendientes del admin (tabla admin_inbox_counters).
+
+Cubre:
+- crear / aprobar recargas mueve el contador del equipo y el de plataforma
+- crear / resolver soportes
+- vinculo de repartidor PENDING -> APPROVED
+- archivar / restaurar una direccion con parqueo pendiente
+- la reconciliacion corrige contadores desviados y dice cuantos arreglo
+- get_admin_inbox_counts devuelve 0 para tipos sin fila
+"""
+import os
+import tempfile
+import unittest
+
+import db
+
+
+PLATFORM = db.INBOX_PLATFORM_ADMIN_ID
+
+
+class AdminInboxCountersTests(unittest.TestCase):
+
+    def setUp(self):
+        fd, path = tempfile.mkstemp(prefix="domi_inbox_", suffix=".db")
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        os.environ["DB_PATH"] = path
+        os.environ.pop("DATABASE_URL", None)
+        db.init_db()
+        self.admin_id = 41
+        self.courier_id = self._insert(
+            "INSERT INTO couriers (user_id, full_name, id_number, phone, city, barrio, status) "
+            "VALUES (?, 'Bandeja', 'CC970001', '3000000003', 'Pereira', 'Centro', 'PENDING')",
+            (db.ensure_user(970001, "bandeja")["id"],),
+        )
+        # El INSERT directo no pasa por los hooks: alinear la bandeja como lo haria el job
+        db.reconcile_admin_inbox_counters()
+
+    def _insert(self, sql, params):
+        conn = db.get_connection()
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        row_id = cur.lastrowid
+        conn.commit()
+        conn.close()
+        return row_id
+
+    def _counts(self, kind):
+        counts = db.get_admin_inbox_counts([self.admin_id, PLATFORM])
+        return counts[self.admin_id][kind], counts[PLATFORM][kind]
+
+    def test_recharge_create_and_approve(self):
+        request_id = db.create_recharge_request("COURIER", self.courier_id, self.admin_id, 10000, 1)
+        db.create_recharge_request("COURIER", self.courier_id, 99, 5000, 1)
+        self.assertEqual((1, 2), self._counts(db.INBOX_RECHARGES))
+
+        db.update_recharge_status(request_id, "APPROVED", self.admin_id)
+        self.assertEqual((0, 1), self._counts(db.INBOX_RECHARGES))
+
+    def test_support_create_and_resolve(self):
+        support_id, created = db.create_or_get_pending_support_request(self.courier_id, self.admin_id, order_id=1)
+        self.assertTrue(created)
+        self.assertEqual((1, 1), self._counts(db.INBOX_SUPPORT))
+
+        self.assertTrue(db.resolve_support_request(support_id, "FIN", self.admin_id))
+        self.assertEqual((0, 0), self._counts(db.INBOX_SUPPORT))
+
+    def test_courier_link_pending_then_approved(self):
+        db.upsert_admin_courier_link(self.admin_id, self.courier_id, "PENDING")
+        self.assertEqual((1, 1), self._counts(db.INBOX_COURIERS))
+
+        db.update_admin_courier_status(self.admin_id, self.courier_id, "APPROVED")
+        self.assertEqual(0, self._counts(db.INBOX_COURIERS)[0])
+
+    def test_parking_address_archive_and_restore(self):
+        ally_id = self._insert(
+            "INSERT INTO allies (user_id, business_name, owner_name, address, city, barrio, phone, status) "
+            "VALUES (?, 'Negocio', 'Duenio', 'Calle 1', 'Pereira', 'Centro', '3100000000', 'APPROVED')",
+            (db.ensure_user(970002, "bandeja_aliado")["id"],),
+        )
+        self._insert("INSERT INTO admin_allies (admin_id, ally_id, status) VALUES (?, ?, 'APPROVED')",
+                     (self.admin_id, ally_id))
+        customer_id = db.create_ally_customer(ally_id, "Cliente", "3200000000")
+        address_id = db.create_customer_address(customer_id, "Casa", "Calle 2", lat=4.81, lng=-75.69)
+        db.set_address_parking_status(address_id, "ALLY_YES")
+        self.assertEqual((1, 1), self._counts(db.INBOX_PARKING))
+
+        self.assertTrue(db.archive_customer_address(address_id, customer_id))
+        self.assertEqual((0, 0), self._counts(db.INBOX_PARKING))
+
+        self.assertTrue(db.restore_customer_address(address_id, customer_id))
+        self.assertEqual((1, 1), self._counts(db.INBOX_PARKING))
+
+    def test_reconcile_fixes_drift(self):
+        db.create_recharge_request("COURIER", self.courier_id, self.admin_id, 10000, 1)
+        self.assertEqual(0, db.reconcile_admin_inbox_counters())
+
+        conn = db.get_connection()
+        conn.execute("UPDATE admin_inbox_counters SET pending = 99 WHERE kind = ?", (db.INBOX_RECHARGES,))
+        conn.commit()
+        conn.close()
+        self.assertEqual((99, 99), self._counts(db.INBOX_RECHARGES))
+
+        self.assertEqual(2, db.reconcile_admin_inbox_counters())
+        self.assertEqual((1, 1), self._counts(db.INBOX_RECHARGES))
+
+    def test_missing_kinds_default_to_zero(self):
+        counts = db.get_admin_inbox_counts([12345])
+        self.assertEqual(dict.fromkeys(db.INBOX_KINDS, 0), counts[12345])
+        self.assertEqual({}, db.get_admin_inbox_counts([]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -832,7 +832,7 @@ class SupportRequestAdminRoutingTests(unittest.TestCase):
 
         order_delivery._handle_order_pickup_pinissue(update, context, 55)
 
-        mock_schedule_support_follow_up_jobs.assert_called_once_with(context, 701)
+        mock_schedule_support_follow_up_jobs.assert_called_once_with(context, 701, 55)
         mock_dispatch_support_request_notification.assert_called_once_with(context, 701, 13)
         self.assertIn(
             "Reenviamos la alerta a tu administrador",
@@ -864,7 +864,7 @@ class SupportRequestAdminRoutingTests(unittest.TestCase):
 
         order_delivery._handle_order_pickup_pinissue(update, context, 55)
 
-        mock_schedule_support_follow_up_jobs.assert_called_once_with(context, 701)
+        mock_schedule_support_follow_up_jobs.assert_called_once_with(context, 701, 55)
         mock_dispatch_support_request_notification.assert_called_once_with(context, 701, 13)
         self.assertIn(
             "La solicitud para este pedido ya estaba registrada",
@@ -0,0 +1,184 @@
+"""Tests de avisos masivos (db.create_broadcast + broadcasts.BroadcastSender).
+
+Cubre:
+- destinatarios por equipo (vinculos APPROVED), por plataforma y por ciudad/barrio,
+  sin repetir al usuario que es repartidor y aliado a la vez
+- el emisor entrega, marca fallidos los errores permanentes, devuelve el lote ante un
+  429 y avisa al creador al terminar
+- lo que quedo CLAIMED por una caida vuelve a la cola al arrancar, y un lote que no se
+  pudo confirmar vuelve en la siguiente vuelta del emisor
+- detener un aviso deja lo pendiente sin enviar
+"""
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import db
+from broadcasts import BroadcastSender
+
+
+class RetryAfter(Exception):
+    def __init__(self, seconds):
+        super().__init__("Flood control exceeded")
+        self.retry_after = seconds
+
+
+class Unauthorized(Exception):
+    pass
+
+
+class FakeBot:
+
+    def __init__(self, errors=None):
+        self.sent = []
+        self.errors = dict(errors or {})
+
+    def send_message(self, chat_id, text):
+        error = self.errors.pop(chat_id, None)
+        if error is not None:
+            raise error
+        self.sent.append((chat_id, text))
+
+
+class BroadcastTests(unittest.TestCase):
+
+    ADMIN_ID = 5
+    OTHER_ADMIN_ID = 6
+
+    def setUp(self):
+        fd, path = tempfile.mkstemp(prefix="domi_broadcast_", suffix=".db")
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        os.environ["DB_PATH"] = path
+        os.environ.pop("DATABASE_URL", None)
+        db.init_db()
+
+    def _insert(self, sql, params):
+        conn = db.get_connection()
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        row_id = cur.lastrowid
+        conn.commit()
+        conn.close()
+        return row_id
+
+    def _courier(self, telegram_id, admin_id=ADMIN_ID, link_status="APPROVED", city="Pereira", barrio="Cuba"):
+        courier_id = self._insert(
+            "INSERT INTO couriers (user_id, full_name, id_number, phone, city, barrio, status) "
+            "VALUES (?, 'Repartidor', ?, '3000000000', ?, ?, 'APPROVED')",
+            (db.ensure_user(telegram_id, "c{}".format(telegram_id))["id"], "CC{}".format(telegram_id), city, barrio),
+        )
+        self._insert("INSERT INTO admin_couriers (admin_id, courier_id, status) VALUES (?, ?, ?)",
+                     (admin_id, courier_id, link_status))
+        return courier_id
+
+    def _ally(self, telegram_id, admin_id=ADMIN_ID, city="Pereira", barrio="Centro"):
+        ally_id = self._insert(
+            "INSERT INTO allies (user_id, business_name, owner_name, address, city, barrio, phone, status) "
+            "VALUES (?, 'Negocio', 'Duenio', 'Calle 1', ?, ?, '3100000000', 'APPROVED')",
+            (db.ensure_user(telegram_id, "a{}".format(telegram_id))["id"], city, barrio),
+        )
+        self._insert("INSERT INTO admin_allies (admin_id, ally_id, status) VALUES (?, ?, 'APPROVED')",
+                     (admin_id, ally_id))
+        return ally_id
+
+    def _sender(self, bot):
+        return BroadcastSender(bot, rate_per_second=10000, batch_size=10, poll_seconds=0)
+
+    def test_audience_by_team_platform_and_zone(self):
+        self._courier(1001)
+        self._courier(1002, city=" pereira ", barrio="Centro")
+        self._courier(1003, link_status="PENDING")
+        self._courier(1004, admin_id=self.OTHER_ADMIN_ID, city="Armenia")
+        self._ally(1001)  # mismo usuario: repartidor y aliado
+        self._ally(1005)
+
+        self.assertEqual(2, db.count_broadcast_audience(db.BROADCAST_ROLE_COURIER, scope_admin_id=self.ADMIN_ID))
+        self.assertEqual(3, db.count_broadcast_audience(db.BROADCAST_ROLE_ALL, scope_admin_id=self.ADMIN_ID))
+        self.assertEqual(1, db.count_broadcast_audience(
+            db.BROADCAST_ROLE_COURIER, scope_admin_id=self.ADMIN_ID, city="PEREIRA", barrio="cuba"))
+        self.assertEqual(5, db.count_broadcast_audience(db.BROADCAST_ROLE_ALL))
+        self.assertEqual(1, db.count_broadcast_audience(db.BROADCAST_ROLE_COURIER, city="Armenia"))
+
+        broadcast_id, total = db.create_broadcast(
+            self.ADMIN_ID, "Alta demanda en Cuba", db.BROADCAST_ROLE_ALL, scope_admin_id=self.ADMIN_ID)
+        self.assertEqual(3, total)
+        broadcast = db.get_broadcast(broadcast_id)
+        self.assertEqual(("SENDING", 3, 3), (broadcast["status"], broadcast["total"], broadcast["pending"]))
+
+        empty_id, empty_total = db.create_broadcast(
+            self.ADMIN_ID, "Nadie", db.BROADCAST_ROLE_ALLY, scope_admin_id=self.ADMIN_ID, city="Cali")
+        self.assertEqual(0, empty_total)
+        self.assertEqual("DONE", db.get_broadcast(empty_id)["status"])
+
+    def test_sender_delivers_and_reports(self):
+        for telegram_id in (2001, 2002, 2003, 2004):
+            self._courier(telegram_id)
+        broadcast_id, _ = db.create_broadcast(
+            self.ADMIN_ID, "Activen el GPS", db.BROADCAST_ROLE_COURIER,
+            scope_admin_id=self.ADMIN_ID, created_by_telegram_id=9000)
+        bot = FakeBot(errors={2002: Unauthorized("bot was blocked by the user"), 2003: RetryAfter(0)})
+        sender = self._sender(bot)
+
+        self.assertEqual(4, sender.send_once())
+        partial = db.get_broadcast(broadcast_id)
+        self.assertEqual(("SENDING", 1, 1, 2), (partial["status"], partial["sent"], partial["failed"], partial["pending"]))
+
+        self.assertEqual(2, sender.send_once())
+        self.assertEqual(0, sender.send_once())
+        done = db.get_broadcast(broadcast_id)
+        self.assertEqual(("DONE", 3, 1, 0), (done["status"], done["sent"], done["failed"], done["pending"]))
+        self.assertEqual([2001, 2003, 2004, 9000], [chat_id for chat_id, _ in bot.sent])
+        self.assertIn("Entregados: 3 de 4", bot.sent[-1][1])
+
+    def test_claimed_recipients_resume_after_restart(self):
+        for telegram_id in (3001, 3002, 3003):
+            self._courier(telegram_id)
+        broadcast_id, _ = db.create_broadcast(self.ADMIN_ID, "Cambio de tarifas", db.BROADCAST_ROLE_COURIER,
+                                              scope_admin_id=self.ADMIN_ID)
+        self.assertEqual(2, len(db.claim_broadcast_recipients("caido:1", limit=2)))
+
+        self.assertEqual(2, db.requeue_broadcast_recipients())
+        bot = FakeBot()
+        self.assertEqual(3, self._sender(bot).send_once())
+        self.assertEqual("DONE", db.get_broadcast(broadcast_id)["status"])
+        self.assertEqual([3001, 3002, 3003], [chat_id for chat_id, _ in bot.sent])
+
+    def test_batch_left_claimed_by_failed_commit_is_requeued(self):
+        for telegram_id in (3101, 3102):
+            self._courier(telegram_id)
+        broadcast_id, _ = db.create_broadcast(self.ADMIN_ID, "Lluvia", db.BROADCAST_ROLE_COURIER,
+                                              scope_admin_id=self.ADMIN_ID)
+        bot = FakeBot()
+        sender = self._sender(bot)
+        sender._requeue()  # como start(): la siguiente revision periodica queda lejos
+
+        with patch("broadcasts.complete_broadcast_recipients", side_effect=RuntimeError("db caida")):
+            self.assertEqual(0, sender.step())
+        conn = db.get_connection()
+        statuses = [row["status"] for row in conn.execute("SELECT status FROM broadcast_recipients")]
+        conn.close()
+        self.assertEqual(["PENDING", "PENDING"], statuses)
+
+        self.assertEqual(2, sender.step())
+        self.assertEqual("DONE", db.get_broadcast(broadcast_id)["status"])
+        self.assertEqual([3101, 3102, 3101, 3102], [chat_id for chat_id, _ in bot.sent])
+
+    def test_cancel_skips_pending(self):
+        for telegram_id in (4001, 4002):
+            self._courier(telegram_id)
+        broadcast_id, _ = db.create_broadcast(self.ADMIN_ID, "Aviso", db.BROADCAST_ROLE_COURIER,
+                                              scope_admin_id=self.ADMIN_ID)
+
+        self.assertTrue(db.cancel_broadcast(broadcast_id))
+        self.assertFalse(db.cancel_broadcast(broadcast_id))
+        bot = FakeBot()
+        self.assertEqual(0, self._sender(bot).send_once())
+        broadcast = db.get_broadcast(broadcast_id)
+        self.assertEqual(("CANCELLED", 0, 0), (broadcast["status"], broadcast["sent"], broadcast["pending"]))
+        self.assertEqual([], bot.sent)
+
+
+if __name__ == "__main__":
+    unittest.main()
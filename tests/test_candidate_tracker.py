@@ -0,0 +1,141 @@
+"""Tests del refresco incremental de candidatos (candidate_tracker.py).
+
+Cubre:
+- la primera pasada evalua a todos los elegibles con una sola consulta por lotes
+- una pasada sin cambios no re-evalua a nadie y reusa vinculo/saldo en memoria
+- cambios de saldo (admin_couriers) solo re-evaluan a los couriers afectados; los
+  pings de ubicacion no re-evaluan a nadie; los nuevos en el radio se evaluan al entrar
+- el umbral de saldo por pedido (fee + comision especial) se aplica sobre el cache
+- team_only deja solo a los couriers del admin y unfunded lista a quienes avisar
+"""
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Backend"))
+
+import db
+import candidate_tracker as ct
+
+
+class CandidateTrackerTests(unittest.TestCase):
+
+    def setUp(self):
+        fd, path = tempfile.mkstemp(prefix="domi_candidates_", suffix=".db")
+        os.close(fd)
+        self.db_path = path
+        os.environ["DB_PATH"] = self.db_path
+        os.environ.pop("DATABASE_URL", None)
+        db.init_db()
+        self.tracker = ct.CandidateTracker()
+        self.couriers = [self._seed_courier(960000 + i, balance=1000) for i in range(5)]
+
+        self.link_lookups = []
+        self._original_links = ct.get_courier_dispatch_links
+
+        def counting_links(courier_ids):
+            self.link_lookups.append(sorted(courier_ids))
+            return self._original_links(courier_ids)
+
+        ct.get_courier_dispatch_links = counting_links
+
+    def tearDown(self):
+        ct.get_courier_dispatch_links = self._original_links
+        try:
+            os.remove(self.db_path)
+        except (FileNotFoundError, PermissionError):
+            pass
+
+    def _seed_courier(self, tg_id, balance, admin_id=1):
+        user = db.ensure_user(tg_id, "courier_{}".format(tg_id))
+        conn = db.get_connection()
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO couriers (user_id, full_name, id_number, phone, city, barrio, status, code)
+            VALUES (?, ?, ?, '3300000000', 'Pereira', 'Cuba', 'APPROVED', ?)
+            """,
+            (user["id"], "Courier {}".format(tg_id), "CC{}".format(tg_id), "R-{}".format(tg_id)),
+        )
+        courier_id = cur.lastrowid
+        cur.execute(
+            "INSERT INTO admin_couriers (admin_id, courier_id, status, balance) VALUES (?, ?, 'APPROVED', ?)",
+            (admin_id, courier_id, balance),
+        )
+        conn.commit()
+        conn.close()
+        return courier_id
+
+    def test_unchanged_pass_reuses_previous_evaluation(self):
+        ids, evaluated = self.tracker.refresh(1, self.couriers, 300)
+        self.assertEqual(self.couriers, ids)
+        self.assertEqual(5, evaluated)
+        self.assertEqual([sorted(self.couriers)], self.link_lookups)
+
+        ids, evaluated = self.tracker.refresh(1, self.couriers, 300)
+        self.assertEqual(self.couriers, ids)
+        self.assertEqual(0, evaluated)
+        self.assertEqual(1, len(self.link_lookups))
+
+    def test_balance_changes_only_reevaluate_affected(self):
+        c1, c2, c3, c4, c5 = self.couriers
+        self.tracker.refresh(2, self.couriers, 300)
+
+        db.update_courier_link_balance(c2, 1, -900)
+        db.update_courier_live_location(c4, 4.81, -75.69)
+        ids, evaluated = self.tracker.refresh(2, self.couriers, 300)
+
+        self.assertEqual(1, evaluated)
+        self.assertEqual([c2], self.link_lookups[-1])
+        self.assertEqual([c1, c3, c4, c5], ids)
+
+        db.update_courier_link_balance(c2, 1, 500)
+        ids, _ = self.tracker.refresh(2, self.couriers, 300)
+        self.assertIn(c2, ids)
+
+    def test_new_courier_in_radius_is_evaluated_on_entry(self):
+        c1, c2, c3, c4, c5 = self.couriers
+        self.tracker.refresh(3, [c1, c2], 300)
+        newcomer = self._seed_courier(969999, balance=100)
+
+        ids, evaluated = self.tracker.refresh(3, [newcomer, c1, c2], 300)
+        self.assertEqual(1, evaluated)
+        self.assertEqual([newcomer], self.link_lookups[-1])
+        self.assertEqual([c1, c2], ids)
+
+    def test_special_commission_threshold_uses_cached_balance(self):
+        c1, c2, c3, c4, c5 = self.couriers
+        db.update_courier_link_balance(c3, 1, 500)
+        ids, _ = self.tracker.refresh(4, self.couriers, 300)
+        self.assertEqual(self.couriers, ids)
+
+        ids, evaluated = self.tracker.refresh(4, self.couriers, 300 + 1000)
+        self.assertEqual(0, evaluated)
+        self.assertEqual([c3], ids)
+
+    def test_team_filter_and_unfunded_couriers(self):
+        c1, c2, c3, c4, c5 = self.couriers
+        outsider = self._seed_courier(969998, balance=1000, admin_id=2)
+        db.update_courier_link_balance(c2, 1, -900)
+        eligible = [outsider, c1, c2, c3]
+
+        ids, _ = self.tracker.refresh(6, eligible, 300)
+        self.assertEqual([outsider, c1, c3], ids)
+        self.assertEqual([c2], self.tracker.unfunded(6))
+
+        ids, evaluated = self.tracker.refresh(6, eligible, 300, admin_id=1)
+        self.assertEqual(0, evaluated)
+        self.assertEqual([c1, c3], ids)
+        self.assertEqual([c2], self.tracker.unfunded(6))
+        self.assertEqual([], self.tracker.unfunded(99))
+
+    def test_expired_set_is_fully_rebuilt(self):
+        tracker = ct.CandidateTracker(full_refresh_seconds=0)
+        tracker.refresh(5, self.couriers, 300)
+        _, evaluated = tracker.refresh(5, self.couriers, 300)
+        self.assertEqual(5, evaluated)
+
+
+if __name__ == "__main__":
+    unittest.main()
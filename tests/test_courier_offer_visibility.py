@@ -1,9 +1,15 @@
 import ast
+import os
 import re
+import sys
 import unittest
 from pathlib import Path
 from types import SimpleNamespace
 
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Backend"))
+
+import courier_ranking
+
 
 REPO_ROOT = Path(__file__).resolve().parents[1]
 ORDER_DELIVERY_PATH = REPO_ROOT / "Backend" / "order_delivery.py"
@@ -29,6 +35,10 @@ def _extract_namespace():
         "_get_route_stop_visible_line",
         "_get_order_missing_courier_visibility_fields",
         "_get_route_missing_courier_visibility_fields",
+        "_build_offer_text_parts",
+        "_offer_courier_distance_text",
+        "_offer_detour_text",
+        "_offer_detour_label",
         "_build_offer_text",
         "_build_route_offer_text",
         "build_courier_order_preview_text",
@@ -73,6 +83,8 @@ def _extract_namespace():
             "fee_admin_share": 200,
             "fee_platform_share": 100,
         },
+        "nearest_neighbor_order": courier_ranking.nearest_neighbor_order,
+        "path_length_km": courier_ranking.path_length_km,
         "haversine_km": lambda lat1, lng1, lat2, lng2: abs(float(lat1) - float(lat2))
         + abs(float(lng1) - float(lng2)),
     }
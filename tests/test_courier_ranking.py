@@ -0,0 +1,152 @@
+"""Tests del kernel de ranking de couriers (courier_ranking.py).
+
+Cubre:
+- rank_candidates da el mismo orden y radio que el ordenamiento anterior por courier
+- los couriers sin ubicacion y los fuera del radio (descarte por caja) quedan fuera
+- detour_ratios coincide con la formula escalar sobre haversine_km (tramos redondeados)
+- _bulk_offer_detour_ratios respeta GPS activo y el servicio PICKED_UP de referencia
+"""
+import math
+import os
+import random
+import sys
+import types
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Backend"))
+
+import courier_ranking as cr
+from services import haversine_km
+
+
+def _reference_rank(couriers, pickup_lat, pickup_lng):
+    """Ordenamiento previo de get_eligible_couriers_for_order (sort_key + segundo pase de radio)."""
+    def _haversine(lat1, lng1, lat2, lng2):
+        p1, p2 = math.radians(lat1), math.radians(lat2)
+        dlat = math.radians(lat2 - lat1)
+        dlng = math.radians(lng2 - lng1)
+        a = math.sin(dlat / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dlng / 2) ** 2
+        return 6371.0 * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+    def _sort_key(c):
+        status = c.get("availability_status", "INACTIVE")
+        is_live = int(c.get("live_location_active") or 0) == 1
+        priority = 0 if status == "APPROVED" and is_live else (1 if status == "APPROVED" else 2)
+        clat = c.get("live_lat") or c.get("residence_lat")
+        clng = c.get("live_lng") or c.get("residence_lng")
+        dist = _haversine(pickup_lat, pickup_lng, clat, clng) if clat is not None and clng is not None else 9999
+        return (priority, dist, -int(c.get("available_cash") or 0))
+
+    ordered = sorted(couriers, key=_sort_key)
+    within = []
+    for c in ordered:
+        clat = c.get("live_lat") or c.get("residence_lat")
+        clng = c.get("live_lng") or c.get("residence_lng")
+        if clat is not None and clng is not None and _haversine(pickup_lat, pickup_lng, clat, clng) <= 7.0:
+            within.append(c)
+    return within
+
+
+def _random_couriers(n, seed=7):
+    rnd = random.Random(seed)
+    couriers = []
+    for idx in range(n):
+        has_live = rnd.random() < 0.8
+        couriers.append({
+            "courier_id": idx + 1,
+            "availability_status": rnd.choice(["APPROVED", "APPROVED", "INACTIVE"]),
+            "live_location_active": 1 if has_live else 0,
+            "live_lat": 4.81 + rnd.uniform(-0.12, 0.12) if has_live else None,
+            "live_lng": -75.69 + rnd.uniform(-0.12, 0.12) if has_live else None,
+            "residence_lat": 4.81 + rnd.uniform(-0.1, 0.1) if rnd.random() < 0.5 else None,
+            "residence_lng": -75.69 + rnd.uniform(-0.1, 0.1),
+            "available_cash": rnd.choice([0, 20000, 50000, 50000]),
+        })
+    return couriers
+
+
+class CourierRankingTests(unittest.TestCase):
+
+    def test_rank_matches_previous_ordering(self):
+        couriers = _random_couriers(600)
+        ranked = cr.rank_candidates(couriers, 4.81, -75.69)
+        self.assertEqual(
+            [c["courier_id"] for c in _reference_rank(couriers, 4.81, -75.69)],
+            [c["courier_id"] for c in ranked],
+        )
+        self.assertTrue(0 < len(ranked) < len(couriers))
+
+    def test_missing_and_far_couriers_are_excluded(self):
+        couriers = [
+            {"courier_id": 1, "availability_status": "APPROVED", "live_location_active": 1,
+             "live_lat": 4.90, "live_lng": -75.69, "available_cash": 0},   # ~10 km al norte
+            {"courier_id": 2, "availability_status": "APPROVED", "live_location_active": 1,
+             "live_lat": None, "live_lng": None, "available_cash": 0},
+            {"courier_id": 3, "availability_status": "APPROVED", "live_location_active": 0,
+             "residence_lat": 4.82, "residence_lng": -75.70, "available_cash": 0},
+            {"courier_id": 4, "availability_status": "APPROVED", "live_location_active": 1,
+             "live_lat": 4.83, "live_lng": -75.69, "available_cash": 0},
+        ]
+        self.assertEqual([4, 3], [c["courier_id"] for c in cr.rank_candidates(couriers, 4.81, -75.69)])
+        self.assertEqual([None, None], cr.distances_km(4.81, -75.69, [(4.90, -75.69), (None, 1)], max_km=7.0))
+
+    def test_detour_ratios_match_scalar_formula(self):
+        rnd = random.Random(3)
+        pickup = (4.81, -75.69)
+        origins = [(4.81 + rnd.uniform(-0.05, 0.05), -75.69 + rnd.uniform(-0.05, 0.05)) for _ in range(50)]
+        dests = [(4.81 + rnd.uniform(-0.05, 0.05), -75.69 + rnd.uniform(-0.05, 0.05)) for _ in range(50)]
+        origins.append((4.81, -75.69))
+        dests.append((4.8101, -75.6901))
+        origins.append((None, None))
+        dests.append((4.8, -75.7))
+
+        ratios = cr.detour_ratios(pickup[0], pickup[1], origins, dests)
+        for (o_lat, o_lng), (d_lat, d_lng), ratio in zip(origins[:-1], dests[:-1], ratios[:-1]):
+            direct = haversine_km(o_lat, o_lng, d_lat, d_lng)
+            expected = 1.0 if direct < 0.05 else (
+                haversine_km(o_lat, o_lng, pickup[0], pickup[1]) + haversine_km(pickup[0], pickup[1], d_lat, d_lng)
+            ) / direct
+            self.assertAlmostEqual(expected, ratio, places=9)
+        self.assertEqual(1.0, ratios[-2])
+        self.assertIsNone(ratios[-1])
+
+    def test_nearest_neighbor_order(self):
+        items = [{"id": 1, "lat": 4.80, "lng": -75.69}, {"id": 2, "lat": 4.90, "lng": -75.69},
+                 {"id": 3, "lat": 4.81, "lng": -75.69}]
+        ordered, km = cr.nearest_neighbor_order(items)
+        self.assertEqual([1, 3, 2], [i["id"] for i in ordered])
+        self.assertAlmostEqual(cr.path_length_km(ordered), km, places=9)
+        self.assertEqual(([], 0.0), cr.nearest_neighbor_order([]))
+
+
+class BulkOfferDetourTests(unittest.TestCase):
+
+    def test_bulk_detours_follow_multi_order_rules(self):
+        telegram_stub = types.ModuleType("telegram")
+        telegram_stub.InlineKeyboardButton = lambda *a, **k: None
+        telegram_stub.InlineKeyboardMarkup = lambda *a, **k: None
+        sys.modules.setdefault("telegram", telegram_stub)
+        import order_delivery
+
+        courier = {"live_lat": 4.81, "live_lng": -75.69, "live_location_active": 1}
+        accepted = {"id": 1, "status": "ACCEPTED", "customer_name": "X", "ally_id": 1,
+                    "pickup_lat": 4.83, "pickup_lng": -75.69}
+        picked_up = {"id": 2, "status": "PICKED_UP", "customer_name": "Y", "ally_id": 1,
+                     "dropoff_lat": 4.85, "dropoff_lng": -75.69}
+        contexts = {
+            10: {"courier": courier, "active_services": [accepted, picked_up]},
+            11: {"courier": dict(courier, live_location_active=0), "active_services": [accepted]},
+            12: {"courier": courier, "active_services": []},
+            13: None,
+        }
+        ratios = order_delivery._bulk_offer_detour_ratios(contexts, 4.82, -75.69)
+        self.assertEqual([10], list(ratios))
+        _ok, _err, scalar = order_delivery._check_multi_order_detour(
+            courier, 4.82, -75.69, [accepted, picked_up], count_block=False
+        )
+        self.assertAlmostEqual(scalar, ratios[10], places=9)
+        self.assertIn("minimo", order_delivery._offer_detour_label(ratios[10]))
+
+
+if __name__ == "__main__":
+    unittest.main()
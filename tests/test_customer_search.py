@@ -0,0 +1,115 @@
+"""Tests de la búsqueda indexada de clientes en las agendas de aliado y admin.
+
+Cubre:
+- name_search/phone_search se mantienen al crear y editar
+- búsqueda insensible a tildes también en SQLite
+- teléfono con separadores coincide con el guardado
+- tolerancia a errores de tipeo y orden por use_count
+- el aislamiento por aliado/admin y por estado ACTIVE se conserva
+"""
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Backend"))
+
+import db
+
+
+class CustomerSearchTests(unittest.TestCase):
+
+    def setUp(self):
+        fd, path = tempfile.mkstemp(prefix="domi_customer_search_", suffix=".db")
+        os.close(fd)
+        self.db_path = path
+        os.environ["DB_PATH"] = self.db_path
+        os.environ.pop("DATABASE_URL", None)
+        db.init_db()
+        self.ally_id = 1
+        self.other_ally_id = 2
+        self.admin_id = 7
+
+    def tearDown(self):
+        try:
+            os.remove(self.db_path)
+        except (FileNotFoundError, PermissionError):
+            pass
+
+    def _names(self, rows):
+        return [r["name"] for r in rows]
+
+    def test_write_paths_keep_normalized_columns(self):
+        customer_id = db.create_ally_customer(self.ally_id, "  José  Peña ", "310-555 1234")
+        row = self._raw("ally_customers", customer_id)
+        self.assertEqual("jose pena", row["name_search"])
+        self.assertEqual("573105551234", row["phone_search"])
+
+        db.update_ally_customer(customer_id, self.ally_id, "Ángela Ríos", "3001112233")
+        row = self._raw("ally_customers", customer_id)
+        self.assertEqual("angela rios", row["name_search"])
+        self.assertEqual("573001112233", row["phone_search"])
+
+    def test_search_folds_accents_and_matches_phone_with_separators(self):
+        db.create_ally_customer(self.ally_id, "José Peña", "3105551234")
+        db.create_ally_customer(self.ally_id, "Maria Lopez", "3009998877")
+
+        self.assertEqual(["José Peña"], self._names(db.search_ally_customers(self.ally_id, "jose")))
+        self.assertEqual(["José Peña"], self._names(db.search_ally_customers(self.ally_id, "PEÑA")))
+        self.assertEqual(["Maria Lopez"], self._names(db.search_ally_customers(self.ally_id, "María")))
+        self.assertEqual(["José Peña"], self._names(db.search_ally_customers(self.ally_id, "310-555 1234")))
+        self.assertEqual(["Maria Lopez"], self._names(db.search_ally_customers(self.ally_id, "998")))
+
+    def test_search_tolerates_typos_after_exact_matches(self):
+        db.create_ally_customer(self.ally_id, "Alejandro Gomez", "3101111111")
+        db.create_ally_customer(self.ally_id, "Alejandra Ruiz", "3102222222")
+        db.create_ally_customer(self.ally_id, "Pedro Perez", "3103333333")
+
+        rows = db.search_ally_customers(self.ally_id, "alejandor")
+        self.assertIn("Alejandro Gomez", self._names(rows))
+        self.assertNotIn("Pedro Perez", self._names(rows))
+
+        rows = db.search_ally_customers(self.ally_id, "alejandra")
+        self.assertEqual("Alejandra Ruiz", rows[0]["name"])
+
+    def test_exact_matches_ranked_by_use_count(self):
+        first = db.create_ally_customer(self.ally_id, "Ana Torres", "3101111111")
+        second = db.create_ally_customer(self.ally_id, "Ana Villa", "3102222222")
+        db.increment_ally_customer_usage(second)
+        db.increment_ally_customer_usage(second)
+        db.increment_ally_customer_usage(first)
+
+        self.assertEqual(["Ana Villa", "Ana Torres"], self._names(db.search_ally_customers(self.ally_id, "ana")))
+
+    def test_search_respects_owner_and_active_status(self):
+        archived = db.create_ally_customer(self.ally_id, "Carlos Mejia", "3101111111")
+        db.archive_ally_customer(archived, self.ally_id)
+        db.create_ally_customer(self.other_ally_id, "Carlos Ruiz", "3102222222")
+        db.create_admin_customer(self.admin_id, "Carlos Admin", "3103333333")
+
+        self.assertEqual([], db.search_ally_customers(self.ally_id, "carlos"))
+        self.assertEqual(["Carlos Ruiz"], self._names(db.search_ally_customers(self.other_ally_id, "carlos")))
+        self.assertEqual(["Carlos Admin"], self._names(db.search_admin_customers(self.admin_id, "cárlos")))
+
+    def test_init_db_backfills_rows_without_search_columns(self):
+        conn = db.get_connection()
+        conn.execute(
+            "INSERT INTO admin_customers (admin_id, name, phone, status) VALUES (?, ?, ?, 'ACTIVE')",
+            (self.admin_id, "Núñez Legacy", "+573104445566"),
+        )
+        conn.commit()
+        conn.close()
+
+        db.init_db()
+
+        self.assertEqual(["Núñez Legacy"], self._names(db.search_admin_customers(self.admin_id, "nunez")))
+
+    def _raw(self, table, row_id):
+        conn = db.get_connection()
+        row = conn.execute(f"SELECT * FROM {table} WHERE id = ?", (row_id,)).fetchone()
+        conn.close()
+        return row
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,152 @@
+"""Tests del modelo de demanda (demand_model.py) y su uso en build_offer_demand_preview.
+
+Cubre:
+- entrenamiento desde pedidos/rutas resueltos + oferta al publicar (dispatch_events)
+- la sugerencia es el menor incentivo que alcanza la probabilidad objetivo, con su ETA
+- bucket fino sin muestras cae al nivel mas grueso; sin historico retorna None
+- los cancelados antes del objetivo no cuentan como rechazo
+- el preview usa el modelo cuando hay historico y las reglas fijas si no
+"""
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Backend"))
+
+import db
+import demand_model as dm
+
+LAT, LNG = 4.8133, -75.6961
+
+
+class DemandModelTests(unittest.TestCase):
+
+    def setUp(self):
+        fd, path = tempfile.mkstemp(prefix="domi_demand_model_", suffix=".db")
+        os.close(fd)
+        self.db_path = path
+        os.environ["DB_PATH"] = self.db_path
+        os.environ.pop("DATABASE_URL", None)
+        db.init_db()
+        dm.demand_model.invalidate()
+        self.next_id = 1
+
+    def tearDown(self):
+        dm.demand_model.invalidate()
+        try:
+            os.remove(self.db_path)
+        except (FileNotFoundError, PermissionError):
+            pass
+
+    def _seed_order(self, incentive, wait_s=None, cancel_s=None, supply=None, distance_km=2.0):
+        order_id = self.next_id
+        self.next_id += 1
+        conn = db.get_connection()
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO orders (id, customer_name, customer_phone, customer_address, customer_city,
+                                customer_barrio, status, pickup_lat, pickup_lng, distance_km,
+                                additional_incentive, published_at, accepted_at, canceled_at)
+            VALUES (?, 'Cliente', '300', 'Calle 1', 'Pereira', 'Centro', ?, ?, ?, ?, ?,
+                    datetime('now', '-1 day'),
+                    CASE WHEN ? IS NULL THEN NULL ELSE datetime('now', '-1 day', ?) END,
+                    CASE WHEN ? IS NULL THEN NULL ELSE datetime('now', '-1 day', ?) END)
+            """,
+            (
+                order_id, "DELIVERED" if wait_s is not None else "CANCELLED", LAT, LNG, distance_km, incentive,
+                wait_s, "+{} seconds".format(wait_s or 0),
+                cancel_s, "+{} seconds".format(cancel_s or 0),
+            ),
+        )
+        if supply is not None:
+            cur.execute(
+                """
+                INSERT INTO dispatch_events (entity_type, entity_id, event, supply, cell, created_at)
+                VALUES ('ORDER', ?, 'PUBLISHED', ?, '-', datetime('now', '-1 day'))
+                """,
+                (order_id, supply),
+            )
+        conn.commit()
+        conn.close()
+
+    def test_suggests_smallest_incentive_reaching_target(self):
+        for _ in range(5):
+            self._seed_order(0, wait_s=900, supply=1)
+        for _ in range(5):
+            self._seed_order(1000, wait_s=120, supply=1)
+        for _ in range(4):
+            self._seed_order(2000, wait_s=60, supply=1)
+        self.assertGreater(dm.train_demand_model(), 0)
+
+        result = dm.suggest_incentive(LAT, LNG, 2.0, eligible_count=2)
+        self.assertEqual(1000, result["suggested_incentive"])
+        self.assertEqual(120, result["eta_accept_s"])
+        self.assertEqual(0.0, result["p_accept_base"])
+        self.assertEqual(1.0, result["p_accept_target"])
+
+    def test_falls_back_to_coarser_bucket_and_none_without_history(self):
+        self.assertIsNone(dm.suggest_incentive(LAT, LNG, 2.0, eligible_count=2))
+
+        for _ in range(10):
+            self._seed_order(0, wait_s=90)  # sin evento PUBLISHED: solo nivel por distancia
+        dm.train_demand_model()
+        result = dm.suggest_incentive(LAT, LNG, 2.5, eligible_count=7)
+        self.assertEqual(3, result["level"])
+        self.assertEqual(0, result["suggested_incentive"])
+        self.assertIsNone(dm.suggest_incentive(LAT, LNG, 12.0, eligible_count=7))
+
+    def test_early_cancellations_are_not_counted(self):
+        rows = [
+            {"incentive": 0, "wait_s": None, "end_s": 30, "distance_km": 1, "supply": None},
+            {"incentive": 0, "wait_s": None, "end_s": 900, "distance_km": 1, "supply": None},
+            {"incentive": 0, "wait_s": 100, "end_s": 100, "distance_km": 1, "supply": None},
+        ]
+        cells = dm.build_demand_cells(rows, "2026-10-19 00:00:00")
+        self.assertEqual([(3, "0-3", 0, 2, 1, 1, 100, "2026-10-19 00:00:00")], cells)
+
+    def test_curve_is_monotonic_in_incentive(self):
+        for _ in range(5):
+            self._seed_order(0, wait_s=60, supply=4)
+        for _ in range(5):
+            self._seed_order(1500, wait_s=None, cancel_s=1200, supply=4)
+        dm.train_demand_model()
+        found = dm.demand_model.lookup(LAT, LNG, 2.0, 4)
+        self.assertEqual([1.0, 1.0], [p for _tier, p, _eta in found["curve"]])
+        self.assertEqual(0, dm.suggest_incentive(LAT, LNG, 2.0, 4)["suggested_incentive"])
+
+    def test_preview_uses_model_when_available(self):
+        import services
+
+        eligible = [{"courier_id": 1, "live_lat": LAT, "live_lng": LNG}]
+        with patch("services.get_eligible_couriers_for_order", return_value=eligible), \
+                patch("services.get_courier_dispatch_links", return_value={1: (5, 5000)}) as links, \
+                patch("services.record_dispatch_signal"):
+            rules = services.build_offer_demand_preview(LAT, LNG, 3.0)
+            self.assertEqual("REGLAS", rules["model"])
+            self.assertEqual(1000, rules["suggested_incentive"])
+            links.assert_called_once_with([1])
+
+            with patch("services.suggest_incentive", return_value={
+                "suggested_incentive": 1500, "eta_accept_s": 240, "p_accept_target": 0.8,
+                "p_accept_base": 0.2, "samples": 30, "level": 1,
+            }):
+                preview = services.build_offer_demand_preview(LAT, LNG, 3.0, current_incentive=500)
+        self.assertEqual("HISTORICO", preview["model"])
+        self.assertEqual("HIGH", preview["signal_code"])
+        self.assertEqual(1500, preview["suggested_incentive"])
+        self.assertEqual(1000, preview["extra_incentive_suggested"])
+        self.assertEqual(240, preview["eta_accept_s"])
+        self.assertIn("~4 min", preview["reason"])
+
+        with patch("services.get_eligible_couriers_for_order", return_value=eligible), \
+                patch("services.get_courier_dispatch_links", return_value={1: (5, 5000)}), \
+                patch("services.record_dispatch_signal"):
+            team = services.build_offer_demand_preview(LAT, LNG, 3.0, admin_id=9, team_only=True)
+        self.assertEqual(0, team["eligible_count"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+"""Tests de la analitica de despacho (dispatch_analytics.py).
+
+Cubre:
+- geohash: codificar/decodificar una coordenada cae en la misma celda
+- oferta -> rechazo -> aceptacion: embudo, couriers vistos, respuesta e histograma de espera
+- el mapa de calor suma demanda y oferta por celda desde los agregados horarios
+- un flush fallido conserva el buffer para el siguiente intento
+- los agregados de varios flush se suman (upsert) en la misma fila horaria
+"""
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Backend"))
+
+import db
+import dispatch_analytics as da
+
+
+class DispatchAnalyticsTests(unittest.TestCase):
+
+    def setUp(self):
+        fd, path = tempfile.mkstemp(prefix="domi_dispatch_analytics_", suffix=".db")
+        os.close(fd)
+        self.db_path = path
+        os.environ["DB_PATH"] = self.db_path
+        os.environ.pop("DATABASE_URL", None)
+        db.init_db()
+        self.analytics = da.DispatchAnalytics()
+
+    def tearDown(self):
+        try:
+            os.remove(self.db_path)
+        except (FileNotFoundError, PermissionError):
+            pass
+
+    def _count(self, table):
+        conn = db.get_connection()
+        cur = conn.cursor()
+        cur.execute("SELECT COUNT(*) FROM {}".format(table))
+        count = cur.fetchone()[0]
+        conn.close()
+        return count
+
+    def test_geohash_roundtrip(self):
+        cell = da.geohash_encode(4.8133, -75.6961)
+        self.assertEqual(6, len(cell))
+        lat, lng = da.geohash_decode(cell)
+        self.assertEqual(cell, da.geohash_encode(lat, lng))
+        self.assertAlmostEqual(4.8133, lat, places=2)
+        self.assertEqual((None, None), da.geohash_decode("a!"))
+
+    def test_funnel_tracks_offers_and_wait(self):
+        a = self.analytics
+        with patch("dispatch_analytics.time.time", side_effect=[1000, 1010, 1040, 1050, 1080]):
+            a.record_published("ORDER", 1, admin_id=3, pickup_lat=4.81, pickup_lng=-75.69, supply=4)
+            a.record("ORDER", 1, "OFFERED", courier_id=11, position=1, distance_km=1.2)
+            a.record("ORDER", 1, "REJECTED", courier_id=11)
+            a.record("ORDER", 1, "OFFERED", courier_id=12, position=2, distance_km=0.8)
+            a.record("ORDER", 1, "ACCEPTED", courier_id=12, position=2)
+        self.assertEqual(5, a.flush())
+        self.assertEqual(0, a.buffered())
+
+        funnel = da.build_dispatch_funnel(hours=1, admin_id=3)
+        self.assertEqual(1, funnel["published"])
+        self.assertEqual(2, funnel["offered"])
+        self.assertEqual(1, funnel["rejected"])
+        self.assertEqual(1, funnel["accepted"])
+        self.assertEqual(1.0, funnel["acceptance_rate"])
+        self.assertEqual(2.0, funnel["avg_couriers_seen_before_accept"])
+        self.assertEqual(80.0, funnel["avg_wait_to_accept_s"])
+        self.assertEqual(30.0, funnel["avg_response_s"])
+        self.assertEqual(4.0, funnel["avg_supply_at_publish"])
+        self.assertEqual(1, funnel["wait_histogram"]["wait_lt_3m"])
+        self.assertEqual(180, funnel["median_wait_to_accept_s_upper"])
+
+        self.assertEqual(0, da.build_dispatch_funnel(hours=1, admin_id=99)["published"])
+
+        conn = db.get_connection()
+        cur = conn.cursor()
+        cur.execute("SELECT distance_m FROM dispatch_events WHERE event = 'OFFERED' ORDER BY id")
+        self.assertEqual([1200, 800], [row[0] for row in cur.fetchall()])
+        conn.close()
+
+    def test_heatmap_groups_demand_and_supply_by_cell(self):
+        a = self.analytics
+        a.record_published("ORDER", 1, admin_id=3, pickup_lat=4.81, pickup_lng=-75.69, supply=0)
+        a.record_published("ORDER", 1, admin_id=3, supply=0, first=False)
+        a.record_published("ORDER", 2, admin_id=3, pickup_lat=4.90, pickup_lng=-75.60, supply=5)
+        a.record("ORDER", 2, "OFFERED", courier_id=21, position=1)
+        a.record("ORDER", 2, "ACCEPTED", courier_id=21, position=1)
+        a.record_signal("ROUTE", 3, None, None, 2)
+        a.flush()
+
+        cells = {c["cell"]: c for c in da.build_dispatch_heatmap(hours=2, entity_type="ORDER")}
+        starving = cells[da.geohash_encode(4.81, -75.69)]
+        served = cells[da.geohash_encode(4.90, -75.60)]
+        self.assertEqual(1, starving["demand"])
+        self.assertEqual(0.0, starving["avg_supply"])
+        self.assertTrue(starving["starving"])
+        self.assertEqual(5.0, served["avg_supply"])
+        self.assertFalse(served["starving"])
+        self.assertEqual(2, len(cells))
+
+    def test_failed_flush_keeps_buffer(self):
+        a = self.analytics
+        a.record_published("ORDER", 5, admin_id=1, pickup_lat=4.8, pickup_lng=-75.7, supply=2)
+        with patch("dispatch_analytics.write_dispatch_batch", side_effect=RuntimeError("db down")):
+            self.assertEqual(0, a.flush())
+        self.assertEqual(1, a.buffered())
+        a.record("ORDER", 5, "OFFERED", courier_id=1, position=1)
+        self.assertEqual(2, a.flush())
+        self.assertEqual(2, self._count("dispatch_events"))
+        self.assertEqual(1, da.build_dispatch_funnel(hours=1)["published"])
+
+    def test_rollups_accumulate_across_flushes(self):
+        a = self.analytics
+        for order_id in (1, 2, 3):
+            a.record_published("ORDER", order_id, admin_id=2, pickup_lat=4.81, pickup_lng=-75.69, supply=1)
+            a.flush()
+        self.assertEqual(1, self._count("dispatch_rollups_hourly"))
+        self.assertEqual(3, da.build_dispatch_funnel(hours=1, admin_id=2)["published"])
+        self.assertEqual(0, db.prune_dispatch_events(max_age_days=1))
+
+
+if __name__ == "__main__":
+    unittest.main()
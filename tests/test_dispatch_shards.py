@@ -0,0 +1,274 @@
+"""Tests del despacho repartido entre procesos (dispatch_shards + order_delivery).
+
+Cubre:
+- reparto de leases entre workers vivos, cesion del excedente y failover al vencer un
+  lease; el token de fencing sube con cada cambio de duenio
+- dispatch_state rechaza escrituras con un token menor (duenio anterior del shard);
+  SharedDispatchState conserva sets y se comporta como el dict de bot_data
+- un proceso que no es duenio no envia ofertas ni programa timers: los pasa como
+  comandos y el duenio los ejecuta en orden; el shard de un timer es el de su pedido o
+  ruta, y solo se ejecutan callbacks del registro
+- las colas de oferta ajenas no se cachean y avisan al duenio al escribirse
+"""
+import os
+import sys
+import tempfile
+import types
+import unittest
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Backend"))
+
+telegram_stub = types.ModuleType("telegram")
+
+
+class _InlineKeyboardButton:
+    def __init__(self, text, callback_data=None):
+        self.text = text
+        self.callback_data = callback_data
+
+
+class _InlineKeyboardMarkup:
+    def __init__(self, inline_keyboard):
+        self.inline_keyboard = inline_keyboard
+
+
+telegram_stub.InlineKeyboardButton = _InlineKeyboardButton
+telegram_stub.InlineKeyboardMarkup = _InlineKeyboardMarkup
+sys.modules.setdefault("telegram", telegram_stub)
+
+import db
+import dispatch_shards
+import offer_queue as oq
+import order_delivery
+from dispatch_shards import SharedDispatchState, ShardLeases, dispatch_shard
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000000.0
+
+    def __call__(self):
+        return self.now
+
+
+class _FixedLeases:
+    """Leases fijos para probar el enrutamiento sin reloj ni BD."""
+
+    def __init__(self, shards=(), token=1):
+        self.shards = set(shards)
+        self.token = token
+        self.worker_id = "fixed"
+
+    def owns(self, shard_no):
+        return shard_no in self.shards
+
+    def fence(self, shard_no):
+        return self.token if shard_no in self.shards else None
+
+    def owned(self):
+        return sorted(self.shards)
+
+    def fence_holds(self, shard_no):
+        return shard_no in self.shards
+
+
+def _commands():
+    return [(command, payload) for _id, command, payload in
+            [(i, c, dispatch_shards.loads_state(p)) for i, c, p in db.fetch_dispatch_commands(range(64))]]
+
+
+class _DbTestCase(unittest.TestCase):
+
+    def setUp(self):
+        fd, path = tempfile.mkstemp(prefix="domi_dispatch_shards_", suffix=".db")
+        os.close(fd)
+        self.db_path = path
+        os.environ["DB_PATH"] = self.db_path
+        os.environ.pop("DATABASE_URL", None)
+        db.init_db()
+
+    def tearDown(self):
+        dispatch_shards.install_dispatch_leases(None)
+        try:
+            os.remove(self.db_path)
+        except (FileNotFoundError, PermissionError):
+            pass
+
+
+class ShardLeaseTests(_DbTestCase):
+
+    def test_workers_split_shards_and_take_over_on_failure(self):
+        clock = _Clock()
+        a = ShardLeases("t", 8, "a", ttl_seconds=20, renew_seconds=5, clock=clock)
+        b = ShardLeases("t", 8, "b", ttl_seconds=20, renew_seconds=5, clock=clock)
+
+        self.assertEqual((list(range(8)), []), a.refresh())
+        self.assertEqual(([], []), b.refresh())  # todo ocupado: b se anuncia y espera
+        self.assertEqual(([], [4, 5, 6, 7]), a.refresh())  # a cede el excedente
+        self.assertEqual(([4, 5, 6, 7], []), b.refresh())
+        self.assertEqual([0, 1, 2, 3], a.owned())
+        token_b = b.fence(4)
+        self.assertEqual(2, token_b)  # 4 paso de a a b: el token subio
+
+        # a deja de renovar (caida): su lease vence y b toma sus shards.
+        clock.now += 25
+        self.assertFalse(a.owns(0))
+        self.assertEqual(([0, 1, 2, 3], []), b.refresh())
+        self.assertEqual(list(range(8)), b.owned())
+        self.assertEqual(2, b.fence(0))
+        self.assertEqual(token_b, b.fence(4))  # renovar no cambia el token
+
+        self.assertTrue(b.fence_holds(0))
+        self.assertFalse(db.check_shard_fence("t", 0, "a", 1, clock.now))
+
+    def test_release_all_hands_shards_over_immediately(self):
+        clock = _Clock()
+        a = ShardLeases("t", 4, "a", clock=clock)
+        b = ShardLeases("t", 4, "b", clock=clock)
+        a.refresh()
+        a.release_all()
+        self.assertEqual([], a.owned())
+        self.assertEqual(([0, 1, 2, 3], []), b.refresh())
+
+
+class SharedStateTests(_DbTestCase):
+
+    def test_fencing_token_rejects_stale_owner_writes(self):
+        self.assertTrue(db.put_dispatch_state("offer_cycles", 7, '{"v":1}', fencing_token=2))
+        self.assertFalse(db.put_dispatch_state("offer_cycles", 7, '{"v":0}', fencing_token=1))
+        self.assertTrue(db.put_dispatch_state("offer_cycles", 7, '{"v":2}'))  # sin token: no es duenio
+        self.assertFalse(db.put_dispatch_state("offer_cycles", 7, '{"v":0}', fencing_token=1))
+        self.assertEqual('{"v":2}', db.get_dispatch_state("offer_cycles", 7))
+
+    def test_shared_state_behaves_like_bot_data_dict(self):
+        leases = dispatch_shards.install_dispatch_leases(_FixedLeases({dispatch_shard(11)}, token=3))
+        cycles = SharedDispatchState("offer_cycles", fenced=True)
+        cycles[11] = {"market_retry_count": 1, "excluded_couriers": {4, 2}}
+
+        other_process = SharedDispatchState("offer_cycles", fenced=True)
+        self.assertEqual({"market_retry_count": 1, "excluded_couriers": {2, 4}}, other_process[11])
+        self.assertEqual({}, other_process.get(12, {}))
+        self.assertEqual([11], list(other_process))
+        self.assertIn(11, other_process)
+
+        leases.token = 2  # duenio anterior con un token viejo
+        cycles[11] = {"market_retry_count": 0}
+        self.assertEqual(1, other_process[11]["market_retry_count"])
+
+        self.assertEqual(1, other_process.pop(11)["market_retry_count"])
+        self.assertIsNone(other_process.pop(11, None))
+        self.assertEqual(0, len(cycles))
+
+
+class ShardedDispatchTests(_DbTestCase):
+
+    ORDER_ID = 8203
+
+    def setUp(self):
+        super().setUp()
+        oq.order_offer_store.forget()
+        self.addCleanup(self._reset_store)
+        self.leases = dispatch_shards.install_dispatch_leases(_FixedLeases())
+        self.ctx = SimpleNamespace(bot=MagicMock(), job_queue=MagicMock(), bot_data={})
+
+    @staticmethod
+    def _reset_store():
+        oq.order_offer_store.owns = None
+        oq.order_offer_store.on_foreign_write = None
+        oq.order_offer_store.forget()
+
+    def test_non_owner_forwards_and_owner_executes_in_order(self):
+        with patch("order_delivery.get_order_by_id") as get_order:
+            order_delivery._send_next_offer(self.ORDER_ID, self.ctx)
+            get_order.assert_not_called()
+        order_delivery._run_timer(
+            self.ctx, order_delivery._offer_retry_job, 30,
+            "offer_retry_{}".format(self.ORDER_ID), {"order_id": self.ORDER_ID}, entity_id=self.ORDER_ID,
+        )
+        order_delivery._cancel_timer(self.ctx, "offer_no_response_{}".format(self.ORDER_ID), entity_id=self.ORDER_ID)
+        query = MagicMock()
+        query.message = SimpleNamespace(chat_id=55, message_id=66)
+        update = SimpleNamespace(callback_query=query, effective_user=SimpleNamespace(id=77))
+        order_delivery._handle_reject(update, self.ctx, self.ORDER_ID)
+
+        self.ctx.job_queue.run_once.assert_not_called()
+        self.ctx.bot.send_message.assert_not_called()
+        query.edit_message_text.assert_not_called()
+        self.assertEqual(["CALL", "TIMER", "CANCEL_TIMER", "RESPOND"], [c for c, _p in _commands()])
+
+        # Otro proceso que no es duenio no ve comandos ajenos.
+        self.assertEqual(0, order_delivery.process_dispatch_commands(self.ctx))
+
+        self.leases.shards.add(dispatch_shard(self.ORDER_ID))
+        seen = []
+        with patch.object(order_delivery._OrderDispatch, "send_next",
+                          lambda _self, sid, _ctx: seen.append(("send_next", sid))), \
+                patch.object(order_delivery._OrderDispatch, "respond",
+                             lambda _self, upd, _ctx, sid, resp: seen.append(("respond", sid, resp, upd))):
+            self.assertEqual(4, order_delivery.process_dispatch_commands(self.ctx))
+
+        self.assertEqual(("send_next", self.ORDER_ID), seen[0])
+        _kind, sid, response, forwarded = seen[1]
+        self.assertEqual((self.ORDER_ID, "REJECTED", 77), (sid, response, forwarded.effective_user.id))
+        forwarded.callback_query.edit_message_text("Oferta rechazada.")
+        self.ctx.bot.edit_message_text.assert_called_once_with(chat_id=55, message_id=66, text="Oferta rechazada.")
+
+        run_once = self.ctx.job_queue.run_once.call_args
+        self.assertEqual("offer_retry_{}".format(self.ORDER_ID), run_once.kwargs["name"])
+        self.assertEqual({"order_id": self.ORDER_ID}, run_once.kwargs["context"])
+        self.assertLessEqual(run_once.kwargs["when"], 30)
+        self.assertEqual([], _commands())
+
+    def test_timers_follow_their_owner_not_their_name(self):
+        support_id = 5  # otro numero en el nombre: el shard es el del pedido
+        with patch("order_delivery.upsert_scheduled_job"), patch("order_delivery.cancel_scheduled_job"):
+            order_delivery._schedule_support_follow_up_jobs(self.ctx, support_id, self.ORDER_ID)
+        commands = _commands()
+        self.assertEqual(["CANCEL_TIMER", "CANCEL_TIMER", "TIMER", "TIMER"], [c for c, _p in commands])
+        self.assertEqual({self.ORDER_ID}, {p["entity_id"] for _c, p in commands})
+
+        self.leases.shards.add(dispatch_shard(self.ORDER_ID))
+        with patch.dict(order_delivery.TIMER_CALLBACKS, clear=True):
+            self.assertEqual(4, order_delivery.process_dispatch_commands(self.ctx))
+        self.ctx.job_queue.run_once.assert_not_called()  # callback fuera del registro
+
+    def test_owner_without_valid_fence_does_not_dispatch(self):
+        self.leases.shards.add(dispatch_shard(self.ORDER_ID))
+        self.leases.fence_holds = lambda _shard: False
+        with patch("order_delivery.get_order_by_id", return_value={"id": self.ORDER_ID, "status": "PUBLISHED"}), \
+                patch("order_delivery.get_next_pending_offer") as next_pending:
+            order_delivery._send_next_offer(self.ORDER_ID, self.ctx)
+        next_pending.assert_not_called()
+        self.ctx.bot.send_message.assert_not_called()
+
+    def test_foreign_offer_queues_are_not_cached(self):
+        user = db.ensure_user(981001, "courier_981001")
+        conn = db.get_connection()
+        cur = conn.cursor()
+        cur.execute(
+            "INSERT INTO couriers (user_id, full_name, id_number, phone, city, barrio, status, code) "
+            "VALUES (?, 'C', 'CC981001', '3300000000', 'Pereira', 'Cuba', 'APPROVED', 'S-981001')",
+            (user["id"],),
+        )
+        courier_id = cur.lastrowid
+        conn.commit()
+        conn.close()
+        notified = []
+        store = oq.order_offer_store
+        store.owns = order_delivery.owns_dispatch
+        store.on_foreign_write = notified.append
+
+        oq.create_offer_queue(self.ORDER_ID, [courier_id])
+        self.assertEqual([self.ORDER_ID], notified)
+        self.assertNotIn(self.ORDER_ID, store._queues)
+        offer = oq.get_next_pending_offer(self.ORDER_ID)
+        oq.mark_offer_as_offered(offer["queue_id"])
+        self.assertEqual(0, store.pending_writes())  # escrito en la tabla al instante
+        self.assertEqual(offer["queue_id"], oq.get_current_offer_for_order(self.ORDER_ID)["queue_id"])
+        self.assertNotIn(self.ORDER_ID, store._queues)
+
+
+if __name__ == "__main__":
+    unittest.main()
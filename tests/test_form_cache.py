@@ -0,0 +1,74 @@
+"""Tests de la capa de servicio del formulario publico (web/form/cache.py).
+
+Cubre:
+- perfil del aliado por token en memoria (tambien tokens invalidos) hasta vencer el TTL
+- cotizacion memorizada por celda del destino, cotizando el centro de la celda
+- la recogida del aliado forma parte de la clave; las estimaciones duran menos
+"""
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Backend"))
+
+from web.form import cache as form_cache
+
+ALLY = {"id": 41, "business_name": "Panaderia", "delivery_subsidy": 1000, "min_purchase_for_subsidy": None}
+
+
+def _quote(_plat, _plng, dlat, dlng):
+    return {"success": True, "price": 5000, "distance_km": 2.0, "dropoff": (dlat, dlng), "is_estimated": False}
+
+
+class FormCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        form_cache.clear_form_cache()
+        self.addCleanup(form_cache.clear_form_cache)
+
+    def test_profile_cached_per_token_until_ttl(self):
+        with patch.object(form_cache, "get_ally_by_public_token", side_effect=lambda t: ALLY if t == "ok" else None) as by_token, \
+                patch.object(form_cache, "get_default_ally_location", return_value={"lat": 4.81, "lng": -75.69}) as location:
+            profile = form_cache.get_form_profile("ok")
+            self.assertIs(profile, form_cache.get_form_profile("ok"))
+            self.assertIsNone(form_cache.get_form_profile("malo"))
+            self.assertIsNone(form_cache.get_form_profile("malo"))
+            self.assertEqual(2, by_token.call_count)
+            self.assertEqual(1, location.call_count)
+
+            with patch("web.form.cache.time.monotonic", return_value=10 ** 9):
+                form_cache.get_form_profile("ok")
+            self.assertEqual(3, by_token.call_count)
+
+        self.assertEqual((41, 1000, 4.81, -75.69),
+                         (profile["id"], profile["delivery_subsidy"], profile["pickup_lat"], profile["pickup_lng"]))
+
+    def test_quote_memoized_per_destination_cell(self):
+        profile = {"pickup_lat": 4.81, "pickup_lng": -75.69}
+        with patch.object(form_cache, "quote_order_by_coords", side_effect=_quote) as quote:
+            first = form_cache.form_quote("ok", profile, 4.80012, -75.70011)
+            self.assertIs(first, form_cache.form_quote("ok", profile, 4.80018, -75.70004))
+            self.assertIs(first, form_cache.cached_form_quote("ok", profile, 4.80009, -75.70015))
+            self.assertEqual(1, quote.call_count)
+            self.assertEqual((4.8, -75.7), tuple(round(v, 6) for v in first["dropoff"]))
+
+            self.assertIsNone(form_cache.cached_form_quote("ok", profile, 4.8011, -75.7001))
+            moved = {"pickup_lat": 4.82, "pickup_lng": -75.69}
+            self.assertIsNone(form_cache.cached_form_quote("ok", moved, 4.80012, -75.70011))
+            form_cache.form_quote("ok", moved, 4.80012, -75.70011)
+            self.assertEqual(2, quote.call_count)
+
+    def test_estimates_expire_sooner(self):
+        profile = {"pickup_lat": 4.81, "pickup_lng": -75.69}
+        estimate = {"success": True, "price": 4000, "distance_km": 1.5, "is_estimated": True}
+        with patch.object(form_cache, "quote_order_by_coords", return_value=estimate), \
+                patch("web.form.cache.time.monotonic", return_value=1000.0):
+            form_cache.form_quote("ok", profile, 4.8, -75.7)
+        later = 1000.0 + form_cache.FORM_QUOTE_ESTIMATE_TTL_SECONDS + 1
+        with patch("web.form.cache.time.monotonic", return_value=later):
+            self.assertIsNone(form_cache.cached_form_quote("ok", profile, 4.8, -75.7))
+
+
+if __name__ == "__main__":
+    unittest.main()
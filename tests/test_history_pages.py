@@ -0,0 +1,120 @@
+"""Tests del historial paginado (db.get_history_day_totals / db.get_history_page).
+
+Cubre:
+- totales por dia agregados en la BD (pedidos + rutas del aliado, comisiones del admin)
+- paginas por cursor hacia atras y hacia adelante, con pedidos y rutas del mismo instante
+- el cursor compacto cabe en callback_data y se decodifica igual
+- los pedidos archivados siguen apareciendo en el historial
+"""
+import os
+import tempfile
+import unittest
+
+import db
+
+
+class HistoryPagesTests(unittest.TestCase):
+
+    def setUp(self):
+        fd, path = tempfile.mkstemp(prefix="domi_history_", suffix=".db")
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        os.environ["DB_PATH"] = path
+        os.environ.pop("DATABASE_URL", None)
+        db.init_db()
+
+    def _insert(self, sql, params):
+        conn = db.get_connection()
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        row_id = cur.lastrowid
+        conn.commit()
+        conn.close()
+        return row_id
+
+    def _order(self, created_at, status="DELIVERED", ally_id=7, admin_id=None, fee=5000, commission=0):
+        return self._insert(
+            "INSERT INTO orders (ally_id, creator_admin_id, status, customer_name, customer_phone, "
+            "customer_address, customer_city, customer_barrio, total_fee, special_commission, created_at) "
+            "VALUES (?, ?, ?, 'Cliente', '3200000000', 'Calle 1', 'Pereira', 'Cuba', ?, ?, ?)",
+            (ally_id, admin_id, status, fee, commission, created_at),
+        )
+
+    def _route(self, created_at, status="DELIVERED", ally_id=7, fee=9000):
+        return self._insert(
+            "INSERT INTO routes (ally_id, status, pickup_address, total_fee, created_at) "
+            "VALUES (?, ?, 'Local', ?, ?)",
+            (ally_id, status, fee, created_at),
+        )
+
+    def test_day_totals_are_aggregated_per_day(self):
+        self._order("2026-03-02 09:00:00")
+        self._order("2026-03-02 10:00:00", status="CANCELLED")
+        self._route("2026-03-02 11:00:00")
+        self._order("2026-03-03 08:00:00", fee=7000)
+        self._order("2026-03-03 09:00:00", status="ACCEPTED")
+        self._order("2026-03-04 08:00:00", ally_id=8)
+        self._order("2026-03-03 12:00:00", ally_id=None, admin_id=3, fee=6000, commission=1500)
+        self._order("2026-03-03 13:00:00", ally_id=None, admin_id=3, status="CANCELLED", commission=900)
+
+        ally_days = db.get_history_day_totals("ally", 7, "2026-03-01 00:00:00", "2026-04-01 00:00:00")
+        self.assertEqual([
+            {"day": "2026-03-03", "total": 1, "delivered": 1, "cancelled": 0, "pesos": 7000, "commission": 0},
+            {"day": "2026-03-02", "total": 3, "delivered": 2, "cancelled": 1, "pesos": 14000, "commission": 0},
+        ], ally_days)
+
+        admin_days = db.get_history_day_totals("admin", 3, "2026-03-01 00:00:00", "2026-04-01 00:00:00")
+        self.assertEqual([
+            {"day": "2026-03-03", "total": 2, "delivered": 1, "cancelled": 1, "pesos": 6000, "commission": 1500},
+        ], admin_days)
+
+    def test_pages_walk_back_and_forth_across_ties(self):
+        same_instant = "2026-03-02 10:00:00"
+        route_id = self._route(same_instant)
+        order_ids = [self._order(same_instant) for _ in range(3)]
+        older_ids = [self._order("2026-03-02 09:{:02d}:00".format(n)) for n in range(3)]
+        expected = [route_id] + order_ids[::-1] + older_ids[::-1]
+
+        first = db.get_history_page("ally", 7, limit=3)
+        self.assertEqual(expected[:3], [item["id"] for item in first["items"]])
+        self.assertEqual(db.HISTORY_KIND_ROUTE, first["items"][0]["kind"])
+        self.assertEqual((True, False), (first["has_older"], first["has_newer"]))
+
+        second = db.get_history_page("ally", 7, cursor=first["items"][-1]["cursor"], limit=3)
+        self.assertEqual(expected[3:6], [item["id"] for item in second["items"]])
+        self.assertEqual((True, True), (second["has_older"], second["has_newer"]))
+
+        last = db.get_history_page("ally", 7, cursor=second["items"][-1]["cursor"], limit=3)
+        self.assertEqual(expected[6:], [item["id"] for item in last["items"]])
+        self.assertFalse(last["has_older"])
+
+        back = db.get_history_page("ally", 7, cursor=second["items"][0]["cursor"], direction="newer", limit=3)
+        self.assertEqual(expected[:3], [item["id"] for item in back["items"]])
+        self.assertEqual((True, False), (back["has_older"], back["has_newer"]))
+
+    def test_cursor_roundtrip_fits_callback_data(self):
+        item = {"created_at": "2026-03-02 10:00:00.123456", "kind": db.HISTORY_KIND_ORDER, "id": 1234567}
+        cursor = db.encode_history_cursor(item)
+        self.assertEqual(("2026-03-02 10:00:00.123456", db.HISTORY_KIND_ORDER, 1234567),
+                         db.decode_history_cursor(cursor))
+        self.assertLessEqual(len("adminhist_pg_m_o_{}_{}".format(cursor, 99999)), 64)
+        self.assertIsNone(db.decode_history_cursor("20260302x1"))
+
+    def test_archived_orders_stay_in_history(self):
+        order_id = self._insert(
+            "INSERT INTO orders (ally_id, status, customer_name, customer_phone, customer_address, "
+            "customer_city, customer_barrio, total_fee, created_at, delivered_at) "
+            "VALUES (7, 'DELIVERED', 'Cliente', '3200000000', 'Calle 1', 'Pereira', 'Cuba', 5000, "
+            "datetime('now', '-60 days'), datetime('now', '-60 days'))",
+            (),
+        )
+        self.assertEqual({"orders": 1, "routes": 0}, db.archive_finished_orders(max_age_days=30))
+
+        page = db.get_history_page("ally", 7)
+        self.assertEqual([order_id], [item["id"] for item in page["items"]])
+        self.assertEqual(1, sum(d["total"] for d in db.get_history_day_totals(
+            "ally", 7, "2000-01-01 00:00:00", "2100-01-01 00:00:00")))
+
+
+if __name__ == "__main__":
+    unittest.main()
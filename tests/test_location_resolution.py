@@ -0,0 +1,154 @@
+"""Tests de la resolución de ubicaciones por texto (aliases locales y geocoding remoto).
+
+Cubre:
+- el índice de aliases conserva la semántica anterior (exacto, contenido, más largo)
+- el índice solo se recompila cuando cambia location_reference_aliases_json
+- un texto sin resultado en Google no se reintenta ni vuelve a registrarse
+- búsquedas idénticas simultáneas comparten una sola cascada de Google
+"""
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Backend"))
+
+import db
+import services
+
+
+class LocationResolutionTests(unittest.TestCase):
+
+    def setUp(self):
+        fd, path = tempfile.mkstemp(prefix="domi_location_resolution_", suffix=".db")
+        os.close(fd)
+        self.db_path = path
+        os.environ["DB_PATH"] = self.db_path
+        os.environ.pop("DATABASE_URL", None)
+        db.init_db()
+        services.invalidate_local_reference_index()
+        services.clear_geocode_negative_cache()
+
+        self.google_calls = []
+        self._originals = {
+            name: getattr(services, name)
+            for name in ("can_call_google_today", "google_geocode_forward", "google_places_text_search")
+        }
+        services.can_call_google_today = lambda: True
+        services.google_geocode_forward = self._fake_google
+        services.google_places_text_search = self._fake_google
+
+    def tearDown(self):
+        for name, fn in self._originals.items():
+            setattr(services, name, fn)
+        services.invalidate_local_reference_index()
+        services.clear_geocode_negative_cache()
+        try:
+            os.remove(self.db_path)
+        except (FileNotFoundError, PermissionError):
+            pass
+
+    def _fake_google(self, query):
+        self.google_calls.append(query)
+        return None
+
+    def _set_aliases(self, aliases):
+        db.set_setting("location_reference_aliases_json", json.dumps(aliases))
+
+    def _candidate(self, normalized_text):
+        conn = db.get_connection()
+        row = conn.execute(
+            "SELECT seen_count, source FROM reference_alias_candidates WHERE normalized_text = ?",
+            (normalized_text,),
+        ).fetchone()
+        conn.close()
+        return row
+
+    def test_local_alias_matches_exact_contained_and_longest(self):
+        self._set_aliases({
+            "Terminal": [4.81, -75.69],
+            "Terminal de Transportes": {"lat": 4.82, "lng": -75.70, "label": "Terminal"},
+            "Alfonso López": {"lat": 4.83, "lng": -75.71, "label": "Barrio Alfonso Lopez"},
+        })
+
+        self.assertEqual(4.81, services.resolve_location("terminal")["lat"])
+        self.assertEqual(4.82, services.resolve_location("frente a la terminal de transportes")["lat"])
+        ref = services.resolve_location("barrio ALFONSO LOPEZ manzana 3")
+        self.assertEqual(("local_alias", "Barrio Alfonso Lopez"), (ref["method"], ref["label"]))
+        # texto contenido dentro de un alias
+        self.assertEqual(4.83, services.resolve_location("alfonso")["lat"])
+        self.assertEqual([], self.google_calls)
+
+    def test_alias_index_rebuilds_only_when_setting_changes(self):
+        self._set_aliases({"la cuba": [4.80, -75.70]})
+        self.assertEqual(4.80, services.resolve_location("la cuba")["lat"])
+        first_index = services._get_local_alias_index()
+
+        services.invalidate_local_reference_index()
+        self.assertIs(first_index, services._get_local_alias_index())
+
+        self._set_aliases({"la cuba": [4.90, -75.70]})
+        services.invalidate_local_reference_index()
+        self.assertEqual(4.90, services.resolve_location("la cuba")["lat"])
+
+    def test_unresolved_text_is_negatively_cached(self):
+        self.assertIsNone(services.resolve_location("calle inexistente 99"))
+        calls_after_first = len(self.google_calls)
+        self.assertGreater(calls_after_first, 0)
+        self.assertEqual(1, self._candidate("calle inexistente 99")["seen_count"])
+
+        self.assertIsNone(services.resolve_location("Calle inexistente #99"))
+        self.assertEqual(calls_after_first, len(self.google_calls))
+        self.assertEqual(1, self._candidate("calle inexistente 99")["seen_count"])
+
+        # otra ciudad de contexto = otra cascada
+        services.resolve_location("calle inexistente 99", city_hint="Dosquebradas")
+        self.assertGreater(len(self.google_calls), calls_after_first)
+
+        services.clear_geocode_negative_cache("calle inexistente 99")
+        before = len(self.google_calls)
+        services.resolve_location("calle inexistente 99")
+        self.assertGreater(len(self.google_calls), before)
+
+    def test_miss_without_quota_is_not_cached(self):
+        services.can_call_google_today = lambda: False
+        self.assertIsNone(services.resolve_location("sin cuota"))
+        services.can_call_google_today = lambda: True
+        services.resolve_location("sin cuota")
+        self.assertGreater(len(self.google_calls), 0)
+
+    def test_concurrent_identical_lookups_share_one_cascade(self):
+        release = threading.Event()
+        started = threading.Event()
+
+        def slow_geocode(query):
+            self.google_calls.append(query)
+            started.set()
+            release.wait(5)
+            return {"lat": 4.81, "lng": -75.69, "formatted_address": "Cra 7, Pereira, Risaralda",
+                    "place_id": "pid-1"}
+
+        services.google_geocode_forward = slow_geocode
+        results = []
+
+        def worker():
+            results.append(services.resolve_location("carrera 7 # 20-30"))
+
+        threads = [threading.Thread(target=worker) for _ in range(5)]
+        threads[0].start()
+        started.wait(5)
+        for t in threads[1:]:
+            t.start()
+        release.set()
+        for t in threads:
+            t.join(5)
+
+        self.assertEqual(1, len(self.google_calls))
+        self.assertEqual(5, len(results))
+        self.assertTrue(all(r and r["place_id"] == "pid-1" for r in results))
+
+
+if __name__ == "__main__":
+    unittest.main()
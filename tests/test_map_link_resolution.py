@@ -0,0 +1,142 @@
+"""Tests de la resolución de links cortos de Google Maps.
+
+Cubre:
+- el mismo link no se expande dos veces (memoria y map_link_cache)
+- coords y place_id extraídos quedan guardados con el link
+- un redirect lento no bloquea más de LINK_EXPAND_WAIT_SECONDS y termina en segundo plano
+- expansiones simultáneas del mismo link comparten una sola petición
+- el respaldo GET solo da URL si hubo redirect y no terminó en error
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+import types
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Backend"))
+
+import db
+import services
+
+SHORT = "https://maps.app.goo.gl/abc123"
+EXPANDED = "https://www.google.com/maps/place/Parque/@4.8133,-75.6961,17z"
+
+
+class MapLinkResolutionTests(unittest.TestCase):
+
+    def setUp(self):
+        fd, path = tempfile.mkstemp(prefix="domi_map_link_", suffix=".db")
+        os.close(fd)
+        self.db_path = path
+        os.environ["DB_PATH"] = self.db_path
+        os.environ.pop("DATABASE_URL", None)
+        db.init_db()
+        services._link_memory_cache.clear()
+
+        self.http_calls = []
+        self.delay = 0
+        self.target = EXPANDED
+        self._original_follow = services._follow_redirects
+        self._original_wait = services.LINK_EXPAND_WAIT_SECONDS
+        services._follow_redirects = self._fake_follow
+
+    def tearDown(self):
+        services._follow_redirects = self._original_follow
+        services.LINK_EXPAND_WAIT_SECONDS = self._original_wait
+        services._link_memory_cache.clear()
+        try:
+            os.remove(self.db_path)
+        except (FileNotFoundError, PermissionError):
+            pass
+
+    def _fake_follow(self, url):
+        self.http_calls.append(url)
+        if self.delay:
+            time.sleep(self.delay)
+        return self.target
+
+    def test_link_is_expanded_once_and_persisted(self):
+        geo = services.resolve_location("mira " + SHORT)
+        self.assertEqual((4.8133, -75.6961, "link"), (geo["lat"], geo["lng"], geo["method"]))
+        self.assertEqual(EXPANDED, services.expand_short_url(SHORT))
+        self.assertEqual(1, len(self.http_calls))
+
+        cached = db.get_link_cache(SHORT)
+        self.assertEqual((EXPANDED, 4.8133, -75.6961), (cached["expanded_link"], cached["lat"], cached["lng"]))
+
+        # Otro proceso / reinicio: memoria vacia, resuelve desde map_link_cache
+        services._link_memory_cache.clear()
+        self.assertEqual(EXPANDED, services.expand_short_url(SHORT))
+        self.assertEqual(1, len(self.http_calls))
+
+    def test_place_id_link_caches_places_coordinates(self):
+        self.target = "https://www.google.com/maps/search/?api=1&query_place_id=ChIJabc"
+        place_calls = []
+        originals = (services.can_call_google_today, services.google_place_details)
+        services.can_call_google_today = lambda: True
+
+        def fake_details(place_id):
+            place_calls.append(place_id)
+            return {"lat": 4.8, "lng": -75.7, "formatted_address": "Pereira", "provider": "google_places",
+                    "place_id": place_id}
+
+        services.google_place_details = fake_details
+        try:
+            first = services.resolve_location(SHORT)
+            second = services.resolve_location(SHORT)
+        finally:
+            services.can_call_google_today, services.google_place_details = originals
+
+        self.assertEqual("places_api", first["method"])
+        self.assertEqual("link", second["method"])
+        self.assertEqual(["ChIJabc"], place_calls)
+        self.assertEqual("ChIJabc", db.get_link_cache(SHORT)["place_id"])
+
+    def test_slow_redirect_does_not_block_caller(self):
+        services.LINK_EXPAND_WAIT_SECONDS = 0.05
+        self.delay = 0.3
+
+        started = time.monotonic()
+        self.assertIsNone(services.expand_short_url(SHORT))
+        self.assertLess(time.monotonic() - started, 0.25)
+
+        deadline = time.monotonic() + 3
+        while db.get_link_cache(SHORT) is None and time.monotonic() < deadline:
+            time.sleep(0.02)
+        self.assertEqual(EXPANDED, services.expand_short_url(SHORT))
+        self.assertEqual(1, len(self.http_calls))
+
+    def test_concurrent_expansions_share_one_request(self):
+        self.delay = 0.1
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(services.expand_short_url(SHORT)))
+                   for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(5)
+
+        self.assertEqual([EXPANDED] * 4, results)
+        self.assertEqual(1, len(self.http_calls))
+
+    def test_non_short_links_are_ignored(self):
+        self.assertIsNone(services.resolve_map_link("calle 10 # 5-20"))
+        self.assertIsNone(services.resolve_map_link(EXPANDED))
+        self.assertEqual([], self.http_calls)
+
+    def test_get_fallback_needs_a_successful_redirect(self):
+        def head(url, **_kwargs):
+            raise OSError("HEAD no permitido")
+
+        for final_url, status, expected in ((SHORT, 200, None), (EXPANDED, 404, None), (EXPANDED, 200, EXPANDED)):
+            response = types.SimpleNamespace(url=final_url, status_code=status, close=lambda: None)
+            fake_requests = types.SimpleNamespace(head=head, get=lambda url, **_kwargs: response)
+            with patch.dict(sys.modules, {"requests": fake_requests}):
+                self.assertEqual(expected, self._original_follow(SHORT))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,185 @@
+"""Tests del contexto de oferta por ciclo (_OrderOfferContext en order_delivery).
+
+Cubre:
+- el contexto del courier se carga por lotes para toda la cola: ofertas sucesivas
+  no vuelven a consultar ubicacion ni servicios activos
+- un envio fallido marca EXPIRED y sigue con el siguiente courier sin recursion
+- si el pedido cambia (p.ej. incentivo) el contexto se reconstruye
+"""
+import os
+import sys
+import tempfile
+import types
+import unittest
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Backend"))
+
+telegram_stub = types.ModuleType("telegram")
+
+
+class _InlineKeyboardButton:
+    def __init__(self, text, callback_data=None):
+        self.text = text
+        self.callback_data = callback_data
+
+
+class _InlineKeyboardMarkup:
+    def __init__(self, inline_keyboard):
+        self.inline_keyboard = inline_keyboard
+
+
+telegram_stub.InlineKeyboardButton = _InlineKeyboardButton
+telegram_stub.InlineKeyboardMarkup = _InlineKeyboardMarkup
+sys.modules.setdefault("telegram", telegram_stub)
+
+import db
+import offer_queue as oq
+import order_delivery
+
+
+ORDER_ID = 7001
+
+
+def _order(**overrides):
+    order = {
+        "id": ORDER_ID,
+        "status": "PUBLISHED",
+        "ally_id": None,
+        "creator_admin_id": None,
+        "pickup_location_id": None,
+        "pickup_lat": 4.8100,
+        "pickup_lng": -75.6900,
+        "dropoff_lat": 4.8200,
+        "dropoff_lng": -75.7000,
+        "distance_km": 2.5,
+        "total_fee": 8000,
+        "special_commission": 0,
+        "parking_fee": 0,
+        "instructions": "",
+        "customer_address": "Calle 10 # 5-20",
+        "customer_city": "Pereira",
+        "customer_barrio": "Centro",
+        "requires_cash": 0,
+        "cash_required_amount": 0,
+        "payment_method": "UNCONFIRMED",
+    }
+    order.update(overrides)
+    return order
+
+
+class OrderOfferContextTests(unittest.TestCase):
+
+    def setUp(self):
+        fd, path = tempfile.mkstemp(prefix="domi_offer_ctx_", suffix=".db")
+        os.close(fd)
+        self.db_path = path
+        os.environ["DB_PATH"] = self.db_path
+        os.environ.pop("DATABASE_URL", None)
+        db.init_db()
+        oq.order_offer_store.forget()
+        order_delivery._order_offer_contexts.clear()
+        self.couriers = [self._seed_courier(970000 + i, lat=4.81 + i * 0.01) for i in range(3)]
+        oq.create_offer_queue(ORDER_ID, self.couriers)
+        self.order = _order()
+
+        self.context_loads = []
+        real_loader = order_delivery.get_offer_courier_contexts
+
+        def counting_loader(courier_ids):
+            self.context_loads.append(sorted(courier_ids))
+            return real_loader(courier_ids)
+
+        patchers = [
+            patch("order_delivery.get_offer_courier_contexts", side_effect=counting_loader),
+            patch("order_delivery.get_order_by_id", side_effect=lambda _oid: self.order),
+            patch("order_delivery.get_courier_by_id", side_effect=AssertionError("consulta por oferta")),
+            patch("order_delivery.get_active_orders_for_courier", side_effect=AssertionError("consulta por oferta")),
+            patch("order_delivery.get_active_route_for_courier", side_effect=AssertionError("consulta por oferta")),
+            patch("order_delivery._cancel_offer_retry_job"),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        oq.order_offer_store.forget()
+        order_delivery._order_offer_contexts.clear()
+        try:
+            os.remove(self.db_path)
+        except (FileNotFoundError, PermissionError):
+            pass
+
+    def _seed_courier(self, tg_id, lat):
+        user = db.ensure_user(tg_id, "courier_{}".format(tg_id))
+        conn = db.get_connection()
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO couriers (user_id, full_name, id_number, phone, city, barrio, status, code,
+                                  live_lat, live_lng, live_location_active)
+            VALUES (?, ?, ?, '3300000000', 'Pereira', 'Cuba', 'APPROVED', ?, ?, -75.69, 1)
+            """,
+            (user["id"], "Courier {}".format(tg_id), "CC{}".format(tg_id), "R-{}".format(tg_id), lat),
+        )
+        courier_id = cur.lastrowid
+        conn.commit()
+        conn.close()
+        return courier_id
+
+    def _context(self):
+        return SimpleNamespace(
+            bot=MagicMock(),
+            job_queue=MagicMock(),
+            bot_data={"offer_cycles": {ORDER_ID: {"market_retry_count": 0}}},
+        )
+
+    def _statuses(self):
+        return [e.status for e in oq.order_offer_store._load(ORDER_ID)]
+
+    def test_courier_context_is_batch_loaded_once_per_queue(self):
+        ctx = self._context()
+        order_delivery._send_next_offer(ORDER_ID, ctx)
+        queue = oq.get_current_offer_for_order(ORDER_ID)
+        oq.mark_offer_response(queue["queue_id"], "REJECTED")
+        order_delivery._send_next_offer(ORDER_ID, ctx)
+
+        self.assertEqual([sorted(self.couriers)], self.context_loads)
+        self.assertEqual(2, ctx.bot.send_message.call_count)
+        first_text = ctx.bot.send_message.call_args_list[0].kwargs["text"]
+        self.assertIn("Pedido: #{}".format(ORDER_ID), first_text)
+        self.assertIn("Tu distancia al punto de recogida", first_text)
+
+    def test_failed_sends_continue_iteratively(self):
+        ctx = self._context()
+        ctx.bot.send_message.side_effect = [
+            RuntimeError("blocked"),
+            RuntimeError("blocked"),
+            SimpleNamespace(message_id=55),
+        ]
+        send_next_offer = order_delivery._send_next_offer
+        with patch("order_delivery._send_next_offer") as recursive_call:
+            send_next_offer(ORDER_ID, ctx)
+            recursive_call.assert_not_called()
+
+        self.assertEqual(["EXPIRED", "EXPIRED", "OFFERED"], self._statuses())
+        self.assertEqual(55, ctx.bot_data["offer_messages"][ORDER_ID]["message_id"])
+        self.assertEqual(1, len(self.context_loads))
+        ctx.job_queue.run_once.assert_called_once()
+
+    def test_changed_order_rebuilds_context(self):
+        ctx = self._context()
+        order_delivery._send_next_offer(ORDER_ID, ctx)
+        first = order_delivery._order_offer_contexts[ORDER_ID]
+
+        oq.mark_offer_response(oq.get_current_offer_for_order(ORDER_ID)["queue_id"], "REJECTED")
+        self.order = _order(total_fee=10000)
+        order_delivery._send_next_offer(ORDER_ID, ctx)
+
+        self.assertIsNot(first, order_delivery._order_offer_contexts[ORDER_ID])
+        self.assertIn("10,000", ctx.bot.send_message.call_args_list[1].kwargs["text"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,175 @@
+"""Tests del motor de colas de ofertas en memoria (offer_queue.py).
+
+Cubre:
+- el ciclo de oferta se resuelve en memoria y las transiciones se escriben por lotes
+- tras un "crash" (memoria perdida) la cola se reconstruye desde la tabla con el
+  ultimo estado persistido, incluido el offered_at de la oferta vigente
+- reset de pedidos (solo REJECTED/EXPIRED) y de rutas (todo) conservan su semantica
+- preload reconstruye varias colas en una sola consulta
+"""
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Backend"))
+
+import db
+import offer_queue as oq
+
+
+class OfferQueueStoreTests(unittest.TestCase):
+
+    def setUp(self):
+        fd, path = tempfile.mkstemp(prefix="domi_offer_queue_", suffix=".db")
+        os.close(fd)
+        self.db_path = path
+        os.environ["DB_PATH"] = self.db_path
+        os.environ.pop("DATABASE_URL", None)
+        db.init_db()
+        oq.order_offer_store.forget()
+        oq.route_offer_store.forget()
+        self.couriers = [self._seed_courier(950000 + i) for i in range(3)]
+
+        self.connections = 0
+        self._original_get_connection = oq.get_connection
+
+        def counting_connection():
+            self.connections += 1
+            return self._original_get_connection()
+
+        oq.get_connection = counting_connection
+
+    def tearDown(self):
+        oq.get_connection = self._original_get_connection
+        oq.order_offer_store.forget()
+        oq.route_offer_store.forget()
+        try:
+            os.remove(self.db_path)
+        except (FileNotFoundError, PermissionError):
+            pass
+
+    def _seed_courier(self, tg_id):
+        user = db.ensure_user(tg_id, "courier_{}".format(tg_id))
+        conn = db.get_connection()
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO couriers (user_id, full_name, id_number, phone, city, barrio, status, code)
+            VALUES (?, ?, ?, '3300000000', 'Pereira', 'Cuba', 'APPROVED', ?)
+            """,
+            (user["id"], "Courier {}".format(tg_id), "CC{}".format(tg_id), "R-{}".format(tg_id)),
+        )
+        courier_id = cur.lastrowid
+        conn.commit()
+        conn.close()
+        return courier_id
+
+    def _db_statuses(self, table, owner_col, owner_id):
+        conn = db.get_connection()
+        rows = conn.execute(
+            f"SELECT courier_id, status FROM {table} WHERE {owner_col} = ? ORDER BY position",
+            (owner_id,),
+        ).fetchall()
+        conn.close()
+        return [(r["courier_id"], r["status"]) for r in rows]
+
+    def test_offer_cycle_runs_in_memory_and_flushes_in_batch(self):
+        c1, c2, c3 = self.couriers
+        oq.create_offer_queue(10, [c1, c2, c3])
+        self.assertEqual(1, self.connections)
+
+        first = oq.get_next_pending_offer(10)
+        self.assertEqual((c1, 0, 950000), (first["courier_id"], first["position"], first["telegram_id"]))
+        oq.mark_offer_as_offered(first["queue_id"])
+        self.assertEqual(first["queue_id"], oq.get_current_offer_for_order(10)["queue_id"])
+        oq.mark_offer_response(first["queue_id"], "REJECTED")
+        second = oq.get_next_pending_offer(10)
+        oq.mark_offer_as_offered(second["queue_id"])
+        oq.mark_offer_response(second["queue_id"], "EXPIRED")
+        third = oq.get_next_pending_offer(10)
+        oq.mark_offer_as_offered(third["queue_id"])
+
+        # Todo el ciclo sin tocar la BD; las 5 transiciones siguen pendientes.
+        self.assertEqual(1, self.connections)
+        self.assertEqual(5, oq.order_offer_store.pending_writes())
+        self.assertEqual([(c1, "PENDING"), (c2, "PENDING"), (c3, "PENDING")],
+                         self._db_statuses("order_offer_queue", "order_id", 10))
+
+        self.assertEqual(5, oq.flush_offer_queues())
+        self.assertEqual(2, self.connections)
+        self.assertEqual([(c1, "REJECTED"), (c2, "EXPIRED"), (c3, "OFFERED")],
+                         self._db_statuses("order_offer_queue", "order_id", 10))
+
+    def test_crash_recovery_rebuilds_last_persisted_state(self):
+        c1, c2, c3 = self.couriers
+        oq.create_offer_queue(20, [c1, c2, c3])
+        first = oq.get_next_pending_offer(20)
+        oq.mark_offer_as_offered(first["queue_id"])
+        oq.mark_offer_response(first["queue_id"], "REJECTED")
+        second = oq.get_next_pending_offer(20)
+        oq.mark_offer_as_offered(second["queue_id"])
+        offered_at = oq.get_current_offer_for_order(20)["offered_at"]
+        oq.flush_offer_queues()
+
+        # Transicion que no alcanzo a escribirse antes del crash.
+        oq.mark_offer_response(second["queue_id"], "EXPIRED")
+        oq.order_offer_store.forget()
+
+        current = oq.get_current_offer_for_order(20)
+        self.assertEqual(second["queue_id"], current["queue_id"])
+        self.assertEqual(str(offered_at), str(current["offered_at"]))
+        self.assertEqual(c3, oq.get_next_pending_offer(20)["courier_id"])
+
+        # Despues de recuperar, el motor sigue operando sobre la cola reconstruida.
+        oq.mark_offer_response(current["queue_id"], "EXPIRED")
+        oq.reset_offer_queue(20)
+        self.assertEqual(c1, oq.get_next_pending_offer(20)["courier_id"])
+        oq.flush_offer_queues()
+        self.assertEqual([(c1, "PENDING"), (c2, "PENDING"), (c3, "PENDING")],
+                         self._db_statuses("order_offer_queue", "order_id", 20))
+
+    def test_reset_keeps_order_and_route_semantics(self):
+        c1, c2, c3 = self.couriers
+        oq.create_offer_queue(30, [c1, c2])
+        accepted = oq.get_next_pending_offer(30)
+        oq.mark_offer_as_offered(accepted["queue_id"])
+        oq.mark_offer_response(accepted["queue_id"], "ACCEPTED")
+        oq.reset_offer_queue(30)
+        self.assertEqual(c2, oq.get_next_pending_offer(30)["courier_id"])
+
+        oq.create_route_offer_queue(40, [c3, c1])
+        route_offer = oq.get_next_pending_route_offer(40)
+        self.assertEqual((c3, 1), (route_offer["courier_id"], route_offer["position"]))
+        oq.mark_route_offer_as_offered(route_offer["queue_id"])
+        oq.mark_route_offer_response(route_offer["queue_id"], "BUSY")
+        oq.reset_route_offer_queue(40)
+        self.assertEqual(c3, oq.get_next_pending_route_offer(40)["courier_id"])
+
+        oq.flush_offer_queues()
+        self.assertEqual([(c1, "ACCEPTED"), (c2, "PENDING")],
+                         self._db_statuses("order_offer_queue", "order_id", 30))
+        self.assertEqual([(c3, "PENDING"), (c1, "PENDING")],
+                         self._db_statuses("route_offer_queue", "route_id", 40))
+
+    def test_delete_then_create_and_preload(self):
+        c1, c2, c3 = self.couriers
+        oq.create_offer_queue(50, [c1, c2])
+        oq.create_offer_queue(51, [c3])
+        oq.delete_offer_queue(50)
+        self.assertIsNone(oq.get_next_pending_offer(50))
+        oq.create_offer_queue(50, [c2])
+        self.assertEqual([(c2, "PENDING")], self._db_statuses("order_offer_queue", "order_id", 50))
+
+        oq.order_offer_store.forget()
+        before = self.connections
+        oq.order_offer_store.preload([50, 51, 52])
+        self.assertEqual(before + 1, self.connections)
+        self.assertEqual(c2, oq.get_next_pending_offer(50)["courier_id"])
+        self.assertEqual(c3, oq.get_next_pending_offer(51)["courier_id"])
+        self.assertIsNone(oq.get_next_pending_offer(52))
+        self.assertEqual(before + 1, self.connections)
+
+
+if __name__ == "__main__":
+    unittest.main()
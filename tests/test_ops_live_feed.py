@@ -0,0 +1,198 @@
+"""Tests del feed en vivo del mapa del panel web.
+
+Cubre:
+- las escrituras del bot (ubicacion en vivo, expiracion, transiciones de pedido)
+  registran eventos en ops_feed_events con el equipo resuelto
+- LiveOpsHub aplica los eventos en memoria y emite deltas por equipo
+- prune_ops_feed_events limpia eventos viejos
+"""
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Backend"))
+
+import db
+from web.admin.live_feed import LiveOpsHub
+
+
+class OpsLiveFeedTests(unittest.TestCase):
+
+    def setUp(self):
+        fd, path = tempfile.mkstemp(prefix="domi_live_feed_", suffix=".db")
+        os.close(fd)
+        self.db_path = path
+        os.environ["DB_PATH"] = self.db_path
+        os.environ.pop("DATABASE_URL", None)
+        db.init_db()
+
+        self.admin_a = self._seed_admin(940001, "feed_a")
+        self.admin_b = self._seed_admin(940002, "feed_b")
+        self.ally_id = self._seed_ally(940010)
+        self.courier_a = self._seed_courier(940020, self.admin_a)
+        self.courier_b = self._seed_courier(940021, self.admin_b)
+
+    def tearDown(self):
+        try:
+            os.remove(self.db_path)
+        except (FileNotFoundError, PermissionError):
+            pass
+
+    # -- helpers de seeding --
+
+    def _seed_admin(self, tg_id, username):
+        user = db.ensure_user(tg_id, username)
+        conn = db.get_connection()
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO admins (user_id, full_name, phone, city, barrio,
+                                status, team_name, team_code, balance)
+            VALUES (?, ?, ?, ?, ?, 'APPROVED', ?, ?, 0)
+            """,
+            (user["id"], "Admin " + username, "3100000000", "Pereira", "Centro",
+             "Equipo " + username, "TEAM_" + str(tg_id)),
+        )
+        admin_id = cur.lastrowid
+        conn.commit()
+        conn.close()
+        return admin_id
+
+    def _seed_ally(self, tg_id):
+        user = db.ensure_user(tg_id, "ally_{}".format(tg_id))
+        conn = db.get_connection()
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO allies (user_id, business_name, owner_name, phone,
+                                city, barrio, address, status)
+            VALUES (?, ?, 'Owner', '3200000000', 'Pereira', 'Centro', 'Calle 1', 'APPROVED')
+            """,
+            (user["id"], "Aliado {}".format(tg_id)),
+        )
+        ally_id = cur.lastrowid
+        conn.commit()
+        conn.close()
+        return ally_id
+
+    def _seed_courier(self, tg_id, admin_id):
+        user = db.ensure_user(tg_id, "courier_{}".format(tg_id))
+        conn = db.get_connection()
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO couriers (user_id, full_name, id_number, phone,
+                                  city, barrio, status, code)
+            VALUES (?, ?, ?, '3300000000', 'Pereira', 'Cuba', 'APPROVED', ?)
+            """,
+            (user["id"], "Courier {}".format(tg_id), "CC{}".format(tg_id), "R-{}".format(tg_id)),
+        )
+        courier_id = cur.lastrowid
+        cur.execute(
+            """
+            INSERT INTO admin_couriers (admin_id, courier_id, status, balance, created_at, updated_at)
+            VALUES (?, ?, 'APPROVED', 0, datetime('now'), datetime('now'))
+            """,
+            (admin_id, courier_id),
+        )
+        conn.commit()
+        conn.close()
+        return courier_id
+
+    def _make_order(self, admin_id):
+        return db.create_order(
+            ally_id=self.ally_id,
+            customer_name="Cliente Feed",
+            customer_phone="3100000001",
+            customer_address="Calle 10 # 5-20",
+            customer_city="Pereira",
+            customer_barrio="Centro",
+            total_fee=8000,
+            pickup_lat=4.81333,
+            pickup_lng=-75.69611,
+            dropoff_lat=4.82000,
+            dropoff_lng=-75.70000,
+            ally_admin_id_snapshot=admin_id,
+        )
+
+    # -- escrituras registran eventos --
+
+    def test_live_location_update_records_courier_event_with_team(self):
+        db.update_courier_live_location(self.courier_a, 4.81, -75.69)
+
+        events = db.list_ops_feed_events_since(0)
+
+        self.assertEqual(1, len(events))
+        self.assertEqual("COURIER", events[0]["entity_type"])
+        self.assertEqual(self.courier_a, events[0]["entity_id"])
+        self.assertEqual(self.admin_a, events[0]["admin_id"])
+        self.assertEqual({"state": "moved", "lat": 4.81, "lng": -75.69}, events[0]["payload"])
+
+    def test_order_transitions_record_order_events(self):
+        order_id = self._make_order(self.admin_b)
+        db.set_order_status(order_id, "PUBLISHED", "published_at")
+        db.assign_order_to_courier(order_id, self.courier_b)
+
+        events = [e for e in db.list_ops_feed_events_since(0) if e["entity_type"] == "ORDER"]
+
+        self.assertEqual(["PUBLISHED", "ACCEPTED"], [e["payload"]["status"] for e in events])
+        self.assertTrue(all(e["admin_id"] == self.admin_b for e in events))
+
+    def test_events_since_cursor_and_prune(self):
+        db.update_courier_live_location(self.courier_a, 4.81, -75.69)
+        last_id = db.get_ops_feed_last_event_id()
+        db.update_courier_live_location(self.courier_b, 4.82, -75.70)
+
+        self.assertEqual([self.courier_b], [e["entity_id"] for e in db.list_ops_feed_events_since(last_id)])
+
+        conn = db.get_connection()
+        conn.execute("UPDATE ops_feed_events SET created_at = datetime('now', '-2 hours')")
+        conn.commit()
+        conn.close()
+        self.assertEqual(2, db.prune_ops_feed_events(max_age_seconds=3600))
+        self.assertEqual([], db.list_ops_feed_events_since(0))
+
+    # -- hub en memoria --
+
+    def test_hub_applies_moves_offline_and_order_lifecycle(self):
+        db.update_courier_live_location(self.courier_a, 4.81, -75.69)
+        hub = LiveOpsHub()
+        hub.load_state()
+        self.assertEqual({self.courier_a}, set(hub.couriers))
+
+        db.update_courier_live_location(self.courier_a, 4.90, -75.60)
+        db.update_courier_live_location(self.courier_b, 4.82, -75.70)
+        order_id = self._make_order(self.admin_b)
+        db.set_order_status(order_id, "PUBLISHED", "published_at")
+
+        deltas = hub.poll_once()
+        by_type = {}
+        for delta in deltas:
+            by_type.setdefault(delta["type"], []).append(delta)
+
+        self.assertEqual(2, len(by_type["courier_moved"]))
+        moved_a = [d for d in by_type["courier_moved"] if d["courier"]["courier_id"] == self.courier_a][0]
+        self.assertEqual(4.90, moved_a["courier"]["lat"])
+        self.assertEqual(order_id, by_type["order_upsert"][0]["order"]["order_id"])
+        self.assertEqual(self.admin_b, by_type["order_upsert"][0]["admin_id"])
+
+        self.assertEqual([self.courier_b], [c["courier_id"] for c in hub.snapshot(self.admin_b)["couriers"]])
+        self.assertEqual([order_id], [o["order_id"] for o in hub.snapshot(self.admin_b)["orders"]])
+        self.assertEqual([], hub.snapshot(self.admin_a)["orders"])
+
+        db.assign_order_to_courier(order_id, self.courier_b)
+        db.set_courier_availability(self.courier_a, "INACTIVE")
+        deltas = hub.poll_once()
+
+        self.assertIn({"type": "order_removed", "order_id": order_id, "status": "ACCEPTED",
+                       "admin_id": self.admin_b}, deltas)
+        self.assertIn({"type": "courier_offline", "courier_id": self.courier_a,
+                       "admin_id": self.admin_a}, deltas)
+        self.assertEqual({}, hub.orders)
+        self.assertEqual({self.courier_b}, set(hub.couriers))
+        self.assertEqual([], hub.poll_once())
+
+
+if __name__ == "__main__":
+    unittest.main()
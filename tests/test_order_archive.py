@@ -0,0 +1,153 @@
+"""Tests del archivo de pedidos y rutas terminados (tablas frias + vistas *_all).
+
+Cubre:
+- solo se archivan pedidos/rutas DELIVERED/CANCELLED cerrados hace mas de N dias,
+  con sus filas hijas; los que tienen ayuda pendiente se quedan
+- historial, totales y el listado de pedidos del panel leen caliente + fria; la
+  busqueda por id solo la caliente, salvo con include_archived (asi un UPDATE
+  posterior no apunta a un pedido archivado)
+- la tabla fria recibe las columnas nuevas de la caliente al reiniciar; sin columnas
+  nuevas, reiniciar no recrea las vistas
+"""
+import os
+import re
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import db
+
+
+class OrderArchiveTests(unittest.TestCase):
+
+    def setUp(self):
+        fd, path = tempfile.mkstemp(prefix="domi_archive_", suffix=".db")
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        os.environ["DB_PATH"] = path
+        os.environ.pop("DATABASE_URL", None)
+        db.init_db()
+        self.courier_id = self._insert(
+            "INSERT INTO couriers (user_id, full_name, id_number, phone, city, barrio, status) "
+            "VALUES (?, 'Archivo', 'CC960001', '3000000002', 'Pereira', 'Centro', 'APPROVED')",
+            (db.ensure_user(960001, "archivo")["id"],),
+        )
+
+    def _insert(self, sql, params):
+        conn = db.get_connection()
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        row_id = cur.lastrowid
+        conn.commit()
+        conn.close()
+        return row_id
+
+    def _order(self, status, days_ago, ally_id=7):
+        order_id = self._insert(
+            "INSERT INTO orders (ally_id, courier_id, status, customer_name, customer_phone, customer_address, "
+            "customer_city, customer_barrio, total_fee, created_at, delivered_at, canceled_at) "
+            "VALUES (?, ?, ?, 'Cliente', '3200000000', 'Calle 1', 'Pereira', 'Cuba', 5000, "
+            "datetime('now', ?), CASE WHEN ? = 'DELIVERED' THEN datetime('now', ?) END, "
+            "CASE WHEN ? = 'CANCELLED' THEN datetime('now', ?) END)",
+            (ally_id, self.courier_id, status, "-{} days".format(days_ago + 1),
+             status, "-{} days".format(days_ago), status, "-{} days".format(days_ago)),
+        )
+        self._insert("INSERT INTO order_offer_queue (order_id, courier_id, position, status) VALUES (?, ?, 0, 'ACCEPTED')",
+                     (order_id, self.courier_id))
+        return order_id
+
+    def _count(self, table, where="1 = 1", params=()):
+        conn = db.get_connection()
+        cur = conn.cursor()
+        cur.execute("SELECT COUNT(*) FROM {} WHERE {}".format(table, where), params)
+        count = cur.fetchone()[0]
+        conn.close()
+        return count
+
+    def _rows(self, sql, params=()):
+        conn = db.get_connection()
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        rows = cur.fetchall()
+        conn.close()
+        return rows
+
+    def test_archives_only_old_terminal_rows_with_their_children(self):
+        old_delivered = self._order("DELIVERED", 45)
+        old_cancelled = self._order("CANCELLED", 40)
+        recent = self._order("DELIVERED", 3)
+        active = self._order("ACCEPTED", 60)
+        with_help = self._order("DELIVERED", 50)
+        self._insert("INSERT INTO order_support_requests (order_id, courier_id, admin_id, status) "
+                     "VALUES (?, ?, 1, 'PENDING')", (with_help, self.courier_id))
+        self._insert("INSERT INTO order_accounting_settlements (order_id, week_key) VALUES (?, '2025-W01')",
+                     (old_delivered,))
+        route_id = self._insert(
+            "INSERT INTO routes (ally_id, courier_id, status, pickup_address, created_at, delivered_at) "
+            "VALUES (7, ?, 'DELIVERED', 'Local', datetime('now', '-41 days'), datetime('now', '-40 days'))",
+            (self.courier_id,),
+        )
+        self._insert("INSERT INTO route_destinations (route_id, sequence, customer_name, customer_phone, "
+                     "customer_address, customer_city, customer_barrio) "
+                     "VALUES (?, 1, 'Cliente', '3200000001', 'Calle 2', 'Pereira', 'Cuba')", (route_id,))
+
+        archived = db.archive_finished_orders(max_age_days=30, batch_size=1)
+
+        self.assertEqual({"orders": 2, "routes": 1}, archived)
+        self.assertEqual({recent, active, with_help},
+                         {r["id"] for r in self._rows("SELECT id FROM orders")})
+        self.assertEqual(2, self._count("orders_archive"))
+        self.assertEqual(0, self._count("order_offer_queue", "order_id IN (?, ?)", (old_delivered, old_cancelled)))
+        self.assertEqual(2, self._count("order_offer_queue_archive"))
+        self.assertEqual(1, self._count("order_accounting_settlements_archive"))
+        self.assertEqual((0, 1), (self._count("route_destinations"), self._count("route_destinations_archive")))
+        self.assertEqual({"orders": 0, "routes": 0}, db.archive_finished_orders(max_age_days=30))
+
+        # Lecturas de historial sobre caliente + fria
+        self.assertEqual("DELIVERED", db.get_order_by_id(old_delivered, include_archived=True)["status"])
+        self.assertEqual(5, len(db.get_orders_by_ally(7)))
+        # Listado del panel: los archivados siguen apareciendo
+        self.assertEqual(5, len(db.get_all_orders(limit=20)))
+        self.assertEqual({old_delivered, recent, with_help},
+                         {r["id"] for r in db.get_all_orders("DELIVERED", limit=20)})
+        self.assertEqual([active], [r["id"] for r in db.get_all_orders("ACTIVE", limit=20)])
+        self.assertEqual(1, len(db.get_route_destinations(route_id, include_archived=True)))
+        self.assertEqual("DELIVERED", db.get_route_by_id(route_id, include_archived=True)["status"])
+        # Busqueda por id de los flujos operativos: solo la caliente
+        self.assertIsNone(db.get_order_by_id(old_delivered))
+        self.assertIsNone(db.get_route_by_id(route_id))
+        self.assertEqual([], db.get_route_destinations(route_id))
+        self.assertEqual(3, db.get_courier_web_dashboard(self.courier_id)["total_entregas"])
+
+    def test_cold_table_follows_new_hot_columns(self):
+        conn = db.get_connection()
+        conn.execute("ALTER TABLE orders ADD COLUMN archive_probe TEXT")
+        conn.commit()
+        conn.close()
+        db.init_db()
+
+        order_id = self._order("DELIVERED", 90)
+        conn = db.get_connection()
+        conn.execute("UPDATE orders SET archive_probe = 'x' WHERE id = ?", (order_id,))
+        conn.commit()
+        conn.close()
+        db.archive_finished_orders(max_age_days=30)
+
+        self.assertEqual("x", self._rows("SELECT archive_probe FROM orders_all WHERE id = ?", (order_id,))[0][0])
+
+    def test_restart_keeps_existing_views(self):
+        statements = []
+        get_connection = db.get_connection
+
+        def traced_connection():
+            conn = get_connection()
+            conn.set_trace_callback(statements.append)
+            return conn
+
+        with patch("db.get_connection", traced_connection):
+            db.init_db()
+        self.assertEqual([], [sql for sql in statements if re.search(r"\b(CREATE|DROP) VIEW\b", sql)])
+
+
+if __name__ == "__main__":
+    unittest.main()
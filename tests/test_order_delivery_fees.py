@@ -552,6 +552,42 @@ class OrderDeliveryFeeTests(unittest.TestCase):
         self.assertTrue(captured["requires_cash"])
         self.assertEqual(40000, captured["cash_required_amount"])
 
+    def test_publish_route_checks_links_and_balance_in_one_batch(self):
+        route_id = self._create_route()
+        context = _DummyContext()
+        activated = {}
+
+        def _activate(route_id, context, cycle_info, courier_ids):
+            activated["courier_ids"] = courier_ids
+
+        with patch.object(order_delivery, "get_eligible_couriers_for_order",
+                          return_value=[{"courier_id": self.courier_id}, {"courier_id": 987654}]), \
+             patch.object(order_delivery, "get_approved_admin_id_for_courier",
+                          side_effect=AssertionError("consulta por courier")), \
+             patch.object(order_delivery, "_activate_route_offer_dispatch", side_effect=_activate), \
+             patch.object(order_delivery, "_cancel_route_no_response_job", return_value=None), \
+             patch.object(order_delivery, "_schedule_persistent_job", return_value=None), \
+             patch.object(order_delivery, "_schedule_route_expire_job", return_value=None):
+            count = order_delivery.publish_route_to_couriers(
+                route_id,
+                self.ally_id,
+                context,
+                admin_id_override=self.local_admin_id,
+                schedule_no_response=False,
+            )
+            excluded = order_delivery.publish_route_to_couriers(
+                route_id,
+                self.ally_id,
+                context,
+                admin_id_override=self.local_admin_id,
+                excluded_courier_ids=[self.courier_id],
+                schedule_no_response=False,
+            )
+
+        self.assertEqual(1, count)
+        self.assertEqual(0, excluded)
+        self.assertEqual([], activated["courier_ids"])
+
 
 if __name__ == "__main__":
     unittest.main()
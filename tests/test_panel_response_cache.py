@@ -0,0 +1,184 @@
+"""Tests del cache HTTP de los listados del panel (web/response_cache.py).
+
+Cubre:
+- versiones de cambio por tabla: suben con cada escritura (triggers), salvo las
+  columnas de ubicacion/disponibilidad del courier
+- If-None-Match con el ETag vigente -> 304 sin ejecutar el endpoint
+- otro panel con el mismo alcance recibe el cuerpo guardado, comprimido si lo acepta
+- el ETag cambia con las versiones y con el alcance del ADMIN_LOCAL
+"""
+import asyncio
+import gzip
+import json
+import os
+import sys
+import tempfile
+import types
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Backend"))
+
+fastapi_stub = sys.modules.get("fastapi")
+if fastapi_stub is None:
+    fastapi_stub = types.ModuleType("fastapi")
+    sys.modules["fastapi"] = fastapi_stub
+if not hasattr(fastapi_stub, "HTTPException"):
+    class HTTPException(Exception):
+        def __init__(self, status_code: int, detail: str = None):
+            super().__init__(detail)
+            self.status_code = status_code
+            self.detail = detail
+
+    fastapi_stub.HTTPException = HTTPException
+if not hasattr(fastapi_stub, "Header"):
+    fastapi_stub.Header = lambda default="": default
+if not hasattr(fastapi_stub, "Depends"):
+    fastapi_stub.Depends = lambda dependency=None: dependency
+if not hasattr(fastapi_stub, "Response"):
+    class Response:
+        def __init__(self, content=b"", status_code=200, headers=None, media_type=None):
+            self.body = content
+            self.status_code = status_code
+            self.headers = dict(headers or {})
+            self.media_type = media_type
+
+    fastapi_stub.Response = Response
+
+import db
+from web import response_cache
+from web.users.models import UserRole, UserStatus
+from web.users.repository import WebUser
+
+PLATFORM = WebUser(id=1, username="plataforma", role=UserRole.PLATFORM_ADMIN, status=UserStatus.APPROVED)
+LOCAL = WebUser(id=2, username="local", role=UserRole.ADMIN_LOCAL, status=UserStatus.APPROVED, admin_id=7)
+
+
+class _EndpointResponse:
+    def __init__(self, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.status_code = 200
+        self.media_type = None
+        self.headers = {"content-type": "application/json", "content-length": str(len(body))}
+        self._chunks = [body[:10], body[10:]]
+
+    @property
+    def body_iterator(self):
+        async def iterate():
+            for chunk in self._chunks:
+                yield chunk
+        return iterate()
+
+
+def _request(path, headers=None, query=""):
+    return SimpleNamespace(method="GET", url=SimpleNamespace(path=path, query=query), headers=headers or {})
+
+
+class ChangeVersionTests(unittest.TestCase):
+
+    def setUp(self):
+        fd, path = tempfile.mkstemp(prefix="domi_change_versions_", suffix=".db")
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        os.environ["DB_PATH"] = path
+        os.environ.pop("DATABASE_URL", None)
+        db.init_db()
+
+    def test_writes_bump_table_versions_except_live_courier_columns(self):
+        user = db.ensure_user(950001, "cambios")
+        start = db.get_change_versions(["couriers", "orders"])
+
+        conn = db.get_connection()
+        cur = conn.cursor()
+        cur.execute(
+            "INSERT INTO couriers (user_id, full_name, id_number, phone, city, barrio, status) "
+            "VALUES (?, 'Versiones', 'CC950001', '3000000001', 'Pereira', 'Centro', 'PENDING')",
+            (user["id"],),
+        )
+        courier_id = cur.lastrowid
+        conn.commit()
+        after_insert = db.get_change_versions(["couriers"])["couriers"]
+
+        cur.execute("UPDATE couriers SET live_lat = 4.8, live_lng = -75.7, availability_status = 'APPROVED' "
+                    "WHERE id = ?", (courier_id,))
+        conn.commit()
+        self.assertEqual(after_insert, db.get_change_versions(["couriers"])["couriers"])
+
+        cur.execute("UPDATE couriers SET status = 'APPROVED' WHERE id = ?", (courier_id,))
+        conn.commit()
+        conn.close()
+
+        end = db.get_change_versions(["couriers", "orders", "no_existe"])
+        self.assertEqual(start["couriers"] + 1, after_insert)
+        self.assertEqual(after_insert + 1, end["couriers"])
+        self.assertEqual(start["orders"], end["orders"])
+        self.assertNotIn("no_existe", end)
+
+
+class PanelResponseCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        response_cache.clear_response_cache()
+        self.addCleanup(response_cache.clear_response_cache)
+        self.versions = {"couriers": 3}
+        self.calls = []
+        self.payload = [{"id": n, "full_name": "Repartidor {}".format(n)} for n in range(60)]
+        self.user = PLATFORM
+
+        async def current_user(_authorization):
+            return self.user
+
+        patches = [
+            patch.object(response_cache, "get_current_user_async", current_user),
+            patch.object(response_cache, "get_change_versions", lambda tables: dict(self.versions)),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    async def _endpoint(self, request):
+        self.calls.append(request.url.path)
+        return _EndpointResponse(self.payload)
+
+    def _get(self, headers=None, path="/admin/couriers"):
+        return asyncio.run(response_cache.panel_response_cache(_request(path, headers), self._endpoint))
+
+    def test_if_none_match_returns_304_without_running_the_endpoint(self):
+        first = self._get()
+        self.assertEqual(200, first.status_code)
+        self.assertEqual(self.payload, json.loads(first.body))
+        etag = first.headers["ETag"]
+
+        cached = self._get({"if-none-match": etag})
+        self.assertEqual(304, cached.status_code)
+        self.assertEqual(1, len(self.calls))
+
+        self.versions["couriers"] += 1
+        changed = self._get({"if-none-match": etag})
+        self.assertEqual(200, changed.status_code)
+        self.assertNotEqual(etag, changed.headers["ETag"])
+        self.assertEqual(2, len(self.calls))
+
+    def test_shared_body_is_served_gzipped_to_other_panels(self):
+        self._get()
+        other = self._get({"accept-encoding": "gzip, deflate"})
+        self.assertEqual(1, len(self.calls))
+        self.assertEqual("gzip", other.headers["Content-Encoding"])
+        self.assertTrue(other.headers["ETag"].endswith('-gz"'))
+        self.assertEqual(self.payload, json.loads(gzip.decompress(other.body)))
+        self.assertEqual(304, self._get({"if-none-match": other.headers["ETag"]}).status_code)
+
+    def test_local_admin_scope_and_unlisted_paths(self):
+        platform_etag = self._get().headers["ETag"]
+        self.user = LOCAL
+        local = self._get({"if-none-match": platform_etag})
+        self.assertEqual(200, local.status_code)
+        self.assertEqual(2, len(self.calls))
+
+        passthrough = self._get(path="/admin/live/feed")
+        self.assertIsInstance(passthrough, _EndpointResponse)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,207 @@
+"""Tests del nucleo de despacho comun a pedidos y rutas (_ServiceDispatch en order_delivery).
+
+Cubre:
+- la ruta usa el mismo bucle de envio que el pedido: un envio fallido marca EXPIRED y
+  sigue con el siguiente courier sin recursion; el texto de la ruta se arma una vez
+- rechazo/ocupado pasan por la misma respuesta; cada tipo conserva su estado en cola
+- el reinicio de ruta usa el mismo pipeline de candidatos (elegibilidad + tracker)
+"""
+import os
+import sys
+import tempfile
+import time
+import types
+import unittest
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Backend"))
+
+telegram_stub = types.ModuleType("telegram")
+
+
+class _InlineKeyboardButton:
+    def __init__(self, text, callback_data=None):
+        self.text = text
+        self.callback_data = callback_data
+
+
+class _InlineKeyboardMarkup:
+    def __init__(self, inline_keyboard):
+        self.inline_keyboard = inline_keyboard
+
+
+telegram_stub.InlineKeyboardButton = _InlineKeyboardButton
+telegram_stub.InlineKeyboardMarkup = _InlineKeyboardMarkup
+sys.modules.setdefault("telegram", telegram_stub)
+
+import db
+import offer_queue as oq
+import order_delivery
+
+
+ROUTE_ID = 8101
+ORDER_ID = 8102
+
+
+def _route(**overrides):
+    route = {
+        "id": ROUTE_ID,
+        "status": "PUBLISHED",
+        "ally_id": 5,
+        "pickup_lat": 4.8100,
+        "pickup_lng": -75.6900,
+        "requires_cash": 0,
+        "cash_required_amount": 0,
+    }
+    route.update(overrides)
+    return route
+
+
+class ServiceDispatchTests(unittest.TestCase):
+
+    def setUp(self):
+        fd, path = tempfile.mkstemp(prefix="domi_service_dispatch_", suffix=".db")
+        os.close(fd)
+        self.db_path = path
+        os.environ["DB_PATH"] = self.db_path
+        os.environ.pop("DATABASE_URL", None)
+        db.init_db()
+        oq.order_offer_store.forget()
+        oq.route_offer_store.forget()
+        order_delivery._route_offer_contexts.clear()
+        self.couriers = [self._seed_courier(971000 + i) for i in range(3)]
+        self.route = _route()
+
+        patchers = [
+            patch("order_delivery.get_route_by_id", side_effect=lambda _rid: self.route),
+            patch("order_delivery.get_route_destinations", return_value=[
+                {"dropoff_lat": 4.8200, "dropoff_lng": -75.6900},
+                {"dropoff_lat": 4.8500, "dropoff_lng": -75.6900},
+            ]),
+            patch("order_delivery._build_route_offer_text", return_value="Ruta #{}".format(ROUTE_ID)),
+            patch("order_delivery._route_offer_reply_markup", return_value=None),
+            patch("order_delivery._cancel_route_offer_retry_job"),
+            patch("order_delivery._cancel_route_offer_jobs"),
+            patch("order_delivery._cancel_offer_jobs"),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        oq.order_offer_store.forget()
+        oq.route_offer_store.forget()
+        order_delivery._route_offer_contexts.clear()
+        try:
+            os.remove(self.db_path)
+        except (FileNotFoundError, PermissionError):
+            pass
+
+    def _seed_courier(self, tg_id):
+        user = db.ensure_user(tg_id, "courier_{}".format(tg_id))
+        conn = db.get_connection()
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO couriers (user_id, full_name, id_number, phone, city, barrio, status, code)
+            VALUES (?, ?, ?, '3300000000', 'Pereira', 'Cuba', 'APPROVED', ?)
+            """,
+            (user["id"], "Courier {}".format(tg_id), "CC{}".format(tg_id), "S-{}".format(tg_id)),
+        )
+        courier_id = cur.lastrowid
+        conn.commit()
+        conn.close()
+        return courier_id
+
+    def _context(self):
+        return SimpleNamespace(
+            bot=MagicMock(),
+            job_queue=MagicMock(),
+            bot_data={
+                "route_offer_cycles": {ROUTE_ID: {"market_retry_count": 1, "ally_id": 5, "admin_id": 3}},
+                "offer_cycles": {ORDER_ID: {"market_retry_count": 0}},
+            },
+        )
+
+    def _update(self):
+        query = MagicMock()
+        return SimpleNamespace(callback_query=query, effective_user=SimpleNamespace(id=1)), query
+
+    def test_route_failed_sends_continue_iteratively(self):
+        oq.create_route_offer_queue(ROUTE_ID, self.couriers)
+        ctx = self._context()
+        ctx.bot.send_message.side_effect = [RuntimeError("blocked"), SimpleNamespace(message_id=91)]
+
+        send_next_route_offer = order_delivery._send_next_route_offer
+        with patch("order_delivery._send_next_route_offer") as recursive_call:
+            send_next_route_offer(ROUTE_ID, ctx)
+            recursive_call.assert_not_called()
+
+        statuses = [e.status for e in oq.route_offer_store._load(ROUTE_ID)]
+        self.assertEqual(["EXPIRED", "OFFERED", "PENDING"], statuses)
+        self.assertEqual(91, ctx.bot_data["route_offer_messages"][ROUTE_ID]["message_id"])
+        self.assertEqual(1, order_delivery._build_route_offer_text.call_count)
+        run_once = ctx.job_queue.run_once.call_args
+        current = oq.get_current_route_offer(ROUTE_ID)
+        self.assertEqual(
+            "route_offer_timeout_{}_{}".format(ROUTE_ID, current["queue_id"]),
+            run_once.kwargs["name"],
+        )
+        self.assertEqual(1, run_once.kwargs["context"]["market_retry_count"])
+
+    def test_busy_keeps_each_kind_queue_status(self):
+        oq.create_route_offer_queue(ROUTE_ID, self.couriers)
+        oq.create_offer_queue(ORDER_ID, self.couriers)
+        ctx = self._context()
+        route_offer = oq.get_next_pending_route_offer(ROUTE_ID)
+        oq.mark_route_offer_as_offered(route_offer["queue_id"])
+        order_offer = oq.get_next_pending_offer(ORDER_ID)
+        oq.mark_offer_as_offered(order_offer["queue_id"])
+        courier = {"id": self.couriers[0]}
+
+        with patch("order_delivery.get_courier_by_telegram_id", return_value=courier), \
+                patch("order_delivery.get_order_by_id", return_value={"id": ORDER_ID, "status": "PUBLISHED"}), \
+                patch("order_delivery._send_next_route_offer") as send_route, \
+                patch("order_delivery._send_next_offer") as send_order:
+            update, route_query = self._update()
+            order_delivery._handle_route_busy(update, ctx, ROUTE_ID)
+            update, order_query = self._update()
+            order_delivery._handle_busy(update, ctx, ORDER_ID)
+
+        self.assertEqual("BUSY", oq.route_offer_store._load(ROUTE_ID)[0].status)
+        self.assertEqual("REJECTED", oq.order_offer_store._load(ORDER_ID)[0].status)
+        route_query.edit_message_text.assert_called_once_with("Registrado. Te saltamos esta ruta.")
+        order_query.edit_message_text.assert_called_once_with(
+            "Oferta #{} marcada como ocupado. Se asignara a otro repartidor.".format(ORDER_ID)
+        )
+        send_route.assert_called_once_with(ROUTE_ID, ctx)
+        send_order.assert_called_once_with(ORDER_ID, ctx)
+
+    def test_route_restart_uses_shared_candidate_pipeline(self):
+        ctx = self._context()
+        cycle = ctx.bot_data["route_offer_cycles"][ROUTE_ID]
+        cycle["started_at"] = time.time()
+        cycle["excluded_couriers"] = {self.couriers[1]}
+        eligible = [{"courier_id": cid} for cid in self.couriers]
+        tracker = MagicMock()
+        tracker.refresh.side_effect = lambda _sid, ids, _balance, admin_id=None: (list(ids), len(ids))
+
+        with patch("order_delivery.get_eligible_couriers_for_order", return_value=eligible) as get_eligible, \
+                patch("order_delivery.get_fee_config", return_value={"fee_service_total": 300}), \
+                patch.object(order_delivery._RouteDispatch, "candidates", tracker), \
+                patch("order_delivery._send_next_route_offer") as send_route:
+            order_delivery._try_restart_route_cycle(ROUTE_ID, ctx)
+
+        kwargs = get_eligible.call_args.kwargs
+        self.assertEqual((3, 5), (kwargs["admin_id"], kwargs["ally_id"]))
+        # Distancia de la ruta = destino mas lejano (~4.4 km al norte del pickup).
+        self.assertAlmostEqual(4.45, kwargs["order_distance_km"], places=1)
+        tracker.refresh.assert_called_once_with(ROUTE_ID, [self.couriers[0], self.couriers[2]], 300, admin_id=None)
+        queued = [e.courier_id for e in oq.route_offer_store._load(ROUTE_ID)]
+        self.assertEqual([self.couriers[0], self.couriers[2]], queued)
+        send_route.assert_called_once_with(ROUTE_ID, ctx)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,167 @@
+"""Tests del reporte de pedidos especiales del panel (get_special_orders_metrics).
+
+Cubre:
+- fees por pedido calculados en SQL (redondeo mitad al par como round()), nombre del
+  courier y totales del periodo en la misma consulta
+- alcance: un admin, o todos los aprobados + plataforma (excluye admins no aprobados)
+- cache por (alcance, periodo) con TTL
+"""
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+import db
+import services
+
+
+class SpecialOrdersMetricsTests(unittest.TestCase):
+
+    def setUp(self):
+        fd, path = tempfile.mkstemp(prefix="domi_special_metrics_", suffix=".db")
+        os.close(fd)
+        self.db_path = path
+        os.environ["DB_PATH"] = self.db_path
+        os.environ.pop("DATABASE_URL", None)
+        db.init_db()
+        services.clear_special_orders_metrics_cache()
+
+        self.platform_id = self._seed_admin(940001, "PLATFORM", "APPROVED")
+        self.local_id = self._seed_admin(940002, "TEAM4", "APPROVED")
+        self.pending_id = self._seed_admin(940003, "TEAM5", "PENDING")
+        self.courier_id = self._seed_courier(940004, "Courier Metricas")
+
+    def tearDown(self):
+        services.clear_special_orders_metrics_cache()
+        try:
+            os.remove(self.db_path)
+        except FileNotFoundError:
+            pass
+
+    def _seed_admin(self, telegram_id, team_code, status):
+        user = db.ensure_user(telegram_id, "admin_{}".format(telegram_id))
+        conn = db.get_connection()
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO admins (user_id, full_name, phone, city, barrio, status, team_name, team_code, balance)
+            VALUES (?, ?, ?, 'Pereira', 'Centro', ?, ?, ?, 0)
+            """,
+            (user["id"], "Admin {}".format(team_code), "300{}".format(telegram_id), status, team_code, team_code),
+        )
+        admin_id = cur.lastrowid
+        conn.commit()
+        conn.close()
+        return admin_id
+
+    def _seed_courier(self, telegram_id, name):
+        user = db.ensure_user(telegram_id, "courier_{}".format(telegram_id))
+        conn = db.get_connection()
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO couriers (user_id, full_name, id_number, phone, city, barrio, status, code)
+            VALUES (?, ?, ?, ?, 'Pereira', 'Centro', 'APPROVED', ?)
+            """,
+            (user["id"], name, "CC{}".format(telegram_id), "311{}".format(telegram_id), "R-{}".format(telegram_id)),
+        )
+        courier_id = cur.lastrowid
+        conn.commit()
+        conn.close()
+        return courier_id
+
+    def _order(self, admin_id, status, total_fee, commission, created_at, courier_id=None):
+        conn = db.get_connection()
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO orders (creator_admin_id, courier_id, status, customer_name, customer_phone,
+                                customer_address, customer_city, customer_barrio, total_fee,
+                                special_commission, created_at)
+            VALUES (?, ?, ?, 'Cliente', '3200000000', 'Calle 1', 'Pereira', 'Cuba', ?, ?, ?)
+            """,
+            (admin_id, courier_id, status, total_fee, commission, created_at),
+        )
+        order_id = cur.lastrowid
+        conn.commit()
+        conn.close()
+        return order_id
+
+    def test_report_computes_fees_and_totals_in_sql(self):
+        delivered_a = self._order(self.local_id, "DELIVERED", 5125, 1000, "2025-03-02 10:00:00", self.courier_id)
+        delivered_b = self._order(self.local_id, "DELIVERED", 5175, 0, "2025-03-03 10:00:00")
+        cancelled = self._order(self.local_id, "CANCELLED", 8000, 500, "2025-03-04 10:00:00")
+        self._order(self.local_id, "PUBLISHED", 9000, 500, "2025-03-04 11:00:00")
+        self._order(self.local_id, "DELIVERED", 9000, 500, "2025-04-01 00:00:00")
+
+        report = db.get_special_orders_metrics(
+            "2025-03-01 00:00:00", "2025-04-01 00:00:00", 100, 2, admin_id=self.local_id,
+        )
+
+        self.assertEqual([cancelled, delivered_b, delivered_a], [p["id"] for p in report["pedidos"]])
+        by_id = {p["id"]: p for p in report["pedidos"]}
+        # 5125 * 2% = 102.5 -> 102, como round() en el cobro real
+        self.assertEqual(round(5125 * 2 / 100), by_id[delivered_a]["tech_dev_fee"])
+        self.assertEqual(202, by_id[delivered_a]["fee_admin_pagado"])
+        self.assertEqual(798, by_id[delivered_a]["ganancia_neta"])
+        self.assertEqual("Courier Metricas", by_id[delivered_a]["courier_name"])
+        self.assertEqual("2025-03-02 10:00:00", by_id[delivered_a]["created_at"])
+        # sin comision especial solo paga el fee de plataforma
+        self.assertEqual((100, 0, -100), (by_id[delivered_b]["platform_fee"], by_id[delivered_b]["tech_dev_fee"],
+                                          by_id[delivered_b]["ganancia_neta"]))
+        self.assertIsNone(by_id[delivered_b]["courier_name"])
+        self.assertEqual((0, 0, 0), (by_id[cancelled]["platform_fee"], by_id[cancelled]["fee_admin_pagado"],
+                                     by_id[cancelled]["ganancia_neta"]))
+        self.assertEqual(
+            {
+                "total_pedidos": 3, "entregados": 2, "cancelados": 1,
+                "total_tarifas": 10300, "total_comisiones": 1000,
+                "total_fees_admin": 302, "ganancia_neta": 698,
+            },
+            report["resumen"],
+        )
+
+    def test_half_up_cases_match_python_round(self):
+        for total_fee in (5075, 5125, 5150, 5175, 4999):
+            self._order(self.local_id, "DELIVERED", total_fee, 100, "2025-03-02 10:00:00")
+        report = db.get_special_orders_metrics("2025-03-01", "2025-04-01", 0, 2, admin_id=self.local_id)
+        self.assertEqual(
+            sorted(round(fee * 2 / 100) for fee in (5075, 5125, 5150, 5175, 4999)),
+            sorted(p["tech_dev_fee"] for p in report["pedidos"]),
+        )
+
+    def test_platform_scope_covers_approved_admins_only(self):
+        self._order(self.platform_id, "DELIVERED", 6000, 0, "2025-03-02 10:00:00")
+        self._order(self.local_id, "DELIVERED", 6000, 0, "2025-03-02 11:00:00")
+        self._order(self.pending_id, "DELIVERED", 6000, 0, "2025-03-02 12:00:00")
+
+        report = db.get_special_orders_metrics("2025-03-01", "2025-04-01", 100, 2)
+        self.assertEqual({self.platform_id, self.local_id}, {p["creator_admin_id"] for p in report["pedidos"]})
+        self.assertEqual(2, report["resumen"]["entregados"])
+
+        empty = db.get_special_orders_metrics("2026-01-01", "2026-02-01", 100, 2)
+        self.assertEqual({"resumen": {name: 0 for name in db.SPECIAL_ORDERS_METRICS_SUMMARY}, "pedidos": []}, empty)
+
+    def test_report_is_cached_per_scope_and_period(self):
+        now = (datetime.now(timezone.utc) - timedelta(minutes=5)).strftime("%Y-%m-%d %H:%M:%S")
+        self._order(self.local_id, "DELIVERED", 6000, 0, now)
+
+        with patch("services.get_special_orders_metrics", wraps=services.get_special_orders_metrics) as query:
+            first = services.get_special_orders_metrics_report("todo", admin_id=self.local_id)
+            self.assertIs(first, services.get_special_orders_metrics_report("todo", admin_id=self.local_id))
+            services.get_special_orders_metrics_report("todo")
+            services.get_special_orders_metrics_report("ayer", admin_id=self.local_id)
+            services.get_special_orders_metrics_report("todo", admin_id=self.local_id, use_cache=False)
+        self.assertEqual(4, query.call_count)
+        self.assertEqual("todo", first["periodo"])
+        self.assertEqual(1, first["resumen"]["total_pedidos"])
+
+        with patch("services.time.monotonic", return_value=10 ** 9):
+            self._order(self.local_id, "CANCELLED", 6000, 0, now)
+            fresh = services.get_special_orders_metrics_report("todo", admin_id=self.local_id)
+        self.assertEqual(2, fresh["resumen"]["total_pedidos"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,194 @@
+"""Tests de la rueda de tiempo de timers por servicio (timer_wheel.TimerWheel).
+
+Cubre:
+- timers en todos los niveles disparan en su tick exacto (cascada entre niveles)
+- cancelar/reprogramar por nombre; reprogramar con el mismo nombre reemplaza
+- el tick dispara en lote (en el pool run_async del dispatcher si lo hay) y el callback
+  ve context.job.name/context como un Job de PTB
+- con la rueda instalada, _schedule_persistent_job / recover_scheduled_jobs la usan en
+  vez de run_once, y la persistencia en scheduled_jobs se mantiene
+"""
+import os
+import sys
+import tempfile
+import types
+import unittest
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Backend"))
+
+telegram_stub = types.ModuleType("telegram")
+
+
+class _InlineKeyboardButton:
+    def __init__(self, text, callback_data=None):
+        self.text = text
+        self.callback_data = callback_data
+
+
+class _InlineKeyboardMarkup:
+    def __init__(self, inline_keyboard):
+        self.inline_keyboard = inline_keyboard
+
+
+telegram_stub.InlineKeyboardButton = _InlineKeyboardButton
+telegram_stub.InlineKeyboardMarkup = _InlineKeyboardMarkup
+sys.modules.setdefault("telegram", telegram_stub)
+
+import db
+import order_delivery
+import timer_wheel
+from timer_wheel import TimerWheel
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _fire_times(wheel, clock, until):
+    fired = {}
+    while clock.now - 1000.0 < until:
+        clock.now += 1.0
+        for timer in wheel.advance():
+            fired[timer.name] = int(clock.now - 1000.0)
+    return fired
+
+
+class TimerWheelTests(unittest.TestCase):
+
+    def test_timers_fire_on_their_tick_across_levels(self):
+        clock = _Clock()
+        wheel = TimerWheel(clock=clock)
+        delays = {"a": 1, "b": 63, "c": 64, "d": 100, "e": 4095, "f": 4097, "g": 300000}
+        for name, delay in delays.items():
+            wheel.schedule(name, None, delay)
+
+        self.assertEqual(delays, _fire_times(wheel, clock, 300001))
+        self.assertEqual(0, len(wheel))
+
+    def test_cancel_and_reschedule_by_name(self):
+        clock = _Clock()
+        wheel = TimerWheel(clock=clock)
+        wheel.schedule("offer_retry_1", None, 30, {"order_id": 1})
+        wheel.schedule("order_expire_1", None, 600)
+        wheel.schedule("arr_warn_1", None, 900)
+
+        self.assertTrue(wheel.cancel("order_expire_1"))
+        self.assertFalse(wheel.cancel("order_expire_1"))
+        self.assertTrue(wheel.reschedule("arr_warn_1", 10))
+        replaced = wheel.get("offer_retry_1")
+        wheel.schedule("offer_retry_1", None, 20, {"order_id": 1, "market_retry_count": 2})
+        replaced.schedule_removal()  # un timer ya reemplazado no cancela al nuevo
+
+        fired = _fire_times(wheel, clock, 1000)
+        self.assertEqual({"arr_warn_1": 10, "offer_retry_1": 20}, fired)
+
+    def test_tick_fires_due_timers_in_batch_with_job_like_context(self):
+        clock = _Clock()
+        wheel = TimerWheel(clock=clock)
+        seen = []
+
+        def callback(context):
+            seen.append((context.job.name, context.job.context, context.bot_data["k"]))
+
+        def broken(context):
+            raise RuntimeError("boom")
+
+        wheel.schedule("x_1", callback, 2, {"order_id": 1})
+        wheel.schedule("x_2", broken, 2)
+        wheel.schedule("x_3", callback, 3, {"order_id": 3})
+        clock.now += 5
+        wheel.tick(SimpleNamespace(bot=MagicMock(), bot_data={"k": "v"}))
+
+        self.assertEqual([("x_1", {"order_id": 1}, "v"), ("x_3", {"order_id": 3}, "v")], seen)
+        self.assertEqual(0, len(wheel))
+
+    def test_tick_hands_due_timers_to_dispatcher_pool(self):
+        clock = _Clock()
+        wheel = TimerWheel(clock=clock)
+        seen = []
+        wheel.schedule("x_1", lambda context: seen.append(context.job.name), 1)
+        wheel.schedule("x_2", lambda context: seen.append(context.job.name), 1)
+        clock.now += 2
+        dispatcher = MagicMock()
+        wheel.tick(SimpleNamespace(bot=MagicMock(), dispatcher=dispatcher))
+
+        self.assertEqual([], seen)
+        self.assertEqual(2, dispatcher.run_async.call_count)
+        for call in dispatcher.run_async.call_args_list:
+            call.args[0](*call.args[1:])
+        self.assertEqual(["x_1", "x_2"], seen)
+
+    def test_large_lag_relocates_instead_of_stepping(self):
+        clock = _Clock()
+        wheel = TimerWheel(clock=clock)
+        wheel.schedule("soon", None, 5)
+        wheel.schedule("later", None, 20000)
+        clock.now += 10000
+        self.assertEqual(["soon"], [t.name for t in wheel.advance()])
+        self.assertEqual({"later": 20000}, _fire_times(wheel, clock, 20001))
+
+
+class TimerWheelIntegrationTests(unittest.TestCase):
+
+    def setUp(self):
+        fd, path = tempfile.mkstemp(prefix="domi_timer_wheel_", suffix=".db")
+        os.close(fd)
+        self.db_path = path
+        os.environ["DB_PATH"] = self.db_path
+        os.environ.pop("DATABASE_URL", None)
+        db.init_db()
+        self.job_queue = MagicMock()
+        self.wheel = timer_wheel.install_timer_wheel(self.job_queue)
+
+    def tearDown(self):
+        timer_wheel._installed_wheel = None
+        try:
+            os.remove(self.db_path)
+        except (FileNotFoundError, PermissionError):
+            pass
+
+    def test_persistent_jobs_use_installed_wheel(self):
+        self.job_queue.run_repeating.assert_called_once()
+        self.assertIs(self.wheel, timer_wheel.install_timer_wheel(self.job_queue))
+        context = SimpleNamespace(job_queue=self.job_queue, bot_data={})
+
+        order_delivery._schedule_persistent_job(
+            context, order_delivery._offer_retry_job, 30, "offer_retry_5", {"order_id": 5}, entity_id=5,
+        )
+        self.assertIn("offer_retry_5", self.wheel)
+        self.job_queue.run_once.assert_not_called()
+        self.assertEqual(["offer_retry_5"], [r["job_name"] for r in db.get_pending_scheduled_jobs()])
+
+        order_delivery._cancel_persistent_job(context, "offer_retry_5", entity_id=5)
+        self.assertNotIn("offer_retry_5", self.wheel)
+        self.assertEqual([], db.get_pending_scheduled_jobs())
+        self.job_queue.get_jobs_by_name.assert_not_called()
+
+    def test_recover_scheduled_jobs_loads_into_wheel(self):
+        db.upsert_scheduled_job("route_expire_9", "_route_expire_job", "2000-01-01T00:00:00", '{"route_id": 9}')
+        db.upsert_scheduled_job("ghost_1", "_no_existe", "2000-01-01T00:00:00", "{}")
+
+        order_delivery.recover_scheduled_jobs(self.job_queue)
+
+        timer = self.wheel.get("route_expire_9")
+        self.assertIs(order_delivery._route_expire_job, timer.callback)
+        self.assertEqual({"route_id": 9}, timer.context)
+        self.assertNotIn("ghost_1", self.wheel)
+        self.job_queue.run_once.assert_not_called()
+
+    def test_other_job_queues_keep_run_once(self):
+        other = SimpleNamespace(job_queue=MagicMock())
+        order_delivery._run_timer(other, order_delivery._offer_retry_job, 5, "offer_retry_6", {"order_id": 6},
+                                  entity_id=6)
+        other.job_queue.run_once.assert_called_once()
+        self.assertNotIn("offer_retry_6", self.wheel)
+
+
+if __name__ == "__main__":
+    unittest.main()
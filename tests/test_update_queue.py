@@ -0,0 +1,179 @@
+"""Tests de la cola durable de updates del modo webhook (update_queue + web/api/telegram).
+
+Cubre:
+- chat/particion del update crudo y reparto disjunto de particiones entre workers
+- reintentos de Telegram (update_id repetido) no duplican; claim solo de particiones propias
+- el consumidor entrega por chat al runner y confirma DONE al terminar; lo que quedo en
+  PROCESSING vuelve a PENDING al arrancar
+- el webhook rechaza token secreto invalido o ausente y guarda los validos
+"""
+import json
+import os
+import sys
+import tempfile
+import types
+import unittest
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Backend"))
+
+fastapi_stub = sys.modules.get("fastapi")
+if fastapi_stub is None:
+    fastapi_stub = types.ModuleType("fastapi")
+    sys.modules["fastapi"] = fastapi_stub
+
+
+if not hasattr(fastapi_stub, "HTTPException"):
+    class HTTPException(Exception):
+        def __init__(self, status_code: int, detail: str):
+            super().__init__(detail)
+            self.status_code = status_code
+            self.detail = detail
+
+    fastapi_stub.HTTPException = HTTPException
+
+
+if not hasattr(fastapi_stub, "APIRouter"):
+    class APIRouter:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def get(self, *args, **kwargs):
+            def decorator(fn):
+                return fn
+            return decorator
+
+        def post(self, *args, **kwargs):
+            def decorator(fn):
+                return fn
+            return decorator
+
+    fastapi_stub.APIRouter = APIRouter
+
+
+if not hasattr(fastapi_stub, "Depends"):
+    def Depends(dependency=None):
+        return dependency
+
+    fastapi_stub.Depends = Depends
+
+
+if not hasattr(fastapi_stub, "Header"):
+    fastapi_stub.Header = lambda default="": default
+
+
+if not hasattr(fastapi_stub, "Body"):
+    fastapi_stub.Body = lambda default=None: default
+
+
+HTTPException = fastapi_stub.HTTPException
+
+import db
+import update_queue
+from update_queue import UpdateQueueConsumer, owned_partitions, update_chat_id, update_partition
+from update_workers import ChatOrderedUpdateRunner
+from web.api.telegram import telegram_webhook
+
+
+def _message(update_id, chat_id, text="hola"):
+    return {"update_id": update_id, "message": {"message_id": update_id, "chat": {"id": chat_id}, "text": text}}
+
+
+def _statuses():
+    conn = db.get_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT update_id, status FROM telegram_update_queue ORDER BY update_id")
+    rows = {row[0]: row[1] for row in cur.fetchall()}
+    conn.close()
+    return rows
+
+
+class UpdateQueueTests(unittest.TestCase):
+
+    def setUp(self):
+        fd, path = tempfile.mkstemp(prefix="domi_update_queue_", suffix=".db")
+        os.close(fd)
+        self.db_path = path
+        os.environ["DB_PATH"] = self.db_path
+        os.environ.pop("DATABASE_URL", None)
+        db.init_db()
+
+    def tearDown(self):
+        os.environ.pop("TELEGRAM_WEBHOOK_SECRET", None)
+        try:
+            os.remove(self.db_path)
+        except (FileNotFoundError, PermissionError):
+            pass
+
+    def test_chat_partition_and_worker_split(self):
+        self.assertEqual(55, update_chat_id(_message(1, 55)))
+        callback = {"update_id": 2, "callback_query": {"from": {"id": 9}, "message": {"chat": {"id": 77}}}}
+        self.assertEqual(77, update_chat_id(callback))
+        self.assertEqual(9, update_chat_id({"update_id": 3, "inline_query": {"from": {"id": 9}}}))
+        self.assertIsNone(update_chat_id({"update_id": 4}))
+        self.assertEqual(update_partition(-1001), update_partition(-1001 + update_queue.UPDATE_QUEUE_PARTITIONS))
+
+        split = [set(owned_partitions(i, 3)) for i in range(3)]
+        self.assertEqual(set(range(update_queue.UPDATE_QUEUE_PARTITIONS)), set().union(*split))
+        self.assertEqual(sum(len(part) for part in split), update_queue.UPDATE_QUEUE_PARTITIONS)
+
+    def test_duplicates_ignored_and_claim_only_owned_partitions(self):
+        self.assertTrue(update_queue.ingest_telegram_update(_message(10, 1)))
+        self.assertFalse(update_queue.ingest_telegram_update(_message(10, 1)))
+        update_queue.ingest_telegram_update(_message(11, 2))
+        update_queue.ingest_telegram_update(_message(12, 1))
+
+        mine = [update_partition(1)]
+        claimed = db.claim_telegram_updates(mine, "w1:1")
+        self.assertEqual([10, 12], [json.loads(p)["update_id"] for _id, p in claimed])
+        self.assertEqual([], db.claim_telegram_updates(mine, "w2:1"))
+        self.assertEqual({10: "PROCESSING", 11: "PENDING", 12: "PROCESSING"}, _statuses())
+
+        self.assertEqual(2, db.requeue_telegram_updates(mine))
+        self.assertEqual({10: "PENDING", 11: "PENDING", 12: "PENDING"}, _statuses())
+
+    def test_consumer_delivers_in_chat_order_and_confirms(self):
+        for update_id, chat_id in ((20, 5), (21, 6), (22, 5), (23, 5)):
+            update_queue.ingest_telegram_update(_message(update_id, chat_id))
+        update_queue.ingest_telegram_update({"update_id": 24, "message": {"chat": {"id": 5}, "boom": True}})
+        seen = []
+
+        def decode(data):
+            if data["message"].get("boom"):
+                raise ValueError("ilegible")
+            return SimpleNamespace(effective_chat=SimpleNamespace(id=data["message"]["chat"]["id"]),
+                                   effective_user=None, update_id=data["update_id"])
+
+        runner = ChatOrderedUpdateRunner(lambda update: seen.append(update.update_id), workers=4)
+        consumer = UpdateQueueConsumer(runner, decode, owned_partitions(0, 1), worker_id="t")
+        self.assertEqual(5, consumer.poll_once())
+        runner.shutdown(wait=True)
+        consumer.flush_finished()
+
+        self.assertEqual([20, 22, 23], [uid for uid in seen if uid != 21])
+        self.assertEqual({uid: "DONE" for uid in (20, 21, 22, 23, 24)}, _statuses())
+        self.assertEqual(0, consumer.poll_once())
+
+    def test_webhook_validates_secret_token(self):
+        payload = _message(30, 8)
+        with self.assertRaises(HTTPException) as disabled:
+            telegram_webhook(payload, "x")
+        self.assertEqual(404, disabled.exception.status_code)
+
+        os.environ["TELEGRAM_WEBHOOK_SECRET"] = "s3cret"
+        with self.assertRaises(HTTPException) as wrong:
+            telegram_webhook(payload, "otro")
+        self.assertEqual(401, wrong.exception.status_code)
+        with self.assertRaises(HTTPException) as missing:
+            telegram_webhook(payload, None)
+        self.assertEqual(401, missing.exception.status_code)
+        with self.assertRaises(HTTPException) as invalid:
+            telegram_webhook({"message": {}}, "s3cret")
+        self.assertEqual(400, invalid.exception.status_code)
+
+        self.assertEqual({"ok": True}, telegram_webhook(payload, "s3cret"))
+        self.assertEqual({30: "PENDING"}, _statuses())
+
+
+if __name__ == "__main__":
+    unittest.main()
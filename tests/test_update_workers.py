@@ -0,0 +1,137 @@
+"""Tests del procesamiento concurrente de updates con orden por chat.
+
+Cubre:
+- updates del mismo chat se procesan en orden y nunca en paralelo
+- chats distintos avanzan en paralelo (un handler lento no frena a los demas)
+- install_chat_ordered_processing conserva el camino original para errores
+- las escrituras de persistencia quedan serializadas y reintentan RuntimeError
+"""
+import os
+import sys
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Backend"))
+
+from update_workers import ChatOrderedUpdateRunner, install_chat_ordered_processing, update_chat_key
+
+
+def _update(chat_id, seq):
+    return SimpleNamespace(effective_chat=SimpleNamespace(id=chat_id), effective_user=None, seq=seq)
+
+
+class ChatOrderedUpdateRunnerTests(unittest.TestCase):
+
+    def test_same_chat_is_strictly_ordered(self):
+        seen = {}
+        running = {}
+        overlaps = []
+        lock = threading.Lock()
+
+        def process(update):
+            chat = update.effective_chat.id
+            with lock:
+                if running.get(chat):
+                    overlaps.append(chat)
+                running[chat] = True
+            time.sleep(0.001)
+            with lock:
+                running[chat] = False
+                seen.setdefault(chat, []).append(update.seq)
+
+        runner = ChatOrderedUpdateRunner(process, workers=8)
+        for seq in range(50):
+            for chat in (1, 2, 3):
+                runner.submit(_update(chat, seq))
+        runner.shutdown(wait=True)
+
+        self.assertEqual([], overlaps)
+        for chat in (1, 2, 3):
+            self.assertEqual(list(range(50)), seen[chat])
+
+    def test_slow_chat_does_not_block_other_chats(self):
+        release = threading.Event()
+        done = []
+
+        def process(update):
+            if update.effective_chat.id == 1:
+                release.wait(5)
+            done.append(update.effective_chat.id)
+
+        runner = ChatOrderedUpdateRunner(process, workers=4)
+        runner.submit(_update(1, 0))
+        for chat in (2, 3, 4):
+            runner.submit(_update(chat, 0))
+
+        deadline = time.monotonic() + 2
+        while len(done) < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual({2, 3, 4}, set(done))
+        release.set()
+        runner.shutdown(wait=True)
+        self.assertEqual(1, done[-1])
+
+    def test_handler_exception_does_not_stall_chat(self):
+        seen = []
+
+        def process(update):
+            if update.seq == 0:
+                raise ValueError("boom")
+            seen.append(update.seq)
+
+        runner = ChatOrderedUpdateRunner(process, workers=2)
+        for seq in range(3):
+            runner.submit(_update(9, seq))
+        runner.shutdown(wait=True)
+        self.assertEqual([1, 2], seen)
+        self.assertEqual(0, runner.pending())
+
+    def test_chat_key_falls_back_to_user(self):
+        self.assertEqual(("chat", 5), update_chat_key(_update(5, 0)))
+        self.assertEqual(("user", 7), update_chat_key(
+            SimpleNamespace(effective_chat=None, effective_user=SimpleNamespace(id=7))))
+        self.assertIsNone(update_chat_key(SimpleNamespace(effective_chat=None, effective_user=None)))
+
+
+class InstallOnDispatcherTests(unittest.TestCase):
+
+    def test_install_routes_updates_and_keeps_error_path(self):
+        processed = []
+        writes = []
+
+        class FakePersistence:
+            def __init__(self):
+                self.failures = 1
+
+            def update_user_data(self, user_id, data):
+                if self.failures:
+                    self.failures -= 1
+                    raise RuntimeError("dictionary changed size during iteration")
+                writes.append(user_id)
+
+        class FakeDispatcher:
+            def __init__(self):
+                self.persistence = FakePersistence()
+
+            def process_update(self, update):
+                processed.append(update)
+
+        dispatcher = FakeDispatcher()
+        runner = install_chat_ordered_processing(dispatcher, workers=2)
+        error = RuntimeError("polling")
+        dispatcher.process_update(error)
+        self.assertEqual([error], processed)
+
+        update = _update(1, 0)
+        dispatcher.process_update(update)
+        runner.shutdown(wait=True)
+        self.assertEqual([error, update], processed)
+
+        dispatcher.persistence.update_user_data(42, {})
+        self.assertEqual([42], writes)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,7 @@
+import asyncio
 import os
 import sys
+import threading
 import types
 import unittest
 from unittest.mock import patch
@@ -27,7 +29,8 @@ if fastapi_stub is None:
 
 HTTPException = fastapi_stub.HTTPException
 
-from web.auth.dependencies import get_current_user
+from web.async_db import read_all
+from web.auth.dependencies import get_current_user, get_current_user_async, invalidate_principal
 from web.auth.token import create_token
 from web.users.models import UserRole, UserStatus
 from web.users.repository import WebUser
@@ -35,6 +38,10 @@ from web.users.repository import WebUser
 
 class WebAuthDependenciesTests(unittest.TestCase):
 
+    def setUp(self):
+        invalidate_principal()
+        self.addCleanup(invalidate_principal)
+
     def test_get_current_user_resolves_configured_identity(self):
         token = create_token("panel_admin")
         fake_user = WebUser(id=77, username="panel_admin",
@@ -57,6 +64,71 @@ class WebAuthDependenciesTests(unittest.TestCase):
 
         self.assertEqual(401, ctx.exception.status_code)
 
+    def test_get_current_user_caches_identity_until_invalidated(self):
+        token = create_token("panel_cache")
+        fake_user = WebUser(id=78, username="panel_cache",
+                            role=UserRole.ADMIN_LOCAL, status=UserStatus.APPROVED)
+
+        with patch("web.auth.dependencies.get_web_user_by_username", return_value=fake_user) as lookup:
+            for _ in range(5):
+                self.assertIs(fake_user, get_current_user(f"Bearer {token}"))
+            self.assertEqual(1, lookup.call_count)
+
+            invalidate_principal(user_id=78)
+            get_current_user(f"Bearer {token}")
+            self.assertEqual(2, lookup.call_count)
+
+            with patch("web.auth.dependencies.time.monotonic", return_value=10 ** 9):
+                get_current_user(f"Bearer {token}")
+            self.assertEqual(3, lookup.call_count)
+
+        with self.assertRaises(HTTPException) as ctx:
+            get_current_user(f"Bearer {token}x")
+        self.assertEqual(401, ctx.exception.status_code)
+
+    def test_unknown_user_is_not_cached(self):
+        token = create_token("recien_creado")
+        fake_user = WebUser(id=79, username="recien_creado",
+                            role=UserRole.ADMIN_LOCAL, status=UserStatus.APPROVED)
+
+        with patch("web.auth.dependencies.get_web_user_by_username", return_value=None):
+            with self.assertRaises(HTTPException):
+                get_current_user(f"Bearer {token}")
+        with patch("web.auth.dependencies.get_web_user_by_username", return_value=fake_user):
+            self.assertEqual(79, get_current_user(f"Bearer {token}").id)
+
+    def test_async_dependency_resolves_from_cache_without_threads(self):
+        token = create_token("panel_async")
+        fake_user = WebUser(id=80, username="panel_async",
+                            role=UserRole.ADMIN_LOCAL, status=UserStatus.APPROVED)
+        threads = []
+
+        def lookup(_username):
+            threads.append(threading.current_thread())
+            return fake_user
+
+        with patch("web.auth.dependencies.get_web_user_by_username", side_effect=lookup):
+            first = asyncio.run(get_current_user_async(f"Bearer {token}"))
+            second = asyncio.run(get_current_user_async(f"Bearer {token}"))
+
+        self.assertIs(fake_user, first)
+        self.assertIs(fake_user, second)
+        self.assertEqual(1, len(threads))
+        self.assertIsNot(threading.main_thread(), threads[0])
+
+        with self.assertRaises(HTTPException) as ctx:
+            asyncio.run(get_current_user_async("Basic abc"))
+        self.assertEqual(401, ctx.exception.status_code)
+
+    def test_read_all_runs_reads_concurrently_in_order(self):
+        barrier = threading.Barrier(3, timeout=5)
+
+        def read(value):
+            barrier.wait()  # solo pasa si las tres lecturas corren a la vez
+            return value
+
+        self.assertEqual(["a", "b", "c"], asyncio.run(read_all((read, "a"), (read, "b"), (read, "c"))))
+
 
 if __name__ == "__main__":
     unittest.main()
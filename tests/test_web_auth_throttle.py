@@ -0,0 +1,112 @@
+"""Tests del limitador de intentos y del pool de bcrypt del login del panel.
+
+Cubre:
+- token bucket por clave: rafaga, espera hasta la proxima ficha, recarga y reset
+- IP del cliente detras del proxy (ultima de X-Forwarded-For)
+- bcrypt corre fuera del hilo de la peticion y se rechaza si el pool esta lleno
+"""
+import asyncio
+import os
+import sys
+import threading
+import types
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Backend"))
+
+bcrypt_stub = types.ModuleType("bcrypt")
+bcrypt_stub.gensalt = lambda: b"$salt$"
+bcrypt_stub.hashpw = lambda password, salt: salt + password[::-1]
+bcrypt_stub.checkpw = lambda password, hashed: hashed == b"$salt$" + password[::-1]
+sys.modules.setdefault("bcrypt", bcrypt_stub)
+
+from web.auth import passwords
+from web.auth.throttle import TokenBucketLimiter, client_ip
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class TokenBucketTests(unittest.TestCase):
+
+    def test_burst_then_wait_for_refill(self):
+        clock = _Clock()
+        limiter = TokenBucketLimiter(capacity=3, refill_per_second=0.5, clock=clock)
+
+        self.assertEqual([0.0, 0.0, 0.0], [limiter.take("ip:1") for _ in range(3)])
+        self.assertAlmostEqual(2.0, limiter.take("ip:1"))
+        self.assertEqual(0.0, limiter.take("ip:2"))  # otra clave, otro balde
+
+        clock.now += 1.0
+        self.assertAlmostEqual(1.0, limiter.take("ip:1"))
+        clock.now += 1.0
+        self.assertEqual(0.0, limiter.take("ip:1"))
+
+        limiter.reset("ip:1")
+        self.assertEqual([0.0, 0.0, 0.0], [limiter.take("ip:1") for _ in range(3)])
+
+    def test_full_buckets_are_pruned_when_the_store_fills(self):
+        clock = _Clock()
+        limiter = TokenBucketLimiter(capacity=2, refill_per_second=1, clock=clock, max_keys=4)
+        for n in range(4):
+            limiter.take("k{}".format(n))
+        clock.now += 5
+        limiter.take("nueva")
+        self.assertEqual(["nueva"], list(limiter._buckets))
+
+    def test_client_ip_uses_proxy_appended_address(self):
+        request = SimpleNamespace(headers={"x-forwarded-for": "6.6.6.6, 10.0.0.7"},
+                                  client=SimpleNamespace(host="100.64.0.1"))
+        self.assertEqual("10.0.0.7", client_ip(request))
+        direct = SimpleNamespace(headers={}, client=SimpleNamespace(host="127.0.0.1"))
+        self.assertEqual("127.0.0.1", client_ip(direct))
+
+
+class PasswordPoolTests(unittest.TestCase):
+
+    def test_hash_and_check_run_in_bcrypt_pool(self):
+        threads = []
+        real_checkpw = passwords.bcrypt.checkpw
+
+        def checkpw(password, hashed):
+            threads.append(threading.current_thread().name)
+            return real_checkpw(password, hashed)
+
+        async def scenario():
+            hashed = await passwords.hash_password("clave123")
+            with patch.object(passwords.bcrypt, "checkpw", checkpw):
+                return (await passwords.check_password("clave123", hashed),
+                        await passwords.check_password("otra", hashed))
+
+        self.assertEqual((True, False), asyncio.run(scenario()))
+        self.assertTrue(all(name.startswith("bcrypt") for name in threads))
+
+    def test_full_pool_is_rejected_instead_of_queued(self):
+        release = threading.Event()
+
+        def slow_checkpw(_password, _hashed):
+            release.wait(5)
+            return True
+
+        async def scenario():
+            with patch.object(passwords, "_pending", threading.BoundedSemaphore(1)), \
+                    patch.object(passwords.bcrypt, "checkpw", slow_checkpw):
+                first = asyncio.ensure_future(passwords.check_password("a", "h"))
+                await asyncio.sleep(0.05)
+                with self.assertRaises(passwords.PasswordHashBusy):
+                    await passwords.check_password("b", "h")
+                release.set()
+                return await first
+
+        self.assertTrue(asyncio.run(scenario()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,3 +1,4 @@
+import asyncio
 import sys
 import types
 import unittest
@@ -89,7 +90,7 @@ class WebPermissionsTests(unittest.TestCase):
         user = self._user(UserRole.PLATFORM_ADMIN, UserStatus.APPROVED)
 
         with patch("web.api.dashboard.get_dashboard_stats", return_value={"ok": True}) as mocked:
-            response = dashboard_stats(current_user=user)
+            response = asyncio.run(dashboard_stats(current_user=user))
 
         mocked.assert_called_once_with(admin_id=None)
         self.assertEqual({"ok": True}, response)